@@ -16,7 +16,7 @@ project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from loguru import logger
@@ -24,6 +24,11 @@ import os
 
 from config.settings import get_settings
 from src.agents.orchestrator import create_agent
+from src.llm.client_registry import get_llm_registry
+from src.analysis.parallel import shutdown_pool
+from src.anomaly.monitor import MetricDefinition, get_anomaly_monitor
+from src.analysis.rollup import get_rollup_store
+from src.utils.artifacts import COMPRESSION_SUFFIXES, RESULT_SUFFIXES, open_artifact, split_compression, uncompressed_size
 
 
 # ============ Pydantic模型定义 ============
@@ -90,6 +95,21 @@ class ChatCompletionStreamResponse(BaseModel):
     choices: List[ChatCompletionStreamChoice]
 
 
+class MonitorMetric(BaseModel):
+    """监控指标定义（自定义SQL 或 事件模板二选一）"""
+    name: str = Field(..., description="指标名称")
+    sql: Optional[str] = Field(default=None, description="自定义SQL，可使用 {since}/{until} 占位符")
+    event: Optional[str] = Field(default=None, description="模板指标的事件名")
+    aggregate: str = Field(default="count", description="聚合方式: count/uv/sum/avg")
+    prop: Optional[str] = Field(default=None, description="sum/avg 聚合的属性名")
+    filters: Dict[str, Any] = Field(default_factory=dict, description="过滤条件，{属性: 值 或 值列表}")
+    granularity: str = Field(default="hour", description="检查粒度: hour/day")
+    time_column: str = Field(default="period", description="自定义SQL结果的时间列")
+    value_column: str = Field(default="value", description="自定义SQL结果的数值列")
+    description: str = Field(default="", description="指标说明")
+    enabled: bool = Field(default=True, description="是否启用")
+
+
 # ============ FastAPI应用 ============
 
 app = FastAPI(
@@ -129,16 +149,37 @@ async def startup_event():
         logger.error(f"Agent初始化失败: {e}")
         raise
 
+    # 后台并行预热LLM连接，不阻塞启动
+    if settings.LLM_WARMUP_ENABLED:
+        asyncio.get_running_loop().run_in_executor(None, get_llm_registry().warm_up)
+
+    # 定时异常监控，复用Agent的神策客户端连接池
+    if settings.ANOMALY_MONITOR_ENABLED and settings.ANOMALY_DETECTION_ENABLED:
+        get_anomaly_monitor(agent.sensors_client).start()
+
+    # 热门事件预聚合表的后台刷新（补齐历史分区、固化前一天、刷新当天分区）；
+    # Agent 的 rollup_query 工具读取该表，刷新与读取在同一进程
+    if settings.ROLLUP_ENABLED:
+        get_rollup_store().start(agent.sensors_client)
+
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """关闭时清理资源"""
     global agent
 
+    if settings and settings.ANOMALY_MONITOR_ENABLED and settings.ANOMALY_DETECTION_ENABLED:
+        get_anomaly_monitor().stop()
+    if settings and settings.ROLLUP_ENABLED:
+        get_rollup_store().stop()
+
     if agent:
         logger.info("关闭Agent资源...")
         agent.close()
 
+    get_llm_registry().close()
+    shutdown_pool()
+
 
 @app.get("/")
 async def root():
@@ -336,13 +377,135 @@ async def reset_agent():
     return {"status": "ok", "message": "Agent状态已重置"}
 
 
+def _monitor():
+    """获取异常监控（Agent未初始化时不可用）"""
+    if not agent:
+        raise HTTPException(status_code=503, detail="Agent未初始化")
+    return get_anomaly_monitor(agent.sensors_client)
+
+
+@app.get("/anomaly/metrics")
+async def list_monitor_metrics():
+    """列出监控指标"""
+    monitor = _monitor()
+    return {"metrics": [m.to_dict() for m in monitor.registry.list()], "interval_seconds": monitor.interval}
+
+
+@app.post("/anomaly/metrics")
+async def register_monitor_metric(metric: MonitorMetric):
+    """注册（或覆盖同名）监控指标"""
+    try:
+        _monitor().registry.register(MetricDefinition(**metric.model_dump()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "ok", "metric": metric.name}
+
+
+@app.delete("/anomaly/metrics/{name}")
+async def remove_monitor_metric(name: str):
+    """删除监控指标"""
+    if not _monitor().registry.remove(name):
+        raise HTTPException(status_code=404, detail="指标不存在")
+    return {"status": "ok", "metric": name}
+
+
+@app.get("/anomaly/alerts")
+async def list_anomaly_alerts(limit: int = 100, metric: Optional[str] = None):
+    """最近的异常告警（新的在前）"""
+    monitor = _monitor()
+    return {"alerts": monitor.alerts.recent(limit, metric), "last_run": monitor.last_run}
+
+
+@app.post("/anomaly/run")
+async def run_anomaly_check():
+    """立即执行一轮异常检查"""
+    monitor = _monitor()
+    return await asyncio.get_running_loop().run_in_executor(None, monitor.run_once)
+
+
+def _accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    """客户端的 Accept-Encoding 是否接受指定编码（q=0 表示拒绝）"""
+    wildcard = None
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        name = name.strip().lower()
+        if name == coding:
+            return quality > 0
+        if name == "*":
+            wildcard = quality > 0
+    return bool(wildcard)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 是否命中（弱比较）"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _parse_single_range(http_range: str, size: int) -> Optional[tuple]:
+    """
+    解析单段 Range 头
+
+    Returns:
+        (起始字节, 结束字节+1)；格式不支持或多段时返回None（按完整内容响应）
+
+    Raises:
+        HTTPException: 范围无法满足（416）
+    """
+    unit, _, spec = http_range.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+        else:
+            start, end = max(size - int(last), 0), size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"}, detail="请求范围无效")
+    return start, end
+
+
+def _decoded_chunks(file_path: str, start: int = 0, end: Optional[int] = None, chunk_size: int = 1 << 16):
+    """逐块读取压缩文件解压后的内容（只产出 [start, end) 范围）"""
+    with open_artifact(file_path, "rb") as f:
+        position = 0
+        while position < start:
+            skipped = len(f.read(min(chunk_size, start - position)))
+            if not skipped:
+                return
+            position += skipped
+        while end is None or position < end:
+            chunk = f.read(chunk_size if end is None else min(chunk_size, end - position))
+            if not chunk:
+                return
+            position += len(chunk)
+            yield chunk
+
+
 @app.get("/files/{filename}")
-async def download_file(filename: str):
+async def download_file(filename: str, request: Request):
     """
     下载或展示文件（支持CSV和图片文件）
 
+    压缩保存的结果（.csv.gz / .csv.zst）可以用压缩文件名或CSV文件名访问：
+    客户端接受对应编码时原样返回并带 Content-Encoding，否则在服务端解压后返回。
+    支持 Range 断点续传（压缩编码时按压缩后的字节计）和 ETag/If-None-Match 条件请求
+
     Args:
-        filename: 文件名（支持 .csv, .png, .jpg, .jpeg 等）
+        filename: 文件名（支持 .csv, .csv.gz, .csv.zst, .png, .jpg, .jpeg 等）
 
     Returns:
         文件响应（CSV文件下载，图片文件直接展示）
@@ -367,18 +530,26 @@ async def download_file(filename: str):
         logger.warning(f"拒绝访问非法路径: {filename}")
         raise HTTPException(status_code=403, detail="访问被拒绝")
 
+    # 按CSV文件名访问时查找压缩保存的同名文件
+    if not os.path.exists(file_path) and filename.lower().endswith('.csv'):
+        file_path = next(
+            (file_path + suffix for suffix in COMPRESSION_SUFFIXES.values() if os.path.exists(file_path + suffix)),
+            file_path
+        )
+
     # 检查文件是否存在
     if not os.path.exists(file_path):
         logger.warning(f"文件不存在: {file_path}")
         raise HTTPException(status_code=404, detail="文件不存在")
 
     # 根据文件类型确定 media_type 和 Content-Disposition
+    filename, compression = split_compression(os.path.basename(file_path))
     filename_lower = filename.lower()
-    
+
     if filename_lower.endswith('.csv'):
         media_type = "text/csv"
         content_disposition = f"attachment; filename={filename}"  # CSV文件下载
-    elif filename_lower.endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
+    elif compression is None and filename_lower.endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
         # 图片文件直接展示
         if filename_lower.endswith('.png'):
             media_type = "image/png"
@@ -395,27 +566,93 @@ async def download_file(filename: str):
         logger.warning(f"不支持的文件类型: {filename}")
         raise HTTPException(status_code=400, detail="只支持 CSV 和图片文件（png, jpg, jpeg, gif, webp）")
 
-    logger.info(f"提供文件访问: {filename} (类型: {media_type})")
+    # ETag 区分压缩编码和解压后的内容（同一文件的两种表示）
+    stat = os.stat(file_path)
+    etag_base = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    encoded = compression is not None and _accepts_encoding(request.headers.get("accept-encoding", ""), compression)
+    etag = f'"{etag_base}-{compression}"' if encoded else f'"{etag_base}"'
+    headers = {
+        "Content-Disposition": content_disposition,
+        "Cache-Control": "no-cache",
+        "ETag": etag,
+    }
+    if compression:
+        headers["Vary"] = "Accept-Encoding"
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Disposition"})
+
+    logger.info(f"提供文件访问: {filename} (类型: {media_type}, 编码: {compression if encoded else 'identity'})")
+
+    # 未压缩或客户端接受压缩编码：直接返回文件（Range/If-Range 由 FileResponse 处理，需要 starlette>=0.39）
+    if compression is None or encoded:
+        if encoded:
+            headers["Content-Encoding"] = compression
+        return FileResponse(
+            path=file_path,
+            filename=filename,
+            media_type=media_type,
+            headers=headers
+        )
 
-    # 返回文件响应
-    return FileResponse(
-        path=file_path,
-        filename=filename,
+    # 客户端不接受压缩编码：服务端解压后流式返回
+    size = await asyncio.get_running_loop().run_in_executor(None, uncompressed_size, file_path)
+    status_code, start, end = 200, 0, None
+    if size is not None:
+        headers["Accept-Ranges"] = "bytes"
+        http_range = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        byte_range = _parse_single_range(http_range, size) if http_range and (not if_range or if_range == etag) else None
+        if byte_range:
+            status_code, (start, end) = 206, byte_range
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        headers["Content-Length"] = str((end if byte_range else size) - start)
+
+    return StreamingResponse(
+        _decoded_chunks(file_path, start, end),
+        status_code=status_code,
         media_type=media_type,
-        headers={
-            "Content-Disposition": content_disposition,
-            "Cache-Control": "no-cache"
-        }
+        headers=headers
     )
 
 
+def _describe_files(csv_dir: str) -> List[Dict[str, Any]]:
+    """收集结果文件信息（压缩文件需要读取原始大小，在线程池中执行）"""
+    files_info = []
+
+    for filename in os.listdir(csv_dir):
+        if not filename.endswith(RESULT_SUFFIXES):
+            continue
+
+        file_path = os.path.join(csv_dir, filename)
+
+        # 获取文件信息
+        stat = os.stat(file_path)
+        csv_name, compression = split_compression(filename)
+        original_size = uncompressed_size(file_path)
+
+        files_info.append({
+            "filename": filename,
+            "size_bytes": stat.st_size,
+            "size_human": f"{stat.st_size / 1024:.2f} KB",
+            "compression": compression,
+            "uncompressed_size_bytes": original_size,
+            "uncompressed_size_human": f"{original_size / 1024:.2f} KB" if original_size is not None else None,
+            "modified_time": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            "download_url": f"/files/{csv_name}"
+        })
+
+    return files_info
+
+
 @app.get("/files")
 async def list_files():
     """
-    列出所有可用的CSV文件
+    列出所有可用的CSV文件（含压缩保存的结果）
 
     Returns:
-        文件列表，包含文件名、大小、修改时间等信息
+        文件列表，包含文件名、压缩后和原始大小、修改时间等信息
 
     Example:
         GET /files
@@ -429,24 +666,7 @@ async def list_files():
         return {"files": [], "message": "输出目录不存在"}
 
     try:
-        files_info = []
-
-        for filename in os.listdir(csv_dir):
-            if not filename.endswith('.csv'):
-                continue
-
-            file_path = os.path.join(csv_dir, filename)
-
-            # 获取文件信息
-            stat = os.stat(file_path)
-
-            files_info.append({
-                "filename": filename,
-                "size_bytes": stat.st_size,
-                "size_human": f"{stat.st_size / 1024:.2f} KB",
-                "modified_time": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                "download_url": f"/files/{filename}"
-            })
+        files_info = await asyncio.get_running_loop().run_in_executor(None, _describe_files, csv_dir)
 
         # 按修改时间倒序排序
         files_info.sort(key=lambda x: x["modified_time"], reverse=True)
@@ -454,6 +674,8 @@ async def list_files():
         return {
             "files": files_info,
             "total_count": len(files_info),
+            "total_size_bytes": sum(f["size_bytes"] for f in files_info),
+            "total_uncompressed_size_bytes": sum(f["uncompressed_size_bytes"] or 0 for f in files_info),
             "directory": csv_dir
         }
 
@@ -2,7 +2,7 @@
 配置管理模块
 使用 pydantic-settings 从环境变量加载配置
 """
-from typing import Optional
+from typing import Dict, List, Optional
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -49,6 +49,52 @@ class Settings(BaseSettings):
         description="LLM最大token数"
     )
 
+    # ========== 模型路由配置 ==========
+    LLM_FAST_MODEL: str = Field(
+        default="gemini-2.5-flash-lite",
+        description="轻量快速模型（Schema检索、级联调用的第一层）"
+    )
+    LLM_ROUTING_ENABLED: bool = Field(
+        default=True,
+        description="是否启用快速模型优先的级联路由（禁用时只使用各调用点的最后一层模型）"
+    )
+    LLM_ESCALATION_CONFIDENCE: float = Field(
+        default=0.7,
+        ge=0.0,
+        le=1.0,
+        description="自报置信度低于该值时升级到大模型"
+    )
+    LLM_ROUTES: Dict[str, List[str]] = Field(
+        default_factory=dict,
+        description="按调用点覆盖模型层级，如 {\"sql_generation\": [\"fast\", \"main\"]}（fast/main 或具体模型ID）"
+    )
+
+    # ========== LLM连接池配置 ==========
+    LLM_POOL_MAX_CONNECTIONS: int = Field(
+        default=20,
+        gt=0,
+        description="每个LLM base URL的最大连接数"
+    )
+    LLM_POOL_MAX_KEEPALIVE: int = Field(
+        default=10,
+        ge=0,
+        description="每个LLM base URL保持的keep-alive连接数"
+    )
+    LLM_KEEPALIVE_EXPIRY: float = Field(
+        default=120.0,
+        gt=0,
+        description="keep-alive连接空闲过期时间（秒）"
+    )
+    LLM_REQUEST_TIMEOUT: float = Field(
+        default=300.0,
+        gt=0,
+        description="LLM请求超时时间（秒）"
+    )
+    LLM_WARMUP_ENABLED: bool = Field(
+        default=True,
+        description="服务启动时是否预热LLM连接"
+    )
+
     # ========== 异常检测配置 ==========
     ANOMALY_DETECTION_ENABLED: bool = Field(
         default=True,
@@ -69,6 +115,290 @@ class Settings(BaseSettings):
         gt=0,
         description="异常检查间隔（秒）"
     )
+    ANOMALY_STATE_PATH: str = Field(
+        default="data/anomaly_state.json",
+        description="在线异常检测状态文件路径"
+    )
+    ANOMALY_ONLINE_ALPHA: float = Field(
+        default=0.1,
+        gt=0,
+        lt=1,
+        description="在线检测EWMA平滑系数"
+    )
+    ANOMALY_ONLINE_WINDOW: int = Field(
+        default=48,
+        ge=3,
+        description="在线检测滚动中位数/MAD窗口大小（点数）"
+    )
+    ANOMALY_ONLINE_SEASONALITY: str = Field(
+        default="hour_of_week",
+        pattern="^(none|hour_of_day|day_of_week|hour_of_week)$",
+        description="在线检测季节基线划分方式"
+    )
+    ANOMALY_ONLINE_WARMUP: int = Field(
+        default=24,
+        ge=1,
+        description="在线检测开始判定异常前所需的最少点数"
+    )
+    ANOMALY_MONITOR_ENABLED: bool = Field(
+        default=True,
+        description="是否在API服务中启动定时异常监控"
+    )
+    ANOMALY_METRICS_PATH: str = Field(
+        default="data/anomaly_metrics.json",
+        description="监控指标注册表文件路径"
+    )
+    ANOMALY_ALERTS_PATH: str = Field(
+        default="data/anomaly_alerts.jsonl",
+        description="异常告警历史文件路径"
+    )
+    ANOMALY_ALERT_HISTORY: int = Field(
+        default=1000,
+        gt=0,
+        description="内存中保留的最近告警条数"
+    )
+    ANOMALY_MONITOR_CONCURRENCY: int = Field(
+        default=4,
+        gt=0,
+        description="定时监控同时执行的扫描数"
+    )
+    ANOMALY_MONITOR_LOOKBACK_DAYS: int = Field(
+        default=14,
+        gt=0,
+        description="指标首次检查时拉取的历史天数（用于初始化检测状态）"
+    )
+
+    # ========== 数据分析配置 ==========
+    ANALYSIS_GROUP_REPORT_LIMIT: int = Field(
+        default=20,
+        gt=0,
+        description="按维度分组分析时报告中展示的最大序列数（按合计值排序）"
+    )
+    ANALYSIS_SAMPLE_MAX_ROWS: int = Field(
+        default=1000,
+        ge=10,
+        description="数据分析前采样的目标行数（超过时按数据形态选择采样策略）"
+    )
+    ANALYSIS_CACHE_ENABLED: bool = Field(
+        default=True,
+        description="是否按数据内容哈希缓存分析结果（同一份数据重复分析时直接复用）"
+    )
+    ANALYSIS_CACHE_SIZE: int = Field(
+        default=512,
+        gt=0,
+        description="分析结果缓存的条目上限（报告、单序列单类结果和中间结果各占一条）"
+    )
+    ANALYSIS_PARALLEL_ENABLED: bool = Field(
+        default=True,
+        description="宽表分析超过规模阈值时是否按列分块交给进程池"
+    )
+    ANALYSIS_PARALLEL_WORKERS: int = Field(
+        default=0,
+        ge=0,
+        description="分析进程池的进程数（0 表示 CPU核数 - 1，只有1个进程时不启用）"
+    )
+    ANALYSIS_PARALLEL_MIN_COLUMNS: int = Field(
+        default=24,
+        gt=1,
+        description="启用多进程分析的最少序列数"
+    )
+    ANALYSIS_PARALLEL_MIN_CELLS: int = Field(
+        default=5000,
+        gt=0,
+        description="启用多进程分析的最少数据点数（行数 × 序列数）"
+    )
+    STATS_SKETCH_THRESHOLD: int = Field(
+        default=5000000,
+        gt=0,
+        description="基础统计超过该行数时改用KLL近似分位数（不再整体排序）"
+    )
+    STATS_SKETCH_K: int = Field(
+        default=200,
+        ge=8,
+        description="KLL分位数草图容量（越大越精确，秩误差约1.7/k）"
+    )
+    CORRELATION_MAX_LAG: int = Field(
+        default=7,
+        ge=0,
+        description="滞后相关分析的最大滞后期数（按行的时间粒度计，0只算同期相关）"
+    )
+    CORRELATION_ALPHA: float = Field(
+        default=0.05,
+        gt=0,
+        lt=1,
+        description="相关性检验多重校正后的显著性水平"
+    )
+    CORRELATION_TOP_K: int = Field(
+        default=10,
+        gt=0,
+        description="相关性分析报告中保留的指标对数量"
+    )
+
+    SEASONAL_CACHE_SIZE: int = Field(
+        default=1024,
+        gt=0,
+        description="季节分解结果缓存的序列数上限"
+    )
+    SEASONAL_BATCH_MAX_COLUMNS: int = Field(
+        default=500,
+        ge=0,
+        description="批量趋势分析中做季节分解的序列数上限（每列一次STL拟合，超过时跳过季节分解，趋势基于原始值）"
+    )
+
+    # ========== 本地结果立方体配置 ==========
+    CUBE_ENABLED: bool = Field(
+        default=True,
+        description="是否缓存会话内的查询结果，追问的切片/过滤/汇总在本地完成"
+    )
+    CUBE_MAX_ENTRIES: int = Field(
+        default=32,
+        gt=0,
+        description="保存的结果立方体数量上限"
+    )
+    CUBE_MAX_ROWS: int = Field(
+        default=200000,
+        gt=0,
+        description="可作为立方体保存的结果行数上限"
+    )
+    CUBE_TTL_SECONDS: int = Field(
+        default=1800,
+        gt=0,
+        description="结果立方体的有效期（秒），相对时间范围跨天后同样失效"
+    )
+
+    # ========== 结果改写配置 ==========
+    REWRITE_ENABLED: bool = Field(
+        default=True,
+        description="是否用本次分析中已有的更细粒度结果直接推导新指令（过滤 + 重新汇总），跳过SQL生成和执行"
+    )
+    REWRITE_MAX_ROWS: int = Field(
+        default=200000,
+        gt=0,
+        description="可作为推导来源的结果行数上限"
+    )
+
+    # ========== 根因分析配置 ==========
+    ROOT_CAUSE_LOCAL_ENABLED: bool = Field(
+        default=True,
+        description="下钻阶段是否优先使用单次立方体查询 + 本地根因分析（失败时回退到逐维度查询）"
+    )
+    ROOT_CAUSE_DEFAULT_DIMENSIONS: List[str] = Field(
+        default=["platform", "country", "channel"],
+        description="决策未给出建议维度时用于根因分析的默认维度"
+    )
+    ROOT_CAUSE_MAX_DIMENSIONS: int = Field(
+        default=3,
+        gt=0,
+        description="根因分析结果中保留的维度数上限"
+    )
+    ROOT_CAUSE_TEP: float = Field(
+        default=0.67,
+        gt=0,
+        le=1,
+        description="候选取值集合需达到的累计解释力阈值（Adtributor TEP）"
+    )
+    ROOT_CAUSE_TEEP: float = Field(
+        default=0.1,
+        gt=0,
+        le=1,
+        description="单个取值进入候选集合的最小解释力（Adtributor TEEP）"
+    )
+
+    # ========== 漏斗分析配置 ==========
+    FUNNEL_LOCAL_ENABLED: bool = Field(
+        default=True,
+        description="带 funnel_steps 的指令是否由本地漏斗引擎计算（一次明细查询，不经LLM生成SQL）"
+    )
+    FUNNEL_WINDOW_DAYS: int = Field(
+        default=7,
+        gt=0,
+        description="漏斗默认转化窗口期（天）"
+    )
+    FUNNEL_STREAM_BATCH_ROWS: int = Field(
+        default=100000,
+        gt=0,
+        description="漏斗明细流式读取时每批的行数"
+    )
+
+    # ========== 留存分析配置 ==========
+    RETENTION_LOCAL_ENABLED: bool = Field(
+        default=True,
+        description="带 retention_events 的指令是否由本地留存引擎计算（按天用户位图，不经LLM生成SQL）"
+    )
+    RETENTION_PERIODS: int = Field(
+        default=7,
+        gt=0,
+        description="留存矩阵默认计算的后续周期数（日/周/月）"
+    )
+    RETENTION_CACHE_ENTRIES: int = Field(
+        default=2000,
+        gt=0,
+        description="缓存的 (事件, 过滤条件, 日期) 用户位图数量上限，超出时淘汰最久未用的"
+    )
+
+    # ========== 用户ID字典配置 ==========
+    USER_ID_DICT_DIR: str = Field(
+        default="data/user_ids",
+        description="distinct_id 字典编码文件目录（序号稳定，跨进程共享）"
+    )
+    USER_ID_COLUMNS: List[str] = Field(
+        default=["distinct_id"],
+        description="SQL结果中按字典编码为整数序号的用户ID列"
+    )
+
+    # ========== 预聚合表配置 ==========
+    ROLLUP_ENABLED: bool = Field(
+        default=True,
+        description="是否维护热门事件的按天预聚合表，并用其直接回答简单的次数/人数查询"
+    )
+    ROLLUP_DIR: str = Field(
+        default="data/rollups",
+        description="预聚合表的本地存储目录（每天一个列式分区文件）"
+    )
+    ROLLUP_EVENTS: List[str] = Field(
+        default=["ProductClick", "AddToCartClick", "PurchaseSuccess"],
+        description="预聚合的事件"
+    )
+    ROLLUP_DIMENSIONS: Dict[str, List[str]] = Field(
+        default={
+            "web_platform_type": ["platform", "平台", "平台类型"],
+            "site_code": ["site", "站点", "站点国家码"],
+        },
+        description="预聚合的维度属性及其别名（维度的每种组合都单独聚合，人数按组合精确去重）"
+    )
+    ROLLUP_DAYS: int = Field(
+        default=90,
+        gt=0,
+        description="预聚合表保留并自动补齐的天数"
+    )
+    ROLLUP_REFRESH_HOUR: int = Field(
+        default=2,
+        ge=0,
+        lt=24,
+        description="每天几点之后固化前一天的分区（留出迟到数据的时间）"
+    )
+    ROLLUP_TODAY_REFRESH_SECONDS: int = Field(
+        default=900,
+        gt=0,
+        description="当天分区的刷新间隔（秒），超过两个间隔未刷新的当天分区不用于回答"
+    )
+
+    # ========== 综合分析配置 ==========
+    SYNTHESIS_DIGEST_MAX_CHARS: int = Field(
+        default=1200,
+        gt=0,
+        description="综合分析提示词中单个查询结果摘要的字符预算"
+    )
+    SYNTHESIS_DIGEST_TOTAL_CHARS: int = Field(
+        default=8000,
+        gt=0,
+        description="综合分析提示词中所有查询结果摘要的总字符预算"
+    )
+    SYNTHESIS_DIGEST_TOP_K: int = Field(
+        default=5,
+        gt=0,
+        description="结果摘要中Top-K的行数"
+    )
 
     # ========== 日志配置 ==========
     LOG_LEVEL: str = Field(
@@ -101,6 +431,11 @@ class Settings(BaseSettings):
         default="/tmp/sensors_data",
         description="CSV输出文件目录"
     )
+    SQL_OUTPUT_COMPRESSION: str = Field(
+        default="gzip",
+        pattern="^(none|gzip|zstd)$",
+        description="结果文件压缩方式：none / gzip / zstd（zstd需安装zstandard，未安装时使用gzip）"
+    )
     SQL_TIMEOUT: int = Field(
         default=60,
         gt=0,
@@ -111,6 +446,10 @@ class Settings(BaseSettings):
         ge=0,
         description="SQL执行最大重试次数"
     )
+    SQL_LINT_STRICT_COLUMNS: bool = Field(
+        default=True,
+        description="本地SQL校验时未知字段是否视为错误（False时仅警告）"
+    )
     IMPALA_VERSION: str = Field(
         default="4.0.0.4258",
         description="Impala版本（用于SQL生成）"
@@ -120,6 +459,20 @@ class Settings(BaseSettings):
         gt=0,
         description="CSV文件保留时间（小时），超时自动清理"
     )
+    SQL_STREAM_ENABLED: bool = Field(
+        default=True,
+        description="是否流式写出SQL结果（边接收边写CSV，大结果不在内存中构建完整DataFrame）"
+    )
+    SQL_STREAM_BATCH_ROWS: int = Field(
+        default=50000,
+        gt=0,
+        description="流式写出时每批行数"
+    )
+    SQL_STREAM_BUFFER_ROWS: int = Field(
+        default=100000,
+        gt=0,
+        description="流式写出的缓冲行数，结果不超过该行数时整体构建DataFrame（生成完整摘要）"
+    )
 
     # ========== 其他配置 ==========
     REQUEST_TIMEOUT: int = Field(
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+刷新热门事件预聚合表
+
+补齐缺失的历史分区、固化前一天的分区并刷新当天分区；
+API服务和V2 Agent运行时会在读取预聚合表的进程内后台定时执行，这里用于手动补齐或重建分区。
+只用 cron 每晚调用时当天分区会过期，包含今天的查询会截止到昨天回答（结果中带说明）
+
+用法:
+    python scripts/refresh_rollups.py
+    python scripts/refresh_rollups.py --rebuild 2024-12-01
+"""
+import sys
+import json
+from datetime import date, datetime
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import click
+
+from config.settings import get_settings
+from src.sensors.client import SensorsClient
+from src.analysis.rollup import get_rollup_store
+
+
+@click.command()
+@click.option("--rebuild", multiple=True, help="强制重建指定日期的分区（YYYY-MM-DD，可多次指定）")
+def main(rebuild):
+    """刷新预聚合表"""
+    settings = get_settings()
+    client = SensorsClient(
+        api_url=settings.SENSORS_API_URL,
+        project=settings.SENSORS_PROJECT,
+        api_key=settings.SENSORS_API_KEY,
+        timeout=settings.REQUEST_TIMEOUT,
+        max_retries=settings.MAX_RETRIES
+    )
+    store = get_rollup_store()
+    try:
+        if rebuild:
+            today = datetime.now().date()
+            days = sorted(date.fromisoformat(d) for d in rebuild)
+            store.refresh(client, days, complete=all(d < today for d in days))
+        click.echo(json.dumps(store.run_once(client), ensure_ascii=False, indent=2))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
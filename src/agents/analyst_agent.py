@@ -8,13 +8,26 @@
 - 生成分析计划，将复杂问题拆解为多个子任务
 - 向下层Agent发送自然语言指令
 """
+import os
+import re
+import json
 from typing import List, Dict, Any, Optional
+import pandas as pd
 from smolagents import CodeAgent
 from smolagents.models import OpenAIServerModel
 from loguru import logger
 from datetime import datetime
 
 from config.settings import get_settings
+from src.analysis.digest import ResultDigester
+from src.llm.client_registry import get_llm_registry
+from src.llm.router import ModelRouter, CALL_SITE_DRILLDOWN_DECISION
+from src.models.instruction import (
+    AnalysisPlan,
+    analysis_plan_response_format,
+    parse_analysis_plan,
+    repair_json_text,
+)
 
 
 class AnalystAgent:
@@ -32,7 +45,8 @@ class AnalystAgent:
         self,
         model: Optional[OpenAIServerModel] = None,
         model_name: Optional[str] = None,
-        api_key: Optional[str] = None
+        api_key: Optional[str] = None,
+        router: Optional[ModelRouter] = None
     ):
         """
         初始化分析规划Agent
@@ -41,8 +55,10 @@ class AnalystAgent:
             model: LLM模型实例(可选)
             model_name: 模型名称(可选)
             api_key: API密钥(可选)
+            router: 模型路由器(可选)，提供时下钻决策先用快速模型，置信度不足再升级
         """
         self.settings = get_settings()
+        self.router = router
 
         # 初始化模型
         if model is None:
@@ -68,13 +84,8 @@ class AnalystAgent:
 
         logger.info(f"创建AnalystAgent LLM模型: {model_name}")
 
-        model = OpenAIServerModel(
-            model_id=model_name,
-            api_key=api_key,
-            api_base=self.settings.LITELLM_BASE_URL,
-        )
-
-        return model
+        # 从共享注册表获取，复用连接池（reset() 重建Agent时不会重新握手）
+        return get_llm_registry().get_model(model_name, api_key=api_key)
 
     def _create_agent(self) -> CodeAgent:
         """创建CodeAgent"""
@@ -188,26 +199,44 @@ class AnalystAgent:
 - 将分析计划转化为自然语言指令
 - 这些指令会交给AutoSQLQueryTool执行(它会自动生成并执行SQL)
 
-【指令格式示例】
-你需要生成如下格式的指令:
+【输出格式】
+你必须只输出一个JSON对象（不要输出Markdown或其他文字），格式如下:
 
-```python
-# 第一步: 查询整体趋势
-instruction_1 = {{
-    "task": "查询最近7天每天的GMV总额和订单数",
-    "time_range": "last_7_days",
-    "dimensions": ["date"],
-    "metrics": ["GMV总额", "订单数"]
+{{
+    "plan": "用自然语言描述的分析计划，例如：先查整体GMV趋势，如有异常再按渠道下钻",
+    "instructions": [
+        {{
+            "task": "查询最近7天每天的GMV总额和订单数",
+            "time_range": "last_7_days",
+            "dimensions": ["date"],
+            "metrics": ["GMV总额", "订单数"]
+        }},
+        {{
+            "task": "查询昨天各渠道的GMV和订单数",
+            "time_range": "yesterday",
+            "dimensions": ["channel"],
+            "metrics": ["GMV", "订单数"]
+        }}
+    ]
 }}
 
-# 第二步: 如果发现异常，深入分析
-instruction_2 = {{
-    "task": "查询昨天各渠道的GMV和订单数",
-    "time_range": "yesterday",
-    "dimensions": ["channel"],
-    "metrics": ["GMV", "订单数"]
-}}
-```
+字段说明:
+- task: 完整的自然语言查询任务（必填），需包含时间、维度和指标，可独立执行
+- time_range: 时间范围，如"last_7_days"、"yesterday"或"2024-12-01 to 2024-12-07"
+- dimensions: 分组维度列表，没有则为[]
+- metrics: 指标列表
+- filters: 过滤条件（可选），如 {{"platform": ["iOS"]}}；task 中也需写明该过滤条件
+- funnel_steps: 漏斗步骤事件名（可选，按顺序，至少2个），如 ["ProductClick", "AddToCartClick", "PurchaseSuccess"]；
+  填写后由本地漏斗引擎按有序窗口口径计算各步骤用户数和转化率，dimensions 中的第一个非日期维度作为分组属性
+- funnel_window_days: 漏斗转化窗口期（天，可选，默认7）
+- retention_events: 留存的[起始事件, 回访事件]（可选，2个），如 ["AppLaunch", "AppLaunch"]；
+  填写后由本地留存引擎按同期群计算各期留存人数和留存率，time_range 为同期群的日期范围
+- retention_type: 留存类型 daily/weekly/monthly（可选，默认daily）
+- event_metrics: 指标都是单个事件的次数或去重人数时填写（可选，与 metrics 一一对应），
+  如 [{{"name": "商品点击次数", "event": "ProductClick", "aggregate": "count"}}, {{"name": "加购人数", "event": "AddToCartClick", "aggregate": "uv"}}]；
+  热门事件按日期/平台/站点的统计会直接由本地预聚合表回答
+- 追问（如"再按平台拆分"、"只看iOS"）尽量沿用上一次的 time_range 和 metrics 写法，便于复用已有结果
+- 如果不需要新的查询，instructions 返回 []
 
 【可用的维度和指标】
 常见维度:
@@ -225,9 +254,9 @@ instruction_2 = {{
 - 客单价: GMV/订单数
 
 【输出要求】
-1. 先用自然语言描述你的分析计划
-2. 然后生成具体的指令(JSON格式)
-3. 每个指令要清晰、可执行
+1. 在 plan 字段中用自然语言描述你的分析计划
+2. 在 instructions 字段中生成具体的指令
+3. 每个指令要清晰、可执行，不要生成重复的指令
 
 【重要提示】
 - 你只负责"想"(分析规划)，不负责"做"(执行SQL)
@@ -269,20 +298,18 @@ instruction_2 = {{
 
             full_prompt = f"{system_prompt}\n\n【用户问题】\n{user_question}{context_info}"
 
-            # 调用LLM分析
+            # 调用LLM分析（结构化输出）
             logger.info(f"[AnalystAgent] 调用LLM生成分析计划 (阶段: {stage})...")
-            response = self.model([{"role": "user", "content": full_prompt}])
-
-            # 解析响应
-            analysis_plan = response.content
+            plan = self._generate_plan(full_prompt)
 
-            logger.info("[AnalystAgent] 分析计划生成完成")
-            logger.debug(f"[分析计划]\n{analysis_plan}")
+            logger.info(f"[AnalystAgent] 分析计划生成完成，共 {len(plan.instructions)} 条指令")
+            logger.debug(f"[分析计划]\n{plan.plan}")
 
             # 返回结构化结果
             result = {
                 "user_question": user_question,
-                "analysis_plan": analysis_plan,
+                "analysis_plan": plan.plan,
+                "instructions": [instruction.to_dict() for instruction in plan.instructions],
                 "stage": stage,
                 "timestamp": datetime.now().isoformat()
             }
@@ -294,6 +321,80 @@ instruction_2 = {{
             logger.error(f"[AnalystAgent] 分析失败: {e}", exc_info=True)
             raise
 
+    def _generate_plan(self, prompt: str) -> AnalysisPlan:
+        """
+        调用LLM生成结构化分析计划
+
+        流程: JSON Schema结构化输出 -> 严格解析 -> 本地修复 -> LLM修复（仅一次）
+
+        Args:
+            prompt: 完整提示词
+
+        Returns:
+            去重后的分析计划
+
+        Raises:
+            ValueError: 修复后仍无法解析
+        """
+        messages = [{"role": "user", "content": prompt}]
+        try:
+            response = self.model(messages, response_format=analysis_plan_response_format())
+        except Exception as e:
+            # 部分模型/网关不支持 json_schema，退化为普通调用，依赖严格解析和修复
+            logger.warning(f"[AnalystAgent] 结构化输出调用失败，使用普通调用: {e}")
+            response = self.model(messages)
+
+        content = response.content if hasattr(response, 'content') else str(response)
+        return self._parse_plan(content).deduplicated()
+
+    def _parse_plan(self, content: str) -> AnalysisPlan:
+        """
+        严格解析分析计划，失败时进行低成本修复
+
+        Args:
+            content: LLM返回内容
+
+        Returns:
+            分析计划
+
+        Raises:
+            ValueError: 修复后仍无法解析
+        """
+        try:
+            return parse_analysis_plan(content)
+        except ValueError as e:
+            logger.warning(f"[AnalystAgent] 分析计划严格解析失败: {e}")
+            parse_error = e
+
+        # 本地修复（去代码块、尾随逗号、单引号等）
+        repaired = repair_json_text(content)
+        try:
+            plan = parse_analysis_plan(repaired)
+            logger.info("[AnalystAgent] 分析计划经本地修复后解析成功")
+            return plan
+        except ValueError as e:
+            parse_error = e
+
+        # LLM修复：只发送原始输出和错误信息，不重复完整提示词
+        logger.info("[AnalystAgent] 请求LLM修复分析计划JSON...")
+        repair_prompt = f"""下面的内容应当是一个符合Schema的JSON对象，但解析失败。
+请修复并只输出JSON对象本身，不要添加任何解释。
+
+【错误信息】
+{str(parse_error)[:500]}
+
+【JSON Schema】
+{json.dumps(AnalysisPlan.model_json_schema(), ensure_ascii=False)}
+
+【原始内容】
+{content[:4000]}
+"""
+        response = self.model([{"role": "user", "content": repair_prompt}])
+        repaired_content = response.content if hasattr(response, 'content') else str(response)
+        plan = parse_analysis_plan(repair_json_text(repaired_content))
+        logger.info("[AnalystAgent] 分析计划经LLM修复后解析成功")
+        return plan
+
     def synthesize_results(
         self,
         instructions: List[Dict[str, Any]],
@@ -341,7 +442,7 @@ instruction_2 = {{
 ## 2. 数据分析
 
 ### 2.1 关键指标
-- **必须从"查询结果摘要"的"数据预览"或"统计摘要"中提取实际数值**
+- **必须从"查询结果摘要"的合计、Top-K、环比等数值中提取实际数值**
 - 使用表格展示关键数据
 - 示例格式：
   | 指标名称 | 数值 | 单位 |
@@ -378,8 +479,8 @@ instruction_2 = {{
 - 时间范围: [从查询结果摘要中提取]
 - 主要维度: [从查询结果摘要中提取]
 
-**数据预览:**
-[将"查询结果摘要"中的"数据预览"转换为Markdown表格格式]
+**关键数据:**
+[将"查询结果摘要"中的Top-K/环比数据转换为Markdown表格格式]
 
 **完整数据下载:** [点击下载CSV文件]([CSV下载链接])
 
@@ -409,8 +510,8 @@ instruction_2 = {{
 
 【关键要求 - 必须遵守】
 1. **绝对禁止使用"待填充"、"待计算"等占位符** - 必须使用上面"查询结果摘要"中的实际数值
-2. **数据预览部分**：将文本格式的数据预览转换为规范的Markdown表格
-3. **关键指标部分**：必须填入具体数值，从"数据预览"或"统计摘要"中提取
+2. **关键数据部分**：将摘要中的Top-K和环比数据转换为规范的Markdown表格
+3. **关键指标部分**：必须填入具体数值，从摘要的合计/均值/最值中提取
 4. **趋势分析部分**：必须引用实际数据进行对比计算
 5. 表格使用标准Markdown格式: | 列1 | 列2 | ... |
 6. 使用清晰的业务语言，避免技术术语
@@ -432,13 +533,13 @@ instruction_2 = {{
 
     def _extract_results_summary(self, results: List[Dict[str, Any]]) -> str:
         """
-        从查询结果中提取摘要信息，避免上下文爆炸
+        从查询结果中提取紧凑摘要，避免上下文爆炸
 
         策略:
-        1. 只保留CSV路径和行数
-        2. 如果数据≤30行，保留全部数据；否则保留前20行
-        3. 提取structured_data中的统计摘要
-        4. 移除大段的原始数据
+        1. 每个查询只保留下载链接和数值摘要（合计、Top-K、环比、日期范围、异常标记）
+        2. 原始行全部放得下预算时才放入原始数据，否则只给摘要（不可加指标不求和）
+        3. 每个查询有严格的字符预算，总预算按查询数均分，
+           提示词大小与结果行数和查询数量无关
 
         Args:
             results: 查询结果列表
@@ -446,127 +547,58 @@ instruction_2 = {{
         Returns:
             结果摘要字符串
         """
-        import re
-        import json
-
-        summaries = []
+        digester = ResultDigester()
+        per_query_budget = min(
+            self.settings.SYNTHESIS_DIGEST_MAX_CHARS,
+            self.settings.SYNTHESIS_DIGEST_TOTAL_CHARS // max(len(results), 1)
+        )
 
+        output_lines = []
         for i, result in enumerate(results, 1):
-            summary = {
-                "查询序号": i,
-                "状态": result.get("status", "unknown")
-            }
+            output_lines.append(f"\n查询 {i}: {result.get('instruction', '')}")
+            output_lines.append("-" * 60)
 
-            if result.get("status") == "success":
-                result_text = result.get("result", "")
-
-                # 确保 result_text 是字符串
-                if isinstance(result_text, dict):
-                    result_text = str(result_text)
-                elif not isinstance(result_text, str):
-                    result_text = str(result_text)
-
-                # 提取CSV路径和下载链接
-                csv_match = re.search(r'CSV 文件:\s*(.+)', result_text)
-                if csv_match:
-                    summary["CSV文件"] = csv_match.group(1).strip()
-
-                # 提取下载链接
-                download_match = re.search(r'下载链接:\s*(.+)', result_text)
-                if download_match:
-                    summary["下载链接"] = download_match.group(1).strip()
-
-                # 提取行数
-                rows_match = re.search(r'行数:\s*(\d+)', result_text)
-                rows_count = 0
-                if rows_match:
-                    rows_count = int(rows_match.group(1))
-                    summary["数据行数"] = rows_count
-
-                # 提取列信息
-                columns_match = re.search(r'列:\s*\[([^\]]+)\]', result_text)
-                if columns_match:
-                    summary["列名"] = columns_match.group(1).strip()
-
-                # 提取structured_data中的统计信息
-                structured_match = re.search(r'<structured_data>(.*?)</structured_data>', result_text, re.DOTALL)
-                if structured_match:
-                    try:
-                        structured_data = json.loads(structured_match.group(1))
-
-                        # 保留所有关键模块信息
-                        if "summary_stats" in structured_data:
-                            summary["统计摘要"] = structured_data["summary_stats"]
-
-                        if "summary" in structured_data:
-                            summary["摘要信息"] = structured_data["summary"]
-
-                        if "date_range" in structured_data:
-                            summary["日期范围"] = structured_data["date_range"]
-
-                        if "analysis" in structured_data:
-                            summary["分析详情"] = structured_data["analysis"]
-
-                        if "key_findings" in structured_data:
-                            summary["关键发现"] = structured_data["key_findings"]
-
-                        # detailed_data通常数据量较大,只保留行数信息
-                        if "detailed_data" in structured_data:
-                            detailed = structured_data["detailed_data"]
-                            if isinstance(detailed, list):
-                                # 对于小数据集(<=30行),保留完整数据
-                                if len(detailed) <= 30:
-                                    summary["详细数据"] = detailed
-                                else:
-                                    # 对于大数据集,保留前20行
-                                    summary["详细数据"] = detailed[:20]
-                                    summary["详细数据_说明"] = f"仅显示前20行,共{len(detailed)}行"
-                            else:
-                                summary["详细数据"] = detailed
-                    except:
-                        pass
-
-                # 提取数据预览 - 根据数据量动态调整
-                preview_match = re.search(r'数据预览.*?:\s*\n-+\n(.*?)(?:\n\.\.\.|=====|\Z)', result_text, re.DOTALL)
-                if preview_match:
-                    preview_lines = preview_match.group(1).strip().split('\n')
-
-                    # 动态决定保留多少行数据
-                    if rows_count > 0 and rows_count <= 30:
-                        # 小数据集：保留所有数据
-                        summary["数据预览"] = '\n'.join(preview_lines)
-                        summary["_数据完整性"] = "完整数据"
-                    else:
-                        # 大数据集：保留前20行
-                        max_preview = 20
-                        summary["数据预览"] = '\n'.join(preview_lines[:max_preview])
-                        if len(preview_lines) > max_preview:
-                            summary["数据预览"] += f"\n... (还有 {len(preview_lines) - max_preview} 行未显示)"
-                        summary["_数据完整性"] = f"前{max_preview}行预览"
+            if result.get("status") != "success":
+                output_lines.append(f"  错误: {str(result.get('error', '未知错误'))[:300]}")
+                continue
 
-            else:
-                # 失败的查询
-                summary["错误"] = result.get("error", "未知错误")
+            tool_data = self._parse_tool_result(result.get("result", ""))
+            if tool_data.get("download_url"):
+                output_lines.append(f"  下载链接: {tool_data['download_url']}")
 
-            summaries.append(summary)
+            if result.get("root_cause_text"):
+                # 本地根因分析结论已足够紧凑，代替原始立方体的摘要
+                output_lines.extend(f"  {line}" for line in result["root_cause_text"].split("\n"))
+                continue
 
-        # 格式化输出
-        output_lines = []
-        for summary in summaries:
-            output_lines.append(f"\n查询 {summary['查询序号']}:")
-            output_lines.append("-" * 60)
-            for key, value in summary.items():
-                if key != "查询序号" and not key.startswith("_"):
-                    if isinstance(value, dict):
-                        output_lines.append(f"  {key}:")
-                        for k, v in value.items():
-                            output_lines.append(f"    {k}: {v}")
-                    else:
-                        output_lines.append(f"  {key}: {value}")
-            output_lines.append("")
+            digest = tool_data.get("digest")
+            if digest is None and tool_data.get("csv_path") and os.path.exists(tool_data["csv_path"]):
+                # 旧结果没有摘要时从CSV重新生成
+                try:
+                    digest = digester.digest(pd.read_csv(tool_data["csv_path"]))
+                except Exception as e:
+                    logger.warning(f"[AnalystAgent] 读取CSV生成摘要失败: {e}")
+
+            if digest is None:
+                output_lines.append("  (无可用数据摘要)")
+                continue
+
+            text = digester.render(digest, max_chars=per_query_budget)
+            output_lines.extend(f"  {line}" for line in text.split("\n"))
 
         return '\n'.join(output_lines)
 
+    @staticmethod
+    def _parse_tool_result(result: Any) -> Dict[str, Any]:
+        """解析AutoSQLQueryTool返回的JSON结果"""
+        if isinstance(result, dict):
+            return result
+        try:
+            data = json.loads(result)
+            return data if isinstance(data, dict) else {}
+        except (TypeError, json.JSONDecodeError):
+            return {}
+
     def _format_instructions(self, instructions: List[Dict[str, Any]]) -> str:
         """
         格式化指令列表，避免冗余信息
@@ -656,44 +688,25 @@ instruction_2 = {{
 - 如果用户问"对比分析"，初步结果只有整体数据 -> DRILLDOWN_NEEDED
 """
 
-            # 调用LLM评估
-            response = self.model([{"role": "user", "content": evaluation_prompt}])
-
-            # 处理响应内容 - 可能是字符串或字典
-            if hasattr(response, 'content'):
-                evaluation_text = response.content
+            # 调用LLM评估（启用路由时先用快速模型，解析失败或置信度不足再升级）
+            if self.router is not None:
+                threshold = self.settings.LLM_ESCALATION_CONFIDENCE
+                outcome = self.router.cascade(
+                    CALL_SITE_DRILLDOWN_DECISION,
+                    lambda model: self._request_drilldown_decision(model, evaluation_prompt),
+                    accept=lambda data: data is not None and self._confidence(data) >= threshold
+                )
+                decision_data = outcome.value
             else:
-                evaluation_text = str(response)
-
-            # 确保是字符串
-            if isinstance(evaluation_text, dict):
-                evaluation_text = json.dumps(evaluation_text, ensure_ascii=False)
-
-            logger.debug(f"[评估结果]\n{evaluation_text}")
-
-            # 解析JSON响应
-            import json
-            import re
+                decision_data = self._request_drilldown_decision(self.model, evaluation_prompt)
 
-            json_match = re.search(r'```json\s*(\{.*?\})\s*```', evaluation_text, re.DOTALL)
-            if json_match:
-                decision_data = json.loads(json_match.group(1))
-            else:
-                # 尝试直接解析整个文本
-                try:
-                    decision_data = json.loads(evaluation_text)
-                except json.JSONDecodeError:
-                    # 如果还是失败，尝试提取第一个JSON对象
-                    json_obj_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', evaluation_text, re.DOTALL)
-                    if json_obj_match:
-                        decision_data = json.loads(json_obj_match.group(0))
-                    else:
-                        raise ValueError(f"无法从响应中解析JSON: {evaluation_text[:200]}")
+            if decision_data is None:
+                raise ValueError("无法从响应中解析下钻决策JSON")
 
             need_drilldown = decision_data.get("decision") == "DRILLDOWN_NEEDED"
             reasoning = decision_data.get("reasoning", "未提供理由")
             suggested_dimensions = decision_data.get("suggested_dimensions", [])
-            confidence = decision_data.get("confidence", 0.5)
+            confidence = self._confidence(decision_data)
 
             logger.info(f"[决策结果] {'需要下钻' if need_drilldown else '不需要下钻'} (置信度: {confidence})")
             logger.info(f"[决策理由] {reasoning}")
@@ -717,3 +730,55 @@ instruction_2 = {{
                 "suggested_dimensions": [],
                 "confidence": 0.0
             }
+
+    def _request_drilldown_decision(self, model, evaluation_prompt: str) -> Optional[Dict[str, Any]]:
+        """
+        调用LLM获取下钻决策并解析JSON
+
+        Args:
+            model: 使用的模型
+            evaluation_prompt: 评估提示词
+
+        Returns:
+            决策字典，解析失败返回None
+        """
+        response = model([{"role": "user", "content": evaluation_prompt}])
+
+        # 处理响应内容 - 可能是字符串或字典
+        if hasattr(response, 'content'):
+            evaluation_text = response.content
+        else:
+            evaluation_text = str(response)
+
+        # 确保是字符串
+        if isinstance(evaluation_text, dict):
+            evaluation_text = json.dumps(evaluation_text, ensure_ascii=False)
+
+        logger.debug(f"[评估结果]\n{evaluation_text}")
+
+        json_match = re.search(r'```json\s*(\{.*?\})\s*```', evaluation_text, re.DOTALL)
+        candidates = [json_match.group(1)] if json_match else []
+        candidates.append(evaluation_text)
+        # 提取第一个JSON对象
+        json_obj_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', evaluation_text, re.DOTALL)
+        if json_obj_match:
+            candidates.append(json_obj_match.group(0))
+
+        for candidate in candidates:
+            try:
+                data = json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, dict):
+                return data
+
+        logger.warning(f"[AnalystAgent] 无法从响应中解析JSON: {evaluation_text[:200]}")
+        return None
+
+    @staticmethod
+    def _confidence(decision_data: Dict[str, Any]) -> float:
+        """读取自报置信度（缺失或非法时为0.5）"""
+        try:
+            return float(decision_data.get("confidence", 0.5))
+        except (TypeError, ValueError):
+            return 0.5
@@ -16,6 +16,7 @@ from loguru import logger
 from datetime import datetime
 
 from config.settings import get_settings
+from src.llm.client_registry import get_llm_registry
 from src.sensors.client import SensorsClient
 from src.tools.event_schema_tool import EventSchemaTool
 from src.tools.sql_expert_tool import SQLExpertTool
@@ -103,24 +104,14 @@ class EngineerAgent:
 
         logger.info(f"创建EngineerAgent LLM模型: {model_name}")
 
-        model = OpenAIServerModel(
-            model_id=model_name,
-            api_key=api_key,
-            api_base=self.settings.LITELLM_BASE_URL,
-        )
-
-        return model
+        return get_llm_registry().get_model(model_name, api_key=api_key)
 
     def _initialize_tools(self) -> List[Tool]:
         """初始化工具"""
         logger.info("初始化EngineerAgent工具...")
 
         # 为EventSchemaTool创建单独的轻量模型
-        event_schema_model = OpenAIServerModel(
-            model_id="gemini-2.5-flash-lite",  # 使用轻量模型
-            api_key=self.settings.LITELLM_API_KEY,
-            api_base=self.settings.LITELLM_BASE_URL,
-        )
+        event_schema_model = get_llm_registry().get_model(self.settings.LLM_FAST_MODEL)  # 使用轻量模型
 
         # 使用统一的AutoSQLQueryTool替代原来的三个工具
         # 该工具会自动完成：Schema检索 -> SQL生成 -> SQL执行 -> 语法错误重试
@@ -4,13 +4,14 @@ Agent编排器
 """
 from typing import List, Optional
 from smolagents import CodeAgent
-from smolagents.models import OpenAIServerModel
 from loguru import logger
 import os
 
 from config.settings import get_settings
+from src.llm.client_registry import get_llm_registry
 from src.sensors.client import SensorsClient
 from src.tools.auto_sql_query_tool import AutoSQLQueryTool
+from src.tools.rollup_query_tool import RollupQueryTool
 
 
 class SensorsAnalyticsAgent:
@@ -79,9 +80,12 @@ class SensorsAnalyticsAgent:
         logger.info("初始化工具...")
 
         # 使用一体化的 AutoSQLQueryTool，内部完成 Schema 检索、SQL 生成与执行
-        tools = [
-            AutoSQLQueryTool(self.sensors_client, base_url=self.settings.API_BASE_URL),
-        ]
+        auto_sql_query_tool = AutoSQLQueryTool(self.sensors_client, base_url=self.settings.API_BASE_URL)
+        tools = [auto_sql_query_tool]
+
+        # 热门事件的简单次数/人数先查预聚合表（与 auto_sql_query 共用结果保存和格式化）
+        if self.settings.ROLLUP_ENABLED:
+            tools.insert(0, RollupQueryTool(self.sensors_client, sql_execution_tool=auto_sql_query_tool.sql_execution_tool))
 
         logger.info(f"已加载 {len(tools)} 个工具")
         for tool in tools:
@@ -117,11 +121,8 @@ class SensorsAnalyticsAgent:
         try:
             # 使用 OpenAIServerModel 连接到 LiteLLM 服务端（OpenAI 兼容 API）
             # OpenAIServerModel 专门用于连接 OpenAI 兼容的服务端
-            model = OpenAIServerModel(
-                model_id=model_name,
-                api_key=api_key,
-                api_base=self.settings.LITELLM_BASE_URL,
-            )
+            # 从共享注册表获取，复用 keep-alive 连接池
+            model = get_llm_registry().get_model(model_name, api_key=api_key)
             logger.info("LLM模型创建成功")
             return model
         except Exception as e:
@@ -177,6 +178,22 @@ class SensorsAnalyticsAgent:
 
         ⚠️ 重要：在调用 auto_sql_query 工具时，必须将用户的模糊时间表述转换为明确的日期范围传递给 date_range 参数！
 =====================================================
+"""
+
+        rollup_guide = ""
+        if self.settings.ROLLUP_ENABLED:
+            rollup_guide = """
+**步骤0（可选）：热门事件的简单统计先查预聚合表**
+```python
+result = rollup_query(
+    event_metrics='[{"name": "点击次数", "event": "ProductClick", "aggregate": "count"}]',
+    date_range="last_7_days",
+    dimensions='["date"]'
+)
+if json.loads(result).get("status") == "not_available":
+    result = auto_sql_query(user_query="...", date_range="last_7_days")
+```
+只有事件在 rollup_query 说明的预聚合事件中、且只按日期/预聚合维度统计次数或人数时才使用；其他情况直接走步骤1。
 """
 
         return f"""{current_time_info}
@@ -188,7 +205,7 @@ class SensorsAnalyticsAgent:
 2. **数据分析** - 使用 pandas/matplotlib 动态生成分析代码和可视化，输出 Markdown 格式报告
 
 ## 工作流程
-
+{rollup_guide}
 **步骤1：执行SQL查询**
 ```python
 result = auto_sql_query(
@@ -6,7 +6,9 @@ from typing import Optional, Dict, Any
 from loguru import logger
 from datetime import datetime
 import json
-import re
+import os
+import pandas as pd
+from pydantic import ValidationError
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 
@@ -15,8 +17,16 @@ from src.sensors.client import SensorsClient
 from src.agents.analyst_agent import AnalystAgent
 from src.tools.auto_sql_query_tool import AutoSQLQueryTool
 from src.models.task_context import TaskContext
+from src.models.instruction import AnalysisInstruction
 from src.utils.report_formatter import ReportFormatter
-from smolagents.models import OpenAIServerModel
+from src.analysis.root_cause import RootCauseAnalyzer
+from src.analysis.cube import CubeStore
+from src.analysis.rewrite import ResultRewriter
+from src.tools.funnel_tool import FunnelTool
+from src.tools.retention_tool import RetentionTool
+from src.tools.rollup_query_tool import RollupQueryTool
+from src.llm.client_registry import get_llm_registry
+from src.llm.router import get_model_router
 
 
 class SensorsAnalyticsAgentV2:
@@ -61,37 +71,59 @@ class SensorsAnalyticsAgentV2:
             sensors_client = self._create_sensors_client()
         self.sensors_client = sensors_client
 
+        # 模型路由（各调用点的模型选择和级联策略）
+        self.router = get_model_router()
+
         # 初始化上层分析Agent
         logger.info("初始化上层分析Agent (AnalystAgent)...")
         self.analyst_agent = AnalystAgent(
             model_name=analyst_model_name or self.settings.LITELLM_MODEL,
-            api_key=api_key or self.settings.LITELLM_API_KEY
+            api_key=api_key or self.settings.LITELLM_API_KEY,
+            router=self.router
         )
 
         # 初始化AutoSQLQueryTool（直接使用工具，不再通过EngineerAgent）
         logger.info("初始化AutoSQLQueryTool...")
-        
-        # 为EventSchemaTool创建单独的轻量模型
-        event_schema_model = OpenAIServerModel(
-            model_id="gemini-2.5-flash-lite",
-            api_key=api_key or self.settings.LITELLM_API_KEY,
-            api_base=self.settings.LITELLM_BASE_URL,
-        )
-        
-        # SQL生成使用的模型
-        sql_expert_model = OpenAIServerModel(
-            model_id=engineer_model_name or self.settings.LITELLM_MODEL,
-            api_key=api_key or self.settings.LITELLM_API_KEY,
-            api_base=self.settings.LITELLM_BASE_URL,
-        )
-        
+
+        # 显式指定SQL生成模型时不做级联，否则由路由决定（快速模型优先，校验失败再升级）
+        sql_expert_model = None
+        if engineer_model_name:
+            sql_expert_model = get_llm_registry().get_model(
+                engineer_model_name,
+                api_key=api_key or self.settings.LITELLM_API_KEY
+            )
+
         self.auto_sql_query_tool = AutoSQLQueryTool(
             sensors_client=sensors_client,
-            event_schema_model=event_schema_model,
             sql_expert_model=sql_expert_model,
-            base_url=base_url
+            base_url=base_url,
+            router=self.router
         )
 
+        # 下钻阶段的本地根因分析
+        self.root_cause_analyzer = RootCauseAnalyzer()
+
+        # 会话内的结果立方体（追问的切片/过滤/汇总在本地完成）
+        self.cube_store = CubeStore()
+
+        # 热门事件的按天预聚合表（简单的次数/人数指令不经过神策）；
+        # 读取预聚合表的进程负责刷新，否则当天分区过期后包含今天的指令无法回答
+        self.rollup_query_tool = RollupQueryTool(
+            sensors_client, sql_execution_tool=self.auto_sql_query_tool.sql_execution_tool
+        )
+        self.rollup_store = self.rollup_query_tool.store
+        if self.settings.ROLLUP_ENABLED:
+            self.rollup_store.start(sensors_client)
+
+        # 本地漏斗引擎（带 funnel_steps 的指令不经LLM生成SQL）
+        self.funnel_tool = FunnelTool(sensors_client)
+
+        # 本地留存引擎（带 retention_events 的指令由按天用户位图计算）
+        self.retention_tool = RetentionTool(sensors_client)
+
+        # 本次分析中已有结果的改写（下钻指令由更细粒度的结果本地推导）
+        self.result_rewriter = ResultRewriter(self.funnel_tool.parse_date_range)
+
         logger.info("=" * 80)
         logger.info("双层Agent架构初始化完成")
         logger.info("  ├─ 上层: AnalystAgent (业务分析)")
@@ -170,13 +202,19 @@ class SensorsAnalyticsAgentV2:
                 description="根据用户问题生成初步查询计划"
             )
 
-            analysis_result = self.analyst_agent.analyze(user_input, stage="initial")
+            # 提供本会话已有的结果立方体，追问时沿用相同的时间范围和指标以便本地复用
+            recent_cubes = self.cube_store.describe() if self.settings.CUBE_ENABLED else ""
+            analysis_result = self.analyst_agent.analyze(
+                user_input,
+                context={"recent_results": recent_cubes} if recent_cubes else None,
+                stage="initial"
+            )
             analysis_plan = analysis_result.get("analysis_plan", "")
 
             logger.info(f"[初步分析计划]\n{analysis_plan}")
 
-            # 解析分析计划，提取初步指令
-            initial_instructions = self._parse_instructions(analysis_plan)
+            # 结构化输出的指令
+            initial_instructions = self._parse_instructions(analysis_result)
 
             if not initial_instructions:
                 logger.warning("未能从分析计划中提取到具体指令，使用默认指令")
@@ -238,22 +276,36 @@ class SensorsAnalyticsAgentV2:
                         description="基于初步结果进行深入分析"
                     )
 
-                    # 准备上下文信息
-                    context = {
-                        "initial_results": self.analyst_agent._extract_results_summary(initial_results),
-                        "suggested_dimensions": decision["suggested_dimensions"]
-                    }
-
-                    # 生成下钻指令
-                    drilldown_analysis = self.analyst_agent.analyze(
-                        user_question=user_input,
-                        context=context,
-                        stage="drilldown"
-                    )
-                    drilldown_plan = drilldown_analysis.get("analysis_plan", "")
-                    drilldown_instructions = self._parse_instructions(drilldown_plan)
+                    # 优先使用单次立方体查询 + 本地根因分析
+                    if self.settings.ROOT_CAUSE_LOCAL_ENABLED:
+                        drilldown_instructions, drilldown_results = self._run_root_cause_drilldown(
+                            user_input,
+                            decision,
+                            initial_instructions,
+                            task_id=task_id,
+                            task_context=task_context
+                        )
+
+                    if drilldown_results:
+                        task_context.complete_iteration()
+                    else:
+                        # 准备上下文信息
+                        context = {
+                            "initial_results": self.analyst_agent._extract_results_summary(initial_results),
+                            "suggested_dimensions": decision["suggested_dimensions"]
+                        }
+
+                        # 生成下钻指令
+                        drilldown_analysis = self.analyst_agent.analyze(
+                            user_question=user_input,
+                            context=context,
+                            stage="drilldown"
+                        )
+                        drilldown_instructions = self._parse_instructions(drilldown_analysis)
 
-                    if drilldown_instructions:
+                    if drilldown_results:
+                        logger.info("\n本地根因分析完成，跳过逐维度下钻查询")
+                    elif drilldown_instructions:
                         logger.info(f"\n提取到 {len(drilldown_instructions)} 条下钻指令:")
                         for i, inst in enumerate(drilldown_instructions, 1):
                             logger.info(f"  {i}. {inst.get('task', inst)}")
@@ -338,46 +390,22 @@ class SensorsAnalyticsAgentV2:
         hash_obj = hashlib.md5(normalized.encode('utf-8'))
         return hash_obj.hexdigest()
 
-    def _parse_instructions(self, analysis_plan: str) -> list:
+    def _parse_instructions(self, analysis_result: Dict[str, Any]) -> list:
         """
-        从分析计划中解析指令
+        从AnalystAgent的结构化结果中获取指令
 
         Args:
-            analysis_plan: 分析计划文本
+            analysis_result: AnalystAgent.analyze 的返回值
 
         Returns:
-            指令列表
+            指令列表（字典格式，字段: task/time_range/dimensions/metrics）
         """
         instructions = []
-
-        try:
-            # 尝试从JSON代码块中提取
-            json_pattern = r'```(?:json|python)?\s*(\{.*?\})\s*```'
-            matches = re.finditer(json_pattern, analysis_plan, re.DOTALL)
-
-            for match in matches:
-                try:
-                    json_str = match.group(1)
-                    # 移除Python变量赋值
-                    json_str = re.sub(r'^\s*\w+\s*=\s*', '', json_str)
-                    instruction = json.loads(json_str)
-                    instructions.append(instruction)
-                except json.JSONDecodeError:
-                    continue
-
-            # 如果没有找到JSON，尝试从文本中提取关键信息
-            if not instructions:
-                # 查找"查询"、"分析"等关键词开头的行
-                lines = analysis_plan.split('\n')
-                for line in lines:
-                    line = line.strip()
-                    if any(keyword in line for keyword in ["查询", "分析", "统计", "计算"]):
-                        if len(line) > 10 and not line.startswith('#'):
-                            instructions.append({"task": line})
-
-        except Exception as e:
-            logger.error(f"解析指令失败: {e}")
-
+        for raw in analysis_result.get("instructions", []):
+            try:
+                instructions.append(AnalysisInstruction.model_validate(raw).to_dict())
+            except ValidationError as e:
+                logger.warning(f"忽略无效指令: {raw}, 错误: {e}")
         return instructions
 
     def _extract_plan_summary(self, analysis_plan: str) -> str:
@@ -406,6 +434,80 @@ class SensorsAnalyticsAgentV2:
 
         return '\n'.join(summary_lines) if summary_lines else "自动分析"
 
+    def _run_root_cause_drilldown(
+        self,
+        user_input: str,
+        decision: Dict[str, Any],
+        initial_instructions: list,
+        task_id: Optional[str] = None,
+        task_context: Optional[TaskContext] = None
+    ) -> tuple:
+        """
+        单次立方体查询 + 本地根因分析
+
+        一次查询 日期 × 各建议维度 × 指标，在本地计算各维度取值对变化的贡献，
+        替代"每个维度一条查询 + LLM逐条阅读"的下钻方式
+
+        Args:
+            user_input: 用户问题
+            decision: 下钻决策
+            initial_instructions: 初步查询指令（用于沿用时间范围和指标）
+            task_id: 任务ID
+            task_context: 任务上下文
+
+        Returns:
+            (下钻指令列表, 下钻结果列表)；无法完成时返回两个空列表，由调用方回退到逐维度下钻
+        """
+        dimensions = list(dict.fromkeys(
+            decision.get("suggested_dimensions") or self.settings.ROOT_CAUSE_DEFAULT_DIMENSIONS
+        ))
+        first = initial_instructions[0] if initial_instructions else {}
+        metrics = first.get("metrics") or []
+        metric_text = "、".join(metrics) if metrics else "问题中的核心指标"
+
+        instruction = AnalysisInstruction(
+            task=(
+                f"针对问题「{user_input}」，按 日期、{'、'.join(dimensions)} 分组，"
+                f"查询每天每个维度组合的{metric_text}，输出所有组合，不要排序截断或只取TopN"
+            ),
+            time_range=first.get("time_range", "last_7_days"),
+            dimensions=["date"] + dimensions,
+            metrics=metrics,
+            description="根因分析立方体查询"
+        ).to_dict()
+
+        logger.info(f"[根因分析] 立方体查询: 日期 × {' × '.join(dimensions)}")
+        try:
+            results = self._execute_instructions([instruction], task_id=task_id, task_context=task_context)
+        except Exception as e:
+            logger.warning(f"[根因分析] 立方体查询失败，回退到逐维度下钻: {e}")
+            return [], []
+
+        result = results[0] if results else {}
+        tool_data = self.analyst_agent._parse_tool_result(result.get("result", ""))
+        csv_path = tool_data.get("csv_path")
+        if result.get("status") != "success" or not csv_path or not os.path.exists(csv_path):
+            logger.warning("[根因分析] 立方体查询无结果，回退到逐维度下钻")
+            return [], []
+
+        try:
+            cube = pd.read_csv(csv_path)
+            metric = next((m for m in metrics if m in cube.columns), None)
+            analysis = self.root_cause_analyzer.analyze(cube, metric=metric)
+        except Exception as e:
+            logger.warning(f"[根因分析] 本地计算失败，回退到逐维度下钻: {e}")
+            return [], []
+
+        if analysis.get("status") != "success" or not analysis.get("dimensions"):
+            logger.info(f"[根因分析] 未找到集中的贡献来源，回退到逐维度下钻: {analysis.get('message', analysis.get('description'))}")
+            return [], []
+
+        logger.info(f"[根因分析] {analysis['description']}")
+        result = dict(result)
+        result["root_cause"] = analysis
+        result["root_cause_text"] = self.root_cause_analyzer.render(analysis)
+        return [instruction], [result]
+
     def _execute_instructions(
         self,
         instructions: list,
@@ -445,8 +547,11 @@ class SensorsAnalyticsAgentV2:
                 instruction_str = str(instruction)
                 instruction_params = {}
 
-            # 生成指令的唯一标识
-            instruction_hash = self._generate_instruction_hash(instruction_str)
+            # 生成指令的唯一标识（结构化指令使用规范化的 task/time_range/dimensions/metrics）
+            try:
+                instruction_hash = AnalysisInstruction.model_validate(instruction).cache_key()
+            except ValidationError:
+                instruction_hash = self._generate_instruction_hash(instruction_str)
 
             # 在TaskContext中创建查询记录
             query_ctx = None
@@ -504,12 +609,24 @@ class SensorsAnalyticsAgentV2:
                 if task_id:
                     filename = f"task_{task_id}_query_{i+1}.csv"
                 
-                # 调用AutoSQLQueryTool
-                tool_result = self.auto_sql_query_tool.forward(
-                    user_query=instruction_str,
-                    date_range=date_range,
-                    filename=filename
-                )
+                # 漏斗/留存指令由本地引擎计算；已有结果、预聚合表或本地立方体能回答时不再查询神策
+                tool_result = self._run_local_funnel(instruction_params, filename)
+                if tool_result is None:
+                    tool_result = self._run_local_retention(instruction_params, filename)
+                if tool_result is None:
+                    tool_result = self._answer_from_results(instruction_params, filename, task_context, query_ctx)
+                if tool_result is None:
+                    tool_result = self._answer_from_rollup(instruction_params, filename)
+                if tool_result is None:
+                    tool_result = self._answer_from_cube(instruction_params, filename)
+                if tool_result is None:
+                    # 调用AutoSQLQueryTool
+                    tool_result = self.auto_sql_query_tool.forward(
+                        user_query=instruction_str,
+                        date_range=date_range,
+                        filename=filename
+                    )
+                    self._update_cube(instruction_params, tool_result)
                 
                 # 解析工具返回的JSON字符串
                 import json
@@ -584,6 +701,206 @@ class SensorsAnalyticsAgentV2:
 
         return execution_results
 
+    def _answer_from_cube(self, instruction: Dict[str, Any], filename: Optional[str] = None) -> Optional[str]:
+        """
+        尝试用本地立方体回答指令
+
+        Args:
+            instruction: 结构化指令
+            filename: CSV文件名（可选）
+
+        Returns:
+            与AutoSQLQueryTool相同格式的JSON字符串；无法回答时返回None
+        """
+        if not self.settings.CUBE_ENABLED or not isinstance(instruction, dict):
+            return None
+
+        try:
+            df = self.cube_store.answer(instruction)
+            if df is None:
+                return None
+
+            execution_tool = self.auto_sql_query_tool.sql_execution_tool
+            if not filename:
+                filename = f"cube_{self._generate_instruction_hash(instruction.get('task', ''))[:8]}.csv"
+            csv_path = execution_tool._save_csv(df, os.path.join(execution_tool.default_output_dir, filename))
+
+            result_data = json.loads(execution_tool._format_result(csv_path, df, {}))
+            result_data["source"] = "local_cube"
+            return json.dumps(result_data, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning(f"[CubeStore] 本地立方体回答失败，改为查询神策: {e}")
+            return None
+
+    def _answer_from_results(
+        self,
+        instruction: Dict[str, Any],
+        filename: Optional[str] = None,
+        task_context: Optional[TaskContext] = None,
+        query_ctx: Any = None
+    ) -> Optional[str]:
+        """
+        尝试由本次分析中已有的更细粒度结果推导指令（过滤 + 重新汇总）
+
+        Args:
+            instruction: 结构化指令
+            filename: CSV文件名（可选）
+            task_context: 任务上下文（已成功的查询作为来源）
+            query_ctx: 当前指令的查询上下文（不作为自己的来源）
+
+        Returns:
+            与AutoSQLQueryTool相同格式的JSON字符串；无法推导时返回None
+        """
+        if not self.settings.REWRITE_ENABLED or task_context is None or not isinstance(instruction, dict):
+            return None
+
+        sources = [
+            (q.parameters, q.csv_path, q.events_analyzed)
+            for q in task_context.get_successful_queries()
+            if q is not query_ctx and q.csv_path
+        ]
+        if not sources:
+            return None
+
+        try:
+            answered = self.result_rewriter.answer(instruction, sources)
+            if answered is None:
+                return None
+            df, source, events = answered
+
+            execution_tool = self.auto_sql_query_tool.sql_execution_tool
+            if not filename:
+                filename = f"derived_{self._generate_instruction_hash(instruction.get('task', ''))[:8]}.csv"
+            csv_path = execution_tool._save_csv(df, os.path.join(execution_tool.default_output_dir, filename))
+
+            result_data = json.loads(execution_tool._format_result(csv_path, df, {}))
+            result_data["source"] = "derived_result"
+            result_data["derived_from"] = source.get("task", "")
+            result_data.setdefault("query_info", {})["events_analyzed"] = sorted(events)
+            return json.dumps(result_data, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning(f"[ResultRewriter] 由已有结果推导失败，改为查询神策: {e}")
+            return None
+
+    def _answer_from_rollup(self, instruction: Dict[str, Any], filename: Optional[str] = None) -> Optional[str]:
+        """
+        尝试用热门事件预聚合表回答指令（与V1的 rollup_query 工具共用路由）
+
+        Args:
+            instruction: 结构化指令（需包含 event_metrics）
+            filename: CSV文件名（可选）
+
+        Returns:
+            与AutoSQLQueryTool相同格式的JSON字符串；无法回答时返回None
+        """
+        return self.rollup_query_tool.answer_instruction(instruction, filename)
+
+    def _run_local_funnel(self, instruction: Dict[str, Any], filename: Optional[str] = None) -> Optional[str]:
+        """
+        用本地漏斗引擎执行漏斗指令
+
+        Args:
+            instruction: 结构化指令（需包含 funnel_steps）
+            filename: CSV文件名（可选）
+
+        Returns:
+            与AutoSQLQueryTool相同格式的JSON字符串；不是漏斗指令或计算失败时返回None
+        """
+        if not self.settings.FUNNEL_LOCAL_ENABLED or not isinstance(instruction, dict):
+            return None
+        steps = instruction.get("funnel_steps") or []
+        if len(steps) < 2:
+            return None
+
+        try:
+            start_date, end_date = self.funnel_tool.parse_date_range(instruction.get("time_range", "last_7_days"))
+            breakdown = next((d for d in instruction.get("dimensions", []) if d.lower() != "date"), None)
+            result = self.funnel_tool.engine.run(
+                self.sensors_client,
+                steps,
+                start_date,
+                end_date,
+                window_days=instruction.get("funnel_window_days"),
+                filters=instruction.get("filters") or None,
+                breakdown=breakdown
+            )
+            logger.info(f"[漏斗] {result['description']}")
+
+            df = result["table"]
+            execution_tool = self.auto_sql_query_tool.sql_execution_tool
+            if not filename:
+                filename = f"funnel_{self._generate_instruction_hash('|'.join(steps))[:8]}.csv"
+            csv_path = execution_tool._save_csv(df, os.path.join(execution_tool.default_output_dir, filename))
+
+            result_data = json.loads(execution_tool._format_result(csv_path, df, {}, sql=result["sql"]))
+            result_data["source"] = "local_funnel"
+            result_data["funnel_summary"] = result["description"]
+            return json.dumps(result_data, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning(f"[漏斗] 本地漏斗计算失败，改为生成SQL查询: {e}")
+            return None
+
+    def _run_local_retention(self, instruction: Dict[str, Any], filename: Optional[str] = None) -> Optional[str]:
+        """
+        用本地留存引擎执行留存指令
+
+        Args:
+            instruction: 结构化指令（需包含 retention_events）
+            filename: CSV文件名（可选）
+
+        Returns:
+            与AutoSQLQueryTool相同格式的JSON字符串；不是留存指令或计算失败时返回None
+        """
+        if not self.settings.RETENTION_LOCAL_ENABLED or not isinstance(instruction, dict):
+            return None
+        events = instruction.get("retention_events") or []
+        if len(events) != 2:
+            return None
+
+        try:
+            start_date, end_date = self.retention_tool.parse_date_range(instruction.get("time_range", "last_7_days"))
+            result = self.retention_tool.engine.run(
+                self.sensors_client,
+                events[0],
+                events[1],
+                start_date,
+                end_date,
+                retention_type=instruction.get("retention_type") or "daily",
+                filters=instruction.get("filters") or None
+            )
+            logger.info(f"[留存] {result['description']}")
+
+            df = result["rates"]
+            execution_tool = self.auto_sql_query_tool.sql_execution_tool
+            if not filename:
+                filename = f"retention_{self._generate_instruction_hash('|'.join(events))[:8]}.csv"
+            csv_path = execution_tool._save_csv(df, os.path.join(execution_tool.default_output_dir, filename))
+
+            result_data = json.loads(execution_tool._format_result(csv_path, df, {}, sql=result["sql"] or ""))
+            result_data["source"] = "local_retention"
+            result_data["retention_summary"] = result["description"]
+            return json.dumps(result_data, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning(f"[留存] 本地留存计算失败，改为生成SQL查询: {e}")
+            return None
+
+    def _update_cube(self, instruction: Dict[str, Any], tool_result: str):
+        """用神策查询结果更新本地立方体"""
+        if not self.settings.CUBE_ENABLED or not isinstance(instruction, dict):
+            return
+
+        try:
+            tool_data = json.loads(tool_result)
+            csv_path = tool_data.get("csv_path")
+            if not csv_path or not os.path.exists(csv_path):
+                return
+            if tool_data.get("rows", 0) > self.settings.CUBE_MAX_ROWS:
+                return
+            events = (tool_data.get("query_info") or {}).get("events_analyzed")
+            self.cube_store.add(instruction, pd.read_csv(csv_path), events=events)
+        except Exception as e:
+            logger.warning(f"[CubeStore] 更新立方体失败: {e}")
+
     def _record_result_to_context(self, query_ctx: Any, result: Dict[str, Any]):
         """
         将查询结果记录到TaskContext
@@ -618,7 +935,8 @@ class SensorsAnalyticsAgentV2:
                         column_count=result_data.get("column_count"),
                         columns=result_data.get("columns"),
                         data_preview=result_data.get("data_preview", []),
-                        download_url=result_data.get("download_url")
+                        download_url=result_data.get("download_url"),
+                        events_analyzed=(result_data.get("query_info") or {}).get("events_analyzed")
                     )
 
             # 记录状态
@@ -645,13 +963,17 @@ class SensorsAnalyticsAgentV2:
         # 重新初始化分析Agent和工具
         self.analyst_agent = AnalystAgent(
             model_name=self.settings.LITELLM_MODEL,
-            api_key=self.settings.LITELLM_API_KEY
+            api_key=self.settings.LITELLM_API_KEY,
+            router=self.router
         )
         # AutoSQLQueryTool不需要重置，因为它本身是无状态的
+        self.cube_store.clear()
 
     def close(self):
         """关闭资源"""
         logger.info("关闭双层Agent资源")
+        if self.settings.ROLLUP_ENABLED:
+            self.rollup_store.stop()
         if self.sensors_client:
             self.sensors_client.close()
 
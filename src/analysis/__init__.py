@@ -1,13 +1,25 @@
 """
 数据分析模块
 
-提供趋势分析、统计分析、异常检测和洞察生成功能
+提供趋势分析、统计分析、异常检测、洞察生成、结果摘要、多序列批量分析、根因分析、相关性分析、漏斗计算、留存计算、用户ID字典编码、分析结果缓存、多进程分析、热门事件预聚合、基于已有结果的指令改写和大数据集采样功能
 """
 
 from .trends import TrendAnalyzer
 from .statistics import StatisticsAnalyzer
 from .anomaly import AnomalyDetector
 from .insights import InsightGenerator
+from .digest import ResultDigester, StreamingDigest
+from .batch import BatchAnalyzer
+from .root_cause import RootCauseAnalyzer
+from .correlation import CorrelationAnalyzer
+from .funnel import FunnelEngine
+from .retention import RetentionEngine, get_retention_engine
+from .user_ids import UserIdInterner, get_user_id_interner
+from .memo import AnalysisCache, get_analysis_cache
+from .parallel import ParallelAnalyzer
+from .rollup import RollupStore, get_rollup_store
+from .rewrite import ResultRewriter
+from .sampling import DataSampler, SampleResult
 from . import utils
 
 __all__ = [
@@ -15,5 +27,23 @@ __all__ = [
     'StatisticsAnalyzer',
     'AnomalyDetector',
     'InsightGenerator',
+    'ResultDigester',
+    'StreamingDigest',
+    'BatchAnalyzer',
+    'RootCauseAnalyzer',
+    'CorrelationAnalyzer',
+    'FunnelEngine',
+    'RetentionEngine',
+    'get_retention_engine',
+    'UserIdInterner',
+    'get_user_id_interner',
+    'AnalysisCache',
+    'get_analysis_cache',
+    'ParallelAnalyzer',
+    'RollupStore',
+    'get_rollup_store',
+    'ResultRewriter',
+    'DataSampler',
+    'SampleResult',
     'utils'
 ]
@@ -6,6 +6,7 @@
 - IQR（四分位距）方法
 - 突变检测
 - 时间序列异常
+- 季节残差异常（STL/MSTL分解后的残差）
 """
 
 from typing import Dict, List, Optional, Any, Tuple
@@ -13,13 +14,28 @@ import pandas as pd
 import numpy as np
 from scipy import stats
 
+from .seasonal import MIN_ANOMALY_CYCLES, get_seasonal_decomposer
+
+
+def _index_labels(index: pd.Index, positions: np.ndarray) -> List[Any]:
+    """将被标记位置的索引转换为结果中的索引表示（整数索引保持为int，其余转为字符串）"""
+    return [
+        int(idx) if isinstance(idx, (int, np.integer)) else str(idx)
+        for idx in index[positions]
+    ]
+
+
+def _order_by_magnitude(positions: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """按 |key| 降序排列被标记位置（稳定排序，相同值保持原顺序）"""
+    return positions[np.argsort(-np.abs(keys[positions]), kind="stable")]
+
 
 class AnomalyDetector:
     """异常检测器"""
 
     def __init__(self):
         """初始化异常检测器"""
-        pass
+        self.seasonal_decomposer = get_seasonal_decomposer()
 
     def detect_zscore_anomalies(
         self,
@@ -66,23 +82,24 @@ class AnomalyDetector:
                 "description": "数据无变化，标准差为0"
             }
 
-        z_scores = np.abs((clean_data - mean) / std)
-
-        # 识别异常值
-        anomalies = []
-        for idx, z_score in z_scores.items():
-            if z_score > threshold:
-                value = clean_data[idx]
-                anomalies.append({
-                    "index": int(idx) if isinstance(idx, (int, np.integer)) else str(idx),
-                    "value": float(value),
-                    "z_score": float(z_score),
-                    "deviation": float((value - mean) / mean * 100) if mean != 0 else 0,
-                    "description": f"偏离均值{abs((value - mean) / mean * 100):.1f}% (Z={z_score:.2f})"
-                })
-
-        # 按Z-score排序
-        anomalies.sort(key=lambda x: abs(x['z_score']), reverse=True)
+        values = clean_data.to_numpy(dtype=float)
+        z_scores = np.abs((values - mean) / std)
+
+        # 识别异常值（只为被标记的点生成结果，按Z-score排序）
+        flagged = _order_by_magnitude(np.flatnonzero(z_scores > threshold), z_scores)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            deviations = (values[flagged] - mean) / mean * 100
+
+        anomalies = [
+            {
+                "index": label,
+                "value": float(values[pos]),
+                "z_score": float(z_scores[pos]),
+                "deviation": float(deviation) if mean != 0 else 0,
+                "description": f"偏离均值{abs(deviation):.1f}% (Z={z_scores[pos]:.2f})"
+            }
+            for pos, label, deviation in zip(flagged, _index_labels(clean_data.index, flagged), deviations)
+        ]
 
         return {
             "method": "Z-score",
@@ -145,21 +162,26 @@ class AnomalyDetector:
         lower_bound = q1 - multiplier * iqr
         upper_bound = q3 + multiplier * iqr
 
-        # 识别异常值
-        anomalies = []
-        for idx, value in clean_data.items():
-            if value < lower_bound or value > upper_bound:
-                median = clean_data.median()
-                anomalies.append({
-                    "index": int(idx) if isinstance(idx, (int, np.integer)) else str(idx),
-                    "value": float(value),
-                    "type": "low" if value < lower_bound else "high",
-                    "deviation": float((value - median) / median * 100) if median != 0 else 0,
-                    "description": f"{'低于' if value < lower_bound else '高于'}正常范围"
-                })
-
-        # 按偏离程度排序
-        anomalies.sort(key=lambda x: abs(x['deviation']), reverse=True)
+        # 识别异常值（只为被标记的点生成结果，按偏离程度排序）
+        values = clean_data.to_numpy(dtype=float)
+        median = clean_data.median()
+        flagged = np.flatnonzero((values < lower_bound) | (values > upper_bound))
+        if median != 0:
+            deviations = (values - median) / median * 100
+        else:
+            deviations = np.zeros(len(values))
+        flagged = _order_by_magnitude(flagged, deviations)
+
+        anomalies = [
+            {
+                "index": label,
+                "value": float(values[pos]),
+                "type": "low" if values[pos] < lower_bound else "high",
+                "deviation": float(deviations[pos]) if median != 0 else 0,
+                "description": f"{'低于' if values[pos] < lower_bound else '高于'}正常范围"
+            }
+            for pos, label in zip(flagged, _index_labels(clean_data.index, flagged))
+        ]
 
         return {
             "method": "IQR",
@@ -210,32 +232,28 @@ class AnomalyDetector:
                 "description": "有效数据不足"
             }
 
-        # 计算变化率
-        pct_changes = clean_data.pct_change(periods=window)
-
-        # 识别突变
-        changes = []
-        for idx, pct_change in pct_changes.items():
-            if pd.notna(pct_change) and abs(pct_change) > threshold:
-                current_value = clean_data[idx]
-                previous_idx = clean_data.index[clean_data.index.get_loc(idx) - window]
-                previous_value = clean_data[previous_idx]
-
-                change_type = "surge" if pct_change > 0 else "drop"
-                change_desc = "激增" if pct_change > 0 else "骤降"
-
-                changes.append({
-                    "index": int(idx) if isinstance(idx, (int, np.integer)) else str(idx),
-                    "value": float(current_value),
-                    "previous_value": float(previous_value),
-                    "change_rate": float(pct_change),
-                    "change_rate_pct": float(pct_change * 100),
-                    "type": change_type,
-                    "description": f"{change_desc} {abs(pct_change * 100):.1f}%"
-                })
-
-        # 按变化率绝对值排序
-        changes.sort(key=lambda x: abs(x['change_rate']), reverse=True)
+        # 计算变化率（第 i 个点相对第 i-window 个点）
+        values = clean_data.to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct_changes = np.full(len(values), np.nan)
+            pct_changes[window:] = values[window:] / values[:-window] - 1
+
+        # 识别突变（只为被标记的点生成结果，按变化率绝对值排序）
+        flagged = np.flatnonzero(~np.isnan(pct_changes) & (np.abs(pct_changes) > threshold))
+        flagged = _order_by_magnitude(flagged, pct_changes)
+
+        changes = [
+            {
+                "index": label,
+                "value": float(values[pos]),
+                "previous_value": float(values[pos - window]),
+                "change_rate": float(pct_changes[pos]),
+                "change_rate_pct": float(pct_changes[pos] * 100),
+                "type": "surge" if pct_changes[pos] > 0 else "drop",
+                "description": f"{'激增' if pct_changes[pos] > 0 else '骤降'} {abs(pct_changes[pos] * 100):.1f}%"
+            }
+            for pos, label in zip(flagged, _index_labels(clean_data.index, flagged))
+        ]
 
         return {
             "method": "Sudden Change",
@@ -290,36 +308,34 @@ class AnomalyDetector:
         upper_bound = rolling_mean + n_std * rolling_std
         lower_bound = rolling_mean - n_std * rolling_std
 
-        # 识别异常值
-        anomalies = []
-        for idx, value in clean_data.items():
-            expected_mean = rolling_mean[idx]
-            expected_std = rolling_std[idx]
-            upper = upper_bound[idx]
-            lower = lower_bound[idx]
-
-            if pd.notna(upper) and pd.notna(lower):
-                if value > upper or value < lower:
-                    # 计算偏离度
-                    if expected_std > 0:
-                        deviation_std = abs(value - expected_mean) / expected_std
-                    else:
-                        deviation_std = 0
-
-                    anomalies.append({
-                        "index": int(idx) if isinstance(idx, (int, np.integer)) else str(idx),
-                        "value": float(value),
-                        "expected_mean": float(expected_mean),
-                        "expected_std": float(expected_std),
-                        "upper_bound": float(upper),
-                        "lower_bound": float(lower),
-                        "deviation_std": float(deviation_std),
-                        "type": "high" if value > upper else "low",
-                        "description": f"{'高于' if value > upper else '低于'}预期范围（偏离{deviation_std:.1f}σ）"
-                    })
-
-        # 按偏离度排序
-        anomalies.sort(key=lambda x: abs(x['deviation_std']), reverse=True)
+        # 识别异常值（边界为NaN的点不参与判定）
+        values = clean_data.to_numpy(dtype=float)
+        means = rolling_mean.to_numpy()
+        stds = rolling_std.to_numpy()
+        upper = upper_bound.to_numpy()
+        lower = lower_bound.to_numpy()
+        flagged = np.flatnonzero(~np.isnan(upper) & ~np.isnan(lower) & ((values > upper) | (values < lower)))
+
+        # 计算偏离度（只为被标记的点生成结果，按偏离度排序）
+        deviation_std = np.zeros(len(values))
+        positive = flagged[stds[flagged] > 0]
+        deviation_std[positive] = np.abs(values[positive] - means[positive]) / stds[positive]
+        flagged = _order_by_magnitude(flagged, deviation_std)
+
+        anomalies = [
+            {
+                "index": label,
+                "value": float(values[pos]),
+                "expected_mean": float(means[pos]),
+                "expected_std": float(stds[pos]),
+                "upper_bound": float(upper[pos]),
+                "lower_bound": float(lower[pos]),
+                "deviation_std": float(deviation_std[pos]),
+                "type": "high" if values[pos] > upper[pos] else "low",
+                "description": f"{'高于' if values[pos] > upper[pos] else '低于'}预期范围（偏离{deviation_std[pos]:.1f}σ）"
+            }
+            for pos, label in zip(flagged, _index_labels(clean_data.index, flagged))
+        ]
 
         return {
             "method": "Timeseries Anomaly",
@@ -331,6 +347,77 @@ class AnomalyDetector:
             "description": f"检测到{len(anomalies)}个时序异常点"
         }
 
+    def detect_seasonal_anomalies(
+        self,
+        data: pd.Series,
+        time_index: Optional[pd.Series] = None,
+        threshold: float = 3.5,
+        key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        基于季节分解残差检测异常（周末等固定周期不会被误判）
+
+        最短周期不足 MIN_ANOMALY_CYCLES 个完整周期时不做检测（残差尺度不可靠）
+
+        Args:
+            data: 数值序列
+            time_index: 时间索引（需为规则的日/小时粒度）
+            threshold: 残差稳健Z分数阈值（默认3.5）
+            key: 序列标识（用于缓存和增量重拟合）
+
+        Returns:
+            异常检测结果
+        """
+        fitted = self.seasonal_decomposer.fit_series(data, time_index, key=key)
+        if fitted is None:
+            return {
+                "method": "Seasonal Residual",
+                "anomalies": [],
+                "anomaly_count": 0,
+                "description": "数据不足或无规则时间索引，无法进行季节分解"
+            }
+        if len(fitted[0].values) < MIN_ANOMALY_CYCLES * min(fitted[0].periods):
+            return {
+                "method": "Seasonal Residual",
+                "anomalies": [],
+                "anomaly_count": 0,
+                "description": f"数据不足{MIN_ANOMALY_CYCLES}个完整周期，季节残差尺度不可靠，未做检测"
+            }
+
+        fit, positions = fitted
+        scores, median, scale = self.seasonal_decomposer.residual_scores(fit)
+        point_scores = scores[positions]
+        residuals = fit.resid[positions]
+        expected = (fit.values - fit.resid)[positions]
+        values = fit.values[positions]
+
+        # 只为被标记的点生成结果，按残差分数排序
+        flagged = _order_by_magnitude(np.flatnonzero(point_scores > threshold), point_scores)
+        anomalies = [
+            {
+                "index": label,
+                "value": float(values[pos]),
+                "expected": float(expected[pos]),
+                "residual": float(residuals[pos]),
+                "score": float(point_scores[pos]),
+                "type": "high" if residuals[pos] > median else "low",
+                "description": f"{'高于' if residuals[pos] > median else '低于'}季节预期{abs(values[pos] - expected[pos]):.2f}（分数={point_scores[pos]:.1f}）"
+            }
+            for pos, label in zip(flagged, _index_labels(data.index, flagged))
+        ]
+
+        return {
+            "method": "Seasonal Residual",
+            "decomposition": fit.method,
+            "periods": list(fit.periods),
+            "threshold": threshold,
+            "residual_scale": scale,
+            "anomalies": anomalies,
+            "anomaly_count": len(anomalies),
+            "anomaly_rate": len(anomalies) / len(data),
+            "description": f"检测到{len(anomalies)}个季节残差异常点（{fit.method}, 周期={list(fit.periods)}）"
+        }
+
     def comprehensive_detection(
         self,
         data: pd.Series,
@@ -342,7 +429,7 @@ class AnomalyDetector:
 
         Args:
             data: 数值序列
-            methods: 检测方法列表 ['zscore', 'iqr', 'sudden_change', 'timeseries']
+            methods: 检测方法列表 ['zscore', 'iqr', 'sudden_change', 'timeseries', 'seasonal']
             time_index: 时间索引（用于时间序列分析）
 
         Returns:
@@ -354,11 +441,14 @@ class AnomalyDetector:
                 "message": "数据为空"
             }
 
-        # 默认使用所有方法
+        # 默认使用所有方法；有时间索引且周期数足够时优先季节残差检测，否则回退到移动窗口检测
         if methods is None:
             methods = ['zscore', 'iqr', 'sudden_change']
             if time_index is not None and len(data) >= 14:
-                methods.append('timeseries')
+                if self.seasonal_decomposer.is_applicable(data, time_index, min_cycles=MIN_ANOMALY_CYCLES):
+                    methods.append('seasonal')
+                else:
+                    methods.append('timeseries')
 
         results = {}
 
@@ -378,6 +468,10 @@ class AnomalyDetector:
         if 'timeseries' in methods and len(data) >= 14:
             results['timeseries'] = self.detect_timeseries_anomalies(data)
 
+        # 季节残差异常检测
+        if 'seasonal' in methods:
+            results['seasonal'] = self.detect_seasonal_anomalies(data, time_index)
+
         # 汇总所有异常
         all_anomaly_indices = set()
         for method_name, method_result in results.items():
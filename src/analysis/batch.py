@@ -0,0 +1,732 @@
+"""
+批量（多序列）分析模块
+
+对二维矩阵（时间 × 指标，或 时间 × 维度分组）一次性完成：
+- 线性趋势拟合、增长率、移动平均、周期性、季节分解
+- Z-score、IQR、突变、季节残差检测
+- 基础统计量、分布特征
+
+所有序列共用一次NumPy向量化计算，只有被标记的点才转换为字典。
+输出与 TrendAnalyzer / AnomalyDetector / StatisticsAnalyzer 的
+comprehensive_* 方法逐序列的结果结构一致
+"""
+
+from typing import Dict, List, Optional, Any, Sequence, Tuple
+import pandas as pd
+import numpy as np
+from loguru import logger
+from scipy import stats
+
+from config.settings import get_settings
+
+from .trends import TrendAnalyzer
+from .anomaly import AnomalyDetector
+from .stats_kernel import summarize
+from .memo import get_analysis_cache, content_digest
+
+
+def _index_label(idx: Any) -> Any:
+    """与单序列分析器一致的索引表示"""
+    return int(idx) if isinstance(idx, (int, np.integer)) else str(idx)
+
+
+class BatchAnalyzer:
+    """多序列批量分析器"""
+
+    def __init__(self):
+        """初始化批量分析器"""
+        self.settings = get_settings()
+        self.trend_analyzer = TrendAnalyzer()
+        self.anomaly_detector = AnomalyDetector()
+        self.cache = get_analysis_cache()
+
+    # ========== 入口 ==========
+
+    def analyze(
+        self,
+        frame: pd.DataFrame,
+        analysis_types: Sequence[str],
+        time_index: Optional[pd.Series] = None,
+        anomaly_methods: Sequence[str] = ("zscore", "iqr", "sudden_change")
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        批量分析所有列
+
+        Args:
+            frame: 数据框，每一列是一条序列（行为时间点），需为无缺失的数值
+            analysis_types: 分析类型列表（trend / anomaly / statistics）
+            time_index: 时间索引（可选，与行对齐）
+            anomaly_methods: 异常检测方法
+
+        Returns:
+            {列名: {"trend_analysis": ..., "anomaly_detection": ..., "statistics": ...}}
+        """
+        names = list(frame.columns)
+        values = frame.to_numpy(dtype=float)
+        index = frame.index
+
+        results: Dict[str, Dict[str, Any]] = {name: {} for name in names}
+
+        if "trend" in analysis_types:
+            for name, result in zip(names, self.trend_batch(values, index, time_index, names)):
+                results[name]["trend_analysis"] = result
+
+        if "anomaly" in analysis_types:
+            for name, result in zip(names, self.anomaly_batch(values, index, anomaly_methods, time_index)):
+                results[name]["anomaly_detection"] = result
+
+        if "statistics" in analysis_types:
+            for name, result in zip(names, self.statistics_batch(values, names)):
+                results[name]["statistics"] = result
+
+        return results
+
+    # ========== 共用中间结果 ==========
+
+    def rolling_stats(self, values: np.ndarray, window: int, stat: str = "mean") -> np.ndarray:
+        """
+        居中滚动窗口统计（min_periods=1），按内容缓存
+
+        趋势的移动平均和时序异常检测使用同一窗口，同一份数据只计算一次
+
+        Args:
+            values: T × K 矩阵
+            window: 窗口大小
+            stat: mean / std
+
+        Returns:
+            T × K 矩阵（只读）
+        """
+        def compute() -> np.ndarray:
+            rolling = pd.DataFrame(values).rolling(window=window, center=True, min_periods=1)
+            return getattr(rolling, stat)().to_numpy()
+
+        return self.cache.array(("rolling", content_digest(values), window, stat), compute)
+
+    # ========== 趋势分析 ==========
+
+    @staticmethod
+    def linear_fit(values: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        对每一列做 y ~ x 线性回归（x 为 0..T-1），结果与 scipy.stats.linregress 一致
+
+        Args:
+            values: T × K 矩阵
+
+        Returns:
+            {"slope", "intercept", "r_value", "p_value", "std_err"}，每项为长度K的数组
+        """
+        n, k = values.shape
+        x = np.arange(n, dtype=float)
+        x_mean = x.mean()
+        y_mean = values.mean(axis=0)
+
+        ssxm = np.mean((x - x_mean) ** 2)
+        ssym = np.mean((values - y_mean) ** 2, axis=0)
+        ssxym = ((x - x_mean) @ (values - y_mean)) / n
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = ssxym / ssxm
+            intercept = y_mean - slope * x_mean
+            r = np.clip(ssxym / np.sqrt(ssxm * ssym), -1.0, 1.0)
+            degenerate = ssym == 0
+            r[degenerate] = np.where(ssxym[degenerate] == 0, np.nan, 0.0)
+
+            if n == 2:
+                constant = values[0] == values[1]
+                p_value = np.where(constant, 1.0, 0.0)
+                std_err = np.zeros(k)
+            else:
+                df = n - 2
+                tiny = 1.0e-20
+                t = r * np.sqrt(df / ((1.0 - r + tiny) * (1.0 + r + tiny)))
+                p_value = 2 * stats.t.sf(np.abs(t), df)
+                std_err = np.sqrt((1 - r ** 2) * ssym / ssxm / df)
+
+        result = {"slope": slope, "intercept": intercept, "r_value": r, "p_value": p_value, "std_err": std_err}
+
+        # 结果落在分类阈值附近的序列用 linregress 重新拟合，保证与单序列分析的判定完全一致
+        r_squared = r ** 2
+        borderline = (
+            np.isclose(p_value, 0.05, rtol=1e-9, atol=0)
+            | np.isclose(np.abs(r), 0.7, rtol=1e-9, atol=0)
+            | np.isclose(r_squared, 0.8, rtol=1e-9, atol=0)
+            | np.isclose(r_squared, 0.5, rtol=1e-9, atol=0)
+        )
+        for j in np.flatnonzero(borderline):
+            exact = stats.linregress(x, values[:, j])
+            result["slope"][j] = exact.slope
+            result["intercept"][j] = exact.intercept
+            result["r_value"][j] = exact.rvalue
+            result["p_value"][j] = exact.pvalue
+            result["std_err"][j] = exact.stderr
+
+        return result
+
+    def trend_batch(
+        self,
+        values: np.ndarray,
+        index: pd.Index,
+        time_index: Optional[pd.Series],
+        names: List[str]
+    ) -> List[Dict[str, Any]]:
+        """批量趋势分析，逐列结果与 TrendAnalyzer.comprehensive_analysis 一致"""
+        n, k = values.shape
+        if n == 0:
+            return [{"status": "error", "message": "数据为空"} for _ in range(k)]
+
+        frame = pd.DataFrame(values, index=index)
+        means = values.mean(axis=0)
+        medians = np.median(values, axis=0)
+        stds = frame.std().to_numpy()
+        mins = values.min(axis=0)
+        maxs = values.max(axis=0)
+
+        seasonality, fit_values = self._seasonality_batch(values, time_index, names)
+
+        fit = self.linear_fit(fit_values) if n >= 2 else None
+        growth = self._growth_batch(values, daily=time_index is not None)
+        periodicity = self._periodicity_batch(values, time_index)
+
+        ma_window = min(7, n)
+        moving_avg = self.rolling_stats(values, ma_window, "mean")
+
+        # 拐点：变化率和显著性阈值整体计算，峰谷识别逐列调用 find_peaks
+        if n >= 3:
+            changes = self.trend_analyzer.change_rates(values)
+            prominences = stds * 0.5
+
+        results = []
+        for j in range(k):
+            if n >= 3:
+                turning_points = self.trend_analyzer.find_turning_points(values[:, j], prominences[j], changes[:, j])
+            else:
+                turning_points = self.trend_analyzer.identify_turning_points(pd.Series(values[:, j], index=index))
+            results.append({
+                "metric_name": names[j],
+                "summary": {
+                    "mean": float(means[j]),
+                    "median": float(medians[j]),
+                    "std": float(stds[j]),
+                    "min": float(mins[j]),
+                    "max": float(maxs[j]),
+                    "count": n
+                },
+                "trend": self._trend_result(fit, j, seasonality[j]["available"]) if fit is not None else {
+                    "direction": "insufficient_data",
+                    "strength": 0,
+                    "description": "数据不足，无法分析趋势"
+                },
+                "growth": growth[j],
+                "turning_points": turning_points,
+                "periodicity": periodicity[j],
+                "seasonality": seasonality[j],
+                "moving_average": moving_avg[:, j].tolist() if n <= 100 else []
+            })
+        return results
+
+    def _seasonality_batch(
+        self,
+        values: np.ndarray,
+        time_index: Optional[pd.Series],
+        names: List[str]
+    ) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        """
+        批量季节分解：时间网格只整理一次，逐列STL拟合（带缓存）
+
+        Returns:
+            (各列分解摘要, 趋势拟合用的矩阵)；可分解的列替换为去季节化值
+        """
+        n, k = values.shape
+        unavailable = {"available": False, "description": "数据不足或无规则时间索引，未做季节分解"}
+        max_columns = self.settings.SEASONAL_BATCH_MAX_COLUMNS
+        if k > max_columns:
+            logger.info(f"[BatchAnalyzer] {k} 条序列超过季节分解上限 {max_columns}，跳过季节分解")
+            skipped = {"available": False, "description": f"序列数超过{max_columns}，批量分析未做季节分解"}
+            return [dict(skipped) for _ in range(k)], values
+
+        decomposer = self.trend_analyzer.seasonal_decomposer
+        seasonality = []
+        fit_values = values
+        for j, fitted in enumerate(decomposer.fit_matrix(values, time_index, names)):
+            if fitted is None:
+                seasonality.append(dict(unavailable))
+                continue
+            fit, positions = fitted
+            seasonality.append(decomposer.summarize(fit))
+            if fit_values is values:
+                fit_values = values.copy()
+            fit_values[:, j] = fit.deseasonalized[positions]
+        return seasonality, fit_values
+
+    @staticmethod
+    def _trend_result(fit: Dict[str, np.ndarray], j: int, deseasonalized: bool = False) -> Dict[str, Any]:
+        """由回归结果生成趋势描述（与 TrendAnalyzer.detect_trend 规则一致）"""
+        slope = fit["slope"][j]
+        r_value = fit["r_value"][j]
+        p_value = fit["p_value"][j]
+
+        if p_value > 0.05:
+            direction, description, emoji = "stable", "平稳", "→"
+        elif slope > 0:
+            direction, description = "increasing", "上升"
+            emoji = "↗️" if abs(r_value) > 0.7 else "↗"
+        else:
+            direction, description = "decreasing", "下降"
+            emoji = "↘️" if abs(r_value) > 0.7 else "↘"
+
+        r_squared = r_value ** 2
+        if r_squared > 0.8:
+            strength, strength_desc = "strong", "强"
+        elif r_squared > 0.5:
+            strength, strength_desc = "moderate", "中等"
+        else:
+            strength, strength_desc = "weak", "弱"
+
+        result = {
+            "direction": direction,
+            "direction_desc": description,
+            "emoji": emoji,
+            "strength": strength,
+            "strength_desc": strength_desc,
+            "slope": float(slope),
+            "r_squared": float(r_squared),
+            "p_value": float(p_value),
+            "description": f"{description}趋势，强度{strength_desc}"
+        }
+        if deseasonalized:
+            result["basis"] = "deseasonalized"
+        return result
+
+    @staticmethod
+    def _growth_batch(values: np.ndarray, daily: bool) -> List[Dict[str, Any]]:
+        """批量增长率（与 TrendAnalyzer.calculate_growth_rate 规则一致）"""
+        n, k = values.shape
+        if n < 2:
+            return [{"growth_rate": 0, "description": "数据不足"} for _ in range(k)]
+
+        first, last = values[0], values[-1]
+        daily_mean = None
+        if daily:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                changes = values[1:] / values[:-1] - 1
+            valid = ~np.isnan(changes)
+            counts = valid.sum(axis=0)
+            with np.errstate(invalid="ignore"):
+                daily_mean = np.where(counts > 0, np.where(valid, changes, 0).sum(axis=0) / np.maximum(counts, 1), np.nan)
+
+        results = []
+        for j in range(k):
+            first_value, last_value = first[j], last[j]
+            if first_value == 0:
+                if last_value > 0:
+                    growth_rate = float('inf')
+                    description = "从零开始增长"
+                else:
+                    growth_rate = 0
+                    description = "无变化"
+            else:
+                growth_rate = float((last_value - first_value) / first_value)
+                description = f"{'增长' if growth_rate > 0 else '下降'} {abs(growth_rate):.1%}"
+
+            result = {
+                "growth_rate": growth_rate,
+                "growth_rate_pct": growth_rate * 100 if growth_rate != float('inf') else None,
+                "first_value": float(first_value),
+                "last_value": float(last_value),
+                "absolute_change": float(last_value - first_value),
+                "description": description
+            }
+            if daily_mean is not None:
+                result["daily_growth_rate"] = float(daily_mean[j])
+                result["daily_growth_rate_pct"] = float(daily_mean[j] * 100)
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _periodicity_batch(values: np.ndarray, time_index: Optional[pd.Series]) -> List[Dict[str, Any]]:
+        """批量周期性分析（星期分组均值只计算一次）"""
+        n, k = values.shape
+        no_periodicity = {"has_periodicity": False, "description": "未检测到明显周期性"}
+        if time_index is None or n < 14:
+            return [{"has_periodicity": False, "description": "数据不足或无时间索引"} for _ in range(k)]
+        if not hasattr(time_index.iloc[0], 'dayofweek'):
+            return [dict(no_periodicity) for _ in range(k)]
+
+        dayofweek = time_index.dt.dayofweek.to_numpy()
+        weekday_avg_all = pd.DataFrame(values).groupby(dayofweek).mean()
+        weekday_std = weekday_avg_all.std().to_numpy()
+        weekday_mean = weekday_avg_all.mean().to_numpy()
+        day_names = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+
+        results = []
+        for j in range(k):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cv = weekday_std[j] / weekday_mean[j]
+            if not cv > 0.2:
+                results.append(dict(no_periodicity))
+                continue
+
+            weekday_avg = weekday_avg_all[j]
+            max_day = weekday_avg.idxmax()
+            min_day = weekday_avg.idxmin()
+            results.append({
+                "has_periodicity": True,
+                "pattern": "weekly",
+                "weekday_avg": weekday_avg.to_dict(),
+                "max_day": int(max_day),
+                "max_day_name": day_names[max_day],
+                "max_value": float(weekday_avg.iloc[max_day]),
+                "min_day": int(min_day),
+                "min_day_name": day_names[min_day],
+                "min_value": float(weekday_avg.iloc[min_day]),
+                "description": f"{day_names[max_day]}最高，{day_names[min_day]}最低"
+            })
+        return results
+
+    # ========== 异常检测 ==========
+
+    def anomaly_batch(
+        self,
+        values: np.ndarray,
+        index: pd.Index,
+        methods: Sequence[str] = ("zscore", "iqr", "sudden_change"),
+        time_index: Optional[pd.Series] = None
+    ) -> List[Dict[str, Any]]:
+        """批量异常检测，逐列结果与 AnomalyDetector.comprehensive_detection 一致"""
+        n, k = values.shape
+        if n == 0:
+            return [{"status": "error", "message": "数据为空"} for _ in range(k)]
+
+        per_method: Dict[str, List[Dict[str, Any]]] = {}
+        if 'zscore' in methods:
+            per_method['zscore'] = self.zscore_batch(values, index)
+        if 'iqr' in methods:
+            per_method['iqr'] = self.iqr_batch(values, index)
+        if 'sudden_change' in methods:
+            per_method['sudden_change'] = self.sudden_change_batch(values, index)
+        if 'timeseries' in methods and n >= 14:
+            per_method['timeseries'] = self.timeseries_batch(values, index)
+        if 'seasonal' in methods:
+            per_method['seasonal'] = [
+                self.anomaly_detector.detect_seasonal_anomalies(pd.Series(values[:, j], index=index), time_index)
+                for j in range(k)
+            ]
+
+        results = []
+        for j in range(k):
+            by_method = {method: method_results[j] for method, method_results in per_method.items()}
+            indices = set()
+            for method_result in by_method.values():
+                for item in method_result.get('anomalies', method_result.get('changes', [])):
+                    indices.add(item['index'])
+            results.append({
+                "summary": {
+                    "total_anomaly_points": len(indices),
+                    "methods_used": len(by_method),
+                    "details": {
+                        method: result.get('anomaly_count', result.get('change_count', 0))
+                        for method, result in by_method.items()
+                    }
+                },
+                "results_by_method": by_method,
+                "anomaly_indices": sorted(list(indices))
+            })
+        return results
+
+    def zscore_batch(self, values: np.ndarray, index: pd.Index, threshold: float = 3.0) -> List[Dict[str, Any]]:
+        """批量Z-score检测"""
+        n, k = values.shape
+        if n < 3:
+            return [{"method": "Z-score", "anomalies": [], "anomaly_count": 0, "description": "数据不足"} for _ in range(k)]
+
+        mean = values.mean(axis=0)
+        std = values.std(axis=0, ddof=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z_scores = np.abs((values - mean) / std)
+        flagged = (z_scores > threshold) & (std > 0)
+
+        results = []
+        for j in range(k):
+            if std[j] == 0:
+                results.append({
+                    "method": "Z-score", "anomalies": [], "anomaly_count": 0,
+                    "description": "数据无变化，标准差为0"
+                })
+                continue
+
+            m = np.float64(mean[j])
+            anomalies = []
+            for pos in np.flatnonzero(flagged[:, j]):
+                value = np.float64(values[pos, j])
+                z_score = z_scores[pos, j]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    deviation = (value - m) / m * 100
+                anomalies.append({
+                    "index": _index_label(index[pos]),
+                    "value": float(value),
+                    "z_score": float(z_score),
+                    "deviation": float(deviation) if m != 0 else 0,
+                    "description": f"偏离均值{abs(deviation):.1f}% (Z={z_score:.2f})"
+                })
+            anomalies.sort(key=lambda x: abs(x['z_score']), reverse=True)
+
+            results.append({
+                "method": "Z-score",
+                "threshold": threshold,
+                "mean": float(m),
+                "std": float(std[j]),
+                "anomalies": anomalies,
+                "anomaly_count": len(anomalies),
+                "anomaly_rate": len(anomalies) / n,
+                "description": f"检测到{len(anomalies)}个异常值（阈值={threshold}σ）"
+            })
+        return results
+
+    def iqr_batch(self, values: np.ndarray, index: pd.Index, multiplier: float = 1.5) -> List[Dict[str, Any]]:
+        """批量IQR检测"""
+        n, k = values.shape
+        if n < 4:
+            return [{"method": "IQR", "anomalies": [], "anomaly_count": 0, "description": "数据不足"} for _ in range(k)]
+
+        q1, q3 = np.quantile(values, [0.25, 0.75], axis=0)
+        iqr = q3 - q1
+        lower_bound = q1 - multiplier * iqr
+        upper_bound = q3 + multiplier * iqr
+        median = np.median(values, axis=0)
+        flagged = ((values < lower_bound) | (values > upper_bound)) & (iqr != 0)
+
+        results = []
+        for j in range(k):
+            if iqr[j] == 0:
+                results.append({
+                    "method": "IQR", "anomalies": [], "anomaly_count": 0,
+                    "description": "IQR为0，数据集中度过高"
+                })
+                continue
+
+            anomalies = []
+            for pos in np.flatnonzero(flagged[:, j]):
+                value = values[pos, j]
+                is_low = value < lower_bound[j]
+                anomalies.append({
+                    "index": _index_label(index[pos]),
+                    "value": float(value),
+                    "type": "low" if is_low else "high",
+                    "deviation": float((value - median[j]) / median[j] * 100) if median[j] != 0 else 0,
+                    "description": f"{'低于' if is_low else '高于'}正常范围"
+                })
+            anomalies.sort(key=lambda x: abs(x['deviation']), reverse=True)
+
+            results.append({
+                "method": "IQR",
+                "multiplier": multiplier,
+                "q1": float(q1[j]),
+                "q3": float(q3[j]),
+                "iqr": float(iqr[j]),
+                "lower_bound": float(lower_bound[j]),
+                "upper_bound": float(upper_bound[j]),
+                "anomalies": anomalies,
+                "anomaly_count": len(anomalies),
+                "anomaly_rate": len(anomalies) / n,
+                "description": f"检测到{len(anomalies)}个异常值（范围: [{lower_bound[j]:.2f}, {upper_bound[j]:.2f}]）"
+            })
+        return results
+
+    def sudden_change_batch(
+        self,
+        values: np.ndarray,
+        index: pd.Index,
+        threshold: float = 0.5,
+        window: int = 1
+    ) -> List[Dict[str, Any]]:
+        """批量突变检测"""
+        n, k = values.shape
+        if n < window + 1:
+            return [{"method": "Sudden Change", "changes": [], "change_count": 0, "description": "数据不足"} for _ in range(k)]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct_changes = values[window:] / values[:-window] - 1
+        flagged = ~np.isnan(pct_changes) & (np.abs(pct_changes) > threshold)
+
+        results = []
+        for j in range(k):
+            changes = []
+            for pos in np.flatnonzero(flagged[:, j]):
+                pct_change = pct_changes[pos, j]
+                changes.append({
+                    "index": _index_label(index[pos + window]),
+                    "value": float(values[pos + window, j]),
+                    "previous_value": float(values[pos, j]),
+                    "change_rate": float(pct_change),
+                    "change_rate_pct": float(pct_change * 100),
+                    "type": "surge" if pct_change > 0 else "drop",
+                    "description": f"{'激增' if pct_change > 0 else '骤降'} {abs(pct_change * 100):.1f}%"
+                })
+            changes.sort(key=lambda x: abs(x['change_rate']), reverse=True)
+
+            results.append({
+                "method": "Sudden Change",
+                "threshold": threshold,
+                "threshold_pct": threshold * 100,
+                "window": window,
+                "changes": changes,
+                "change_count": len(changes),
+                "description": f"检测到{len(changes)}个突变点（阈值={threshold*100:.0f}%）"
+            })
+        return results
+
+    def timeseries_batch(
+        self,
+        values: np.ndarray,
+        index: pd.Index,
+        window_size: int = 7,
+        n_std: float = 2.5
+    ) -> List[Dict[str, Any]]:
+        """批量移动窗口异常检测"""
+        n, k = values.shape
+        if n < window_size * 2:
+            return [{
+                "method": "Timeseries Anomaly", "anomalies": [], "anomaly_count": 0,
+                "description": f"数据不足，需要至少{window_size * 2}个数据点"
+            } for _ in range(k)]
+
+        rolling_mean = self.rolling_stats(values, window_size, "mean")
+        rolling_std = self.rolling_stats(values, window_size, "std")
+        upper = rolling_mean + n_std * rolling_std
+        lower = rolling_mean - n_std * rolling_std
+        flagged = ~np.isnan(upper) & ~np.isnan(lower) & ((values > upper) | (values < lower))
+
+        results = []
+        for j in range(k):
+            anomalies = []
+            for pos in np.flatnonzero(flagged[:, j]):
+                value = values[pos, j]
+                expected_mean = rolling_mean[pos, j]
+                expected_std = rolling_std[pos, j]
+                deviation_std = abs(value - expected_mean) / expected_std if expected_std > 0 else 0
+                is_high = value > upper[pos, j]
+                anomalies.append({
+                    "index": _index_label(index[pos]),
+                    "value": float(value),
+                    "expected_mean": float(expected_mean),
+                    "expected_std": float(expected_std),
+                    "upper_bound": float(upper[pos, j]),
+                    "lower_bound": float(lower[pos, j]),
+                    "deviation_std": float(deviation_std),
+                    "type": "high" if is_high else "low",
+                    "description": f"{'高于' if is_high else '低于'}预期范围（偏离{deviation_std:.1f}σ）"
+                })
+            anomalies.sort(key=lambda x: abs(x['deviation_std']), reverse=True)
+
+            results.append({
+                "method": "Timeseries Anomaly",
+                "window_size": window_size,
+                "n_std": n_std,
+                "anomalies": anomalies,
+                "anomaly_count": len(anomalies),
+                "anomaly_rate": len(anomalies) / n,
+                "description": f"检测到{len(anomalies)}个时序异常点"
+            })
+        return results
+
+    # ========== 统计分析 ==========
+
+    def statistics_batch(self, values: np.ndarray, names: List[str]) -> List[Dict[str, Any]]:
+        """批量统计分析，逐列结果与 StatisticsAnalyzer.comprehensive_analysis 一致"""
+        n, k = values.shape
+        if n == 0:
+            return [{"status": "error", "message": "数据为空"} for _ in range(k)]
+
+        # 每列只排序一次，中位数/众数/分位数/最值都从排序结果读取
+        summary = summarize(values, (0.25, 0.5, 0.75))
+        mean, median, mode = summary.mean, summary.median, summary.mode
+        std, var = summary.std, summary.var
+        vmin, vmax, total = summary.minimum, summary.maximum, summary.total
+        q25, q50, q75 = summary.quantiles
+
+        skewness = kurtosis = None
+        if n >= 3:
+            skewness = stats.skew(values, axis=0)
+            kurtosis = stats.kurtosis(values, axis=0)
+
+        results = []
+        for j in range(k):
+            basic = {
+                "count": n,
+                "mean": float(mean[j]),
+                "median": float(median[j]),
+                "mode": float(mode[j]),
+                "std": float(std[j]),
+                "variance": float(var[j]),
+                "min": float(vmin[j]),
+                "max": float(vmax[j]),
+                "range": float(vmax[j] - vmin[j]),
+                "sum": float(total[j]),
+                "quantiles": {
+                    "q25": float(q25[j]),
+                    "q50": float(q50[j]),
+                    "q75": float(q75[j]),
+                },
+                "iqr": float(q75[j] - q25[j])
+            }
+            if basic["mean"] != 0:
+                basic["coefficient_of_variation"] = basic["std"] / basic["mean"]
+
+            results.append({
+                "metric_name": names[j],
+                "basic_stats": basic,
+                "distribution": self._distribution(values[:, j], skewness, kurtosis, j)
+            })
+        return results
+
+    @staticmethod
+    def _distribution(
+        column: np.ndarray,
+        skewness: Optional[np.ndarray],
+        kurtosis: Optional[np.ndarray],
+        j: int
+    ) -> Dict[str, Any]:
+        """分布特征描述（偏度/峰度已批量计算，正态性检验逐列）"""
+        if skewness is None:
+            return {"error": "数据不足，需要至少3个数据点"}
+
+        skew_value = float(skewness[j])
+        kurt_value = float(kurtosis[j])
+
+        normality_test = None
+        if len(column) >= 8:
+            try:
+                stat, p_value = stats.shapiro(column[:5000])
+                normality_test = {
+                    "test": "Shapiro-Wilk",
+                    "statistic": float(stat),
+                    "p_value": float(p_value),
+                    "is_normal": p_value > 0.05
+                }
+            except Exception:
+                pass
+
+        if abs(skew_value) < 0.5:
+            skewness_desc = "接近对称"
+        elif skew_value > 0.5:
+            skewness_desc = "右偏（长尾在右侧）"
+        else:
+            skewness_desc = "左偏（长尾在左侧）"
+
+        if abs(kurt_value) < 0.5:
+            kurtosis_desc = "接近正态分布"
+        elif kurt_value > 0.5:
+            kurtosis_desc = "尖峰分布（比正态分布更集中）"
+        else:
+            kurtosis_desc = "平峰分布（比正态分布更分散）"
+
+        result = {
+            "skewness": skew_value,
+            "skewness_desc": skewness_desc,
+            "kurtosis": kurt_value,
+            "kurtosis_desc": kurtosis_desc
+        }
+        if normality_test:
+            result["normality_test"] = normality_test
+        return result
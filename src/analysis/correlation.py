@@ -0,0 +1,339 @@
+"""
+相关性分析模块
+
+对宽表结果（时间 × 多个指标）的所有数值列一次性计算：
+- Pearson / Spearman 相关系数矩阵及显著性
+- 滞后互相关（指标A的第t期与指标B的第t+L期，L = 0..max_lag，双向），
+  在预白化序列上计算：水平值非平稳（随机游走、趋势）时自相关很强，
+  直接做滞后相关和t检验会把互不相关的指标判为"领先滞后"
+- 多重检验校正（Benjamini-Hochberg FDR 或 Bonferroni），检验族包含所有列对 × 所有滞后
+
+每个滞后只做一次标准化矩阵乘法，不逐列对循环。
+用于回答"哪个漏斗步骤和GMV同涨同跌/领先GMV几天"这类问题
+"""
+
+from typing import Dict, List, Optional, Any, Sequence, Tuple
+import pandas as pd
+import numpy as np
+from scipy import stats
+
+from config.settings import get_settings
+
+CORRELATION_METHODS = ("pearson", "spearman")
+CORRECTION_METHODS = ("fdr_bh", "bonferroni")
+
+# 每个滞后至少需要的重叠点数
+MIN_OVERLAP = 5
+
+
+def adjust_pvalues(p_values: np.ndarray, method: str = "fdr_bh") -> np.ndarray:
+    """
+    多重检验校正
+
+    Args:
+        p_values: 原始p值
+        method: fdr_bh（Benjamini-Hochberg）或 bonferroni
+
+    Returns:
+        校正后的p值（与输入同序，上限为1）
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    m = len(p_values)
+    if m == 0:
+        return p_values
+    if method == "bonferroni":
+        return np.minimum(p_values * m, 1.0)
+    if method != "fdr_bh":
+        raise ValueError(f"不支持的校正方法: {method}，支持: {', '.join(CORRECTION_METHODS)}")
+
+    order = np.argsort(p_values)
+    scaled = p_values[order] * m / np.arange(1, m + 1)
+    # 从后往前取累计最小值，保证校正后p值单调
+    scaled = np.minimum.accumulate(scaled[::-1])[::-1]
+    adjusted = np.empty(m)
+    adjusted[order] = np.minimum(scaled, 1.0)
+    return adjusted
+
+
+def correlation_pvalues(r: np.ndarray, n: int) -> np.ndarray:
+    """相关系数的双侧t检验p值（与 scipy.stats.pearsonr 一致）"""
+    if n <= 2:
+        return np.full(np.shape(r), np.nan)
+    df = n - 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = r * np.sqrt(df / ((1.0 - r) * (1.0 + r)))
+    return 2 * stats.t.sf(np.abs(t), df)
+
+
+def prewhiten(values: np.ndarray) -> np.ndarray:
+    """
+    按列预白化：去除线性趋势后取AR(1)残差
+
+    AR(1)系数接近1（随机游走）时近似一阶差分，接近0（白噪声）时序列基本不变，
+    平稳序列不会因过度差分引入负自相关
+
+    Args:
+        values: n × K 矩阵（行按时间升序，无缺失）
+
+    Returns:
+        (n-1) × K 残差矩阵，第i行对应原序列第i+1期
+    """
+    n = values.shape[0]
+    t = np.arange(n) - (n - 1) / 2
+    centered = values - values.mean(axis=0)
+    detrended = centered - np.outer(t, (t @ centered) / (t @ t))
+    previous, current = detrended[:-1], detrended[1:]
+    denominator = np.square(previous).sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        phi = np.where(denominator > 0, (previous * current).sum(axis=0) / denominator, 0.0)
+    return current - previous * np.clip(phi, -1.0, 1.0)
+
+
+def _standardize(values: np.ndarray) -> np.ndarray:
+    """按列中心化并缩放到单位范数（常数列为NaN），Z.T @ Z 即相关系数矩阵"""
+    centered = values - values.mean(axis=0)
+    norms = np.sqrt(np.square(centered).sum(axis=0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return centered / np.where(norms > 0, norms, np.nan)
+
+
+def cross_correlation(left: np.ndarray, right: np.ndarray, method: str = "pearson") -> np.ndarray:
+    """
+    两组列之间的相关系数矩阵（行对齐）
+
+    Args:
+        left: n × K 矩阵
+        right: n × M 矩阵
+        method: pearson 或 spearman（对秩做Pearson）
+
+    Returns:
+        K × M 相关系数矩阵
+    """
+    if method == "spearman":
+        left = stats.rankdata(left, axis=0)
+        right = stats.rankdata(right, axis=0)
+    r = _standardize(left).T @ _standardize(right)
+    return np.clip(r, -1.0, 1.0)
+
+
+class CorrelationAnalyzer:
+    """多指标相关性与滞后相关分析器"""
+
+    def __init__(
+        self,
+        max_lag: Optional[int] = None,
+        alpha: Optional[float] = None,
+        correction: str = "fdr_bh",
+        top_k: Optional[int] = None
+    ):
+        """
+        初始化相关性分析器
+
+        Args:
+            max_lag: 最大滞后期数（默认读取配置，0 表示只算同期相关）
+            alpha: 校正后的显著性水平（默认读取配置）
+            correction: 多重检验校正方法（fdr_bh / bonferroni）
+            top_k: 返回的列对数上限（默认读取配置）
+        """
+        settings = get_settings()
+        self.max_lag = settings.CORRELATION_MAX_LAG if max_lag is None else max_lag
+        self.alpha = alpha or settings.CORRELATION_ALPHA
+        self.correction = correction
+        self.top_k = top_k or settings.CORRELATION_TOP_K
+
+    # ========== 矩阵计算 ==========
+
+    def lagged_matrices(
+        self,
+        values: np.ndarray,
+        method: str = "pearson",
+        max_lag: int = 0
+    ) -> List[Tuple[int, np.ndarray, int]]:
+        """
+        计算各滞后的互相关矩阵
+
+        矩阵 C_L[i, j] 为 corr(x_i[t], x_j[t+L])，即 i 领先 j 共 L 期
+
+        Args:
+            values: n × K 矩阵（行按时间升序，无缺失）
+            method: pearson / spearman
+            max_lag: 最大滞后期数
+
+        Returns:
+            [(滞后L, K×K 相关矩阵, 重叠点数)]
+        """
+        n = values.shape[0]
+        matrices = []
+        for lag in range(0, max_lag + 1):
+            overlap = n - lag
+            if overlap < MIN_OVERLAP:
+                break
+            matrices.append((lag, cross_correlation(values[:overlap], values[lag:], method), overlap))
+        return matrices
+
+    # ========== 入口 ==========
+
+    def analyze(
+        self,
+        frame: pd.DataFrame,
+        method: str = "pearson",
+        max_lag: Optional[int] = None,
+        anchor_columns: Optional[Sequence[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        对所有数值列做相关性分析
+
+        Args:
+            frame: 数据框（行按时间升序）；非数值列会被忽略
+            method: pearson / spearman
+            max_lag: 最大滞后期数（None 时使用初始化参数，0 只算同期）
+            anchor_columns: 只检验与这些列相关的列对（如 ["gmv"]），None 检验全部列对
+
+        Returns:
+            {method, n_observations, columns, max_lag, tests, correction, alpha,
+             significant_count, pairs, matrix, description}
+        """
+        if method not in CORRELATION_METHODS:
+            return {"error": f"不支持的相关方法: {method}，支持: {', '.join(CORRELATION_METHODS)}"}
+
+        numeric = frame.apply(pd.to_numeric, errors="coerce")
+        numeric = numeric.loc[:, numeric.notna().sum() >= MIN_OVERLAP]
+        numeric = numeric.loc[:, numeric.nunique() > 1]
+        if numeric.shape[1] < 2:
+            return {"error": "数值列不足，需要至少2个非常数的数值列"}
+
+        max_lag = self.max_lag if max_lag is None else max_lag
+        notes = []
+        complete = numeric.dropna()
+        if len(complete) < len(numeric):
+            notes.append(f"剔除了{len(numeric) - len(complete)}行含缺失值的数据")
+            if max_lag > 0:
+                # 剔除行后时间不再连续，滞后相关没有意义
+                max_lag = 0
+                notes.append("存在缺失行，只计算同期相关")
+        if len(complete) < MIN_OVERLAP:
+            return {"error": f"有效数据不足，需要至少{MIN_OVERLAP}行"}
+
+        columns = [str(c) for c in complete.columns]
+        values = complete.to_numpy(dtype=float)
+        k = len(columns)
+
+        anchors = None
+        if anchor_columns:
+            anchors = np.isin(columns, [str(c) for c in anchor_columns])
+            if not anchors.any():
+                anchors = None
+
+        # 有滞后时所有滞后（含同期）都在预白化序列上检验，各滞后的相关系数才可比
+        matrices = self.lagged_matrices(values, method, 0)
+        if max_lag > 0 and len(values) > MIN_OVERLAP:
+            tested = self.lagged_matrices(prewhiten(values), method, max_lag)
+            notes.append("滞后相关及显著性基于预白化序列（去线性趋势后的AR(1)残差）")
+        else:
+            tested = matrices
+
+        # 汇总所有检验：同期只取上三角，滞后取全部有向列对（不含自相关）
+        lag_list, left_list, right_list, r_list, n_list = [], [], [], [], []
+        for lag, matrix, overlap in tested:
+            if lag == 0:
+                left, right = np.triu_indices(k, 1)
+            else:
+                left, right = np.nonzero(~np.eye(k, dtype=bool))
+            if anchors is not None:
+                keep = anchors[left] | anchors[right]
+                left, right = left[keep], right[keep]
+            r = matrix[left, right]
+            valid = ~np.isnan(r)
+            lag_list.append(np.full(valid.sum(), lag))
+            left_list.append(left[valid])
+            right_list.append(right[valid])
+            r_list.append(r[valid])
+            n_list.append(np.full(valid.sum(), overlap))
+
+        lags = np.concatenate(lag_list)
+        lefts = np.concatenate(left_list)
+        rights = np.concatenate(right_list)
+        rs = np.concatenate(r_list)
+        ns = np.concatenate(n_list)
+        if len(rs) == 0:
+            return {"error": "没有可检验的列对"}
+
+        p_values = np.empty(len(rs))
+        for overlap in np.unique(ns):
+            mask = ns == overlap
+            p_values[mask] = correlation_pvalues(rs[mask], int(overlap))
+        p_adjusted = adjust_pvalues(p_values, self.correction)
+
+        pairs = self._best_pairs(columns, lags, lefts, rights, rs, p_values, p_adjusted)
+        significant = [p for p in pairs if p["significant"]]
+
+        matrix = matrices[0][1]
+        result = {
+            "method": method,
+            "n_observations": len(values),
+            "columns": columns,
+            "max_lag": tested[-1][0],
+            "tests": int(len(rs)),
+            "correction": self.correction,
+            "alpha": self.alpha,
+            "significant_count": len(significant),
+            "pairs": (significant or pairs)[:self.top_k],
+            "matrix": pd.DataFrame(matrix, index=columns, columns=columns).round(4).to_dict() if k <= 20 else {},
+            "description": self._describe(columns, significant, len(rs))
+        }
+        if notes:
+            result["notes"] = notes
+        return result
+
+    def _best_pairs(
+        self,
+        columns: List[str],
+        lags: np.ndarray,
+        lefts: np.ndarray,
+        rights: np.ndarray,
+        rs: np.ndarray,
+        p_values: np.ndarray,
+        p_adjusted: np.ndarray
+    ) -> List[Dict[str, Any]]:
+        """每个无序列对保留|r|最大的滞后，按是否显著、|r|排序"""
+        pair_keys = np.minimum(lefts, rights) * len(columns) + np.maximum(lefts, rights)
+        order = np.lexsort((-np.abs(rs), pair_keys))
+        first = np.r_[True, pair_keys[order][1:] != pair_keys[order][:-1]]
+        best = order[first]
+        best = best[np.lexsort((-np.abs(rs[best]), p_adjusted[best] >= self.alpha))]
+
+        pairs = []
+        for idx in best:
+            r = float(rs[idx])
+            lag = int(lags[idx])
+            leader, follower = columns[lefts[idx]], columns[rights[idx]]
+            abs_r = abs(r)
+            strength = "强" if abs_r > 0.7 else "中等" if abs_r > 0.4 else "弱"
+            direction = "正相关" if r > 0 else "负相关"
+            if lag == 0:
+                relation = f"{leader} 与 {follower} 同期{direction}"
+            else:
+                relation = f"{leader} 领先 {follower} {lag} 期{direction}"
+            pairs.append({
+                "column1": leader,
+                "column2": follower,
+                "lag": lag,
+                "correlation": r,
+                "p_value": float(p_values[idx]),
+                "p_adjusted": float(p_adjusted[idx]),
+                "significant": bool(p_adjusted[idx] < self.alpha),
+                "strength": strength,
+                "direction": direction,
+                "description": f"{relation}（{strength}，r={r:.3f}，校正p={p_adjusted[idx]:.3g}）"
+            })
+        return pairs
+
+    def _describe(self, columns: List[str], significant: List[Dict[str, Any]], tests: int) -> str:
+        """结果摘要"""
+        if not significant:
+            return f"{len(columns)}个指标共{tests}项检验，校正后没有显著相关的指标对"
+        lagged = sum(1 for p in significant if p["lag"] > 0)
+        text = f"{len(columns)}个指标共{tests}项检验，{len(significant)}对指标显著相关"
+        if lagged:
+            text += f"（其中{lagged}对存在领先滞后关系）"
+        return text
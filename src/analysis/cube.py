@@ -0,0 +1,306 @@
+"""
+本地结果立方体模块
+
+同一会话内的追问（"再按平台拆一下"、"只看iOS"）通常只是对上一次结果的
+重新切片、过滤或汇总。这里按 时间范围 + 事件集合 + 指标集合 保存最近最宽（维度最多）的查询结果，
+新指令能由某个立方体回答时直接在本地计算，只有立方体缺少的维度才需要重新查询神策。
+指标名（如"次数"）在不同事件间通用，事件集合无法确定的结果和指令都不参与。
+
+汇总规则:
+- 可加指标（次数、金额等）可以任意汇总掉维度
+- 不可加指标（人数、比率、均值等）只能在维度不变时过滤；
+  被汇总掉的维度必须被过滤为单一取值，否则结果不正确，不由立方体回答
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional, Any, Tuple
+import pandas as pd
+from loguru import logger
+
+from config.settings import get_settings
+from .utils import infer_time_column, infer_numeric_columns
+
+
+# 日期维度的常见写法
+DATE_ALIASES = {"date", "day", "dt", "日期", "天", "eventdate", "time", "时间"}
+
+# 不可加指标的名称特征（去重人数、比率、均值等）
+NON_ADDITIVE_PATTERNS = (
+    "人数", "用户数", "访客", "uv", "dau", "mau", "去重", "distinct",
+    "率", "占比", "比例", "rate", "ratio", "平均", "均值", "人均", "avg", "mean", "客单价",
+)
+
+
+def _normalize(name: Any) -> str:
+    """规范化列名/维度名：忽略大小写、空白、下划线、连字符和$前缀"""
+    return re.sub(r"[\s_\-$]", "", str(name)).lower()
+
+
+def is_additive(metric: str) -> bool:
+    """按名称判断指标是否可加"""
+    normalized = _normalize(metric)
+    return not any(pattern in normalized for pattern in NON_ADDITIVE_PATTERNS)
+
+
+def instruction_events(instruction: Dict[str, Any], events: Optional[List[str]] = None) -> Optional[frozenset]:
+    """
+    指令对应的事件集合
+
+    优先使用指令 event_metrics 中的事件，其次是查询记录的事件（query_info.events_analyzed）
+
+    Args:
+        instruction: 结构化指令
+        events: 查询结果记录的事件（可选）
+
+    Returns:
+        事件名集合；无法确定时返回None
+    """
+    names = [
+        metric.get("event") if isinstance(metric, dict) else getattr(metric, "event", None)
+        for metric in instruction.get("event_metrics") or []
+    ]
+    names = [name for name in names if name] or list(events or [])
+    return frozenset(str(name).strip() for name in names) or None
+
+
+def match_columns(names: List[str], columns: List[str], time_column: Optional[str] = None) -> Dict[str, str]:
+    """
+    将逻辑名称（指令中的维度/指标）映射到结果列
+
+    依次尝试: 规范化后完全相同、日期别名、唯一的包含关系；
+    剩余未匹配的名称与剩余列数量相同时按顺序对应（SQL通常按指令顺序输出列）
+
+    Args:
+        names: 逻辑名称
+        columns: 候选列
+        time_column: 日期列（日期别名映射到该列）
+
+    Returns:
+        {逻辑名称: 列名}，无法确定的名称不出现在结果中
+    """
+    mapping: Dict[str, str] = {}
+    remaining = list(columns)
+
+    for name in names:
+        key = _normalize(name)
+        exact = [c for c in remaining if _normalize(c) == key]
+        if exact:
+            mapping[name] = exact[0]
+        elif key in DATE_ALIASES and time_column in remaining:
+            mapping[name] = time_column
+        else:
+            partial = [c for c in remaining if key and (key in _normalize(c) or _normalize(c) in key)]
+            if len(partial) == 1:
+                mapping[name] = partial[0]
+        if name in mapping:
+            remaining.remove(mapping[name])
+
+    unmatched = [n for n in names if n not in mapping]
+    if unmatched and len(unmatched) == len(remaining):
+        mapping.update(zip(unmatched, remaining))
+    return mapping
+
+
+@dataclass
+class ResultCube:
+    """一次查询结果构成的立方体"""
+    frame: pd.DataFrame
+    time_range: str
+    dimensions: Dict[str, str]
+    metrics: Dict[str, str]
+    source: str
+    events: frozenset = field(default_factory=frozenset)
+    created_at: float = field(default_factory=time.time)
+    created_on: date = field(default_factory=date.today)
+
+    @property
+    def width(self) -> int:
+        return len(self.dimensions)
+
+
+class CubeStore:
+    """会话内的结果立方体缓存"""
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[int] = None):
+        """
+        初始化立方体缓存
+
+        Args:
+            max_entries: 保存的立方体数量上限（默认读取配置）
+            ttl_seconds: 立方体有效期（默认读取配置）
+        """
+        settings = get_settings()
+        self.max_entries = max_entries or settings.CUBE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or settings.CUBE_TTL_SECONDS
+        self._cubes: "OrderedDict[Tuple[str, frozenset, frozenset], ResultCube]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(time_range: str, events: frozenset, metrics: List[str]) -> Tuple[str, frozenset, frozenset]:
+        return time_range.strip().lower(), events, frozenset(_normalize(m) for m in metrics)
+
+    def _expired(self, cube: ResultCube) -> bool:
+        # 相对时间范围（如last_7_days）跨天后含义改变
+        return time.time() - cube.created_at > self.ttl_seconds or cube.created_on != date.today()
+
+    # ========== 写入 ==========
+
+    def add(self, instruction: Dict[str, Any], df: pd.DataFrame, events: Optional[List[str]] = None) -> Optional[ResultCube]:
+        """
+        用一次查询结果更新立方体（同一 时间范围 + 事件集合 + 指标集合 只保留维度最多的结果）
+
+        Args:
+            instruction: 结构化指令（task/time_range/dimensions/metrics/filters/event_metrics）
+            df: 查询结果
+            events: 查询涉及的事件（指令没有 event_metrics 时使用）
+
+        Returns:
+            新保存的立方体；结果不适合作为立方体时返回None
+        """
+        metrics = instruction.get("metrics") or []
+        if not metrics or df.empty or instruction.get("filters"):
+            # 带过滤条件的结果不完整，不能用于回答其他问题
+            return None
+        event_set = instruction_events(instruction, events)
+        if event_set is None:
+            # 事件未知时无法区分不同事件的同名指标
+            return None
+
+        time_column = infer_time_column(df)
+        numeric_cols = [c for c in infer_numeric_columns(df) if c != time_column]
+        metric_map = match_columns(metrics, numeric_cols)
+        if len(metric_map) != len(metrics):
+            return None
+
+        dim_cols = [c for c in df.columns if c not in metric_map.values()]
+        dimension_map = match_columns(instruction.get("dimensions") or [], dim_cols, time_column)
+        if len(dimension_map) != len(dim_cols):
+            # 结果里有无法对应到维度的列，无法判断汇总方式
+            return None
+
+        cube = ResultCube(
+            frame=df,
+            time_range=instruction.get("time_range", ""),
+            dimensions=dimension_map,
+            metrics=metric_map,
+            source=instruction.get("task", ""),
+            events=event_set,
+        )
+
+        key = self._key(cube.time_range, event_set, metrics)
+        with self._lock:
+            existing = self._cubes.get(key)
+            if existing is not None and not self._expired(existing) and existing.width > cube.width:
+                return None
+            self._cubes[key] = cube
+            self._cubes.move_to_end(key)
+            while len(self._cubes) > self.max_entries:
+                self._cubes.popitem(last=False)
+
+        logger.debug(f"[CubeStore] 保存立方体: {cube.time_range} × {sorted(event_set)} × {list(dimension_map)} × {list(metric_map)}, {len(df)} 行")
+        return cube
+
+    # ========== 查询 ==========
+
+    def find(self, instruction: Dict[str, Any]) -> Optional[ResultCube]:
+        """
+        查找能回答指令的立方体（事件集合需与立方体相同，指令无法确定事件时不回答）
+
+        Args:
+            instruction: 结构化指令
+
+        Returns:
+            立方体；没有可用立方体时返回None
+        """
+        metrics = instruction.get("metrics") or []
+        event_set = instruction_events(instruction)
+        if not metrics or event_set is None:
+            return None
+        time_range = instruction.get("time_range", "").strip().lower()
+        wanted = {_normalize(m) for m in metrics}
+        dims = {_normalize(d) for d in instruction.get("dimensions") or []}
+        filters = instruction.get("filters") or {}
+        needed_dims = dims | {_normalize(d) for d in filters}
+
+        with self._lock:
+            for key in reversed(list(self._cubes)):
+                cube = self._cubes[key]
+                if self._expired(cube):
+                    del self._cubes[key]
+                    continue
+                if key[0] != time_range or key[1] != event_set or not wanted <= key[2]:
+                    continue
+                cube_dims = {_normalize(d) for d in cube.dimensions}
+                if not needed_dims <= cube_dims:
+                    continue
+
+                # 需要汇总掉的维度：不可加指标只允许被过滤为单一取值的维度
+                dropped = cube_dims - dims
+                single_valued = {_normalize(d) for d, v in filters.items() if len(v) == 1}
+                if not dropped <= single_valued and not all(is_additive(m) for m in metrics):
+                    continue
+
+                self._cubes.move_to_end(key)
+                return cube
+        return None
+
+    def answer(self, instruction: Dict[str, Any]) -> Optional[pd.DataFrame]:
+        """
+        尝试用立方体在本地回答指令（过滤 + 汇总）
+
+        Args:
+            instruction: 结构化指令
+
+        Returns:
+            结果DataFrame（列为 请求的维度 + 请求的指标）；无法回答时返回None
+        """
+        cube = self.find(instruction)
+        if cube is None:
+            return None
+
+        by_name = {_normalize(d): col for d, col in cube.dimensions.items()}
+        metric_cols = {_normalize(m): col for m, col in cube.metrics.items()}
+
+        frame = cube.frame
+        for name, values in (instruction.get("filters") or {}).items():
+            column = by_name[_normalize(name)]
+            allowed = {str(v).strip().lower() for v in values}
+            frame = frame[frame[column].astype(str).str.strip().str.lower().isin(allowed)]
+
+        group_cols = list(dict.fromkeys(by_name[_normalize(d)] for d in instruction.get("dimensions") or []))
+        value_cols = list(dict.fromkeys(metric_cols[_normalize(m)] for m in instruction["metrics"]))
+
+        if set(group_cols) == set(cube.dimensions.values()):
+            result = frame[group_cols + value_cols]
+        elif group_cols:
+            result = frame.groupby(group_cols, sort=True, dropna=False)[value_cols].sum().reset_index()
+        else:
+            result = frame[value_cols].sum().to_frame().T
+
+        logger.info(f"[CubeStore] 本地立方体命中: {cube.source[:50]} → {len(result)} 行")
+        return result.reset_index(drop=True)
+
+    def describe(self) -> str:
+        """
+        当前可用立方体的简要说明（供分析Agent规划追问时沿用相同的时间范围和指标写法）
+
+        Returns:
+            每个立方体一行；没有可用立方体时返回空字符串
+        """
+        with self._lock:
+            cubes = [c for c in self._cubes.values() if not self._expired(c)]
+        return "\n".join(
+            f"- time_range={c.time_range}, dimensions={list(c.dimensions)}, metrics={list(c.metrics)}"
+            f"（来源: {c.source[:60]}）"
+            for c in reversed(cubes)
+        )
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._cubes.clear()
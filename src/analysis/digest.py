@@ -0,0 +1,532 @@
+"""
+查询结果摘要模块
+
+将查询结果（DataFrame）压缩为紧凑的数值摘要，用于综合分析提示词：
+- 合计/均值/最值
+- 日期范围、最新日环比、区间首尾变化
+- 按指标排序的Top-K
+- 基于异常检测模块的异常标记
+- 小结果附带原始行，预算足够时直接给出原始数据
+
+可加指标（次数、金额等）按日/按分组求和；不可加指标（人数、比率、均值等）求和没有意义，
+按日/按分组取各行均值，且不给出合计。
+渲染时有严格的字符预算，提示词大小与结果行数无关；
+流式写出的大结果可用 StreamingDigest 逐批累积生成同样结构的摘要
+"""
+
+from typing import Dict, List, Optional, Any
+import pandas as pd
+import numpy as np
+
+from config.settings import get_settings
+from .anomaly import AnomalyDetector
+from .cube import is_additive
+from .utils import infer_time_column, infer_numeric_columns
+
+
+# 结果行数不超过该值时在摘要中保留原始行（渲染时放得下才输出）
+MAX_RAW_ROWS = 100
+
+
+def _to_native(value: Any) -> Any:
+    """转换为可JSON序列化的Python原生类型"""
+    if value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (np.floating,)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(pd.Timestamp(value).date())
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def _fmt(value: Any) -> str:
+    """格式化数值（保留精确值，千分位分隔）"""
+    if value is None:
+        return "-"
+    if isinstance(value, (int, np.integer)) or (isinstance(value, float) and value.is_integer()):
+        return f"{int(value):,}"
+    if isinstance(value, float):
+        # 比率等小数保留有效数字，避免 0.034 被显示为 0.03
+        return f"{value:.4g}" if abs(value) < 1 else f"{value:,.2f}"
+    return str(value)
+
+
+def _fmt_raw(value: Any) -> str:
+    """格式化原始行的值（不做千分位和两位小数截断，保留比率等小数的精度）"""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else f"{value:.6g}"
+    return str(value)
+
+
+def _aggregate(values: pd.DataFrame, keys: Any, additive: Dict[str, bool]) -> pd.DataFrame:
+    """分组汇总：可加指标求和，不可加指标取均值"""
+    grouped = values.groupby(keys)
+    sums, means = grouped.sum(), grouped.mean()
+    return pd.DataFrame({col: sums[col] if additive[col] else means[col] for col in values.columns})
+
+
+def _fmt_pct(value: Optional[float]) -> str:
+    """格式化百分比变化"""
+    if value is None:
+        return "-"
+    return f"{value:+.1f}%"
+
+
+class ResultDigester:
+    """查询结果摘要生成器"""
+
+    def __init__(
+        self,
+        max_chars: Optional[int] = None,
+        top_k: Optional[int] = None,
+        anomaly_threshold: Optional[float] = None
+    ):
+        """
+        初始化摘要生成器
+
+        Args:
+            max_chars: 单个查询摘要的字符预算（默认读取配置）
+            top_k: Top-K行数（默认读取配置）
+            anomaly_threshold: 异常Z-score阈值（默认读取配置）
+        """
+        settings = get_settings()
+        self.max_chars = max_chars or settings.SYNTHESIS_DIGEST_MAX_CHARS
+        self.top_k = top_k or settings.SYNTHESIS_DIGEST_TOP_K
+        self.anomaly_threshold = anomaly_threshold or settings.ANOMALY_ZSCORE_THRESHOLD
+        self.detector = AnomalyDetector()
+
+    def digest(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """
+        生成结构化摘要（可JSON序列化）
+
+        Args:
+            df: 查询结果
+
+        Returns:
+            摘要字典
+        """
+        digest: Dict[str, Any] = {
+            "rows": int(len(df)),
+            "columns": [str(c) for c in df.columns],
+        }
+        if df.empty:
+            return digest
+
+        time_col = infer_time_column(df)
+        metric_cols = [c for c in infer_numeric_columns(df) if c != time_col]
+        dim_cols = [c for c in df.columns if c not in metric_cols and c != time_col]
+        metrics = df[metric_cols].apply(pd.to_numeric, errors="coerce") if metric_cols else pd.DataFrame(index=df.index)
+
+        additive = {col: is_additive(col) for col in metric_cols}
+        digest["metrics"] = [str(c) for c in metric_cols]
+        digest["non_additive"] = [str(c) for c in metric_cols if not additive[c]]
+        digest["dimensions"] = [str(c) for c in dim_cols]
+        if len(df) <= MAX_RAW_ROWS:
+            digest["records"] = [[_to_native(v) for v in row] for row in df.itertuples(index=False, name=None)]
+
+        # 合计与最值（不可加指标不给出合计）
+        if metric_cols:
+            totals = metrics.agg(["sum", "mean", "min", "max"])
+            digest["totals"] = {
+                str(col): {
+                    stat: _to_native(totals.at[stat, col]) if additive[col] or stat != "sum" else None
+                    for stat in totals.index
+                }
+                for col in metric_cols
+            }
+
+        # 时间维度：日期范围、环比、区间变化、异常
+        if time_col is not None:
+            dates = pd.to_datetime(df[time_col], errors="coerce")
+            if dates.notna().any():
+                digest["time_column"] = str(time_col)
+                digest["date_range"] = {
+                    "min": _to_native(dates.min()),
+                    "max": _to_native(dates.max()),
+                    "days": int(dates.dt.normalize().nunique()),
+                }
+                if metric_cols:
+                    daily = _aggregate(metrics, dates.dt.normalize(), additive).sort_index()
+                    self._add_daily_changes(digest, daily)
+                    self._add_anomaly_flags(digest, daily)
+
+        # Top-K：有维度列时按维度汇总，否则按行排序
+        if metric_cols:
+            primary = metric_cols[0]
+            values = metrics[primary]
+            if dim_cols:
+                group_keys = [df[c].astype(str) for c in dim_cols[:2]]
+                grouped = values.groupby(group_keys)
+                grouped = grouped.sum() if additive[primary] else grouped.mean()
+                digest["top"] = self._top_groups(
+                    grouped, str(primary), [str(c) for c in dim_cols[:2]], additive[primary]
+                )
+            elif time_col is None:
+                top_rows = df.loc[values.nlargest(self.top_k).index]
+                digest["top"] = {
+                    "by": str(primary),
+                    "rows": [
+                        {str(k): _to_native(v) for k, v in row.items()}
+                        for row in top_rows.to_dict(orient="records")
+                    ],
+                }
+
+        return digest
+
+    def _top_groups(self, grouped: pd.Series, by: str, group_by: List[str], additive: bool) -> Dict[str, Any]:
+        """分组Top-K（只有可加指标才计算占比）"""
+        grouped = grouped.sort_values(ascending=False)
+        total = grouped.sum() if additive else 0
+        return {
+            "by": by,
+            "group_by": group_by,
+            "groups": int(len(grouped)),
+            "items": [
+                {
+                    "key": " / ".join(key) if isinstance(key, tuple) else str(key),
+                    "value": _to_native(value),
+                    "share_pct": _to_native(value / total * 100) if total else None,
+                }
+                for key, value in grouped.head(self.top_k).items()
+            ],
+        }
+
+    def _add_daily_changes(self, digest: Dict[str, Any], daily: pd.DataFrame):
+        """最新日环比和区间首尾变化"""
+        if len(daily) < 2:
+            return
+
+        last, previous, first = daily.iloc[-1], daily.iloc[-2], daily.iloc[0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dod_pct = np.where(previous != 0, (last - previous) / previous.abs() * 100, np.nan)
+            period_pct = np.where(first != 0, (last - first) / first.abs() * 100, np.nan)
+
+        digest["day_over_day"] = {
+            "date": _to_native(daily.index[-1]),
+            "metrics": {
+                str(col): {
+                    "last": _to_native(last[col]),
+                    "previous": _to_native(previous[col]),
+                    "delta": _to_native(last[col] - previous[col]),
+                    "delta_pct": _to_native(dod_pct[i]),
+                }
+                for i, col in enumerate(daily.columns)
+            },
+        }
+        digest["period_change"] = {
+            "from": _to_native(daily.index[0]),
+            "to": _to_native(daily.index[-1]),
+            "metrics": {
+                str(col): {
+                    "first": _to_native(first[col]),
+                    "last": _to_native(last[col]),
+                    "delta_pct": _to_native(period_pct[i]),
+                }
+                for i, col in enumerate(daily.columns)
+            },
+        }
+
+    def _add_anomaly_flags(self, digest: Dict[str, Any], daily: pd.DataFrame):
+        """基于按日汇总序列的异常标记（Z-score + 突变）"""
+        if len(daily) < 3:
+            return
+
+        flags = []
+        date_labels = [str(d.date()) for d in daily.index]
+        for col in daily.columns[:3]:
+            series = pd.Series(daily[col].to_numpy(), index=date_labels)
+            zscore = self.detector.detect_zscore_anomalies(series, threshold=self.anomaly_threshold)
+            for anomaly in zscore.get("anomalies", [])[:3]:
+                flags.append({
+                    "metric": str(col),
+                    "date": anomaly["index"],
+                    "value": anomaly["value"],
+                    "type": "zscore",
+                    "detail": f"Z={anomaly['z_score']:.1f}",
+                })
+            changes = self.detector.detect_sudden_changes(series)
+            for change in changes.get("changes", [])[:2]:
+                flags.append({
+                    "metric": str(col),
+                    "date": change["index"],
+                    "value": change["value"],
+                    "type": change["type"],
+                    "detail": change["description"],
+                })
+
+        if flags:
+            digest["anomalies"] = flags
+
+    def render(self, digest: Dict[str, Any], max_chars: Optional[int] = None) -> str:
+        """
+        将摘要渲染为紧凑文本，按优先级填充，严格不超过字符预算
+
+        Args:
+            digest: digest() 的返回值
+            max_chars: 字符预算（默认使用初始化时的预算）
+
+        Returns:
+            摘要文本
+        """
+        budget = max_chars or self.max_chars
+        lines: List[str] = [f"行数: {digest.get('rows', 0)}, 列: {', '.join(digest.get('columns', []))}"]
+
+        date_range = digest.get("date_range")
+        if date_range:
+            lines.append(f"日期范围: {date_range['min']} ~ {date_range['max']} ({date_range['days']}天)")
+
+        # 原始行全部放得下时优先给出原始数据，摘要只作补充
+        records = digest.get("records")
+        if records:
+            raw = [f"原始数据（全部{len(records)}行）:", "  " + ",".join(digest.get("columns", []))]
+            raw.extend("  " + ",".join(_fmt_raw(v) for v in row) for row in records)
+            if sum(len(line) + 1 for line in lines + raw) <= budget:
+                lines.extend(raw)
+
+        non_additive = set(digest.get("non_additive", []))
+        for col, stats in digest.get("totals", {}).items():
+            if col in non_additive or stats.get("sum") is None:
+                lines.append(
+                    f"{col}(不可加，未求和): 各行均值 {_fmt(stats['mean'])}, "
+                    f"最小 {_fmt(stats['min'])}, 最大 {_fmt(stats['max'])}"
+                )
+            else:
+                lines.append(
+                    f"{col}: 合计 {_fmt(stats['sum'])}, 均值 {_fmt(stats['mean'])}, "
+                    f"最小 {_fmt(stats['min'])}, 最大 {_fmt(stats['max'])}"
+                )
+
+        def label(col: str) -> str:
+            return f"{col}(各行均值)" if col in non_additive else col
+
+        day_over_day = digest.get("day_over_day")
+        if day_over_day:
+            for col, change in day_over_day["metrics"].items():
+                lines.append(
+                    f"{label(col)} 最新日({day_over_day['date']}): {_fmt(change['last'])}, "
+                    f"较前一日 {_fmt(change['delta'])} ({_fmt_pct(change['delta_pct'])})"
+                )
+
+        period_change = digest.get("period_change")
+        if period_change:
+            for col, change in period_change["metrics"].items():
+                lines.append(
+                    f"{label(col)} 区间变化({period_change['from']}→{period_change['to']}): "
+                    f"{_fmt(change['first'])} → {_fmt(change['last'])} ({_fmt_pct(change['delta_pct'])})"
+                )
+
+        for flag in digest.get("anomalies", []):
+            lines.append(f"⚠ 异常 {label(flag['metric'])} @ {flag['date']}: {_fmt(flag['value'])} ({flag['detail']})")
+
+        top = digest.get("top")
+        if top:
+            if "items" in top:
+                lines.append(f"Top{len(top['items'])} {'/'.join(top['group_by'])} (按{label(top['by'])}, 共{top['groups']}组):")
+                for item in top["items"]:
+                    share = f" ({item['share_pct']:.1f}%)" if item.get("share_pct") is not None else ""
+                    lines.append(f"  {item['key']}: {_fmt(item['value'])}{share}")
+            else:
+                lines.append(f"Top{len(top['rows'])} 行 (按{top['by']}):")
+                for row in top["rows"]:
+                    lines.append("  " + ", ".join(f"{k}={_fmt(v)}" for k, v in row.items()))
+
+        return self._fit(lines, budget)
+
+    @staticmethod
+    def _fit(lines: List[str], budget: int) -> str:
+        """按顺序拼接行，超出预算时截断"""
+        marker = "…(已截断)"
+        output: List[str] = []
+        used = 0
+        for line in lines:
+            cost = len(line) + (1 if output else 0)
+            if used + cost > budget:
+                if used + len(marker) + 1 <= budget:
+                    output.append(marker)
+                elif not output:
+                    output.append(line[:max(budget - len(marker), 0)] + marker)
+                break
+            output.append(line)
+            used += cost
+        return "\n".join(output)[:budget]
+
+    def digest_text(self, df: pd.DataFrame, max_chars: Optional[int] = None) -> str:
+        """生成并渲染摘要"""
+        return self.render(self.digest(df), max_chars=max_chars)
+
+
+class StreamingDigest:
+    """
+    增量摘要生成器
+
+    逐批累积合计/最值、按日汇总和分组合计（同时累积非空计数，用于不可加指标的均值），
+    结果与 ResultDigester.digest 结构相同；
+    占用内存只与天数和分组数有关，与行数无关（分组数超过上限时不生成Top-K）
+    """
+
+    def __init__(self, digester: Optional[ResultDigester] = None, max_groups: int = 100000):
+        """
+        初始化增量摘要
+
+        Args:
+            digester: 用于按日变化和异常标记的摘要生成器（默认新建）
+            max_groups: Top-K分组数上限
+        """
+        self.digester = digester or ResultDigester()
+        self.max_groups = max_groups
+        self.rows = 0
+        self.columns: List[str] = []
+        self.time_col: Optional[str] = None
+        self.metric_cols: List[str] = []
+        self.dim_cols: List[str] = []
+        self.additive: Dict[str, bool] = {}
+        self._records: Optional[List[List[Any]]] = []
+        self._stats: Optional[pd.DataFrame] = None
+        self._date_min = None
+        self._date_max = None
+        self._days: set = set()
+        self._daily: Optional[pd.DataFrame] = None
+        self._daily_counts: Optional[pd.DataFrame] = None
+        self._groups: Optional[pd.Series] = None
+        self._group_counts: Optional[pd.Series] = None
+        self._groups_overflow = False
+        self._top_rows: Optional[pd.DataFrame] = None
+
+    def update(self, chunk: pd.DataFrame):
+        """累积一批结果（列角色按第一批非空结果推断）"""
+        if not self.columns:
+            self.columns = [str(c) for c in chunk.columns]
+        if chunk.empty:
+            return
+        if self.rows == 0:
+            self.time_col = infer_time_column(chunk)
+            self.metric_cols = [c for c in infer_numeric_columns(chunk) if c != self.time_col]
+            self.dim_cols = [c for c in chunk.columns if c not in self.metric_cols and c != self.time_col]
+            self.additive = {col: is_additive(col) for col in self.metric_cols}
+        self.rows += len(chunk)
+        if self._records is not None:
+            if self.rows <= MAX_RAW_ROWS:
+                self._records.extend([_to_native(v) for v in row] for row in chunk.itertuples(index=False, name=None))
+            else:
+                self._records = None
+
+        metrics = chunk[self.metric_cols].apply(pd.to_numeric, errors="coerce") if self.metric_cols else None
+        if metrics is not None:
+            stats = pd.DataFrame({
+                "sum": metrics.sum(),
+                "count": metrics.count(),
+                "min": metrics.min(),
+                "max": metrics.max(),
+            })
+            if self._stats is None:
+                self._stats = stats
+            else:
+                previous = self._stats
+                self._stats = pd.DataFrame({
+                    "sum": previous["sum"] + stats["sum"],
+                    "count": previous["count"] + stats["count"],
+                    "min": pd.concat([previous["min"], stats["min"]], axis=1).min(axis=1),
+                    "max": pd.concat([previous["max"], stats["max"]], axis=1).max(axis=1),
+                })
+
+        if self.time_col is not None:
+            dates = pd.to_datetime(chunk[self.time_col], errors="coerce")
+            if dates.notna().any():
+                low, high = dates.min(), dates.max()
+                self._date_min = low if self._date_min is None else min(self._date_min, low)
+                self._date_max = high if self._date_max is None else max(self._date_max, high)
+                days = dates.dt.normalize()
+                self._days.update(days.dropna().unique())
+                if metrics is not None:
+                    grouped = metrics.groupby(days)
+                    daily, counts = grouped.sum(), grouped.count()
+                    self._daily = daily if self._daily is None else self._daily.add(daily, fill_value=0)
+                    self._daily_counts = counts if self._daily_counts is None else self._daily_counts.add(counts, fill_value=0)
+
+        if metrics is not None:
+            self._update_top(chunk, metrics[self.metric_cols[0]])
+
+    def _update_top(self, chunk: pd.DataFrame, values: pd.Series):
+        """累积Top-K：有维度列时按维度汇总，没有时间列时保留最大的K行"""
+        if self.dim_cols:
+            if self._groups_overflow:
+                return
+            grouped = values.groupby([chunk[c].astype(str) for c in self.dim_cols[:2]])
+            sums, counts = grouped.sum(), grouped.count()
+            self._groups = sums if self._groups is None else self._groups.add(sums, fill_value=0)
+            self._group_counts = counts if self._group_counts is None else self._group_counts.add(counts, fill_value=0)
+            if len(self._groups) > self.max_groups:
+                self._groups = None
+                self._group_counts = None
+                self._groups_overflow = True
+        elif self.time_col is None:
+            top = chunk.loc[values.nlargest(self.digester.top_k).index]
+            candidates = top if self._top_rows is None else pd.concat([self._top_rows, top], ignore_index=True)
+            primary = pd.to_numeric(candidates[self.metric_cols[0]], errors="coerce")
+            self._top_rows = candidates.loc[primary.nlargest(self.digester.top_k).index].reset_index(drop=True)
+
+    def result(self) -> Dict[str, Any]:
+        """生成结构化摘要（可JSON序列化）"""
+        digest: Dict[str, Any] = {"rows": int(self.rows), "columns": list(self.columns)}
+        if self.rows == 0:
+            return digest
+
+        digest["metrics"] = [str(c) for c in self.metric_cols]
+        digest["non_additive"] = [str(c) for c in self.metric_cols if not self.additive[c]]
+        digest["dimensions"] = [str(c) for c in self.dim_cols]
+        if self._records is not None:
+            digest["records"] = self._records
+
+        if self._stats is not None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                means = self._stats["sum"] / self._stats["count"].where(self._stats["count"] > 0)
+            digest["totals"] = {
+                str(col): {
+                    "sum": _to_native(self._stats.at[col, "sum"]) if self.additive[col] else None,
+                    "mean": _to_native(means[col]),
+                    "min": _to_native(self._stats.at[col, "min"]),
+                    "max": _to_native(self._stats.at[col, "max"]),
+                }
+                for col in self.metric_cols
+            }
+
+        if self._date_min is not None:
+            digest["time_column"] = str(self.time_col)
+            digest["date_range"] = {
+                "min": _to_native(self._date_min),
+                "max": _to_native(self._date_max),
+                "days": len(self._days),
+            }
+            if self._daily is not None:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    means = self._daily / self._daily_counts.where(self._daily_counts > 0)
+                daily = pd.DataFrame({
+                    col: self._daily[col] if self.additive[col] else means[col] for col in self._daily.columns
+                }).sort_index()
+                self.digester._add_daily_changes(digest, daily)
+                self.digester._add_anomaly_flags(digest, daily)
+
+        if self._groups is not None:
+            primary = self.metric_cols[0]
+            grouped = self._groups
+            if not self.additive[primary]:
+                grouped = grouped / self._group_counts.where(self._group_counts > 0)
+            digest["top"] = self.digester._top_groups(
+                grouped, str(primary), [str(c) for c in self.dim_cols[:2]], self.additive[primary]
+            )
+        elif self._top_rows is not None:
+            digest["top"] = {
+                "by": str(self.metric_cols[0]),
+                "rows": [
+                    {str(k): _to_native(v) for k, v in row.items()}
+                    for row in self._top_rows.to_dict(orient="records")
+                ],
+            }
+
+        return digest
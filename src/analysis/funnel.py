@@ -0,0 +1,346 @@
+"""
+本地漏斗计算模块
+
+一次查询拉取漏斗步骤事件的明细（distinct_id, event, 时间戳[, 分组属性]），在本地计算有序、
+带窗口期的漏斗转化，不需要LLM编写漏斗SQL，也不依赖神策的漏斗API。
+
+计算方式（与神策漏斗口径一致）：
+- 用户在查询日期范围内触发第1步即进入漏斗，每次触发都是一次候选进入
+- 从进入时刻起的窗口期内，按顺序依次匹配后续步骤（每步取最早的满足条件的事件）
+- 用户的转化深度取所有候选进入中走得最远的一次；分组属性取该次进入时第1步事件上的值
+
+每一步对所有候选进入一次性二分查找（按 用户 × 时间 排序后的全局位置），
+不逐用户遍历事件序列
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Iterable, Sequence, Tuple
+import pandas as pd
+import numpy as np
+from pandas.api.types import union_categoricals
+from loguru import logger
+
+from config.settings import get_settings
+from src.sql.literals import sql_literal, sql_column
+from .user_ids import get_user_id_interner
+
+
+class FunnelEngine:
+    """本地有序窗口漏斗计算引擎"""
+
+    def __init__(self, window_days: Optional[int] = None, exclude_spider: bool = True):
+        """
+        初始化漏斗引擎
+
+        Args:
+            window_days: 转化窗口期（天，默认读取配置）
+            exclude_spider: 查询时是否过滤爬虫用户
+        """
+        settings = get_settings()
+        self.window_days = window_days or settings.FUNNEL_WINDOW_DAYS
+        self.batch_rows = settings.FUNNEL_STREAM_BATCH_ROWS
+        self.exclude_spider = exclude_spider
+
+    # ========== 查询 ==========
+
+    def build_sql(
+        self,
+        steps: Sequence[str],
+        start_date: str,
+        end_date: str,
+        window_days: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        breakdown: Optional[str] = None
+    ) -> str:
+        """
+        生成拉取步骤事件明细的SQL
+
+        查询范围为 [start_date, end_date + 窗口期]，保证最后一天进入的用户也有完整的窗口
+
+        Args:
+            steps: 步骤事件名（按顺序）
+            start_date: 进入漏斗的开始日期
+            end_date: 进入漏斗的结束日期
+            window_days: 窗口期（天）
+            filters: 过滤条件，{属性: 值 或 值列表}
+            breakdown: 分组属性（可选）
+
+        Returns:
+            SQL语句
+        """
+        window_days = window_days or self.window_days
+        scan_end = (datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=window_days)).strftime("%Y-%m-%d")
+
+        fields = ["distinct_id", "event", "CAST(unix_timestamp(time) AS BIGINT) AS ts"]
+        if breakdown:
+            fields.append(f"{sql_column(breakdown)} AS breakdown")
+
+        events = ", ".join(sql_literal(e) for e in dict.fromkeys(steps))
+        conditions = [
+            f"date BETWEEN {sql_literal(start_date)} AND {sql_literal(scan_end)}",
+            f"event IN ({events})",
+        ]
+        if self.exclude_spider:
+            conditions.append("is_spider_user = '正常用户'")
+        for name, value in (filters or {}).items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            if len(values) == 1:
+                conditions.append(f"{sql_column(name)} = {sql_literal(values[0])}")
+            else:
+                conditions.append(f"{sql_column(name)} IN ({', '.join(sql_literal(v) for v in values)})")
+
+        return f"SELECT {', '.join(fields)}\nFROM events\nWHERE " + "\n  AND ".join(conditions)
+
+    def load_events(self, batches: Iterable[Tuple[List[str], List[List[Any]]]]) -> pd.DataFrame:
+        """
+        将流式批次转换为列式事件表
+
+        每批只保留需要的列并立即编码为紧凑类型（distinct_id → 用户ID序号，
+        其余字符串 → category，时间 → int64）
+
+        Args:
+            batches: SensorsClient.stream_sql 产出的 (列名, 行) 批次
+
+        Returns:
+            DataFrame[distinct_id（整数序号）, event, ts(, breakdown)]
+        """
+        interner = get_user_id_interner()
+        frames = []
+        for columns, rows in batches:
+            if not rows:
+                continue
+            index = {name: i for i, name in enumerate(columns)}
+            frame = pd.DataFrame({
+                name: [row[index[name]] for row in rows]
+                for name in ("distinct_id", "event", "ts", "breakdown") if name in index
+            })
+            frame["ts"] = pd.to_numeric(frame["ts"], errors="coerce")
+            frame["distinct_id"] = interner.encode(frame["distinct_id"].to_numpy())
+            for name in ("event", "breakdown"):
+                if name in frame:
+                    frame[name] = frame[name].astype("category")
+            frames.append(frame)
+
+        if not frames:
+            return pd.DataFrame(columns=["distinct_id", "event", "ts"])
+
+        # 各批次的类别不同，合并时取类别并集（不退化为object列）
+        events = pd.DataFrame({
+            name: (
+                union_categoricals([frame[name] for frame in frames])
+                if name in ("event", "breakdown") else np.concatenate([frame[name].to_numpy() for frame in frames])
+            )
+            for name in frames[0].columns
+        })
+        events = events[events["distinct_id"] >= 0]
+        return events.dropna(subset=["event", "ts"])
+
+    # ========== 计算 ==========
+
+    def compute(
+        self,
+        events: pd.DataFrame,
+        steps: Sequence[str],
+        entry_start: int,
+        entry_end: int,
+        window_seconds: int,
+        breakdown: bool = False
+    ) -> pd.DataFrame:
+        """
+        计算漏斗各步骤的用户数
+
+        Args:
+            events: 列式事件表（distinct_id, event, ts[, breakdown]）
+            steps: 步骤事件名（按顺序，同一事件可出现在多个步骤）
+            entry_start: 进入漏斗的起始时间戳（秒，含）
+            entry_end: 进入漏斗的结束时间戳（秒，不含）
+            window_seconds: 窗口期（秒）
+            breakdown: 是否按 breakdown 列分组
+
+        Returns:
+            DataFrame[(breakdown,) step, step_name, users, overall_rate, step_rate]，
+            分组时额外包含"全部"分组的合计行
+        """
+        n_steps = len(steps)
+        users = self._codes(events["distinct_id"])
+        times = events["ts"].to_numpy(dtype=np.int64)
+        event_codes, event_names = pd.factorize(events["event"])
+        groups = None
+        if breakdown and "breakdown" in events:
+            groups, group_names = pd.factorize(events["breakdown"].astype(object).fillna("(空)").astype(str))
+
+        # 同一秒内的事件按步骤顺序排列（先出现的步骤在前）
+        step_rank = np.full(len(event_names) + 1, n_steps, dtype=np.int64)
+        for k in reversed(range(n_steps)):
+            code = event_names.get_indexer([steps[k]])[0]
+            if code >= 0:
+                step_rank[code] = k
+        ranks = step_rank[event_codes]
+
+        # 按 用户 × 时间 × 步骤 全局排序，位置即用户内的事件顺序
+        order = self._sort_order(users, times, ranks)
+        users, times, event_codes = users[order], times[order], event_codes[order]
+        if groups is not None:
+            groups = groups[order]
+        positions = np.arange(len(order), dtype=np.int64)
+
+        step_positions = []
+        for name in steps:
+            code = event_names.get_indexer([name])[0]
+            step_positions.append(positions[event_codes == code] if code >= 0 else positions[:0])
+
+        # 候选进入：查询范围内的每次第1步事件
+        first = step_positions[0]
+        first = first[(times[first] >= entry_start) & (times[first] < entry_end)]
+        cand_start = times[first]
+        cand_pos = first.copy()
+        entry_user = users[first]
+        entry_group = groups[first] if groups is not None else None
+
+        # depth[i] 为第 i 个候选进入走到的步数
+        depth = np.ones(len(first), dtype=np.int64)
+        alive = np.arange(len(first))
+
+        for k in range(1, n_steps):
+            if len(alive) == 0:
+                break
+            targets = step_positions[k]
+            if len(targets) == 0:
+                break
+            # 当前位置之后的第一个该步骤事件；需属于同一用户且在窗口期内
+            found = np.searchsorted(targets, cand_pos[alive], side="right")
+            next_pos = targets[np.minimum(found, len(targets) - 1)]
+            ok = (
+                (found < len(targets))
+                & (users[next_pos] == entry_user[alive])
+                & (times[next_pos] <= cand_start[alive] + window_seconds)
+            )
+            alive = alive[ok]
+            cand_pos[alive] = next_pos[ok]
+            depth[alive] = k + 1
+
+            # 同一用户落在同一事件上的候选，进入越晚窗口越宽，只保留最晚的一个
+            if len(alive):
+                keys = np.lexsort((-cand_start[alive], cand_pos[alive]))
+                sorted_pos = cand_pos[alive][keys]
+                keep = np.r_[True, sorted_pos[1:] != sorted_pos[:-1]]
+                alive = alive[keys[keep]]
+
+        # 每个用户取最深的一次进入（深度相同取最早进入）；候选按 用户 × 时间 有序
+        if len(depth) == 0:
+            user_depth = depth
+            chosen = depth
+        else:
+            boundaries = np.flatnonzero(np.r_[True, entry_user[1:] != entry_user[:-1]])
+            segment = np.cumsum(np.r_[True, entry_user[1:] != entry_user[:-1]]) - 1
+            user_depth = np.maximum.reduceat(depth, boundaries)
+            deepest = np.flatnonzero(depth == user_depth[segment])
+            chosen = deepest[np.r_[True, segment[deepest][1:] != segment[deepest][:-1]]]
+
+        total_group = "全部" if entry_group is not None else None
+        rows = [self._step_rows(user_depth, steps, total_group)]
+        if entry_group is not None and len(chosen):
+            user_group = entry_group[chosen]
+            for code in np.unique(user_group):
+                rows.append(self._step_rows(user_depth[user_group == code], steps, group_names[code]))
+        return pd.concat(rows, ignore_index=True)
+
+    @staticmethod
+    def _codes(values: pd.Series) -> np.ndarray:
+        """整数编码（类别列直接使用类别编码）"""
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values.cat.codes.to_numpy(dtype=np.int64)
+        return pd.factorize(values)[0].astype(np.int64)
+
+    @staticmethod
+    def _sort_order(users: np.ndarray, times: np.ndarray, ranks: np.ndarray) -> np.ndarray:
+        """按 (用户, 时间, 步骤) 排序；范围允许时合成一个int64键排序，比 lexsort 快数倍"""
+        if len(users) == 0:
+            return np.arange(0)
+        offset = times.min()
+        span = int(times.max() - offset) + 1
+        n_users = int(users.max()) + 1
+        n_ranks = int(ranks.max()) + 1
+        if n_users * span * n_ranks < 2 ** 62:
+            key = (users * span + (times - offset)) * n_ranks + ranks
+            return np.argsort(key)
+        return np.lexsort((ranks, times, users))
+
+    @staticmethod
+    def _step_rows(depth: np.ndarray, steps: Sequence[str], group: Optional[str]) -> pd.DataFrame:
+        """由每个用户的转化深度生成各步骤的用户数和转化率"""
+        counts = np.array([(depth >= k + 1).sum() for k in range(len(steps))], dtype=np.int64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            overall = np.where(counts[0] > 0, counts / counts[0], 0.0)
+            previous = np.r_[counts[0], counts[:-1]]
+            step_rate = np.where(previous > 0, counts / previous, 0.0)
+
+        frame = pd.DataFrame({
+            "step": np.arange(1, len(steps) + 1),
+            "step_name": list(steps),
+            "users": counts,
+            "overall_rate": np.round(overall, 4),
+            "step_rate": np.round(step_rate, 4),
+        })
+        if group is not None:
+            frame.insert(0, "breakdown", group)
+        return frame
+
+    # ========== 入口 ==========
+
+    def run(
+        self,
+        client: Any,
+        steps: Sequence[str],
+        start_date: str,
+        end_date: str,
+        window_days: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        breakdown: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        查询并计算漏斗
+
+        Args:
+            client: SensorsClient
+            steps: 步骤事件名（至少2个）
+            start_date: 开始日期（YYYY-MM-DD）
+            end_date: 结束日期（YYYY-MM-DD，含）
+            window_days: 窗口期（天）
+            filters: 过滤条件
+            breakdown: 分组属性（可选）
+
+        Returns:
+            {"table": 漏斗结果DataFrame, "sql", "events", "users", "window_days", "description"}
+        """
+        if len(steps) < 2:
+            raise ValueError("漏斗至少需要2个步骤")
+        window_days = window_days or self.window_days
+
+        sql = self.build_sql(steps, start_date, end_date, window_days, filters, breakdown)
+        events = self.load_events(client.stream_sql(sql, batch_rows=self.batch_rows))
+        logger.info(f"[漏斗] 拉取 {len(events)} 条步骤事件，{events['distinct_id'].nunique() if len(events) else 0} 个用户")
+
+        # time 为不带时区的本地时间，unix_timestamp 与 pd.Timestamp 都按UTC换算，两边口径一致
+        entry_start = int(pd.Timestamp(start_date).timestamp())
+        entry_end = int((pd.Timestamp(end_date) + pd.Timedelta(days=1)).timestamp())
+        table = self.compute(
+            events, list(steps), entry_start, entry_end,
+            window_days * 86400, breakdown=breakdown is not None
+        )
+
+        total = table[table["breakdown"] == "全部"] if "breakdown" in table else table
+        entered = int(total["users"].iloc[0])
+        converted = int(total["users"].iloc[-1])
+        rate = converted / entered if entered else 0.0
+        return {
+            "table": table,
+            "sql": sql,
+            "events": len(events),
+            "users": entered,
+            "window_days": window_days,
+            "description": (
+                f"{' → '.join(steps)}（{window_days}天窗口）：进入 {entered:,} 人，"
+                f"完成 {converted:,} 人，总体转化率 {rate:.2%}"
+            )
+        }
@@ -241,6 +241,40 @@ class InsightGenerator:
 
         return insights
 
+    def generate_correlation_insights(self, correlation: Dict[str, Any]) -> List[Dict[str, str]]:
+        """
+        生成相关性洞察
+
+        Args:
+            correlation: CorrelationAnalyzer.analyze 的结果
+
+        Returns:
+            洞察列表（只包含多重校正后显著的指标对）
+        """
+        insights = []
+
+        for pair in correlation.get('pairs', []):
+            if not pair.get('significant'):
+                continue
+
+            strong = abs(pair.get('correlation', 0)) > 0.7
+            if pair.get('lag', 0) > 0:
+                insights.append({
+                    "type": "lead_lag",
+                    "priority": "high" if strong else "medium",
+                    "insight": f"{pair['column1']} 领先 {pair['column2']} {pair['lag']} 期",
+                    "detail": pair.get('description', '')
+                })
+            else:
+                insights.append({
+                    "type": "correlation",
+                    "priority": "medium" if strong else "low",
+                    "insight": f"{pair['column1']} 与 {pair['column2']} {pair.get('direction', '相关')}",
+                    "detail": pair.get('description', '')
+                })
+
+        return insights
+
     def generate_recommendations(
         self,
         all_insights: List[Dict[str, str]],
@@ -284,6 +318,9 @@ class InsightGenerator:
             elif insight_type == 'high_variability':
                 recommendations.append("数据波动较大，建议稳定核心指标或分段分析不同场景")
 
+            elif insight_type == 'lead_lag':
+                recommendations.append("存在领先指标，建议将其作为预警信号提前监控")
+
         # 去重
         recommendations = list(set(recommendations))
 
@@ -308,7 +345,8 @@ class InsightGenerator:
         insights = {
             "trend": [],
             "anomaly": [],
-            "statistics": []
+            "statistics": [],
+            "correlation": []
         }
 
         # 趋势洞察
@@ -323,8 +361,12 @@ class InsightGenerator:
         if 'statistics' in analysis_results:
             insights['statistics'] = self.generate_statistics_insights(analysis_results['statistics'])
 
+        # 相关性洞察
+        if 'correlation' in analysis_results:
+            insights['correlation'] = self.generate_correlation_insights(analysis_results['correlation'])
+
         # 合并所有洞察
-        all_insights = insights['trend'] + insights['anomaly'] + insights['statistics']
+        all_insights = insights['trend'] + insights['anomaly'] + insights['statistics'] + insights['correlation']
 
         # 按优先级排序
         priority_order = {'high': 0, 'medium': 1, 'low': 2}
@@ -345,7 +387,8 @@ class InsightGenerator:
             "raw_analysis": {
                 "trend": analysis_results.get('trend_analysis', {}),
                 "anomaly": analysis_results.get('anomaly_detection', {}),
-                "statistics": analysis_results.get('statistics', {})
+                "statistics": analysis_results.get('statistics', {}),
+                "correlation": analysis_results.get('correlation', {})
             }
         }
 
@@ -0,0 +1,145 @@
+"""
+分析结果缓存模块
+
+Agent 经常对同一份结构化数据多次调用 DataAnalysisTool（不同的 analysis_types 或指标子集），
+按内容哈希复用已经算过的结果：
+- 报告级：原始数据文本 + 全部参数 -> 最终报告，完全相同的调用直接返回
+- 序列级：(序列内容哈希, 列名, 时间索引哈希, 分析类型, 方法) -> 单条序列单类分析的结果，
+  新调用只计算缺少的 序列 × 分析类型
+- 中间结果：多类分析共用的计算（趋势的移动平均和时序异常检测使用同一个滚动窗口）
+
+季节分解另有 SeasonalDecomposer 的缓存，趋势和异常检测本来就共用。
+LRU淘汰，进程内共享；取出的结果是副本，调用方修改不会影响缓存
+"""
+
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+import numpy as np
+import pandas as pd
+
+from config.settings import get_settings
+
+
+def content_digest(obj: Any) -> str:
+    """
+    计算数据内容的哈希（相同内容得到相同摘要，与对象身份无关）
+
+    Args:
+        obj: 字符串、NumPy数组、pandas 对象或 None
+
+    Returns:
+        十六进制摘要
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    if obj is None:
+        hasher.update(b"none")
+    elif isinstance(obj, (str, bytes)):
+        hasher.update(obj.encode("utf-8") if isinstance(obj, str) else obj)
+    elif isinstance(obj, np.ndarray):
+        hasher.update(f"{obj.dtype}{obj.shape}".encode())
+        hasher.update(np.ascontiguousarray(obj).tobytes() if obj.dtype != object else repr(obj.tolist()).encode())
+    elif isinstance(obj, (pd.Series, pd.DataFrame, pd.Index)):
+        names = list(obj.columns) if isinstance(obj, pd.DataFrame) else [obj.name]
+        hasher.update(repr(names).encode("utf-8"))
+        hasher.update(pd.util.hash_pandas_object(obj, index=not isinstance(obj, pd.Index)).to_numpy().tobytes())
+    else:
+        hasher.update(repr(obj).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class AnalysisCache:
+    """分析结果的LRU缓存（线程安全）"""
+
+    def __init__(self, max_entries: Optional[int] = None):
+        """
+        初始化分析结果缓存
+
+        Args:
+            max_entries: 缓存条目上限（默认读取配置）
+        """
+        settings = get_settings()
+        self.max_entries = max_entries or settings.ANALYSIS_CACHE_SIZE
+        self.enabled = settings.ANALYSIS_CACHE_ENABLED
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取缓存（未命中或缓存关闭时返回None）"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = self._entries[key]
+        return copy.deepcopy(value)
+
+    def put(self, key: Hashable, value: Any):
+        """写入缓存（超出上限时淘汰最久未使用的条目）"""
+        if not self.enabled:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """读取缓存，未命中时计算并写入"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def array(self, key: Hashable, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        """数组类中间结果（只读共享，不做副本）"""
+        if not self.enabled:
+            return compute()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        value.setflags(write=False)
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """缓存统计"""
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_cache: Optional[AnalysisCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """获取进程内共享的分析结果缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnalysisCache()
+        return _cache
@@ -0,0 +1,170 @@
+"""
+多进程批量分析模块
+
+宽表（几十上百个指标列，或按维度展开的大量分组序列）的趋势/异常/统计分析是CPU密集的，
+scipy 和季节分解在单线程里持有GIL逐列计算。超过规模阈值时按列分块交给进程池：
+- 数值矩阵只写入一次共享内存（multiprocessing.shared_memory），子进程按列切片读取，不经过pickle
+- 每个子进程复用自己的 BatchAnalyzer（及其季节分解缓存），结果字典合并后与单进程结果一致
+- 进程池常驻复用；使用 forkserver/spawn 启动，避免在多线程的服务进程里直接 fork
+"""
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Any, Sequence, Tuple
+import pandas as pd
+import numpy as np
+from loguru import logger
+
+from config.settings import get_settings
+
+# 子进程内复用的批量分析器
+_worker_analyzer = None
+
+
+def _analyze_chunk(
+    shm_name: str,
+    shape: Tuple[int, int],
+    columns: Tuple[int, int],
+    names: List[str],
+    index: pd.Index,
+    time_index: Optional[pd.Series],
+    analysis_types: List[str],
+    anomaly_methods: List[str]
+) -> Dict[str, Dict[str, Any]]:
+    """子进程：从共享内存读取一段列并批量分析"""
+    global _worker_analyzer
+    if _worker_analyzer is None:
+        from .batch import BatchAnalyzer
+        _worker_analyzer = BatchAnalyzer()
+
+    block = shared_memory.SharedMemory(name=shm_name)
+    try:
+        matrix = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+        start, stop = columns
+        # 只拷贝本块的列，之后即可释放共享内存的映射
+        values = np.array(matrix[:, start:stop])
+        del matrix
+    finally:
+        block.close()
+
+    frame = pd.DataFrame(values, index=index, columns=names)
+    return _worker_analyzer.analyze(frame, analysis_types, time_index=time_index, anomaly_methods=anomaly_methods)
+
+
+class ParallelAnalyzer:
+    """按列分块的多进程批量分析器"""
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        min_columns: Optional[int] = None,
+        min_cells: Optional[int] = None
+    ):
+        """
+        初始化多进程分析器
+
+        Args:
+            max_workers: 进程数（默认读取配置，0 表示 CPU核数 - 1）
+            min_columns: 启用多进程的最少序列数（默认读取配置）
+            min_cells: 启用多进程的最少 行数 × 序列数（默认读取配置）
+        """
+        settings = get_settings()
+        workers = settings.ANALYSIS_PARALLEL_WORKERS if max_workers is None else max_workers
+        self.max_workers = workers or max((os.cpu_count() or 1) - 1, 1)
+        self.min_columns = min_columns or settings.ANALYSIS_PARALLEL_MIN_COLUMNS
+        self.min_cells = min_cells or settings.ANALYSIS_PARALLEL_MIN_CELLS
+        self.enabled = settings.ANALYSIS_PARALLEL_ENABLED
+
+    def should_parallelize(self, frame: pd.DataFrame) -> bool:
+        """数据规模是否值得使用进程池（进程间通信和合并有固定开销）"""
+        n_rows, n_columns = frame.shape
+        return (
+            self.enabled
+            and self.max_workers > 1
+            and n_columns >= self.min_columns
+            and n_rows * n_columns >= self.min_cells
+        )
+
+    def analyze(
+        self,
+        frame: pd.DataFrame,
+        analysis_types: Sequence[str],
+        time_index: Optional[pd.Series] = None,
+        anomaly_methods: Sequence[str] = ("zscore", "iqr", "sudden_change")
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        多进程批量分析所有列（参数和返回值与 BatchAnalyzer.analyze 相同）
+
+        Args:
+            frame: 数据框，每一列是一条序列，需为无缺失的数值
+            analysis_types: 分析类型列表（trend / anomaly / statistics）
+            time_index: 时间索引（可选，与行对齐）
+            anomaly_methods: 异常检测方法
+
+        Returns:
+            {列名: {"trend_analysis": ..., "anomaly_detection": ..., "statistics": ...}}
+        """
+        names = [str(c) for c in frame.columns]
+        values = np.ascontiguousarray(frame.to_numpy(dtype=np.float64))
+        n_rows, n_columns = values.shape
+
+        # 每个进程约2块，负载不均时空闲进程可以接着处理
+        n_chunks = min(n_columns, self.max_workers * 2)
+        bounds = np.linspace(0, n_columns, n_chunks + 1).astype(int)
+
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        try:
+            shared = np.ndarray(values.shape, dtype=np.float64, buffer=block.buf)
+            shared[:] = values
+            del shared
+
+            pool = _get_pool(self.max_workers)
+            futures = [
+                pool.submit(
+                    _analyze_chunk, block.name, values.shape, (int(start), int(stop)),
+                    names[start:stop], frame.index, time_index,
+                    list(analysis_types), list(anomaly_methods)
+                )
+                for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+            ]
+            results: Dict[str, Dict[str, Any]] = {}
+            for future in futures:
+                results.update(future.result())
+        finally:
+            block.close()
+            block.unlink()
+
+        logger.info(f"[并行分析] {n_columns} 个序列 × {n_rows} 行，{len(futures)} 块 / {self.max_workers} 进程")
+        # 与输入列的原始名称对应（列名可能不是字符串）
+        return {column: results[name] for column, name in zip(frame.columns, names)}
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(max_workers: int) -> ProcessPoolExecutor:
+    """获取常驻进程池（进程数变化时重建）"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+            _pool_workers = max_workers
+        return _pool
+
+
+def shutdown_pool():
+    """关闭进程池（服务退出时调用）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
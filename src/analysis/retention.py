@@ -0,0 +1,531 @@
+"""
+本地留存计算模块
+
+按 (事件, 日期) 保存当天触发该事件的用户集合（distinct_id 字典序号的压缩位图），
+日/周/月留存矩阵由位图的并集和交集计算：
+- 同期群：起始周期内触发起始事件的用户（周期内各天位图的并集）
+- 第k期留存：同期群 ∩ 第k个后续周期内触发回访事件的用户
+
+每天的位图单独缓存，移动日期窗口或改变留存类型时只查询缓存中缺少的天。
+位图容器按密度选择（与 Roaring 的容器思路一致）：稀疏时为有序 uint32 数组，
+稠密时为按位打包的 uint8 位图，取两者中更小的一种
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Any, Iterable, Sequence, Tuple
+import pandas as pd
+import numpy as np
+from loguru import logger
+
+from config.settings import get_settings
+from src.sql.literals import sql_literal, sql_column
+from .user_ids import get_user_id_interner
+
+# 留存类型 -> 周期单位（兼容 daily/day 两种写法）
+PERIOD_UNITS = {
+    "daily": "day", "day": "day",
+    "weekly": "week", "week": "week",
+    "monthly": "month", "month": "month",
+}
+
+# 字节 -> 置位数（numpy 2.0 以下没有 bitwise_count 时查表）
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+_BITWISE_COUNT = getattr(np, "bitwise_count", None)
+
+
+def _popcount(bits: np.ndarray) -> int:
+    """打包位图中置位的个数（按 uint64 分块计数）"""
+    if _BITWISE_COUNT is None:
+        return int(_POPCOUNT[bits].sum())
+    head = len(bits) - len(bits) % 8
+    words = np.ascontiguousarray(bits[:head]).view(np.uint64)
+    return int(_BITWISE_COUNT(words).sum(dtype=np.int64)) + int(_POPCOUNT[bits[head:]].sum())
+
+
+class UserBitmap:
+    """用户序号集合（不可变），按密度在有序数组和打包位图之间选择存储方式"""
+
+    __slots__ = ("_array", "_bits", "_size")
+
+    def __init__(self, array: Optional[np.ndarray] = None, bits: Optional[np.ndarray] = None, size: int = 0):
+        self._array = array
+        self._bits = bits
+        self._size = size
+
+    @classmethod
+    def from_ordinals(cls, ordinals: Iterable[int]) -> "UserBitmap":
+        """由用户序号构建（可重复、无序）"""
+        values = np.unique(np.asarray(ordinals, dtype=np.uint32))
+        return cls._compress(values)
+
+    @classmethod
+    def _compress(cls, values: np.ndarray) -> "UserBitmap":
+        """有序去重的序号数组 -> 较小的存储形式"""
+        if len(values) == 0:
+            return cls(array=np.empty(0, dtype=np.uint32))
+        n_bytes = (int(values[-1]) >> 3) + 1
+        if len(values) * 4 <= n_bytes:
+            return cls(array=values, size=len(values))
+        mask = np.zeros(n_bytes * 8, dtype=bool)
+        mask[values] = True
+        return cls(bits=np.packbits(mask, bitorder="little"), size=len(values))
+
+    @classmethod
+    def _from_bits(cls, bits: np.ndarray) -> "UserBitmap":
+        """打包位图 -> 较小的存储形式"""
+        size = _popcount(bits)
+        if size * 4 <= len(bits):
+            return cls._compress(np.flatnonzero(np.unpackbits(bits, bitorder="little")).astype(np.uint32))
+        nonzero = np.flatnonzero(bits)
+        bits = bits[:nonzero[-1] + 1] if len(nonzero) else bits[:0]
+        return cls(bits=bits, size=size)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        """占用的字节数"""
+        return (self._array if self._array is not None else self._bits).nbytes
+
+    def to_array(self) -> np.ndarray:
+        """有序的用户序号数组"""
+        if self._array is not None:
+            return self._array
+        return np.flatnonzero(np.unpackbits(self._bits, bitorder="little")).astype(np.uint32)
+
+    def _contains(self, values: np.ndarray) -> np.ndarray:
+        """位图形式下逐个判断序号是否在集合中"""
+        inside = values < len(self._bits) * 8
+        hit = np.zeros(len(values), dtype=bool)
+        candidates = values[inside]
+        hit[inside] = (self._bits[candidates >> 3] >> (candidates & 7).astype(np.uint8)) & 1 == 1
+        return hit
+
+    def __and__(self, other: "UserBitmap") -> "UserBitmap":
+        if self._bits is not None and other._bits is not None:
+            n = min(len(self._bits), len(other._bits))
+            return UserBitmap._from_bits(self._bits[:n] & other._bits[:n])
+        if self._array is not None and other._array is not None:
+            values = np.intersect1d(self._array, other._array, assume_unique=True)
+            return UserBitmap(array=values, size=len(values))
+        array, bitmap = (self, other) if self._array is not None else (other, self)
+        values = array._array[bitmap._contains(array._array)]
+        return UserBitmap(array=values, size=len(values))
+
+    def intersection_count(self, other: "UserBitmap") -> int:
+        """交集大小（不构造结果集合）"""
+        if self._bits is not None and other._bits is not None:
+            n = min(len(self._bits), len(other._bits))
+            return _popcount(self._bits[:n] & other._bits[:n])
+        if self._array is not None and other._array is not None:
+            small, large = sorted((self._array, other._array), key=len)
+            if len(small) == 0:
+                return 0
+            found = np.searchsorted(large, small)
+            return int((large[np.minimum(found, len(large) - 1)] == small).sum()) if len(large) else 0
+        array, bitmap = (self, other) if self._array is not None else (other, self)
+        return int(bitmap._contains(array._array).sum())
+
+    @classmethod
+    def union(cls, bitmaps: Sequence["UserBitmap"]) -> "UserBitmap":
+        """多个集合的并集"""
+        bitmaps = [b for b in bitmaps if len(b)]
+        if not bitmaps:
+            return cls(array=np.empty(0, dtype=np.uint32))
+        if len(bitmaps) == 1:
+            return bitmaps[0]
+        if all(b._array is not None for b in bitmaps):
+            return cls._compress(np.unique(np.concatenate([b._array for b in bitmaps])))
+
+        n_bytes = max(len(b._bits) if b._bits is not None else (int(b._array[-1]) >> 3) + 1 for b in bitmaps)
+        bits = np.zeros(n_bytes, dtype=np.uint8)
+        sparse = []
+        for b in bitmaps:
+            if b._bits is not None:
+                bits[:len(b._bits)] |= b._bits
+            else:
+                sparse.append(b._array)
+        if sparse:
+            values = np.concatenate(sparse)
+            np.bitwise_or.at(bits, values >> 3, (1 << (values & 7)).astype(np.uint8))
+        return cls._from_bits(bits)
+
+
+class RetentionEngine:
+    """基于按天用户位图的留存计算引擎"""
+
+    def __init__(
+        self,
+        periods: Optional[int] = None,
+        cache_entries: Optional[int] = None,
+        exclude_spider: bool = True
+    ):
+        """
+        初始化留存引擎
+
+        Args:
+            periods: 默认计算的后续周期数（默认读取配置）
+            cache_entries: 缓存的 (事件, 过滤条件, 日期) 位图数量上限（默认读取配置）
+            exclude_spider: 查询时是否过滤爬虫用户
+        """
+        settings = get_settings()
+        self.periods = periods or settings.RETENTION_PERIODS
+        self.cache_entries = cache_entries or settings.RETENTION_CACHE_ENTRIES
+        self.batch_rows = settings.FUNNEL_STREAM_BATCH_ROWS
+        self.exclude_spider = exclude_spider
+        self._ordinals = get_user_id_interner()
+        self._cache: "OrderedDict[Tuple[str, str, date], UserBitmap]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ========== 周期 ==========
+
+    @staticmethod
+    def period_start(day: date, unit: str) -> date:
+        """日期所在周期的第一天（周从周一开始）"""
+        if unit == "week":
+            return day - timedelta(days=day.weekday())
+        if unit == "month":
+            return day.replace(day=1)
+        return day
+
+    @staticmethod
+    def shift_period(start: date, unit: str, k: int) -> date:
+        """第 k 个后续周期的第一天"""
+        if unit == "week":
+            return start + timedelta(weeks=k)
+        if unit == "month":
+            month = start.month - 1 + k
+            return date(start.year + month // 12, month % 12 + 1, 1)
+        return start + timedelta(days=k)
+
+    @classmethod
+    def period_days(cls, start: date, unit: str) -> List[date]:
+        """周期内的所有日期"""
+        end = cls.shift_period(start, unit, 1)
+        return [start + timedelta(days=i) for i in range((end - start).days)]
+
+    # ========== 缓存与查询 ==========
+
+    def _filter_key(self, filters: Optional[Dict[str, Any]]) -> str:
+        """过滤条件的规范化键（不同过滤条件的位图分开缓存）"""
+        return json.dumps([filters or {}, self.exclude_spider], ensure_ascii=False, sort_keys=True, default=str)
+
+    @staticmethod
+    def _date_ranges(days: Sequence[date]) -> List[Tuple[date, date]]:
+        """日期列表合并为连续区间"""
+        ranges: List[Tuple[date, date]] = []
+        for day in sorted(days):
+            if ranges and day == ranges[-1][1] + timedelta(days=1):
+                ranges[-1] = (ranges[-1][0], day)
+            else:
+                ranges.append((day, day))
+        return ranges
+
+    def build_sql(self, missing: Dict[str, List[date]], filters: Optional[Dict[str, Any]] = None) -> str:
+        """
+        生成拉取缺失 (事件, 日期) 用户集合的SQL
+
+        每个事件只查询自己缺少的日期区间，结果按 (事件, 日期, 用户) 去重
+
+        Args:
+            missing: {事件名: 缺少的日期列表}
+            filters: 过滤条件，{属性: 值 或 值列表}
+
+        Returns:
+            SQL语句
+        """
+        event_conditions = []
+        for event, days in missing.items():
+            ranges = " OR ".join(
+                f"date BETWEEN {sql_literal(a.isoformat())} AND {sql_literal(b.isoformat())}" if a != b
+                else f"date = {sql_literal(a.isoformat())}"
+                for a, b in self._date_ranges(days)
+            )
+            event_conditions.append(f"(event = {sql_literal(event)} AND ({ranges}))")
+
+        conditions = ["(" + " OR ".join(event_conditions) + ")"]
+        if self.exclude_spider:
+            conditions.append("is_spider_user = '正常用户'")
+        for name, value in (filters or {}).items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            if len(values) == 1:
+                conditions.append(f"{sql_column(name)} = {sql_literal(values[0])}")
+            else:
+                conditions.append(f"{sql_column(name)} IN ({', '.join(sql_literal(v) for v in values)})")
+
+        return (
+            "SELECT event, date, distinct_id\nFROM events\nWHERE " + "\n  AND ".join(conditions)
+            + "\nGROUP BY event, date, distinct_id"
+        )
+
+    def load_bitmaps(self, batches: Iterable[Tuple[List[str], List[List[Any]]]]) -> Dict[Tuple[str, date], UserBitmap]:
+        """
+        将流式批次转换为 (事件, 日期) -> 用户位图
+
+        每批立即编码为用户序号，只保留整数数组
+
+        Args:
+            batches: SensorsClient.stream_sql 产出的 (列名, 行) 批次
+
+        Returns:
+            {(事件, 日期): UserBitmap}
+        """
+        parts: Dict[Tuple[str, date], List[np.ndarray]] = {}
+        for columns, rows in batches:
+            if not rows:
+                continue
+            frame = pd.DataFrame(rows, columns=columns)[["event", "date", "distinct_id"]].dropna()
+            if frame.empty:
+                continue
+            ordinals = self._ordinals.encode(frame["distinct_id"].to_numpy())
+            keys, uniques = pd.factorize(frame["event"].astype(str) + "|" + frame["date"].astype(str).str[:10])
+            order = np.argsort(keys, kind="stable")
+            bounds = np.flatnonzero(np.diff(keys[order])) + 1
+            for segment in np.split(order, bounds):
+                event, day = uniques[keys[segment[0]]].rsplit("|", 1)
+                key = (event, datetime.strptime(day, "%Y-%m-%d").date())
+                parts.setdefault(key, []).append(ordinals[segment])
+
+        return {key: UserBitmap.from_ordinals(np.concatenate(arrays)) for key, arrays in parts.items()}
+
+    def day_bitmaps(
+        self,
+        client: Any,
+        wanted: Dict[str, Sequence[date]],
+        filters: Optional[Dict[str, Any]] = None,
+        last_complete_day: Optional[date] = None
+    ) -> Tuple[Dict[Tuple[str, date], UserBitmap], Dict[str, Any]]:
+        """
+        获取各事件每天的用户位图，缓存中缺少的 (事件, 日期) 一次查询补齐
+
+        Args:
+            client: SensorsClient
+            wanted: {事件名: 日期列表}
+            filters: 过滤条件
+            last_complete_day: 数据完整的最后一天，之后的日期不写入缓存（默认昨天）
+
+        Returns:
+            ({(事件, 日期): UserBitmap}, {"sql", "fetched_days", "cached_days"})
+        """
+        filter_key = self._filter_key(filters)
+        last_complete_day = last_complete_day or date.today() - timedelta(days=1)
+
+        found: Dict[Tuple[str, date], UserBitmap] = {}
+        missing: Dict[str, List[date]] = {}
+        with self._lock:
+            for event, days in wanted.items():
+                for day in days:
+                    bitmap = self._cache.get((event, filter_key, day))
+                    if bitmap is None:
+                        missing.setdefault(event, []).append(day)
+                    else:
+                        self._cache.move_to_end((event, filter_key, day))
+                        found[(event, day)] = bitmap
+
+        info = {"sql": None, "fetched_days": sum(len(v) for v in missing.values()), "cached_days": len(found)}
+        if not missing:
+            return found, info
+
+        sql = self.build_sql(missing, filters)
+        loaded = self.load_bitmaps(client.stream_sql(sql, batch_rows=self.batch_rows))
+        info["sql"] = sql
+
+        empty = UserBitmap.from_ordinals([])
+        with self._lock:
+            for event, event_days in missing.items():
+                for day in event_days:
+                    bitmap = loaded.get((event, day), empty)
+                    found[(event, day)] = bitmap
+                    # 当天及之后的数据还在增长，不缓存
+                    if day <= last_complete_day:
+                        self._cache[(event, filter_key, day)] = bitmap
+                        self._cache.move_to_end((event, filter_key, day))
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+        logger.info(
+            f"[留存] 查询 {info['fetched_days']} 个(事件, 日期)位图，命中缓存 {info['cached_days']} 个，"
+            f"累计 {len(self._ordinals)} 个用户序号"
+        )
+        return found, info
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """缓存统计（位图数量、占用字节、用户序号数）"""
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "bytes": sum(bitmap.nbytes for bitmap in self._cache.values()),
+                "users": len(self._ordinals),
+            }
+
+    # ========== 计算 ==========
+
+    def compute(
+        self,
+        start_bitmaps: Dict[date, UserBitmap],
+        return_bitmaps: Dict[date, UserBitmap],
+        start_date: date,
+        end_date: date,
+        unit: str,
+        periods: int,
+        last_day: date
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        由每天的位图计算留存矩阵
+
+        Args:
+            start_bitmaps: 起始事件 {日期: 用户位图}
+            return_bitmaps: 回访事件 {日期: 用户位图}
+            start_date: 同期群开始日期（含）
+            end_date: 同期群结束日期（含）
+            unit: 周期单位（day/week/month）
+            periods: 后续周期数
+            last_day: 数据完整的最后一天；未完整结束的周期记为空值
+
+        Returns:
+            (留存人数矩阵, 留存率矩阵)，行为同期群，列为 cohort, users, {unit}_0..{unit}_N；
+            留存率矩阵末行为按人数加权的"合计"
+        """
+        columns = [f"{unit}_{k}" for k in range(periods + 1)]
+        empty = UserBitmap.from_ordinals([])
+        returned: Dict[date, Optional[UserBitmap]] = {}
+
+        def return_users(period: date) -> Optional[UserBitmap]:
+            # 同一个回访周期被多个同期群共用，只合并一次
+            if period not in returned:
+                days = self.period_days(period, unit)
+                returned[period] = None if days[-1] > last_day else UserBitmap.union(
+                    [return_bitmaps.get(day, empty) for day in days]
+                )
+            return returned[period]
+
+        cohort_days: Dict[date, List[date]] = OrderedDict()
+        day = start_date
+        while day <= min(end_date, last_day):
+            cohort_days.setdefault(self.period_start(day, unit), []).append(day)
+            day += timedelta(days=1)
+
+        rows = []
+        for cohort, days in cohort_days.items():
+            users = UserBitmap.union([start_bitmaps.get(day, empty) for day in days])
+            row: Dict[str, Any] = {"cohort": cohort.isoformat(), "users": len(users)}
+            for k, name in enumerate(columns):
+                returning = return_users(self.shift_period(cohort, unit, k))
+                row[name] = users.intersection_count(returning) if returning is not None else None
+            rows.append(row)
+
+        counts = pd.DataFrame(rows, columns=["cohort", "users"] + columns)
+        for name in columns:
+            counts[name] = counts[name].astype("Int64")
+
+        rates = counts.copy()
+        for name in columns:
+            rates[name] = (counts[name] / counts["users"].where(counts["users"] > 0)).astype(float).round(4)
+
+        # 合计：每一期只统计已观测到该期的同期群
+        total: Dict[str, Any] = {"cohort": "合计", "users": int(counts["users"].sum())}
+        for name in columns:
+            observed = counts[name].notna()
+            base = counts.loc[observed, "users"].sum()
+            total[name] = round(float(counts.loc[observed, name].sum()) / base, 4) if base else np.nan
+        rates = pd.concat([rates, pd.DataFrame([total])], ignore_index=True)
+        return counts, rates
+
+    # ========== 入口 ==========
+
+    def run(
+        self,
+        client: Any,
+        start_event: str,
+        return_event: str,
+        start_date: str,
+        end_date: str,
+        retention_type: str = "daily",
+        periods: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        查询并计算留存
+
+        Args:
+            client: SensorsClient
+            start_event: 起始事件
+            return_event: 回访事件
+            start_date: 同期群开始日期（YYYY-MM-DD）
+            end_date: 同期群结束日期（YYYY-MM-DD，含）
+            retention_type: daily/weekly/monthly（也接受 day/week/month）
+            periods: 后续周期数（默认读取配置）
+            filters: 过滤条件
+
+        Returns:
+            {"counts", "rates", "sql"（全部命中缓存时为None）, "fetched_days", "cached_days",
+             "retention_type", "periods", "users", "description"}
+        """
+        unit = PERIOD_UNITS.get(retention_type)
+        if unit is None:
+            raise ValueError(f"不支持的留存类型: {retention_type}，支持: daily, weekly, monthly")
+        periods = self.periods if periods is None else periods
+
+        first = datetime.strptime(start_date, "%Y-%m-%d").date()
+        last = datetime.strptime(end_date, "%Y-%m-%d").date()
+        last_day = date.today() - timedelta(days=1)
+        if first > min(last, last_day):
+            raise ValueError("日期范围内没有数据完整的日期（留存只统计到昨天）")
+
+        # 起始事件：同期群日期；回访事件：覆盖到最后一个同期群的第N期（不超过昨天）
+        cohort_days = [first + timedelta(days=i) for i in range((min(last, last_day) - first).days + 1)]
+        final_period = self.shift_period(self.period_start(cohort_days[-1], unit), unit, periods + 1)
+        scan_end = min(final_period - timedelta(days=1), last_day)
+        scan_start = self.period_start(first, unit)
+        return_days = [scan_start + timedelta(days=i) for i in range((scan_end - scan_start).days + 1)]
+
+        wanted = {start_event: set(cohort_days)}
+        wanted[return_event] = wanted.get(return_event, set()) | set(return_days)
+        bitmaps, info = self.day_bitmaps(
+            client, {event: sorted(days) for event, days in wanted.items()}, filters, last_day
+        )
+
+        counts, rates = self.compute(
+            {day: bitmaps[(start_event, day)] for day in cohort_days},
+            {day: bitmaps[(return_event, day)] for day in return_days},
+            first, last, unit, periods, last_day
+        )
+
+        total = rates.iloc[-1]
+        users = int(total["users"])
+        unit_name = {"day": "日", "week": "周", "month": "月"}[unit]
+        if periods >= 1 and pd.notna(total[f"{unit}_1"]):
+            headline = f"第1{unit_name}留存 {total[f'{unit}_1']:.2%}"
+        else:
+            headline = "暂无完整的后续周期"
+        return {
+            "counts": counts,
+            "rates": rates,
+            "sql": info["sql"],
+            "fetched_days": info["fetched_days"],
+            "cached_days": info["cached_days"],
+            "retention_type": unit,
+            "periods": periods,
+            "users": users,
+            "description": (
+                f"{start_event} → {return_event}（{unit_name}留存，{len(counts)}个同期群）："
+                f"起始用户 {users:,} 人，{headline}"
+            )
+        }
+
+
+_engine: Optional[RetentionEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_retention_engine() -> RetentionEngine:
+    """获取进程内共享的留存引擎（RetentionTool 和编排器共用按天位图缓存）"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RetentionEngine()
+        return _engine
@@ -0,0 +1,205 @@
+"""
+基于已有结果的指令改写模块
+
+同一次分析中，下钻阶段的指令经常只是初始阶段结果的子集或更粗的汇总
+（例如已有"每天 × 平台"的表，又要"每天合计"）。执行前先检查 TaskContext 中已成功的查询，
+存在更细粒度的结果时在本地过滤 + 重新汇总，跳过SQL生成和执行。
+
+可推导的条件（与结果立方体相同的汇总规则，另外支持过滤条件和日期子区间）:
+- 事件: 新指令与已有结果的事件集合相同（指标名如"次数"在不同事件间通用），任一方事件未知时不推导
+- 指标: 新指令的指标都能对应到已有结果的列
+- 维度: 新指令的维度和过滤维度都是已有结果的维度
+- 过滤: 已有结果带过滤条件时，新指令在相同维度上的过滤取值必须是其子集
+- 时间: 时间范围相同；或已有结果按日期分组且新范围在其范围内
+- 可加性: 被汇总掉的维度（包括汇总掉的日期）只允许可加指标，
+  或该维度被过滤为单一取值（日期范围只有一天）
+"""
+
+import os
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import pandas as pd
+from loguru import logger
+
+from config.settings import get_settings
+from .cube import DATE_ALIASES, _normalize, instruction_events, is_additive, match_columns
+from .utils import infer_time_column, infer_numeric_columns
+
+
+class ResultRewriter:
+    """用已有的更细粒度结果回答新指令"""
+
+    def __init__(self, parse_range: Callable[[str], Tuple[str, str]], max_rows: Optional[int] = None):
+        """
+        初始化改写器
+
+        Args:
+            parse_range: 时间范围解析函数（如 BaseSensorsTool.parse_date_range），返回 (开始日期, 结束日期)
+            max_rows: 可作为来源的结果行数上限（默认读取配置）
+        """
+        settings = get_settings()
+        self.enabled = settings.REWRITE_ENABLED
+        self.max_rows = max_rows or settings.REWRITE_MAX_ROWS
+        self.parse_range = parse_range
+        self._frames: Dict[str, Tuple[int, pd.DataFrame]] = {}
+
+    def _load(self, csv_path: str) -> Optional[pd.DataFrame]:
+        """读取来源结果（按文件修改时间缓存）"""
+        try:
+            mtime = os.stat(csv_path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._frames.get(csv_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, pd.read_csv(csv_path))
+            self._frames[csv_path] = cached
+        return cached[1]
+
+    def _days(self, time_range: str) -> Optional[Tuple[date, date]]:
+        try:
+            start, end = self.parse_range(time_range or "last_7_days")
+            return date.fromisoformat(start), date.fromisoformat(end)
+        except (ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def _is_plain(instruction: Dict[str, Any]) -> bool:
+        """普通聚合指令（漏斗/留存结果的口径不同，不参与改写）"""
+        return bool(instruction.get("metrics")) and not instruction.get("funnel_steps") and not instruction.get("retention_events")
+
+    def _derive(
+        self,
+        instruction: Dict[str, Any],
+        source: Dict[str, Any],
+        frame: pd.DataFrame
+    ) -> Optional[pd.DataFrame]:
+        """尝试由一个来源结果推导新指令的结果，不满足条件时返回None"""
+        time_column = infer_time_column(frame)
+        numeric_cols = [c for c in infer_numeric_columns(frame) if c != time_column]
+        source_metrics = match_columns(source["metrics"], numeric_cols)
+        if len(source_metrics) != len(source["metrics"]):
+            return None
+        dim_cols = [c for c in frame.columns if c not in source_metrics.values()]
+        source_dims = match_columns(source.get("dimensions") or [], dim_cols, time_column)
+        if len(source_dims) != len(dim_cols):
+            return None
+
+        # 指标：新指令的指标先对应到来源指令的指标名，再对应到列名
+        metric_cols = {}
+        for metric in instruction["metrics"]:
+            match = match_columns([metric], list(source_metrics))
+            if metric in match:
+                metric_cols[metric] = source_metrics[match[metric]]
+                continue
+            match = match_columns([metric], list(source_metrics.values()))
+            if metric not in match:
+                return None
+            metric_cols[metric] = match[metric]
+
+        by_name = {_normalize(d): col for d, col in source_dims.items()}
+        date_col = next((col for d, col in source_dims.items() if _normalize(d) in DATE_ALIASES), None)
+
+        # 维度
+        group_cols = []
+        for dim in instruction.get("dimensions") or []:
+            column = by_name.get(_normalize(dim))
+            if column is None:
+                return None
+            group_cols.append(column)
+
+        # 过滤：来源的过滤条件必须被新指令覆盖（取值为子集）
+        source_filters = {_normalize(k): {str(v).strip().lower() for v in values} for k, values in (source.get("filters") or {}).items()}
+        filters = {_normalize(k): {str(v).strip().lower() for v in values} for k, values in (instruction.get("filters") or {}).items()}
+        for name, allowed in source_filters.items():
+            if name not in filters or not filters[name] <= allowed:
+                return None
+        local_filters = {}
+        for name, allowed in filters.items():
+            if name in source_filters and allowed == source_filters[name]:
+                continue
+            column = by_name.get(name)
+            if column is None:
+                return None
+            local_filters[column] = allowed
+
+        # 时间：相同范围，或按日期分组的来源覆盖新范围
+        date_window = None
+        new_days = self._days(instruction.get("time_range", ""))
+        if instruction.get("time_range", "").strip().lower() != source.get("time_range", "").strip().lower():
+            source_days = self._days(source.get("time_range", ""))
+            if date_col is None or new_days is None or source_days is None:
+                return None
+            if not (source_days[0] <= new_days[0] and new_days[1] <= source_days[1]):
+                return None
+            date_window = new_days
+
+        # 可加性：汇总掉的维度只允许可加指标或单一取值
+        single_valued = {column for column, allowed in local_filters.items() if len(allowed) == 1}
+        single_valued |= {by_name[name] for name, allowed in filters.items() if len(allowed) == 1 and name in by_name}
+        if date_col is not None and new_days is not None and new_days[0] == new_days[1]:
+            single_valued.add(date_col)
+        dropped = set(source_dims.values()) - set(group_cols)
+        if not dropped <= single_valued and not all(is_additive(m) for m in instruction["metrics"]):
+            return None
+
+        result = frame
+        for column, allowed in local_filters.items():
+            result = result[result[column].astype(str).str.strip().str.lower().isin(allowed)]
+        if date_window is not None:
+            days = pd.to_datetime(result[date_col], errors="coerce").dt.date
+            result = result[(days >= date_window[0]) & (days <= date_window[1])]
+
+        value_cols = list(dict.fromkeys(metric_cols.values()))
+        group_cols = list(dict.fromkeys(group_cols))
+        if set(group_cols) == set(source_dims.values()):
+            result = result[group_cols + value_cols]
+        elif group_cols:
+            result = result.groupby(group_cols, sort=True, dropna=False)[value_cols].sum().reset_index()
+        else:
+            result = result[value_cols].sum().to_frame().T
+        return result.reset_index(drop=True)
+
+    def answer(
+        self,
+        instruction: Dict[str, Any],
+        sources: Sequence[Tuple[Dict[str, Any], str, Optional[List[str]]]]
+    ) -> Optional[Tuple[pd.DataFrame, Dict[str, Any], frozenset]]:
+        """
+        尝试用已有结果回答指令
+
+        Args:
+            instruction: 新的结构化指令
+            sources: 已有结果 [(指令, CSV路径, 结果记录的事件)]
+
+        Returns:
+            (结果DataFrame, 来源指令, 事件集合)，多个来源可用时选行数最少的；无法回答时返回None
+        """
+        if not self.enabled or not isinstance(instruction, dict) or not self._is_plain(instruction):
+            return None
+        events = instruction_events(instruction)
+        if events is None:
+            return None
+
+        best = None
+        for source, csv_path, source_events in sources:
+            if not isinstance(source, dict) or not self._is_plain(source) or not csv_path:
+                continue
+            if instruction_events(source, source_events) != events:
+                continue
+            try:
+                frame = self._load(csv_path)
+                if frame is None or frame.empty or len(frame) > self.max_rows:
+                    continue
+                if best is not None and len(frame) >= best[2]:
+                    continue
+                derived = self._derive(instruction, source, frame)
+            except Exception as e:
+                logger.debug(f"[ResultRewriter] 来源不可用 {csv_path}: {e}")
+                continue
+            if derived is not None:
+                best = (derived, source, len(frame))
+
+        if best is None:
+            return None
+        logger.info(f"[ResultRewriter] 由已有结果推导: {best[1].get('task', '')[:50]} → {len(best[0])} 行")
+        return best[0], best[1], events
@@ -0,0 +1,447 @@
+"""
+热门事件预聚合模块
+
+大部分问题落在少数几个热门事件上，并且只是按日期/平台等常用维度统计次数和人数。
+这里按天把这些事件的聚合结果固化到本地列式存储，能由预聚合表回答的指令不再经过 Impala：
+- 每天一个分区文件（.npz，每列一个数组，只读取需要的列）
+- 常用维度的每种组合（grain，维度位掩码）单独聚合，人数在该组合内精确去重
+- 已结束的日期在 ROLLUP_REFRESH_HOUR 之后固化（complete），当天分区按较短间隔刷新
+- 缺失或维度配置已变化的分区自动补齐
+
+回答规则:
+- 次数可以任意汇总（跨天、跨多个过滤取值）
+- 人数不可加：只在按日期分组（或只有一天）且被汇总掉的维度过滤为单一取值时回答
+- 范围包含今天但当天分区缺失或未及时刷新时，去掉今天回答并在结果 attrs["note"] 中说明；
+  只查今天时不回答。其他日期的分区缺失时不回答（由调用方改为查询神策）
+"""
+
+import os
+import io
+import json
+import time
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from config.settings import get_settings
+from .cube import DATE_ALIASES, _normalize
+from src.sql.literals import sql_literal, sql_column
+
+# 首次补齐历史分区时每次查询的天数
+_BACKFILL_CHUNK_DAYS = 7
+# 维度组合数为 2^维度数，限制维度数量避免查询分支过多
+_MAX_DIMENSIONS = 4
+# 聚合方式 -> 预聚合列
+_MEASURES = {"count": "event_count", "uv": "user_count"}
+
+
+class RollupStore:
+    """按天分区的热门事件预聚合表"""
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        events: Optional[Sequence[str]] = None,
+        dimensions: Optional[Dict[str, List[str]]] = None,
+        days: Optional[int] = None,
+        exclude_spider: bool = True
+    ):
+        """
+        初始化预聚合表
+
+        Args:
+            directory: 存储目录（默认读取配置）
+            events: 预聚合的事件（默认读取配置）
+            dimensions: {维度属性: 别名列表}（默认读取配置）
+            days: 保留并自动补齐的天数（默认读取配置）
+            exclude_spider: 聚合时是否过滤爬虫用户
+        """
+        settings = get_settings()
+        self.enabled = settings.ROLLUP_ENABLED
+        self.directory = directory or settings.ROLLUP_DIR
+        self.events = list(events or settings.ROLLUP_EVENTS)
+        dimensions = dimensions if dimensions is not None else settings.ROLLUP_DIMENSIONS
+        if len(dimensions) > _MAX_DIMENSIONS:
+            raise ValueError(f"预聚合维度最多 {_MAX_DIMENSIONS} 个: {list(dimensions)}")
+        self.dimensions = [sql_column(name) for name in dimensions]
+        self.days = days or settings.ROLLUP_DAYS
+        self.refresh_hour = settings.ROLLUP_REFRESH_HOUR
+        self.today_interval = settings.ROLLUP_TODAY_REFRESH_SECONDS
+        self.exclude_spider = exclude_spider
+
+        # 规范化的维度名/别名 -> 维度属性
+        self._aliases: Dict[str, str] = {}
+        for name, aliases in dimensions.items():
+            for alias in [name, *aliases]:
+                self._aliases[_normalize(alias)] = name
+
+        self._partitions: Dict[date, Tuple[int, Dict[str, Any], pd.DataFrame]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ========== 分区存储 ==========
+
+    def _path(self, day: date) -> str:
+        return os.path.join(self.directory, f"{day.isoformat()}.npz")
+
+    def _write(self, day: date, frame: pd.DataFrame, complete: bool, refreshed_at: float):
+        """写入一天的分区（先写临时文件再替换）"""
+        meta = {
+            "events": self.events,
+            "dimensions": self.dimensions,
+            "complete": complete,
+            "refreshed_at": refreshed_at,
+        }
+        columns = {
+            "grain": frame["grain"].to_numpy(dtype=np.int16),
+            "event": frame["event"].to_numpy(dtype=str),
+            "event_count": frame["event_count"].to_numpy(dtype=np.int64),
+            "user_count": frame["user_count"].to_numpy(dtype=np.int64),
+            "__meta__": np.array(json.dumps(meta, ensure_ascii=False)),
+        }
+        for i in range(len(self.dimensions)):
+            columns[f"d{i}"] = frame[f"d{i}"].to_numpy(dtype=str)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(day)
+        buffer = io.BytesIO()
+        np.savez(buffer, **columns)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._partitions.pop(day, None)
+
+    def _read(self, day: date) -> Optional[Tuple[Dict[str, Any], pd.DataFrame]]:
+        """读取一天的分区（按文件修改时间缓存）；不存在或维度配置已变化时返回None"""
+        path = self._path(day)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._partitions.get(day)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data["__meta__"]))
+                if meta.get("dimensions") != self.dimensions:
+                    return None
+                frame = pd.DataFrame({name: data[name] for name in data.files if name != "__meta__"})
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"[Rollup] 分区读取失败 {path}: {e}")
+            return None
+
+        with self._lock:
+            self._partitions[day] = (mtime, meta, frame)
+        return meta, frame
+
+    def _usable(self, day: date, now: datetime, events: set) -> Optional[pd.DataFrame]:
+        """可用于回答的分区：包含所需事件，且已固化或是刷新及时的当天分区"""
+        partition = self._read(day)
+        if partition is None:
+            return None
+        meta, frame = partition
+        if not events <= set(meta.get("events", [])):
+            return None
+        if meta.get("complete"):
+            return frame
+        if day == now.date() and now.timestamp() - meta.get("refreshed_at", 0) <= 2 * self.today_interval:
+            return frame
+        return None
+
+    # ========== 构建 ==========
+
+    def build_sql(self, days: Sequence[date]) -> str:
+        """
+        生成一批日期的预聚合SQL（每种维度组合一个分支，UNION ALL 合并）
+
+        Args:
+            days: 日期列表
+
+        Returns:
+            SQL语句，列为 date, event, grain, d0..dk, event_count, user_count
+        """
+        days = sorted(days)
+        contiguous = (days[-1] - days[0]).days == len(days) - 1
+        date_condition = (
+            f"date BETWEEN {sql_literal(days[0].isoformat())} AND {sql_literal(days[-1].isoformat())}" if contiguous
+            else f"date IN ({', '.join(sql_literal(d.isoformat()) for d in days)})"
+        )
+        conditions = [f"event IN ({', '.join(sql_literal(e) for e in self.events)})", date_condition]
+        if self.exclude_spider:
+            conditions.append("is_spider_user = '正常用户'")
+        where = "\n  AND ".join(conditions)
+
+        branches = []
+        for grain in range(2 ** len(self.dimensions)):
+            grouped = [name for i, name in enumerate(self.dimensions) if grain >> i & 1]
+            selected = ", ".join(
+                f"CAST({name} AS STRING) AS d{i}" if grain >> i & 1 else f"CAST(NULL AS STRING) AS d{i}"
+                for i, name in enumerate(self.dimensions)
+            )
+            branches.append(
+                f"SELECT date, event, {grain} AS grain, {selected}, "
+                f"COUNT(*) AS event_count, COUNT(DISTINCT distinct_id) AS user_count\n"
+                f"FROM events\nWHERE {where}\nGROUP BY {', '.join(['date', 'event', *grouped])}"
+            )
+        return "\nUNION ALL\n".join(branches)
+
+    def refresh(self, client, days: Sequence[date], complete: bool, now: Optional[datetime] = None) -> int:
+        """
+        查询并写入一批日期的分区（没有数据的日期写入空分区）
+
+        Args:
+            client: 神策客户端
+            days: 日期列表
+            complete: 分区是否已固化
+            now: 刷新时间（默认系统时间）
+
+        Returns:
+            写入的行数
+        """
+        columns = ["date", "event", "grain", *[f"d{i}" for i in range(len(self.dimensions))], "event_count", "user_count"]
+        frames = [pd.DataFrame(rows, columns=cols) for cols, rows in client.stream_sql(self.build_sql(days))]
+        result = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+        result["date"] = pd.to_datetime(result["date"]).dt.date
+        for i in range(len(self.dimensions)):
+            result[f"d{i}"] = result[f"d{i}"].fillna("").astype(str)
+        result[["event_count", "user_count"]] = result[["event_count", "user_count"]].fillna(0)
+
+        refreshed_at = (now or datetime.now()).timestamp()
+        for day in days:
+            self._write(day, result[result["date"] == day], complete, refreshed_at)
+        return len(result)
+
+    def pending(self, now: Optional[datetime] = None) -> Tuple[List[date], bool]:
+        """
+        需要刷新的分区
+
+        Returns:
+            (需要固化的历史日期, 当天分区是否需要刷新)
+        """
+        now = now or datetime.now()
+        today = now.date()
+        last_final = today - timedelta(days=1 if now.hour >= self.refresh_hour else 2)
+        days = []
+        for offset in range(self.days):
+            day = today - timedelta(days=offset + 1)
+            if day > last_final:
+                continue
+            partition = self._read(day)
+            if partition is None or not partition[0].get("complete") or not set(self.events) <= set(partition[0].get("events", [])):
+                days.append(day)
+
+        partition = self._read(today)
+        stale = partition is None or now.timestamp() - partition[0].get("refreshed_at", 0) >= self.today_interval
+        return sorted(days), stale
+
+    def run_once(self, client, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        执行一轮刷新：固化已结束的日期、刷新当天分区、清理过期分区
+
+        Returns:
+            刷新统计
+        """
+        now = now or datetime.now()
+        with self._refresh_lock:
+            start = time.time()
+            days, refresh_today = self.pending(now)
+            rows = 0
+            for i in range(0, len(days), _BACKFILL_CHUNK_DAYS):
+                rows += self.refresh(client, days[i:i + _BACKFILL_CHUNK_DAYS], complete=True, now=now)
+            if refresh_today:
+                rows += self.refresh(client, [now.date()], complete=False, now=now)
+            removed = self._cleanup(now.date())
+
+        summary = {
+            "finalized_days": [d.isoformat() for d in days],
+            "refreshed_today": refresh_today,
+            "rows": rows,
+            "removed": removed,
+            "elapsed_seconds": round(time.time() - start, 3),
+        }
+        if days or refresh_today:
+            logger.info(
+                f"[Rollup] 固化 {len(days)} 天，当天分区{'已' if refresh_today else '未'}刷新，"
+                f"{rows} 行，耗时 {summary['elapsed_seconds']}秒"
+            )
+        return summary
+
+    def _cleanup(self, today: date) -> int:
+        """删除超出保留天数的分区"""
+        if not os.path.isdir(self.directory):
+            return 0
+        oldest = today - timedelta(days=self.days)
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                day = date.fromisoformat(name[:-4])
+            except ValueError:
+                continue
+            if day < oldest:
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+        return removed
+
+    # ========== 调度 ==========
+
+    def _loop(self, client):
+        while not self._stop.is_set():
+            try:
+                self.run_once(client)
+            except Exception as e:
+                logger.exception(f"[Rollup] 刷新失败: {e}")
+            self._stop.wait(self.today_interval)
+
+    def start(self, client):
+        """启动后台刷新线程（已启动时忽略）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(client,), name="rollup-refresh", daemon=True)
+        self._thread.start()
+        logger.info(f"[Rollup] 后台刷新已启动: {self.events} × {self.dimensions}")
+
+    def stop(self, timeout: Optional[float] = 10):
+        """停止后台刷新线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ========== 查询 ==========
+
+    def resolve_dimension(self, name: str) -> Optional[str]:
+        """维度名/别名 -> 维度属性（日期维度返回 "date"）；不是预聚合维度时返回None"""
+        key = _normalize(name)
+        if key in DATE_ALIASES:
+            return "date"
+        return self._aliases.get(key)
+
+    def answer(
+        self,
+        event_metrics: Sequence[Dict[str, str]],
+        dimensions: Sequence[str],
+        filters: Optional[Dict[str, Sequence[str]]],
+        start_date: str,
+        end_date: str,
+        now: Optional[datetime] = None
+    ) -> Optional[pd.DataFrame]:
+        """
+        尝试用预聚合表回答指令
+
+        Args:
+            event_metrics: [{"name": 指标列名, "event": 事件名, "aggregate": "count"/"uv"}]
+            dimensions: 分组维度（日期或预聚合维度）
+            filters: 过滤条件，{维度: 取值列表}
+            start_date: 开始日期 YYYY-MM-DD
+            end_date: 结束日期 YYYY-MM-DD
+            now: 当前时间（默认系统时间）
+
+        Returns:
+            结果DataFrame（列为 请求的维度 + 指标，去掉今天时 attrs["note"] 为说明）；无法回答时返回None
+        """
+        if not self.enabled or not event_metrics:
+            return None
+        if any(m.get("event") not in self.events or m.get("aggregate") not in _MEASURES for m in event_metrics):
+            logger.debug(f"[Rollup] 不回答: 事件或聚合方式不在预聚合范围内 {list(event_metrics)}")
+            return None
+
+        by_date = False
+        grouped: List[Tuple[str, int]] = []
+        for name in dimensions:
+            column = self.resolve_dimension(name)
+            if column is None:
+                return None
+            if column == "date":
+                by_date = True
+            else:
+                grouped.append((name, self.dimensions.index(column)))
+
+        filtered: Dict[int, set] = {}
+        for name, values in (filters or {}).items():
+            column = self.resolve_dimension(name)
+            if column is None or column == "date":
+                return None
+            filtered[self.dimensions.index(column)] = {str(v).strip().lower() for v in values}
+
+        now = now or datetime.now()
+        events = {m["event"] for m in event_metrics}
+        first, last = date.fromisoformat(start_date), date.fromisoformat(end_date)
+        days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+        usable = {day: self._usable(day, now, events) for day in days}
+
+        note = None
+        today = now.date()
+        if today in usable and usable[today] is None:
+            if len(days) == 1:
+                logger.info(f"[Rollup] 不回答: 当天({today})分区缺失或超过 {2 * self.today_interval} 秒未刷新")
+                return None
+            days = [day for day in days if day != today]
+            note = f"预聚合表当天({today})分区未及时刷新，结果截止到{days[-1]}，不含今天"
+        missing = [day.isoformat() for day in days if usable[day] is None]
+        if missing:
+            logger.info(f"[Rollup] 不回答: 分区缺失或未固化 {missing[:5]}{'…' if len(missing) > 5 else ''}")
+            return None
+
+        group_index = {i for _, i in grouped}
+        if any(m["aggregate"] == "uv" for m in event_metrics):
+            # 人数跨天或跨多个取值相加会重复计算同一用户
+            if (not by_date and len(days) > 1) or any(len(v) > 1 for i, v in filtered.items() if i not in group_index):
+                logger.debug("[Rollup] 不回答: 人数不能跨天或跨多个取值相加")
+                return None
+
+        partitions = [usable[day].assign(date=day.isoformat()) for day in days]
+
+        grain = sum(1 << i for i in group_index | set(filtered))
+        frame = pd.concat(partitions, ignore_index=True)
+        frame = frame[(frame["grain"] == grain) & frame["event"].isin(events)]
+        for i, allowed in filtered.items():
+            frame = frame[frame[f"d{i}"].str.strip().str.lower().isin(allowed)]
+
+        keys = (["date"] if by_date else []) + [f"d{i}" for _, i in grouped]
+        columns = {}
+        for metric in event_metrics:
+            rows = frame[frame["event"] == metric["event"]]
+            measure = _MEASURES[metric["aggregate"]]
+            columns[metric["name"]] = rows.groupby(keys)[measure].sum() if keys else pd.Series([rows[measure].sum()])
+        result = pd.DataFrame(columns).fillna(0).astype("int64")
+
+        if keys:
+            if keys == ["date"]:
+                result = result.reindex([d.isoformat() for d in days], fill_value=0).rename_axis("date")
+            result = result.reset_index().sort_values(keys, kind="stable")
+            result = result.rename(columns={
+                "date": next(d for d in dimensions if self.resolve_dimension(d) == "date") if by_date else "date",
+                **{f"d{i}": name for name, i in grouped}
+            })
+        result = result.reset_index(drop=True)
+        if note:
+            result.attrs["note"] = note
+        logger.info(f"[Rollup] 预聚合表命中: {[m['name'] for m in event_metrics]} × {list(dimensions)}, {len(result)} 行")
+        return result
+
+
+_store: Optional[RollupStore] = None
+_store_lock = threading.Lock()
+
+
+def get_rollup_store() -> RollupStore:
+    """获取进程内共享的预聚合表"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RollupStore()
+        return _store
@@ -0,0 +1,295 @@
+"""
+根因分析模块
+
+在一个多维立方体查询结果（日期 × 维度1 × 维度2 ... × 指标）上本地计算：
+- 基准期 vs 对比期的指标变化
+- 各维度各取值对变化的贡献（解释力，Explanatory Power）
+- 各取值分布变化的意外度（Surprise，JS散度）
+
+算法参考 Adtributor（Bhagwan et al., NSDI 2014）：
+每个维度按意外度从高到低选取解释力超过阈值的取值，累计解释力达到阈值为止；
+维度按候选集合的总意外度排序。对排名第一的取值再在其余维度上递归一层，
+得到"国家=US → 渠道=ads"这样的多维路径。
+
+只适用于可加指标（次数、人数合计、金额等），比率类指标需拆成分子和分母
+"""
+
+from typing import Dict, List, Optional, Any, Tuple
+import pandas as pd
+import numpy as np
+
+from config.settings import get_settings
+from .utils import infer_time_column, infer_numeric_columns
+
+
+def _js_surprise(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """逐元素的JS散度项: 0.5 * (p·log(2p/(p+q)) + q·log(2q/(p+q)))，0·log0 记为0"""
+    m = p + q
+    with np.errstate(divide="ignore", invalid="ignore"):
+        term_p = np.where(p > 0, p * np.log(2 * p / m), 0.0)
+        term_q = np.where(q > 0, q * np.log(2 * q / m), 0.0)
+    return 0.5 * (term_p + term_q)
+
+
+class RootCauseAnalyzer:
+    """多维根因分析器（Adtributor）"""
+
+    def __init__(
+        self,
+        tep: Optional[float] = None,
+        teep: Optional[float] = None,
+        max_dimensions: Optional[int] = None,
+        max_depth: int = 2
+    ):
+        """
+        初始化根因分析器
+
+        Args:
+            tep: 候选集合需达到的累计解释力阈值（默认读取配置）
+            teep: 单个取值进入候选集合的最小解释力（默认读取配置）
+            max_dimensions: 返回的维度数上限（默认读取配置）
+            max_depth: 递归下钻的层数（1 表示只做单维度分析）
+        """
+        settings = get_settings()
+        self.tep = tep or settings.ROOT_CAUSE_TEP
+        self.teep = teep or settings.ROOT_CAUSE_TEEP
+        self.max_dimensions = max_dimensions or settings.ROOT_CAUSE_MAX_DIMENSIONS
+        self.max_depth = max_depth
+
+    # ========== 数据准备 ==========
+
+    @staticmethod
+    def split_periods(
+        dates: pd.Series,
+        current_days: Optional[int] = None
+    ) -> Tuple[pd.Series, pd.Series, Dict[str, str]]:
+        """
+        划分基准期和对比期
+
+        默认对比期为最后 min(7, 天数//2) 天，基准期为紧邻其前的相同天数
+
+        Args:
+            dates: 日期列
+            current_days: 对比期天数（可选）
+
+        Returns:
+            (基准期掩码, 对比期掩码, 区间描述)
+        """
+        days = pd.to_datetime(dates).dt.normalize()
+        unique_days = np.sort(days.dropna().unique())
+        if len(unique_days) < 2:
+            raise ValueError("至少需要两天的数据才能对比")
+
+        window = current_days or max(1, min(7, len(unique_days) // 2))
+        window = min(window, len(unique_days) // 2) or 1
+        current_set = unique_days[-window:]
+        baseline_set = unique_days[-2 * window:-window]
+
+        periods = {
+            "baseline": f"{pd.Timestamp(baseline_set[0]).date()} ~ {pd.Timestamp(baseline_set[-1]).date()}",
+            "current": f"{pd.Timestamp(current_set[0]).date()} ~ {pd.Timestamp(current_set[-1]).date()}",
+        }
+        return days.isin(baseline_set), days.isin(current_set), periods
+
+    # ========== 分析 ==========
+
+    def analyze(
+        self,
+        df: pd.DataFrame,
+        metric: Optional[str] = None,
+        dimensions: Optional[List[str]] = None,
+        time_column: Optional[str] = None,
+        current_days: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        对立方体结果做根因分析
+
+        Args:
+            df: 立方体查询结果（日期 × 维度 × 指标）
+            metric: 指标列（默认第一个数值列）
+            dimensions: 维度列（默认除日期和数值列外的所有列）
+            time_column: 日期列（默认自动推断）
+            current_days: 对比期天数（默认自动）
+
+        Returns:
+            根因分析结果
+        """
+        time_column = time_column or infer_time_column(df)
+        if time_column is None or time_column not in df.columns:
+            return {"status": "error", "message": "未找到日期列"}
+
+        numeric_cols = [c for c in infer_numeric_columns(df) if c != time_column]
+        metric = metric or (numeric_cols[0] if numeric_cols else None)
+        if metric is None or metric not in df.columns:
+            return {"status": "error", "message": "未找到指标列"}
+
+        if dimensions is None:
+            dimensions = [c for c in df.columns if c not in numeric_cols and c != time_column]
+        dimensions = [d for d in dimensions if d in df.columns and d != metric]
+        if not dimensions:
+            return {"status": "error", "message": "未找到维度列"}
+
+        try:
+            baseline_mask, current_mask, periods = self.split_periods(df[time_column], current_days)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+
+        values = pd.to_numeric(df[metric], errors="coerce").fillna(0.0)
+        frame = df[dimensions].fillna("(空)").astype(str)
+        frame["_baseline"] = np.where(baseline_mask, values, 0.0)
+        frame["_current"] = np.where(current_mask, values, 0.0)
+        frame = frame[baseline_mask | current_mask]
+
+        baseline_total = float(frame["_baseline"].sum())
+        current_total = float(frame["_current"].sum())
+        delta = current_total - baseline_total
+
+        result: Dict[str, Any] = {
+            "status": "success",
+            "metric": str(metric),
+            "periods": periods,
+            "baseline_total": baseline_total,
+            "current_total": current_total,
+            "delta": delta,
+            "delta_pct": delta / baseline_total * 100 if baseline_total else None,
+            "dimensions": [],
+            "drilldown": [],
+        }
+        if delta == 0:
+            result["description"] = "两期指标无变化，无需归因"
+            return result
+
+        ranked = self._rank_dimensions(frame, dimensions, delta)
+        result["dimensions"] = ranked[:self.max_dimensions]
+
+        # 在排名第一的取值内部对其余维度递归一层
+        if self.max_depth > 1 and ranked and ranked[0]["segments"]:
+            top_dim = ranked[0]["dimension"]
+            top_value = ranked[0]["segments"][0]["value"]
+            remaining = [d for d in dimensions if d != top_dim]
+            subset = frame[frame[top_dim] == top_value]
+            sub_delta = float(subset["_current"].sum() - subset["_baseline"].sum())
+            if remaining and sub_delta != 0:
+                for item in self._rank_dimensions(subset, remaining, sub_delta)[:1]:
+                    item["parent"] = {"dimension": top_dim, "value": top_value}
+                    # 相对整体变化的解释力
+                    for segment in item["segments"]:
+                        segment["overall_explanatory_power"] = segment["delta"] / delta
+                    result["drilldown"].append(item)
+
+        result["description"] = self._describe(result)
+        return result
+
+    def _rank_dimensions(self, frame: pd.DataFrame, dimensions: List[str], delta: float) -> List[Dict[str, Any]]:
+        """逐维度计算候选集合，按总意外度排序"""
+        baseline_total = frame["_baseline"].sum()
+        current_total = frame["_current"].sum()
+
+        ranked = []
+        for dim in dimensions:
+            grouped = frame.groupby(dim, sort=False, observed=True)[["_baseline", "_current"]].sum()
+            f = grouped["_baseline"].to_numpy()
+            a = grouped["_current"].to_numpy()
+
+            ep = (a - f) / delta
+            p = f / baseline_total if baseline_total else np.zeros(len(f))
+            q = a / current_total if current_total else np.zeros(len(a))
+            surprise = _js_surprise(p, q)
+
+            # 按意外度从高到低选取解释力超过阈值的取值，累计解释力达到阈值为止
+            order = np.argsort(-surprise, kind="stable")
+            chosen = []
+            cumulative = 0.0
+            for pos in order:
+                if ep[pos] < self.teep:
+                    continue
+                chosen.append(pos)
+                cumulative += ep[pos]
+                if cumulative >= self.tep:
+                    break
+            if not chosen:
+                continue
+
+            segments = [
+                {
+                    "value": str(grouped.index[pos]),
+                    "baseline": float(f[pos]),
+                    "current": float(a[pos]),
+                    "delta": float(a[pos] - f[pos]),
+                    "delta_pct": float((a[pos] - f[pos]) / f[pos] * 100) if f[pos] else None,
+                    "explanatory_power": float(ep[pos]),
+                    "surprise": float(surprise[pos]),
+                    "share_baseline": float(p[pos]),
+                    "share_current": float(q[pos]),
+                }
+                for pos in chosen
+            ]
+            ranked.append({
+                "dimension": str(dim),
+                "explanatory_power": float(cumulative),
+                "surprise": float(surprise[chosen].sum()),
+                "explains_fully": bool(cumulative >= self.tep),
+                "cardinality": int(len(grouped)),
+                "segments": segments,
+            })
+
+        ranked.sort(key=lambda x: (x["explains_fully"], x["surprise"]), reverse=True)
+        return ranked
+
+    @staticmethod
+    def _describe(result: Dict[str, Any]) -> str:
+        """一句话结论"""
+        direction = "上升" if result["delta"] > 0 else "下降"
+        pct = f"{abs(result['delta_pct']):.1f}%" if result.get("delta_pct") is not None else ""
+        if not result["dimensions"]:
+            return f"{result['metric']}{direction}{pct}，变化分散在各维度，未找到集中的贡献来源"
+
+        top = result["dimensions"][0]
+        causes = "、".join(
+            f"{top['dimension']}={s['value']}（贡献{s['explanatory_power'] * 100:.0f}%）"
+            for s in top["segments"][:3]
+        )
+        return f"{result['metric']}{direction}{pct}，主要由 {causes} 驱动"
+
+    def render(self, result: Dict[str, Any], max_segments: int = 3) -> str:
+        """
+        渲染为紧凑文本（供综合分析提示词使用）
+
+        Args:
+            result: analyze() 的返回值
+            max_segments: 每个维度展示的取值数
+
+        Returns:
+            文本
+        """
+        if result.get("status") != "success":
+            return f"根因分析失败: {result.get('message', '未知错误')}"
+
+        def fmt(value: Optional[float]) -> str:
+            return "-" if value is None else f"{value:+.1f}%"
+
+        lines = [
+            f"根因分析（{result['metric']}）: 基准期 {result['periods']['baseline']} = {result['baseline_total']:,.2f}, "
+            f"对比期 {result['periods']['current']} = {result['current_total']:,.2f}, "
+            f"变化 {result['delta']:+,.2f} ({fmt(result.get('delta_pct'))})",
+            f"结论: {result.get('description', '')}",
+        ]
+        for item in result["dimensions"]:
+            lines.append(
+                f"- 维度 {item['dimension']}: 解释力 {item['explanatory_power'] * 100:.0f}%, "
+                f"意外度 {item['surprise']:.3f}{'' if item['explains_fully'] else '（未完全解释）'}"
+            )
+            for s in item["segments"][:max_segments]:
+                lines.append(
+                    f"    {s['value']}: {s['baseline']:,.2f} → {s['current']:,.2f} ({fmt(s['delta_pct'])}), "
+                    f"贡献 {s['explanatory_power'] * 100:.0f}%, 占比 {s['share_baseline'] * 100:.1f}% → {s['share_current'] * 100:.1f}%"
+                )
+        for item in result.get("drilldown", []):
+            parent = item["parent"]
+            lines.append(f"- 下钻 {parent['dimension']}={parent['value']} → 维度 {item['dimension']}:")
+            for s in item["segments"][:max_segments]:
+                lines.append(
+                    f"    {s['value']}: {s['baseline']:,.2f} → {s['current']:,.2f} ({fmt(s['delta_pct'])}), "
+                    f"占整体变化 {s['overall_explanatory_power'] * 100:.0f}%"
+                )
+        return "\n".join(lines)
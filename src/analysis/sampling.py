@@ -0,0 +1,410 @@
+"""
+数据采样模块
+
+大数据集进入趋势/异常/统计分析前的采样，按数据形态选择策略：
+- time_bucket: 按时间桶聚合（同一时间点多行时可加指标按桶求和，不可加指标和单行时间点按桶求均值）
+- stratified: 按分组列分层采样（各分组按行数比例分配，每组至少保留一行）
+- reservoir: 蓄水池采样（随机键取最小的k个，可跨数据块合并，适用于流式输入）
+- lttb: Largest-Triangle-Three-Buckets，保留序列形状和尖峰
+
+每种策略都报告引入的误差（桶内偏差、95%置信区间半宽或插值偏差），
+供报告标注采样带来的不确定性
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Iterable
+import pandas as pd
+import numpy as np
+from loguru import logger
+
+from config.settings import get_settings
+from .cube import is_additive
+from .utils import infer_time_column, infer_numeric_columns
+
+
+STRATEGY_NAMES = {
+    "time_bucket": "时间桶聚合",
+    "stratified": "分层采样",
+    "reservoir": "蓄水池采样",
+    "lttb": "LTTB形状保持采样",
+}
+
+# 正态分布95%分位数
+Z_95 = 1.96
+
+# 时间桶宽度候选（取不小于 时间跨度/目标行数 的最小值，便于解读）
+BUCKET_WIDTHS = [
+    pd.Timedelta(v) for v in (
+        "1s", "5s", "15s", "30s", "1min", "5min", "15min", "30min",
+        "1h", "2h", "3h", "6h", "12h", "1D", "2D", "7D", "14D", "28D",
+    )
+]
+
+
+@dataclass
+class SampleResult:
+    """一次采样的结果"""
+    frame: pd.DataFrame
+    strategy: str
+    original_rows: int
+    error_bounds: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    details: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def sampled_rows(self) -> int:
+        return len(self.frame)
+
+    @property
+    def description(self) -> str:
+        """一句话说明（含误差）"""
+        text = (
+            f"数据量较大({self.original_rows}行)，使用{STRATEGY_NAMES.get(self.strategy, self.strategy)}"
+            f"缩减至{self.sampled_rows}行"
+        )
+        if self.details.get("bucket"):
+            text += f"（时间桶 {self.details['bucket']}）"
+
+        bounds = []
+        for column, bound in list(self.error_bounds.items())[:3]:
+            if "mean_ci95_pct" in bound:
+                bounds.append(f"{column}均值±{bound['mean_ci95_pct']:.1f}%")
+            elif "p95_interp_error_pct" in bound:
+                bounds.append(f"{column}插值偏差P95 {bound['p95_interp_error_pct']:.1f}%")
+            elif "point_error_pct" in bound:
+                bounds.append(f"{column}桶内平均偏差{bound['point_error_pct']:.1f}%")
+        if bounds:
+            text += "，误差: " + "，".join(bounds)
+        return text
+
+
+def _format_width(width: pd.Timedelta) -> str:
+    """时间桶宽度的中文表示"""
+    seconds = int(width.total_seconds())
+    for unit, name in ((86400, "天"), (3600, "小时"), (60, "分钟")):
+        if seconds % unit == 0:
+            return f"{seconds // unit}{name}"
+    return f"{seconds}秒"
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets 降采样
+
+    首尾点固定保留；中间每个桶选取与 上一个选中点、下一个桶均值点 构成三角形面积最大的点
+
+    Args:
+        x: 横坐标（升序）
+        y: 纵坐标
+        n_out: 输出点数
+
+    Returns:
+        选中点的位置（升序）
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (n_out - 2)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+class DataSampler:
+    """大数据集采样器"""
+
+    def __init__(self, max_rows: Optional[int] = None, seed: int = 0):
+        """
+        初始化采样器
+
+        Args:
+            max_rows: 采样后的目标行数（默认读取配置）
+            seed: 随机种子（随机类策略结果可复现）
+        """
+        self.max_rows = max_rows or get_settings().ANALYSIS_SAMPLE_MAX_ROWS
+        self.seed = seed
+
+    # ========== 策略选择 ==========
+
+    def choose_strategy(
+        self,
+        df: pd.DataFrame,
+        time_column: Optional[str] = None,
+        group_column: Optional[str] = None,
+        analysis_types: Optional[List[str]] = None
+    ) -> str:
+        """
+        根据数据形态选择采样策略
+
+        - 有时间列且同一时间点有多行（明细或多维度）: time_bucket（可加指标按桶求和，合计不变）
+        - 有时间列且每个时间点一行: 需要异常检测时用 lttb（保留尖峰），否则 time_bucket（均值无偏）
+        - 无时间列但有分组列: stratified
+        - 其他: reservoir
+        """
+        analysis_types = analysis_types or []
+        if time_column is not None and time_column in df.columns:
+            if df[time_column].duplicated().any():
+                return "time_bucket"
+            return "lttb" if "anomaly" in analysis_types else "time_bucket"
+        if group_column is not None and group_column in df.columns:
+            return "stratified"
+        return "reservoir"
+
+    def sample(
+        self,
+        df: pd.DataFrame,
+        metric_columns: Optional[List[str]] = None,
+        time_column: Optional[str] = None,
+        group_column: Optional[str] = None,
+        analysis_types: Optional[List[str]] = None,
+        strategy: Optional[str] = None
+    ) -> SampleResult:
+        """
+        采样（未超过目标行数时原样返回）
+
+        Args:
+            df: 数据
+            metric_columns: 指标列（默认所有数值列）
+            time_column: 时间列（默认自动推断）
+            group_column: 分组列（可选）
+            analysis_types: 后续要做的分析类型（影响策略选择）
+            strategy: 指定策略（可选）
+
+        Returns:
+            SampleResult
+        """
+        if len(df) <= self.max_rows:
+            return SampleResult(frame=df, strategy="none", original_rows=len(df))
+
+        time_column = time_column or infer_time_column(df)
+        metric_columns = metric_columns or [c for c in infer_numeric_columns(df) if c != time_column]
+        strategy = strategy or self.choose_strategy(df, time_column, group_column, analysis_types)
+
+        if strategy in ("time_bucket", "lttb") and (time_column is None or time_column not in df.columns):
+            strategy = "stratified" if group_column in df.columns else "reservoir"
+        if strategy == "stratified" and (group_column is None or group_column not in df.columns):
+            strategy = "reservoir"
+
+        if strategy == "time_bucket":
+            result = self.time_bucket(df, time_column, metric_columns)
+        elif strategy == "lttb":
+            result = self.lttb(df, time_column, metric_columns)
+        elif strategy == "stratified":
+            result = self.stratified(df, group_column, metric_columns)
+        else:
+            result = self.reservoir([df], metric_columns)
+
+        logger.info(f"[DataSampler] {result.description}")
+        return result
+
+    # ========== 策略实现 ==========
+
+    def time_bucket(self, df: pd.DataFrame, time_column: str, metric_columns: List[str]) -> SampleResult:
+        """
+        按时间桶聚合
+
+        同一时间点有多行时可加指标按桶求和（合计精确保持）；不可加指标（比率、人数等）
+        求和没有意义，与单行时间点的序列一样按桶求均值。
+        误差为各行相对所在桶均值的平均绝对偏差（占均值绝对值的百分比），即聚合抹掉的行间差异；
+        按桶求和的指标另外报告合计误差为0
+        """
+        times = pd.to_datetime(df[time_column])
+        values = df[metric_columns].apply(pd.to_numeric, errors="coerce")
+        duplicated = bool(times.duplicated().any())
+        aggregation = {column: "sum" if duplicated and is_additive(column) else "mean" for column in metric_columns}
+
+        n_times = times.nunique()
+        if n_times <= self.max_rows:
+            buckets = times
+            bucket = None
+        else:
+            span = times.max() - times.min()
+            candidates = [w for w in BUCKET_WIDTHS if w >= span / self.max_rows] or [BUCKET_WIDTHS[-1]]
+            for width in candidates:
+                buckets = times.dt.floor(width)
+                # 桶边界按整点对齐，桶数可能多出一个
+                if buckets.nunique() <= self.max_rows:
+                    break
+            bucket = _format_width(width)
+
+        grouped = values.groupby(buckets.rename(time_column))
+        sums, means = grouped.sum(), grouped.mean()
+        frame = pd.DataFrame({
+            column: sums[column] if aggregation[column] == "sum" else means[column] for column in metric_columns
+        }).sort_index().reset_index()
+
+        error_bounds = {}
+        if duplicated or bucket is not None:
+            deviation = (values - grouped.transform("mean")).abs().mean()
+            scale = values.abs().mean()
+            for column in metric_columns:
+                bound = {"total_error_pct": 0.0} if aggregation[column] == "sum" else {}
+                if scale[column] > 0:
+                    bound["point_error_pct"] = float(deviation[column] / scale[column] * 100)
+                if bound:
+                    error_bounds[str(column)] = bound
+
+        return SampleResult(
+            frame=frame,
+            strategy="time_bucket",
+            original_rows=len(df),
+            error_bounds=error_bounds,
+            details={"bucket": bucket, "aggregation": aggregation},
+        )
+
+    def lttb(self, df: pd.DataFrame, time_column: str, metric_columns: List[str]) -> SampleResult:
+        """
+        LTTB采样（按时间排序；多个指标各分配一份点数后取并集）
+
+        误差为各点相对选中点线性插值的偏差（占值域的百分比，P95和最大值；
+        尖峰附近的插值偏差会拉高最大值，报告使用P95）
+        """
+        ordered = df.assign(_time=pd.to_datetime(df[time_column])).sort_values("_time", kind="stable")
+        x = ordered["_time"].to_numpy().astype("int64").astype(float)
+        budget = max(3, self.max_rows // max(len(metric_columns), 1))
+
+        keep = set()
+        series = {}
+        for column in metric_columns:
+            y = pd.to_numeric(ordered[column], errors="coerce").to_numpy(dtype=float)
+            if np.isnan(y).any():
+                y = pd.Series(y).interpolate(limit_direction="both").fillna(0.0).to_numpy()
+            series[column] = y
+            keep.update(lttb_indices(x, y, budget).tolist())
+
+        positions = np.array(sorted(keep))
+        error_bounds = {}
+        for column, y in series.items():
+            value_range = float(np.ptp(y))
+            if value_range > 0:
+                error = np.abs(y - np.interp(x, x[positions], y[positions])) / value_range * 100
+                error_bounds[str(column)] = {
+                    "p95_interp_error_pct": float(np.percentile(error, 95)),
+                    "max_interp_error_pct": float(error.max()),
+                }
+
+        frame = ordered.iloc[positions].drop(columns="_time")
+        return SampleResult(
+            frame=frame,
+            strategy="lttb",
+            original_rows=len(df),
+            error_bounds=error_bounds,
+        )
+
+    def stratified(self, df: pd.DataFrame, group_column: str, metric_columns: List[str]) -> SampleResult:
+        """
+        分层采样（按比例分配，每组至少一行；组内随机且保持原有顺序）
+
+        误差为分层估计总体均值的95%置信区间半宽（占均值的百分比）
+        """
+        codes, uniques = pd.factorize(df[group_column].astype(str))
+        if len(uniques) > self.max_rows:
+            # 分组数超过目标行数时无法每组保留一行
+            return self.reservoir([df], metric_columns)
+
+        sizes = np.bincount(codes, minlength=len(uniques))
+        allocation = np.maximum(1, np.floor(sizes / len(df) * self.max_rows)).astype(np.int64)
+        allocation = np.minimum(allocation, sizes)
+
+        rng = np.random.default_rng(self.seed)
+        order = np.lexsort((rng.random(len(df)), codes))
+        sorted_codes = codes[order]
+        group_start = np.r_[0, np.cumsum(sizes)[:-1]]
+        rank = np.arange(len(df)) - group_start[sorted_codes]
+        chosen = np.sort(order[rank < allocation[sorted_codes]])
+
+        error_bounds = {}
+        weights = sizes / len(df)
+        fpc = np.where(sizes > 1, (sizes - allocation) / np.maximum(sizes - 1, 1), 0.0)
+        for column in metric_columns:
+            values = pd.to_numeric(df[column], errors="coerce")
+            variances = values.groupby(codes).var(ddof=1).reindex(range(len(uniques))).fillna(0.0).to_numpy()
+            se = np.sqrt(np.sum(weights ** 2 * fpc * variances / allocation))
+            mean = values.mean()
+            if mean:
+                error_bounds[str(column)] = {"mean_ci95_pct": float(Z_95 * se / abs(mean) * 100)}
+
+        return SampleResult(
+            frame=df.iloc[chosen],
+            strategy="stratified",
+            original_rows=len(df),
+            error_bounds=error_bounds,
+            details={"groups": int(len(uniques))},
+        )
+
+    def reservoir(self, chunks: Iterable[pd.DataFrame], metric_columns: Optional[List[str]] = None) -> SampleResult:
+        """
+        蓄水池采样（给每行一个随机键，保留键最小的 max_rows 行；逐块合并，内存只占用 max_rows 行）
+
+        误差为简单随机样本均值的95%置信区间半宽（占均值的百分比，含有限总体校正）
+
+        Args:
+            chunks: 数据块序列（单个DataFrame传入 [df]）
+            metric_columns: 指标列（用于误差估计）
+        """
+        rng = np.random.default_rng(self.seed)
+        reservoir: Optional[pd.DataFrame] = None
+        keys = np.empty(0)
+        total = 0
+        offset = 0
+        # 流式累计各指标的和与平方和（用于总体方差）
+        sums: Dict[str, List[float]] = {}
+
+        for chunk in chunks:
+            chunk_keys = rng.random(len(chunk))
+            total += len(chunk)
+            for column in metric_columns or []:
+                values = pd.to_numeric(chunk[column], errors="coerce").dropna().to_numpy(dtype=float)
+                acc = sums.setdefault(column, [0.0, 0.0, 0.0])
+                acc[0] += len(values)
+                acc[1] += values.sum()
+                acc[2] += np.square(values).sum()
+
+            candidate = chunk.assign(_order=np.arange(offset, offset + len(chunk)))
+            offset += len(chunk)
+            if reservoir is not None:
+                candidate = pd.concat([reservoir, candidate])
+                chunk_keys = np.concatenate([keys, chunk_keys])
+            if len(candidate) > self.max_rows:
+                keep = np.argpartition(chunk_keys, self.max_rows - 1)[:self.max_rows]
+                candidate = candidate.iloc[keep]
+                chunk_keys = chunk_keys[keep]
+            reservoir, keys = candidate, chunk_keys
+
+        if reservoir is None:
+            return SampleResult(frame=pd.DataFrame(), strategy="reservoir", original_rows=0)
+
+        frame = reservoir.sort_values("_order").drop(columns="_order")
+        n = len(frame)
+        error_bounds = {}
+        for column, (count, total_sum, total_sq) in sums.items():
+            if count < 2:
+                continue
+            mean = total_sum / count
+            variance = max(total_sq / count - mean ** 2, 0.0) * count / (count - 1)
+            fpc = (total - n) / (total - 1) if total > 1 else 0.0
+            se = np.sqrt(variance / n * fpc)
+            if mean:
+                error_bounds[str(column)] = {"mean_ci95_pct": float(Z_95 * se / abs(mean) * 100)}
+
+        return SampleResult(
+            frame=frame,
+            strategy="reservoir",
+            original_rows=total,
+            error_bounds=error_bounds,
+        )
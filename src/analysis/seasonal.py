@@ -0,0 +1,447 @@
+"""
+季节分解模块
+
+使用 STL（单一周期）或 MSTL（多周期）将时间序列分解为 趋势 + 季节 + 残差：
+- 日粒度序列按周（7天）分解，小时粒度序列按日（24）及周（168）分解
+- 拟合结果按序列缓存；同一序列追加新数据时只重新拟合末尾窗口并拼接
+- 基于残差的异常评分和基于去季节化序列的趋势，避免周末等固定周期被误判
+
+供 TrendAnalyzer / AnomalyDetector 使用
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Sequence, Tuple
+import pandas as pd
+import numpy as np
+from loguru import logger
+from statsmodels.tsa.seasonal import STL, MSTL
+
+from config.settings import get_settings
+
+
+# 缺失时间点占比超过该值时不做分解（避免插值主导结果）
+MAX_MISSING_RATIO = 0.1
+
+# MAD换算为标准差的系数（正态分布下）
+MAD_SCALE = 1.4826
+
+# STL季节平滑窗口（默认7过于灵活，会把噪声吸收进季节分量，使残差尺度偏小、误报增多）
+STL_SEASONAL_WINDOW = 13
+
+# 残差异常评分至少需要的完整周期数（周期太少时残差MAD明显低估噪声尺度，误报增多）
+MIN_ANOMALY_CYCLES = 8
+
+# 截尾迭代拟合：把原始值截到 拟合值 ± CLIP_K 倍残差尺度 后重新拟合，直到拟合值的变化
+# 小于 CLIP_TOLERANCE 倍残差尺度（最多 CLIP_MAX_ITERATIONS 轮），单个尖峰不会泄漏到趋势和季节分量
+CLIP_K = 3.5
+CLIP_TOLERANCE = 0.01
+CLIP_MAX_ITERATIONS = 10
+
+# 增量重拟合：重新拟合末尾（新增点 + N个周期），丢弃窗口开头M个周期的边缘效应后与缓存拼接
+REFIT_TAIL_PERIODS = 16
+REFIT_DISCARD_PERIODS = 5
+
+
+@dataclass
+class SeasonalFit:
+    """一次季节分解的结果（规则时间网格上）"""
+    index: pd.DatetimeIndex
+    values: np.ndarray
+    trend: np.ndarray
+    seasonal: np.ndarray
+    resid: np.ndarray
+    periods: Tuple[int, ...]
+    digest: str
+
+    @property
+    def method(self) -> str:
+        return "MSTL" if len(self.periods) > 1 else "STL"
+
+    @property
+    def deseasonalized(self) -> np.ndarray:
+        return self.values - self.seasonal
+
+
+class SeasonalDecomposer:
+    """季节分解器（带缓存和增量重拟合）"""
+
+    def __init__(self, cache_size: Optional[int] = None):
+        """
+        初始化季节分解器
+
+        Args:
+            cache_size: 缓存的序列数上限（默认读取配置）
+        """
+        self.cache_size = cache_size or get_settings().SEASONAL_CACHE_SIZE
+        self._cache: "OrderedDict[str, SeasonalFit]" = OrderedDict()
+        self._by_digest: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    # ========== 数据准备 ==========
+
+    @staticmethod
+    def infer_periods(step: pd.Timedelta, length: int) -> Optional[Tuple[int, ...]]:
+        """
+        根据采样间隔推断季节周期
+
+        Args:
+            step: 时间间隔
+            length: 序列长度
+
+        Returns:
+            周期元组；数据不足两个完整周期或粒度不支持时返回None
+        """
+        if step == pd.Timedelta(days=1):
+            candidates = (7,)
+        elif step == pd.Timedelta(hours=1):
+            candidates = (24, 168)
+        else:
+            return None
+
+        periods = tuple(p for p in candidates if length >= 2 * p)
+        return periods or None
+
+    def prepare(
+        self,
+        data: pd.Series,
+        time_index: Optional[pd.Series]
+    ) -> Optional[Tuple[pd.Series, np.ndarray]]:
+        """
+        将数据整理为规则时间网格上的序列
+
+        Args:
+            data: 数值序列
+            time_index: 时间索引
+
+        Returns:
+            (规则网格序列, 原始各点在网格中的位置)；无法整理时返回None
+        """
+        values = pd.to_numeric(pd.Series(np.asarray(data)), errors="coerce").to_numpy(dtype=float)
+        prepared = self.prepare_matrix(values[:, None], time_index)
+        if prepared is None or not prepared[3][0]:
+            return None
+        grid, regular, positions, _ = prepared
+        return pd.Series(regular[:, 0], index=grid), positions
+
+    def prepare_matrix(
+        self,
+        values: np.ndarray,
+        time_index: Optional[pd.Series]
+    ) -> Optional[Tuple[pd.DatetimeIndex, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        将多条共用时间索引的序列整理到同一规则时间网格（网格只建立一次）
+
+        Args:
+            values: T × K 矩阵（行与 time_index 对齐）
+            time_index: 时间索引
+
+        Returns:
+            (网格, 网格上的 G × K 矩阵, 原始各点在网格中的位置, 各列能否分解)；
+            时间索引无法整理时返回None。含缺失值或为常数（没有可分解的季节性）的列不能分解
+        """
+        if time_index is None or len(values) < 14:
+            return None
+
+        times = pd.DatetimeIndex(pd.to_datetime(np.asarray(time_index)))
+        if len(times) != len(values) or times.has_duplicates or times.hasnans:
+            return None
+
+        step = pd.Series(times.sort_values()).diff().dropna().median()
+        if pd.isna(step) or step <= pd.Timedelta(0):
+            return None
+
+        grid = pd.date_range(times.min(), times.max(), freq=step)
+        if len(grid) == 0 or (len(grid) - len(times)) / len(grid) > MAX_MISSING_RATIO:
+            return None
+        positions = grid.get_indexer(times)
+        if (positions < 0).any():
+            return None
+
+        with np.errstate(invalid="ignore"):
+            usable = np.ptp(values, axis=0) > 0
+        regular = np.full((len(grid), values.shape[1]), np.nan)
+        regular[positions] = values
+        if len(grid) > len(times):
+            regular = pd.DataFrame(regular).interpolate(method="linear").to_numpy()
+        return grid, regular, positions, usable
+
+    def is_applicable(
+        self,
+        data: pd.Series,
+        time_index: Optional[pd.Series],
+        min_cycles: int = 2
+    ) -> bool:
+        """
+        序列能否做季节分解（规则的日/小时粒度）
+
+        Args:
+            data: 数值序列
+            time_index: 时间索引
+            min_cycles: 最短周期至少需要的完整周期数（异常检测使用 MIN_ANOMALY_CYCLES）
+        """
+        prepared = self.prepare(data, time_index)
+        if prepared is None:
+            return False
+        regular = prepared[0]
+        periods = self.infer_periods(regular.index[1] - regular.index[0], len(regular))
+        return periods is not None and len(regular) >= min_cycles * min(periods)
+
+    # ========== 拟合 ==========
+
+    @staticmethod
+    def _digest(series: pd.Series) -> str:
+        hasher = hashlib.md5()
+        hasher.update(series.index.asi8.tobytes())
+        hasher.update(series.to_numpy(dtype=float).tobytes())
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _fit_once(values: np.ndarray, periods: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray]:
+        """执行一次普通STL/MSTL拟合，返回 (trend, seasonal)"""
+        if len(periods) == 1:
+            result = STL(values, period=periods[0], seasonal=STL_SEASONAL_WINDOW).fit()
+            seasonal = np.asarray(result.seasonal)
+        else:
+            result = MSTL(values, periods=periods).fit()
+            seasonal = np.asarray(result.seasonal)
+            if seasonal.ndim > 1:
+                seasonal = seasonal.sum(axis=1)
+        return np.asarray(result.trend), seasonal
+
+    @classmethod
+    def _fit(cls, values: np.ndarray, periods: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        截尾迭代的STL/MSTL拟合，返回 (trend, seasonal, resid)，残差为原始值减拟合值
+
+        普通拟合会让单个尖峰泄漏到相邻点和同周期位置的分量里（造成一串误报）；
+        statsmodels 的稳健拟合在正态噪声上残差也呈厚尾，按MAD评分时误报偏多。
+        这里每轮把原始值截到 拟合值 ± CLIP_K 倍残差MAD尺度 再普通拟合（Huber型M估计）：
+        尖峰的影响被限制在截尾值以内，正常点几乎不被截尾，残差仍接近正态。
+        没有点被截尾时只拟合一次
+        """
+        trend, seasonal = cls._fit_once(values, periods)
+        for _ in range(CLIP_MAX_ITERATIONS):
+            fitted = trend + seasonal
+            resid = values - fitted
+            median = float(np.median(resid))
+            scale = MAD_SCALE * float(np.median(np.abs(resid - median)))
+            if scale <= 0:
+                break
+            clipped = np.clip(values, fitted + median - CLIP_K * scale, fitted + median + CLIP_K * scale)
+            if np.array_equal(clipped, values):
+                break
+            trend, seasonal = cls._fit_once(clipped, periods)
+            if np.max(np.abs(trend + seasonal - fitted)) <= CLIP_TOLERANCE * scale:
+                break
+        return trend, seasonal, values - trend - seasonal
+
+    def decompose(self, series: pd.Series, key: Optional[str] = None) -> Optional[SeasonalFit]:
+        """
+        分解规则时间网格上的序列（带缓存）
+
+        - 内容完全相同：直接返回缓存
+        - 同一key且旧数据是新数据的前缀：只重新拟合末尾窗口，之前的分量沿用缓存
+        - 其他情况：完整拟合
+
+        Args:
+            series: 规则时间网格上的序列（prepare() 的返回值）
+            key: 序列标识（如指标名）；不提供时只按内容缓存
+
+        Returns:
+            SeasonalFit；周期无法确定时返回None
+        """
+        step = series.index[1] - series.index[0] if len(series) > 1 else None
+        periods = self.infer_periods(step, len(series)) if step is not None else None
+        if periods is None:
+            return None
+
+        digest = self._digest(series)
+        key = key or digest
+        with self._lock:
+            cached_key = self._by_digest.get(digest)
+            if cached_key in self._cache:
+                self._cache.move_to_end(cached_key)
+                return self._cache[cached_key]
+            previous = self._cache.get(key)
+
+        values = series.to_numpy(dtype=float)
+        fit = None
+        if previous is not None and previous.periods == periods:
+            fit = self._refit_tail(previous, series, values, periods, digest)
+        if fit is None:
+            trend, seasonal, resid = self._fit(values, periods)
+            fit = SeasonalFit(series.index, values, trend, seasonal, resid, periods, digest)
+            logger.debug(f"[SeasonalDecomposer] 完整拟合 {key[:32]}: {len(values)} 点, 周期 {periods}")
+
+        self._store(key, fit)
+        return fit
+
+    def _refit_tail(
+        self,
+        previous: SeasonalFit,
+        series: pd.Series,
+        values: np.ndarray,
+        periods: Tuple[int, ...],
+        digest: str
+    ) -> Optional[SeasonalFit]:
+        """追加数据时的增量拟合：只重新拟合末尾窗口，丢弃窗口开头的边缘效应后拼接"""
+        old_len = len(previous.values)
+        appended = len(values) - old_len
+        if appended <= 0 or not series.index[:old_len].equals(previous.index):
+            return None
+        if not np.array_equal(values[:old_len], previous.values):
+            return None
+
+        period = max(periods)
+        start = len(values) - (appended + REFIT_TAIL_PERIODS * period)
+        if start < REFIT_DISCARD_PERIODS * period:
+            return None
+        cut = start + REFIT_DISCARD_PERIODS * period
+
+        trend, seasonal, resid = self._fit(values[start:], periods)
+        offset = cut - start
+        logger.debug(f"[SeasonalDecomposer] 增量拟合: 新增 {appended} 点, 重新拟合末尾 {len(values) - start} 点")
+        return SeasonalFit(
+            index=series.index,
+            values=values,
+            trend=np.concatenate([previous.trend[:cut], trend[offset:]]),
+            seasonal=np.concatenate([previous.seasonal[:cut], seasonal[offset:]]),
+            resid=np.concatenate([previous.resid[:cut], resid[offset:]]),
+            periods=periods,
+            digest=digest,
+        )
+
+    def _store(self, key: str, fit: SeasonalFit):
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._by_digest.pop(old.digest, None)
+            self._cache[key] = fit
+            self._by_digest[fit.digest] = key
+            while len(self._cache) > self.cache_size:
+                _, evicted = self._cache.popitem(last=False)
+                self._by_digest.pop(evicted.digest, None)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._cache.clear()
+            self._by_digest.clear()
+
+    # ========== 分析 ==========
+
+    def fit_series(
+        self,
+        data: pd.Series,
+        time_index: Optional[pd.Series],
+        key: Optional[str] = None
+    ) -> Optional[Tuple[SeasonalFit, np.ndarray]]:
+        """
+        整理并分解序列
+
+        Returns:
+            (SeasonalFit, 原始各点在网格中的位置)；不适用时返回None
+        """
+        values = pd.to_numeric(pd.Series(np.asarray(data)), errors="coerce").to_numpy(dtype=float)
+        return self.fit_matrix(values[:, None], time_index, [key])[0]
+
+    def fit_matrix(
+        self,
+        values: np.ndarray,
+        time_index: Optional[pd.Series],
+        keys: Sequence[Optional[str]]
+    ) -> List[Optional[Tuple[SeasonalFit, np.ndarray]]]:
+        """
+        整理并逐列分解共用时间索引的多条序列（时间网格只建立一次），逐列结果与 fit_series 一致
+
+        Args:
+            values: T × K 矩阵
+            time_index: 时间索引
+            keys: 各列的序列标识
+
+        Returns:
+            每列一个 (SeasonalFit, 原始各点在网格中的位置)；不适用的列为None
+        """
+        prepared = self.prepare_matrix(values, time_index)
+        if prepared is None:
+            return [None] * values.shape[1]
+        grid, regular, positions, usable = prepared
+
+        results: List[Optional[Tuple[SeasonalFit, np.ndarray]]] = []
+        for j, key in enumerate(keys):
+            fit = None
+            if usable[j]:
+                try:
+                    fit = self.decompose(pd.Series(regular[:, j], index=grid), key=key)
+                except Exception as e:
+                    logger.warning(f"[SeasonalDecomposer] 季节分解失败: {e}")
+            results.append((fit, positions) if fit is not None else None)
+        return results
+
+    @staticmethod
+    def _strength(component: np.ndarray, resid: np.ndarray) -> float:
+        total = np.var(component + resid)
+        return float(max(0.0, 1 - np.var(resid) / total)) if total > 0 else 0.0
+
+    def summarize(self, fit: SeasonalFit) -> Dict[str, Any]:
+        """
+        分解结果摘要（季节强度、趋势强度、最近一个周期的季节振幅）
+
+        强度定义: F = max(0, 1 - Var(残差) / Var(分量 + 残差))
+        """
+        seasonal_strength = self._strength(fit.seasonal, fit.resid)
+        trend_strength = self._strength(fit.trend, fit.resid)
+
+        period = min(fit.periods)
+        recent = fit.seasonal[-period:]
+        amplitude = float(recent.max() - recent.min())
+
+        if seasonal_strength >= 0.6:
+            level = "明显"
+        elif seasonal_strength >= 0.3:
+            level = "中等"
+        else:
+            level = "较弱"
+        cycle = "周" if fit.periods == (7,) else "日/周" if len(fit.periods) > 1 else "日"
+
+        return {
+            "available": True,
+            "method": fit.method,
+            "periods": list(fit.periods),
+            "seasonal_strength": seasonal_strength,
+            "trend_strength": trend_strength,
+            "seasonal_amplitude": amplitude,
+            "description": f"{cycle}周期{level}（季节强度{seasonal_strength:.2f}，振幅{amplitude:.2f}）"
+        }
+
+    def residual_scores(self, fit: SeasonalFit) -> Tuple[np.ndarray, float, float]:
+        """
+        残差的稳健Z分数
+
+        Returns:
+            (|稳健Z|, 残差中位数, 残差尺度)
+        """
+        median = float(np.median(fit.resid))
+        mad = float(np.median(np.abs(fit.resid - median)))
+        scale = MAD_SCALE * mad
+        if scale <= 0:
+            scale = float(np.std(fit.resid))
+        if scale <= 0:
+            return np.zeros(len(fit.resid)), median, 0.0
+        return np.abs(fit.resid - median) / scale, median, scale
+
+
+_decomposer: Optional[SeasonalDecomposer] = None
+_decomposer_lock = threading.Lock()
+
+
+def get_seasonal_decomposer() -> SeasonalDecomposer:
+    """获取进程内共享的季节分解器（TrendAnalyzer 和 AnomalyDetector 共用缓存）"""
+    global _decomposer
+    with _decomposer_lock:
+        if _decomposer is None:
+            _decomposer = SeasonalDecomposer()
+        return _decomposer
@@ -6,6 +6,8 @@
 - 分布分析
 - 期间对比
 - 分组统计
+
+基础统计、分组统计和百分位排名都走 stats_kernel：每个序列/分组只排序一次
 """
 
 from typing import Dict, List, Optional, Any, Union
@@ -13,6 +15,12 @@ import pandas as pd
 import numpy as np
 from scipy import stats
 
+from config.settings import get_settings
+from .stats_kernel import summarize, grouped_summary, sketch_summary
+
+# 近似统计时每次送入草图的块大小
+SKETCH_CHUNK_ROWS = 1_000_000
+
 
 class StatisticsAnalyzer:
     """统计分析器"""
@@ -21,15 +29,16 @@ class StatisticsAnalyzer:
         """初始化统计分析器"""
         pass
 
-    def calculate_basic_stats(self, data: pd.Series) -> Dict[str, Any]:
+    def calculate_basic_stats(self, data: pd.Series, approximate: Optional[bool] = None) -> Dict[str, Any]:
         """
         计算基础统计量
 
         Args:
             data: 数值序列
+            approximate: 是否使用KLL近似分位数（None时超过 STATS_SKETCH_THRESHOLD 行自动启用）
 
         Returns:
-            基础统计结果
+            基础统计结果（近似时 approximate=True，不计算众数）
         """
         if len(data) == 0:
             return {"error": "数据为空"}
@@ -40,23 +49,33 @@ class StatisticsAnalyzer:
         if len(clean_data) == 0:
             return {"error": "有效数据为空"}
 
+        values = clean_data.to_numpy(dtype=float)
+        if approximate is None:
+            approximate = len(values) > get_settings().STATS_SKETCH_THRESHOLD
+
+        if approximate:
+            return self._approximate_basic_stats(values)
+
+        summary = summarize(values, (0.25, 0.50, 0.75))
+        q25, q50, q75 = (float(q) for q in summary.quantiles)
+
         result = {
-            "count": len(clean_data),
-            "mean": float(clean_data.mean()),
-            "median": float(clean_data.median()),
-            "mode": float(clean_data.mode().iloc[0]) if len(clean_data.mode()) > 0 else None,
-            "std": float(clean_data.std()),
-            "variance": float(clean_data.var()),
-            "min": float(clean_data.min()),
-            "max": float(clean_data.max()),
-            "range": float(clean_data.max() - clean_data.min()),
-            "sum": float(clean_data.sum()),
+            "count": summary.count,
+            "mean": float(summary.mean),
+            "median": float(summary.median),
+            "mode": float(summary.mode),
+            "std": float(summary.std),
+            "variance": float(summary.var),
+            "min": float(summary.minimum),
+            "max": float(summary.maximum),
+            "range": float(summary.maximum - summary.minimum),
+            "sum": float(summary.total),
             "quantiles": {
-                "q25": float(clean_data.quantile(0.25)),
-                "q50": float(clean_data.quantile(0.50)),
-                "q75": float(clean_data.quantile(0.75)),
+                "q25": q25,
+                "q50": q50,
+                "q75": q75,
             },
-            "iqr": float(clean_data.quantile(0.75) - clean_data.quantile(0.25))
+            "iqr": q75 - q25
         }
 
         # 计算变异系数
@@ -65,6 +84,40 @@ class StatisticsAnalyzer:
 
         return result
 
+    def _approximate_basic_stats(self, values: np.ndarray) -> Dict[str, Any]:
+        """分块流式计算矩和KLL分位数（不整体排序）"""
+        chunks = (
+            values[start:start + SKETCH_CHUNK_ROWS]
+            for start in range(0, len(values), SKETCH_CHUNK_ROWS)
+        )
+        summary = sketch_summary(chunks, (0.25, 0.50, 0.75), k=get_settings().STATS_SKETCH_K)
+        q25, q50, q75 = (float(q) for q in summary["quantiles"])
+
+        result = {
+            "count": summary["count"],
+            "mean": float(summary["mean"]),
+            "median": q50,
+            "mode": None,
+            "std": summary["std"],
+            "variance": float(summary["var"]),
+            "min": summary["min"],
+            "max": summary["max"],
+            "range": summary["max"] - summary["min"],
+            "sum": summary["sum"],
+            "quantiles": {
+                "q25": q25,
+                "q50": q50,
+                "q75": q75,
+            },
+            "iqr": q75 - q25,
+            "approximate": True
+        }
+
+        if result["mean"] != 0:
+            result["coefficient_of_variation"] = result["std"] / result["mean"]
+
+        return result
+
     def calculate_distribution_metrics(self, data: pd.Series) -> Dict[str, Any]:
         """
         计算分布特征
@@ -212,10 +265,11 @@ class StatisticsAnalyzer:
         if value_column not in data.columns:
             return {"error": f"数值列不存在: {value_column}"}
 
-        # 分组统计
-        grouped = data.groupby(groupby_column)[value_column].agg([
-            'count', 'mean', 'median', 'sum', 'std', 'min', 'max'
-        ])
+        # 分组统计（一次排序得到所有分组的中位数和最值）
+        codes, groups = pd.factorize(data[groupby_column], sort=True)
+        keep = codes >= 0
+        values = data[value_column].to_numpy(dtype=float)
+        grouped = grouped_summary(codes[keep], values[keep], len(groups), (0.5,))
 
         # 转换为字典
         result = {
@@ -224,16 +278,16 @@ class StatisticsAnalyzer:
             "segments": []
         }
 
-        for group_name, row in grouped.iterrows():
+        for i, group_name in enumerate(groups):
             result["segments"].append({
                 "group": str(group_name),
-                "count": int(row['count']),
-                "mean": float(row['mean']),
-                "median": float(row['median']),
-                "sum": float(row['sum']),
-                "std": float(row['std']) if not pd.isna(row['std']) else 0,
-                "min": float(row['min']),
-                "max": float(row['max'])
+                "count": int(grouped["count"][i]),
+                "mean": float(grouped["mean"][i]),
+                "median": float(grouped["quantiles"][0, i]),
+                "sum": float(grouped["sum"][i]),
+                "std": float(grouped["std"][i]) if not np.isnan(grouped["std"][i]) else 0,
+                "min": float(grouped["min"][i]),
+                "max": float(grouped["max"][i])
             })
 
         # 找到最大和最小的组
@@ -330,6 +384,9 @@ class StatisticsAnalyzer:
 
         clean_data = data.dropna()
 
+        if len(clean_data) == 0:
+            return {"error": "有效数据为空"}
+
         if values is None:
             # 计算所有值的百分位排名
             ranks = clean_data.rank(pct=True)
@@ -337,10 +394,12 @@ class StatisticsAnalyzer:
                 "percentile_ranks": ranks.to_dict() if len(ranks) <= 100 else {}
             }
         else:
-            # 计算指定值的百分位排名
+            # 计算指定值的百分位排名（排序一次，二分查找小于该值的个数）
+            ordered = np.sort(clean_data.to_numpy(dtype=float))
+            below = np.searchsorted(ordered, np.asarray(values, dtype=float), side="left")
             results = []
-            for value in values:
-                rank = (clean_data < value).sum() / len(clean_data)
+            for value, count in zip(values, below):
+                rank = count / len(ordered) if not pd.isna(value) else 0.0
                 results.append({
                     "value": value,
                     "percentile_rank": float(rank * 100),
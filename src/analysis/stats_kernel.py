@@ -0,0 +1,330 @@
+"""
+统计计算内核
+
+StatisticsAnalyzer / BatchAnalyzer 共用的单次遍历统计：
+- 每个序列（或每个分组）只排序一次，分位数、中位数、众数、最值都从排序结果读取
+- 均值/方差按 numpy 的两遍算法计算（与 pandas 结果一致）；流式输入用 Welford/Chan 合并
+- 分组统计一次 lexsort 完成所有分组，不逐组循环
+- 超大或流式输入可使用 KLL 近似分位数草图（内存有界、可合并）
+
+分位数插值与 numpy/pandas 的 linear 方法逐位一致
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Sequence
+import numpy as np
+
+
+def quantiles_from_sorted(sorted_values: np.ndarray, qs: Sequence[float]) -> np.ndarray:
+    """
+    从已排序数组读取分位数（linear插值，与 np.quantile 一致）
+
+    Args:
+        sorted_values: 沿 axis 0 升序排列的数组（1维或2维）
+        qs: 分位点
+
+    Returns:
+        形状为 (len(qs), ...) 的分位数
+    """
+    n = sorted_values.shape[0]
+    qs = np.asarray(qs, dtype=float)
+    # 与 numpy 的 _compute_virtual_index(alpha=1, beta=1) 相同的浮点运算顺序
+    virtual = n * qs + (1 + qs * (1 - 1 - 1)) - 1
+    lower = np.floor(virtual).astype(np.int64)
+    gamma = virtual - lower
+    lower = np.clip(lower, 0, n - 1)
+    upper = np.clip(lower + 1, 0, n - 1)
+
+    below = sorted_values[lower]
+    above = sorted_values[upper]
+    gamma = gamma.reshape((-1,) + (1,) * (sorted_values.ndim - 1))
+    diff = above - below
+    return np.where(gamma >= 0.5, above - diff * (1 - gamma), below + diff * gamma)
+
+
+def mode_from_sorted(sorted_values: np.ndarray) -> np.ndarray:
+    """
+    从已排序数组读取众数（出现次数相同时取最小值，与 pandas/scipy 一致）
+
+    Args:
+        sorted_values: 沿 axis 0 升序排列的数组（1维或2维）
+
+    Returns:
+        众数（1维输入返回0维数组）
+    """
+    column = sorted_values.reshape(sorted_values.shape[0], -1)
+    n, k = column.shape
+    modes = np.empty(k)
+    for j in range(k):
+        values = column[:, j]
+        starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+        runs = np.diff(np.r_[starts, n])
+        modes[j] = values[starts[np.argmax(runs)]]
+    return modes.reshape(sorted_values.shape[1:])
+
+
+@dataclass
+class SortedSummary:
+    """一次排序得到的汇总统计（逐列）"""
+    count: int
+    mean: np.ndarray
+    std: np.ndarray
+    var: np.ndarray
+    total: np.ndarray
+    minimum: np.ndarray
+    maximum: np.ndarray
+    median: np.ndarray
+    mode: np.ndarray
+    quantiles: np.ndarray
+
+
+def summarize(values: np.ndarray, qs: Sequence[float] = (0.25, 0.5, 0.75), ddof: int = 1) -> SortedSummary:
+    """
+    单次排序的汇总统计
+
+    Args:
+        values: 无缺失的数值（1维或 n×k 的2维，按列统计）
+        qs: 分位点
+        ddof: 方差自由度
+
+    Returns:
+        SortedSummary（1维输入时各字段为0维数组）
+    """
+    n = values.shape[0]
+    ordered = np.sort(values, axis=0)
+    total = values.sum(axis=0)
+    mean = values.mean(axis=0)
+    if n > ddof:
+        var = values.var(axis=0, ddof=ddof)
+    else:
+        var = np.full(values.shape[1:], np.nan)
+
+    middle = n // 2
+    if n % 2:
+        median = ordered[middle]
+    else:
+        median = np.mean(ordered[middle - 1:middle + 1], axis=0)
+
+    return SortedSummary(
+        count=n,
+        mean=mean,
+        std=np.sqrt(var),
+        var=var,
+        total=total,
+        minimum=ordered[0],
+        maximum=ordered[-1],
+        median=median,
+        mode=mode_from_sorted(ordered),
+        quantiles=quantiles_from_sorted(ordered, qs),
+    )
+
+
+def grouped_summary(
+    codes: np.ndarray,
+    values: np.ndarray,
+    n_groups: int,
+    qs: Sequence[float] = (0.5,),
+    ddof: int = 1
+) -> Dict[str, np.ndarray]:
+    """
+    分组汇总统计（一次 lexsort 完成所有分组）
+
+    Args:
+        codes: 分组编码（0..n_groups-1）
+        values: 数值（与 codes 等长，NaN会被忽略）
+        n_groups: 分组数
+        qs: 分位点
+        ddof: 方差自由度
+
+    Returns:
+        {count, sum, mean, std, min, max, quantiles(len(qs) × n_groups)}，空组为NaN
+    """
+    valid = ~np.isnan(values)
+    codes = codes[valid]
+    values = values[valid]
+
+    count = np.bincount(codes, minlength=n_groups)
+    total = np.bincount(codes, weights=values, minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = total / count
+        deviation = values - mean[codes]
+        sq = np.bincount(codes, weights=deviation * deviation, minlength=n_groups)
+        var = np.where(count > ddof, sq / (count - ddof), np.nan)
+
+    # 先按值排序，再按分组稳定排序（分组编码收窄后 numpy 走基数排序，比 lexsort 快）
+    by_value = np.argsort(values, kind="stable")
+    narrow = np.uint16 if n_groups <= np.iinfo(np.uint16).max else np.int64
+    by_group = np.argsort(codes[by_value].astype(narrow), kind="stable")
+    ordered = values[by_value[by_group]]
+    starts = np.r_[0, np.cumsum(count)[:-1]]
+    nonempty = count > 0
+
+    minimum = np.full(n_groups, np.nan)
+    maximum = np.full(n_groups, np.nan)
+    minimum[nonempty] = ordered[starts[nonempty]]
+    maximum[nonempty] = ordered[starts[nonempty] + count[nonempty] - 1]
+
+    quantiles = np.full((len(qs), n_groups), np.nan)
+    for i, q in enumerate(qs):
+        # 与 quantiles_from_sorted 相同的插值，按组偏移
+        virtual = count * q + (1 + q * (1 - 1 - 1)) - 1
+        lower = np.floor(virtual).astype(np.int64)
+        gamma = virtual - lower
+        lower = np.clip(lower, 0, np.maximum(count - 1, 0))
+        upper = np.minimum(lower + 1, np.maximum(count - 1, 0))
+        below = ordered[np.minimum(starts + lower, len(ordered) - 1)[nonempty]]
+        above = ordered[np.minimum(starts + upper, len(ordered) - 1)[nonempty]]
+        g = gamma[nonempty]
+        diff = above - below
+        quantiles[i, nonempty] = np.where(g >= 0.5, above - diff * (1 - g), below + diff * g)
+
+    return {
+        "count": count,
+        "sum": total,
+        "mean": mean,
+        "std": np.sqrt(var),
+        "min": minimum,
+        "max": maximum,
+        "quantiles": quantiles,
+    }
+
+
+class RunningMoments:
+    """流式均值/方差（Welford 算法，分块时用 Chan 公式合并）"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.total = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    def update(self, values: np.ndarray):
+        """合并一块数据（NaN忽略）"""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        n = len(values)
+        if n == 0:
+            return
+        block_mean = values.mean()
+        block_m2 = float(np.square(values - block_mean).sum())
+
+        combined = self.count + n
+        delta = block_mean - self.mean
+        self.mean += delta * n / combined
+        self.m2 += block_m2 + delta * delta * self.count * n / combined
+        self.count = combined
+        self.total += float(values.sum())
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    def variance(self, ddof: int = 1) -> float:
+        return self.m2 / (self.count - ddof) if self.count > ddof else float("nan")
+
+
+class KLLSketch:
+    """
+    KLL 分位数草图
+
+    每层缓冲区满时排序、随机取奇数位或偶数位的一半提升到上一层（权重翻倍）。
+    内存约 O(k)，秩误差约 O(1/k)，两个草图可直接合并
+    """
+
+    def __init__(self, k: int = 200, seed: int = 0):
+        """
+        Args:
+            k: 顶层容量（越大越精确）
+            seed: 随机种子
+        """
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(8, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values: np.ndarray):
+        """加入一块数据（NaN忽略）"""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other: "KLLSketch"):
+        """合并另一个草图"""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, buffer in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], buffer])
+        self.count += other.count
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            buffer = self.levels[level]
+            if len(buffer) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                buffer = np.sort(buffer)
+                # 奇数个时留下一个在本层
+                keep = buffer[-1:] if len(buffer) % 2 else buffer[:0]
+                even = buffer[:len(buffer) - len(keep)]
+                promoted = even[int(self._rng.integers(2))::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantiles(self, qs: Sequence[float]) -> np.ndarray:
+        """近似分位数"""
+        if self.count == 0:
+            return np.full(len(qs), np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(b), 2.0 ** level) for level, b in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values = values[order]
+        cumulative = np.cumsum(weights[order])
+        targets = np.asarray(qs, dtype=float) * cumulative[-1]
+        positions = np.searchsorted(cumulative, targets, side="left")
+        return values[np.minimum(positions, len(values) - 1)]
+
+
+def sketch_summary(
+    chunks: Iterable[np.ndarray],
+    qs: Sequence[float] = (0.25, 0.5, 0.75),
+    k: int = 200
+) -> Optional[Dict[str, float]]:
+    """
+    流式近似汇总（Welford 矩 + KLL 分位数，一次遍历）
+
+    Args:
+        chunks: 数据块序列
+        qs: 分位点
+        k: KLL 容量
+
+    Returns:
+        {count, mean, std, var, sum, min, max, quantiles}；没有有效数据时返回None
+    """
+    moments = RunningMoments()
+    sketch = KLLSketch(k=k)
+    for chunk in chunks:
+        moments.update(chunk)
+        sketch.update(chunk)
+    if moments.count == 0:
+        return None
+
+    var = moments.variance()
+    return {
+        "count": moments.count,
+        "mean": moments.mean,
+        "std": float(np.sqrt(var)),
+        "var": var,
+        "sum": moments.total,
+        "min": moments.minimum,
+        "max": moments.maximum,
+        "quantiles": sketch.quantiles(qs),
+    }
@@ -7,6 +7,7 @@
 - 移动平均
 - 拐点识别
 - 趋势线拟合
+- 季节分解（有规则时间索引时，趋势基于去季节化序列）
 """
 
 from typing import Dict, List, Optional, Tuple, Any
@@ -15,13 +16,15 @@ import numpy as np
 from scipy import stats
 from scipy.signal import find_peaks
 
+from .seasonal import get_seasonal_decomposer
+
 
 class TrendAnalyzer:
     """趋势分析器"""
 
     def __init__(self):
         """初始化趋势分析器"""
-        pass
+        self.seasonal_decomposer = get_seasonal_decomposer()
 
     def detect_trend(self, data: pd.Series, time_index: Optional[pd.Series] = None) -> Dict[str, Any]:
         """
@@ -185,44 +188,50 @@ class TrendAnalyzer:
         if prominence is None:
             prominence = data.std() * 0.5
 
-        # 识别峰值
-        peaks, peak_properties = find_peaks(data.values, prominence=prominence)
+        values = data.to_numpy(dtype=float)
+        return self.find_turning_points(values, prominence, self.change_rates(values))
 
-        # 识别谷值（反转数据）
-        troughs, trough_properties = find_peaks(-data.values, prominence=prominence)
+    @staticmethod
+    def change_rates(values: np.ndarray) -> np.ndarray:
+        """
+        各点相对前一个点的变化率（前一个值为0或第一个点时为0）
 
-        # 构建结果
-        peak_list = []
-        for idx in peaks:
-            value = data.iloc[idx]
-            # 计算相对于前一个值的增长
-            if idx > 0:
-                prev_value = data.iloc[idx - 1]
-                change = (value - prev_value) / prev_value if prev_value != 0 else 0
-            else:
-                change = 0
+        Args:
+            values: 一维数组，或 T × K 矩阵（按列计算）
 
-            peak_list.append({
-                "index": int(idx),
-                "value": float(value),
-                "change_pct": float(change * 100) if change != 0 else 0
-            })
-
-        trough_list = []
-        for idx in troughs:
-            value = data.iloc[idx]
-            # 计算相对于前一个值的下降
-            if idx > 0:
-                prev_value = data.iloc[idx - 1]
-                change = (value - prev_value) / prev_value if prev_value != 0 else 0
-            else:
-                change = 0
+        Returns:
+            与 values 形状相同的数组
+        """
+        previous = values[:-1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rates = np.where(previous != 0, (values[1:] - previous) / previous, 0.0)
+        return np.concatenate([np.zeros_like(values[:1]), rates])
 
-            trough_list.append({
+    @staticmethod
+    def find_turning_points(values: np.ndarray, prominence: float, changes: np.ndarray) -> Dict[str, Any]:
+        """
+        按显著性识别峰值和谷值（identify_turning_points 与批量分析共用）
+
+        Args:
+            values: 一维数值数组
+            prominence: 峰值显著性阈值
+            changes: change_rates(values) 的结果
+
+        Returns:
+            拐点分析结果
+        """
+        def describe(positions: np.ndarray) -> List[Dict[str, Any]]:
+            return [{
                 "index": int(idx),
-                "value": float(value),
-                "change_pct": float(change * 100) if change != 0 else 0
-            })
+                "value": float(values[idx]),
+                "change_pct": float(changes[idx] * 100) if changes[idx] != 0 else 0
+            } for idx in positions]
+
+        # 识别峰值，以及谷值（反转数据）
+        peaks, _ = find_peaks(values, prominence=prominence)
+        troughs, _ = find_peaks(-values, prominence=prominence)
+        peak_list = describe(peaks)
+        trough_list = describe(troughs)
 
         # 找到最大峰值和最小谷值
         max_peak = max(peak_list, key=lambda x: x['value']) if peak_list else None
@@ -327,6 +336,34 @@ class TrendAnalyzer:
             "description": "未检测到明显周期性"
         }
 
+    def analyze_seasonality(
+        self,
+        data: pd.Series,
+        time_index: Optional[pd.Series] = None,
+        key: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], Optional[pd.Series]]:
+        """
+        季节分解（STL/MSTL）
+
+        Args:
+            data: 数值序列
+            time_index: 时间索引（需为规则的日/小时粒度）
+            key: 序列标识（用于缓存和增量重拟合）
+
+        Returns:
+            (分解摘要, 去季节化序列)；无法分解时去季节化序列为None
+        """
+        fitted = self.seasonal_decomposer.fit_series(data, time_index, key=key)
+        if fitted is None:
+            return {
+                "available": False,
+                "description": "数据不足或无规则时间索引，未做季节分解"
+            }, None
+
+        fit, positions = fitted
+        deseasonalized = pd.Series(fit.deseasonalized[positions], index=data.index)
+        return self.seasonal_decomposer.summarize(fit), deseasonalized
+
     def comprehensive_analysis(
         self,
         data: pd.Series,
@@ -355,8 +392,15 @@ class TrendAnalyzer:
         median_value = data.median()
         std_value = data.std()
 
+        # 季节分解；可分解时趋势基于去季节化序列，避免周末等固定周期干扰斜率
+        seasonality, deseasonalized = self.analyze_seasonality(data, time_index, key=metric_name)
+
         # 趋势检测
-        trend = self.detect_trend(data, time_index)
+        if deseasonalized is not None:
+            trend = self.detect_trend(deseasonalized, time_index)
+            trend["basis"] = "deseasonalized"
+        else:
+            trend = self.detect_trend(data, time_index)
 
         # 增长率
         growth = self.calculate_growth_rate(data, period='daily' if time_index is not None else 'total', time_index=time_index)
@@ -385,5 +429,6 @@ class TrendAnalyzer:
             "growth": growth,
             "turning_points": turning_points,
             "periodicity": periodicity,
+            "seasonality": seasonality,
             "moving_average": moving_avg.tolist() if len(moving_avg) <= 100 else []
         }
@@ -0,0 +1,316 @@
+"""
+用户ID字典编码模块
+
+为 distinct_id 分配稳定的整数序号（按首次出现的顺序），字典持久化在磁盘并通过内存映射查找。
+本地的用户级计算（漏斗、留存、跨查询去重）只处理整数序号，不在内存中保留ID字符串。
+
+磁盘布局（目录下的文件只追加或整体替换）：
+- strings.bin: 所有ID的UTF-8字节依次拼接
+- offsets.bin: int64，第 i 个ID在 strings.bin 中的起止位置（共 n+1 项）
+- hashes.bin: 每个ID的128位哈希（两个uint64），写入哈希即视为该ID提交
+- index.bin: 开放寻址哈希表（int64，首项为已索引的ID数，之后每个槽存 序号+1，0 为空槽）
+
+编码和解码都只对去重后的取值批量处理。哈希由 pandas 的 hash_array（SipHash，固定密钥）计算，
+两组密钥组成128位，碰撞概率可以忽略，查找时不再比对字符串。
+多个进程共用同一目录时，追加由文件锁串行化
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+import numpy as np
+import pandas as pd
+from pandas.util import hash_array
+from loguru import logger
+
+from config.settings import get_settings
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只做进程内加锁
+    fcntl = None
+
+# 两组16字节的SipHash密钥，组成128位哈希
+_HASH_KEYS = ("sensors-userid-1", "sensors-userid-2")
+
+# 哈希表装载因子上限，超过后整体重建为更大的表
+_MAX_LOAD = 0.5
+_MIN_CAPACITY = 1024
+
+
+def _hash128(values: np.ndarray) -> np.ndarray:
+    """ID字符串 -> n×2 的uint64哈希"""
+    return np.column_stack([hash_array(values, hash_key=key, categorize=False) for key in _HASH_KEYS])
+
+
+def _map_file(path: str, dtype: Any) -> np.ndarray:
+    """只读内存映射整个文件（文件不存在或为空时返回空数组）"""
+    itemsize = np.dtype(dtype).itemsize
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size < itemsize:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(size // itemsize,))
+
+
+def _capacity(count: int) -> int:
+    """容纳 count 个ID的哈希表槽数（2的幂，建表时装载因子不超过1/2）"""
+    return max(_MIN_CAPACITY, 1 << int(np.ceil(np.log2(max(count, 1) * 2))))
+
+
+def _table_insert(table: np.ndarray, hashes: np.ndarray, ordinals: np.ndarray):
+    """批量线性探测插入（同一轮争用同一空槽时，只有第一个写入，其余继续探测）"""
+    mask = len(table) - 1
+    pending = np.arange(len(ordinals))
+    slots = (hashes[:, 0] & np.uint64(mask)).astype(np.int64)
+    while len(pending):
+        free = table[slots] == 0
+        free_positions = np.flatnonzero(free)
+        _, first = np.unique(slots[free_positions], return_index=True)
+        claimed = free_positions[first]
+        table[slots[claimed]] = ordinals[pending[claimed]] + 1
+
+        keep = np.ones(len(pending), dtype=bool)
+        keep[claimed] = False
+        # 本轮槽已被占用的向后探测，争用失败的下一轮会看到槽已占用
+        slots = np.where(free, slots, (slots + 1) & mask)[keep]
+        pending = pending[keep]
+
+
+class UserIdInterner:
+    """distinct_id 字典编码器（稳定序号 + 磁盘持久化 + 内存映射查找）"""
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        初始化字典编码器
+
+        Args:
+            directory: 字典文件目录（默认读取配置）
+        """
+        self.directory = directory or get_settings().USER_ID_DICT_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._size = 0
+        self._strings = np.empty(0, dtype=np.uint8)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._hashes = np.empty((0, 2), dtype=np.uint64)
+        self._table: Optional[np.ndarray] = None
+        with self._lock:
+            self._refresh()
+        logger.info(f"[UserIdInterner] 加载用户ID字典: {self._size} 个ID，目录: {self.directory}")
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def dtype(self) -> np.dtype:
+        """序号的整数类型（ID数超过 int32 范围后为 int64）"""
+        return np.dtype(np.int32) if self._size < np.iinfo(np.int32).max else np.dtype(np.int64)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    # ========== 文件映射 ==========
+
+    def _refresh(self):
+        """重新映射字典文件（本进程或其他进程追加之后调用，需持有 _lock）"""
+        hashes = _map_file(self._path("hashes.bin"), np.uint64)
+        hashes = hashes[:len(hashes) - len(hashes) % 2].reshape(-1, 2)
+        offsets = _map_file(self._path("offsets.bin"), np.int64)
+        n = min(len(hashes), max(len(offsets) - 1, 0))
+
+        self._size = n
+        self._hashes = hashes[:n]
+        self._offsets = offsets[:n + 1] if n else np.zeros(1, dtype=np.int64)
+        self._strings = _map_file(self._path("strings.bin"), np.uint8)
+
+        table = _map_file(self._path("index.bin"), np.int64)
+        if len(table) > 1 and table[0] >= n:
+            # 索引可能比已映射的哈希更新，指向 >= n 的槽在查找时视为未命中
+            self._table = table[1:]
+        elif n:
+            # 索引落后（上次写入中断），先在内存中重建，下次追加时写回磁盘
+            self._table = np.zeros(_capacity(n), dtype=np.int64)
+            _table_insert(self._table, np.asarray(self._hashes), np.arange(n, dtype=np.int64))
+        else:
+            self._table = None
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        """进程内 + 跨进程的写锁"""
+        with self._lock:
+            with open(self._path("lock"), "a") as handle:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(handle, fcntl.LOCK_UN)
+
+    # ========== 查找与追加 ==========
+
+    def _probe(self, hashes: np.ndarray) -> np.ndarray:
+        """按哈希批量查找序号（未找到为 -1）"""
+        found = np.full(len(hashes), -1, dtype=np.int64)
+        table, n = self._table, self._size
+        if table is None or n == 0 or len(hashes) == 0:
+            return found
+
+        mask = len(table) - 1
+        pending = np.arange(len(hashes))
+        slots = (hashes[:, 0] & np.uint64(mask)).astype(np.int64)
+        while len(pending):
+            ordinals = table[slots] - 1
+            empty = ordinals < 0
+            valid = ~empty & (ordinals < n)
+            match = np.zeros(len(pending), dtype=bool)
+            match[valid] = (self._hashes[ordinals[valid]] == hashes[pending[valid]]).all(axis=1)
+            found[pending[match]] = ordinals[match]
+
+            keep = ~empty & ~match
+            pending = pending[keep]
+            slots = (slots[keep] + 1) & mask
+        return found
+
+    def _append(self, values: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+        """追加新ID并返回序号（持有写锁后重新查找，其他进程可能已写入）"""
+        with self._write_lock():
+            self._refresh()
+            found = self._probe(hashes)
+            new = np.flatnonzero(found < 0)
+            if len(new) == 0:
+                return found
+
+            n = self._size
+            base = int(self._offsets[-1])
+            # 截掉上次中断写入留下的尾部，保证各文件对齐
+            for name, size in (("strings.bin", base), ("offsets.bin", (n + 1) * 8 if n else 0), ("hashes.bin", n * 16)):
+                path = self._path(name)
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    os.truncate(path, size)
+
+            encoded = [str(value).encode("utf-8") for value in values[new]]
+            ends = base + np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+            with open(self._path("strings.bin"), "ab") as f:
+                f.write(b"".join(encoded))
+            with open(self._path("offsets.bin"), "ab") as f:
+                if n == 0:
+                    f.write(np.zeros(1, dtype=np.int64).tobytes())
+                f.write(ends.tobytes())
+            with open(self._path("hashes.bin"), "ab") as f:
+                f.write(np.ascontiguousarray(hashes[new], dtype=np.uint64).tobytes())
+
+            ordinals = np.arange(n, n + len(new), dtype=np.int64)
+            self._write_index(hashes[new], ordinals, n + len(new))
+            found[new] = ordinals
+            self._refresh()
+            return found
+
+    def _write_index(self, hashes: np.ndarray, ordinals: np.ndarray, total: int):
+        """把新ID写入磁盘索引（容量不足或索引落后时整体重建并原子替换）"""
+        path = self._path("index.bin")
+        on_disk = _map_file(path, np.int64)
+        start = int(ordinals[0])
+        if len(on_disk) > 1 and on_disk[0] == start and total <= (len(on_disk) - 1) * _MAX_LOAD:
+            del on_disk
+            table = np.memmap(path, dtype=np.int64, mode="r+")
+            _table_insert(table[1:], hashes, ordinals)
+            table[0] = total
+            table.flush()
+            return
+
+        all_hashes = np.concatenate([np.asarray(self._hashes[:start]), hashes])
+        table = np.zeros(_capacity(total) + 1, dtype=np.int64)
+        _table_insert(table[1:], all_hashes, np.arange(total, dtype=np.int64))
+        table[0] = total
+        tmp_path = f"{path}.tmp"
+        table.tofile(tmp_path)
+        os.replace(tmp_path, path)
+        logger.debug(f"[UserIdInterner] 重建索引: {total} 个ID，{len(table) - 1} 个槽")
+
+    # ========== 编码与解码 ==========
+
+    def encode(self, values: Any, add: bool = True) -> np.ndarray:
+        """
+        批量编码
+
+        Args:
+            values: distinct_id 序列（非字符串取值按 str() 编码；类别列只编码其类别）
+            add: 是否为未见过的ID分配新序号；False 时未见过的ID编码为 -1
+
+        Returns:
+            序号数组（int32，ID数超过 int32 范围后为 int64），空值为 -1
+        """
+        if isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+            # 类别列已经去重，直接编码类别
+            codes, uniques = np.asarray(values.cat.codes if isinstance(values, pd.Series) else values.codes), values.categories
+        else:
+            codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        if len(uniques) == 0:
+            return np.full(len(codes), -1, dtype=self.dtype)
+        uniques = np.asarray(uniques, dtype=object)
+        if pd.api.types.infer_dtype(uniques, skipna=False) != "string":
+            uniques = uniques.astype(str).astype(object)
+        hashes = _hash128(uniques)
+
+        with self._lock:
+            found = self._probe(hashes)
+        missing = found < 0
+        if missing.any():
+            if add:
+                found[missing] = self._append(uniques[missing], hashes[missing])
+            else:
+                # 其他进程可能已经追加，刷新映射后再查一次
+                with self._lock:
+                    self._refresh()
+                    found[missing] = self._probe(hashes[missing])
+
+        result = found.astype(self.dtype)[codes]
+        result[codes < 0] = -1
+        return result
+
+    def decode(self, ordinals: Any) -> np.ndarray:
+        """
+        批量解码
+
+        Args:
+            ordinals: 序号序列
+
+        Returns:
+            distinct_id 数组（object），-1 或未知序号为 None
+        """
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        uniques, inverse = np.unique(ordinals, return_inverse=True)
+        with self._lock:
+            if len(uniques) and uniques[-1] >= self._size:
+                self._refresh()
+            strings, offsets, n = self._strings, self._offsets, self._size
+
+        decoded = np.full(len(uniques), None, dtype=object)
+        valid = (uniques >= 0) & (uniques < n)
+        starts = np.asarray(offsets[uniques[valid]])
+        ends = np.asarray(offsets[uniques[valid] + 1])
+        if len(starts):
+            low, high = int(starts.min()), int(ends.max())
+            if high - low <= 16 * int((ends - starts).sum()):
+                # 需要的ID较密集时一次拷贝整段，切片 bytes 比逐个拷贝内存映射快得多
+                raw = strings[low:high].tobytes()
+                starts, ends = starts - low, ends - low
+            else:
+                raw = strings
+            decoded[valid] = [bytes(raw[s:e]).decode("utf-8") for s, e in zip(starts.tolist(), ends.tolist())]
+        return decoded[inverse.reshape(-1)]
+
+
+_interner: Optional[UserIdInterner] = None
+_interner_lock = threading.Lock()
+
+
+def get_user_id_interner() -> UserIdInterner:
+    """获取进程内共享的用户ID字典（漏斗、留存和SQL结果解码共用同一套序号）"""
+    global _interner
+    with _interner_lock:
+        if _interner is None:
+            _interner = UserIdInterner()
+        return _interner
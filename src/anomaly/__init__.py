@@ -0,0 +1,32 @@
+"""
+异常监控模块
+包含在线（增量）异常检测：常数大小的序列状态、持久化与增量更新；
+以及定时异常监控：指标注册表、合并扫描与告警历史
+"""
+from .online import (
+    OnlineAnomalyDetector,
+    OnlineStateStore,
+    OnlinePoint,
+    SeriesState,
+    get_online_detector,
+)
+from .monitor import (
+    AnomalyMonitor,
+    MetricDefinition,
+    MetricRegistry,
+    AlertStore,
+    get_anomaly_monitor,
+)
+
+__all__ = [
+    'OnlineAnomalyDetector',
+    'OnlineStateStore',
+    'OnlinePoint',
+    'SeriesState',
+    'get_online_detector',
+    'AnomalyMonitor',
+    'MetricDefinition',
+    'MetricRegistry',
+    'AlertStore',
+    'get_anomaly_monitor',
+]
@@ -0,0 +1,495 @@
+"""
+定时异常监控
+
+按 ANOMALY_CHECK_INTERVAL 在后台检查一组关键指标：
+- 指标注册表：每个指标是一段自定义SQL，或由 (事件, 聚合方式, 过滤条件, 粒度) 描述的模板
+- 合并扫描：粒度和过滤条件相同的模板指标合并成一条SQL（条件聚合），同一张事件表只扫描一次；
+  SQL完全相同的自定义指标也只执行一次
+- 增量打分：使用在线检测器（OnlineAnomalyDetector）的持久化状态，每次只查询上次检查之后的完整周期
+- 告警历史：异常点追加写入JSONL文件，并保留最近的告警供API查询
+
+监控在API服务进程内运行，复用Agent的神策客户端（HTTP连接池）和进程内共享的检测器状态
+"""
+import os
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import pandas as pd
+from loguru import logger
+
+from config.settings import get_settings
+from src.sql.literals import sql_literal, sql_column
+from .online import OnlineAnomalyDetector, OnlinePoint, get_online_detector
+
+
+# 粒度 -> (周期时长, 周期起点的SQL表达式)
+GRANULARITIES: Dict[str, Tuple[pd.Timedelta, str]] = {
+    "hour": (pd.Timedelta(hours=1), "date_trunc('hour', time)"),
+    "day": (pd.Timedelta(days=1), "date"),
+}
+
+# 模板聚合方式 -> 条件聚合表达式（{cond} 为事件条件，{prop} 为属性）
+AGGREGATES: Dict[str, str] = {
+    "count": "SUM(CASE WHEN {cond} THEN 1 ELSE 0 END)",
+    "uv": "COUNT(DISTINCT CASE WHEN {cond} THEN distinct_id END)",
+    "sum": "SUM(CASE WHEN {cond} THEN {prop} END)",
+    "avg": "AVG(CASE WHEN {cond} THEN {prop} END)",
+}
+
+
+@dataclass
+class MetricDefinition:
+    """
+    监控指标定义
+
+    自定义SQL可使用 {since} / {until} 占位符（替换为带引号的时间字面量，区间左闭右开），
+    结果需包含时间列和数值列；未设置 sql 时按模板字段生成查询
+    """
+    name: str
+    sql: Optional[str] = None
+    event: Optional[str] = None
+    aggregate: str = "count"
+    prop: Optional[str] = None
+    filters: Dict[str, Any] = field(default_factory=dict)
+    granularity: str = "hour"
+    time_column: str = "period"
+    value_column: str = "value"
+    description: str = ""
+    enabled: bool = True
+
+    def validate(self):
+        """校验定义，不合法时抛出ValueError"""
+        if not self.name:
+            raise ValueError("指标名称不能为空")
+        if self.granularity not in GRANULARITIES:
+            raise ValueError(f"不支持的粒度: {self.granularity}")
+        if self.sql:
+            return
+        if not self.event:
+            raise ValueError(f"指标 {self.name} 需要提供 sql 或 event")
+        if self.aggregate not in AGGREGATES:
+            raise ValueError(f"不支持的聚合方式: {self.aggregate}")
+        if self.aggregate in ("sum", "avg"):
+            if not self.prop:
+                raise ValueError(f"聚合方式 {self.aggregate} 需要指定 prop")
+            sql_column(self.prop)
+        for name in self.filters:
+            sql_column(name)
+
+    @property
+    def key(self) -> str:
+        """在线检测器中的序列标识"""
+        return f"monitor:{self.name}"
+
+    @property
+    def scan_key(self) -> Tuple:
+        """可以合并为一次扫描的指标具有相同的 scan_key"""
+        if self.sql:
+            return ("sql", self.granularity, self.sql)
+        filters = tuple(sorted((k, json.dumps(v, sort_keys=True, ensure_ascii=False)) for k, v in self.filters.items()))
+        return ("events", self.granularity, filters)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MetricDefinition":
+        known = cls.__dataclass_fields__
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+class MetricRegistry:
+    """监控指标注册表（JSON文件持久化，原子写入）"""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化指标注册表
+
+        Args:
+            path: 注册表文件路径（默认读取配置）
+        """
+        self.path = path or get_settings().ANOMALY_METRICS_PATH
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, MetricDefinition] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"[MetricRegistry] 注册表读取失败: {e}")
+            return
+        for item in items:
+            try:
+                metric = MetricDefinition.from_dict(item)
+                metric.validate()
+                self._metrics[metric.name] = metric
+            except (TypeError, ValueError) as e:
+                logger.warning(f"[MetricRegistry] 跳过无效指标 {item.get('name')}: {e}")
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([m.to_dict() for m in self._metrics.values()], f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def register(self, metric: MetricDefinition):
+        """注册（或覆盖同名）指标"""
+        metric.validate()
+        with self._lock:
+            self._metrics[metric.name] = metric
+            self._save()
+        logger.info(f"[MetricRegistry] 注册指标: {metric.name}")
+
+    def remove(self, name: str) -> bool:
+        """删除指标，不存在时返回False"""
+        with self._lock:
+            if self._metrics.pop(name, None) is None:
+                return False
+            self._save()
+        return True
+
+    def get(self, name: str) -> Optional[MetricDefinition]:
+        with self._lock:
+            return self._metrics.get(name)
+
+    def list(self, enabled_only: bool = False) -> List[MetricDefinition]:
+        with self._lock:
+            return [m for m in self._metrics.values() if m.enabled or not enabled_only]
+
+
+class AlertStore:
+    """告警历史（JSONL追加写入，内存中保留最近的告警）"""
+
+    def __init__(self, path: Optional[str] = None, max_recent: Optional[int] = None):
+        """
+        初始化告警存储
+
+        Args:
+            path: 告警文件路径（默认读取配置）
+            max_recent: 内存中保留的最近告警条数（默认读取配置）
+        """
+        settings = get_settings()
+        self.path = path or settings.ANOMALY_ALERTS_PATH
+        self._lock = threading.Lock()
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=max_recent or settings.ANOMALY_ALERT_HISTORY)
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._recent.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+
+    def append(self, metric: MetricDefinition, points: List[OnlinePoint]) -> List[Dict[str, Any]]:
+        """记录一个指标的异常点"""
+        detected_at = datetime.now().isoformat(timespec="seconds")
+        alerts = [
+            {"metric": metric.name, "detected_at": detected_at, **point.to_dict()}
+            for point in points
+        ]
+        if not alerts:
+            return alerts
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for alert in alerts:
+                    f.write(json.dumps(alert, ensure_ascii=False) + "\n")
+            self._recent.extend(alerts)
+        return alerts
+
+    def recent(self, limit: int = 100, metric: Optional[str] = None) -> List[Dict[str, Any]]:
+        """最近的告警（新的在前）"""
+        with self._lock:
+            alerts = [a for a in reversed(self._recent) if metric is None or a.get("metric") == metric]
+        return alerts[:limit]
+
+
+class AnomalyMonitor:
+    """后台定时异常监控"""
+
+    def __init__(
+        self,
+        client,
+        registry: Optional[MetricRegistry] = None,
+        detector: Optional[OnlineAnomalyDetector] = None,
+        alerts: Optional[AlertStore] = None,
+        interval: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        lookback_days: Optional[int] = None,
+        exclude_spider: bool = True
+    ):
+        """
+        初始化监控
+
+        Args:
+            client: 神策客户端（与API服务共用，复用连接池）
+            registry: 指标注册表（默认读取配置的文件）
+            detector: 在线检测器（默认使用进程内共享的实例）
+            alerts: 告警存储（默认读取配置的文件）
+            interval: 检查间隔（秒，默认 ANOMALY_CHECK_INTERVAL）
+            concurrency: 同时执行的扫描数（默认读取配置）
+            lookback_days: 首次检查时拉取的历史天数（默认读取配置）
+            exclude_spider: 模板指标是否过滤爬虫用户
+        """
+        settings = get_settings()
+        self.client = client
+        self.registry = registry or MetricRegistry()
+        self.detector = detector or get_online_detector()
+        self.alerts = alerts or AlertStore()
+        self.interval = interval or settings.ANOMALY_CHECK_INTERVAL
+        self.concurrency = concurrency or settings.ANOMALY_MONITOR_CONCURRENCY
+        self.lookback_days = lookback_days or settings.ANOMALY_MONITOR_LOOKBACK_DAYS
+        self.exclude_spider = exclude_spider
+        self.batch_rows = settings.FUNNEL_STREAM_BATCH_ROWS
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    # ========== 查询计划 ==========
+
+    def _window(self, metric: MetricDefinition, now: pd.Timestamp) -> Tuple[pd.Timestamp, pd.Timestamp]:
+        """指标需要查询的区间 [since, until)：上次处理之后到当前未结束周期之前"""
+        step, _ = GRANULARITIES[metric.granularity]
+        until = now.floor(step)
+        last = self.detector.last_timestamp(metric.key)
+        since = last + step if last is not None else until - pd.Timedelta(days=self.lookback_days)
+        return since, until
+
+    def plan(self, now: Optional[pd.Timestamp] = None) -> List[Dict[str, Any]]:
+        """
+        生成本轮的扫描计划
+
+        Returns:
+            [{"metrics": [...], "since": ..., "until": ..., "sql": ...}]，已是最新的指标不生成扫描
+        """
+        now = now or pd.Timestamp.now()
+        groups: Dict[Tuple, List[Tuple[MetricDefinition, pd.Timestamp, pd.Timestamp]]] = {}
+        for metric in self.registry.list(enabled_only=True):
+            since, until = self._window(metric, now)
+            if since >= until:
+                continue
+            groups.setdefault(metric.scan_key, []).append((metric, since, until))
+
+        scans = []
+        for (kind, _, _), items in groups.items():
+            metrics = [m for m, _, _ in items]
+            # 合并扫描从最早的起点开始，已处理过的时间点在更新时自动跳过
+            since = min(s for _, s, _ in items)
+            until = max(u for _, _, u in items)
+            if kind == "sql":
+                sql = self.render_sql(metrics[0].sql, since, until)
+            else:
+                sql = self.build_sql(metrics, since, until)
+            scans.append({"metrics": metrics, "since": since, "until": until, "sql": sql})
+        return scans
+
+    @staticmethod
+    def render_sql(sql: str, since: pd.Timestamp, until: pd.Timestamp) -> str:
+        """替换自定义SQL中的时间占位符"""
+        return (
+            sql.replace("{since}", sql_literal(since.strftime("%Y-%m-%d %H:%M:%S")))
+            .replace("{until}", sql_literal(until.strftime("%Y-%m-%d %H:%M:%S")))
+        )
+
+    def build_sql(self, metrics: List[MetricDefinition], since: pd.Timestamp, until: pd.Timestamp) -> str:
+        """
+        生成模板指标的合并查询（每个指标一列条件聚合，只扫描一次事件表）
+
+        Args:
+            metrics: 粒度和过滤条件相同的模板指标
+            since: 起点（含）
+            until: 终点（不含）
+
+        Returns:
+            SQL语句，列为 period, m0, m1, ...
+        """
+        _, period_expr = GRANULARITIES[metrics[0].granularity]
+        columns = []
+        for i, metric in enumerate(metrics):
+            expr = AGGREGATES[metric.aggregate].format(
+                cond=f"event = {sql_literal(metric.event)}",
+                prop=sql_column(metric.prop) if metric.prop else ""
+            )
+            columns.append(f"{expr} AS m{i}")
+
+        events = sorted({m.event for m in metrics})
+        conditions = [
+            f"event IN ({', '.join(sql_literal(e) for e in events)})",
+            # date 为分区字段，先按日期裁剪再按时间精确过滤
+            f"date BETWEEN {sql_literal(since.date().isoformat())} AND {sql_literal(until.date().isoformat())}",
+            f"time >= {sql_literal(since.strftime('%Y-%m-%d %H:%M:%S'))}",
+            f"time < {sql_literal(until.strftime('%Y-%m-%d %H:%M:%S'))}",
+        ]
+        if self.exclude_spider:
+            conditions.append("is_spider_user = '正常用户'")
+        for name, value in metrics[0].filters.items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            if len(values) == 1:
+                conditions.append(f"{sql_column(name)} = {sql_literal(values[0])}")
+            else:
+                conditions.append(f"{sql_column(name)} IN ({', '.join(sql_literal(v) for v in values)})")
+
+        return (
+            f"SELECT {period_expr} AS period,\n  " + ",\n  ".join(columns)
+            + "\nFROM events\nWHERE " + "\n  AND ".join(conditions)
+            + f"\nGROUP BY {period_expr}\nORDER BY period"
+        )
+
+    # ========== 执行 ==========
+
+    def _fetch(self, sql: str) -> pd.DataFrame:
+        """流式执行查询并拼成DataFrame"""
+        frames = [
+            pd.DataFrame(rows, columns=columns)
+            for columns, rows in self.client.stream_sql(sql, batch_rows=self.batch_rows)
+        ]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def _metric_frame(self, metric: MetricDefinition, df: pd.DataFrame, column: str, scan: Dict[str, Any]) -> pd.DataFrame:
+        """
+        取出单个指标的 (时间, 数值) 序列
+
+        计数类模板指标补齐没有事件的周期（值为0），数量跌到0本身就是需要告警的异常
+        """
+        if df.empty:
+            frame = pd.DataFrame({"period": pd.Series(dtype="datetime64[ns]"), "value": pd.Series(dtype=float)})
+        else:
+            frame = pd.DataFrame({
+                "period": pd.to_datetime(df[metric.time_column if metric.sql else "period"]),
+                "value": pd.to_numeric(df[column], errors="coerce"),
+            })
+        if not metric.sql and metric.aggregate in ("count", "uv"):
+            step, _ = GRANULARITIES[metric.granularity]
+            periods = pd.date_range(scan["since"], scan["until"] - step, freq=step)
+            frame = (
+                frame.groupby("period")["value"].sum()
+                .reindex(periods, fill_value=0)
+                .rename_axis("period").reset_index()
+            )
+        return frame
+
+    def _run_scan(self, scan: Dict[str, Any]) -> Dict[str, Any]:
+        """执行一次扫描并更新其中所有指标"""
+        names = [m.name for m in scan["metrics"]]
+        try:
+            df = self._fetch(scan["sql"])
+        except Exception as e:
+            logger.error(f"[AnomalyMonitor] 扫描失败 {names}: {e}")
+            return {"metrics": names, "error": str(e), "points": 0, "alerts": []}
+
+        points = 0
+        alerts: List[Dict[str, Any]] = []
+        for i, metric in enumerate(scan["metrics"]):
+            column = metric.value_column if metric.sql else f"m{i}"
+            if not df.empty and (column not in df.columns or (metric.sql and metric.time_column not in df.columns)):
+                logger.warning(f"[AnomalyMonitor] 指标 {metric.name} 的查询结果缺少列: {metric.time_column}/{column}")
+                continue
+            frame = self._metric_frame(metric, df, column, scan)
+            updated = self.detector.update_frame(metric.key, frame, "period", "value", persist=False)
+            points += len(updated)
+            anomalies = [p for p in updated if p.is_anomaly]
+            for anomaly in anomalies:
+                logger.warning(f"[AnomalyMonitor] {metric.name} @ {anomaly.timestamp}: {anomaly.description}")
+            alerts.extend(self.alerts.append(metric, anomalies))
+        return {"metrics": names, "rows": len(df), "points": points, "alerts": alerts}
+
+    def run_once(self, now: Optional[pd.Timestamp] = None) -> Dict[str, Any]:
+        """
+        执行一轮检查（同一时间只有一轮在执行）
+
+        Returns:
+            本轮统计：指标数、扫描数、新增点数、告警和失败的扫描
+        """
+        if not self.detector.enabled:
+            return {"skipped": "异常检测未启用"}
+
+        with self._run_lock:
+            start = time.time()
+            scans = self.plan(now)
+            if scans:
+                with ThreadPoolExecutor(max_workers=min(self.concurrency, len(scans))) as pool:
+                    results = list(pool.map(self._run_scan, scans))
+                self.detector.save()
+            else:
+                results = []
+
+            summary = {
+                "started_at": datetime.fromtimestamp(start).isoformat(timespec="seconds"),
+                "metrics": sum(len(s["metrics"]) for s in scans),
+                "scans": len(scans),
+                "points": sum(r["points"] for r in results),
+                "alerts": [a for r in results for a in r["alerts"]],
+                "errors": {", ".join(r["metrics"]): r["error"] for r in results if "error" in r},
+                "elapsed_seconds": round(time.time() - start, 3),
+            }
+            self.last_run = summary
+
+        logger.info(
+            f"[AnomalyMonitor] 本轮检查 {summary['metrics']} 个指标 / {summary['scans']} 次扫描，"
+            f"新增 {summary['points']} 个点，告警 {len(summary['alerts'])} 条，耗时 {summary['elapsed_seconds']}秒"
+        )
+        return summary
+
+    # ========== 调度 ==========
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(f"[AnomalyMonitor] 检查失败: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """启动后台检查线程（已启动时忽略）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="anomaly-monitor", daemon=True)
+        self._thread.start()
+        logger.info(f"[AnomalyMonitor] 已启动，间隔 {self.interval} 秒，{len(self.registry.list(enabled_only=True))} 个指标")
+
+    def stop(self, timeout: Optional[float] = 10):
+        """停止后台检查线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+            logger.info("[AnomalyMonitor] 已停止")
+
+
+_monitor: Optional[AnomalyMonitor] = None
+_monitor_lock = threading.Lock()
+
+
+def get_anomaly_monitor(client=None) -> AnomalyMonitor:
+    """
+    获取进程内共享的异常监控
+
+    Args:
+        client: 神策客户端，首次调用时必须提供
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            if client is None:
+                raise RuntimeError("异常监控尚未初始化，需要提供神策客户端")
+            _monitor = AnomalyMonitor(client)
+        return _monitor
@@ -0,0 +1,442 @@
+"""
+在线（增量）异常检测
+
+为固定的一组关键指标维护常数大小的状态，每次只用最新一个周期的数据更新：
+- EWMA / EWMVar：指数加权均值和方差
+- 滚动中位数 / MAD：最近N个点的稳健基线
+- 季节基线：按时段（小时、星期几或一周中的小时）分别维护EWMA均值，
+  季节残差的方差在所有时段上合并估计（每个时段的样本很少，单独估计方差不稳定）
+
+每个点先用已有状态打分、再更新状态；状态持久化到磁盘，
+定时检查时每个指标只需查询上次检查之后的数据，无需重新扫描完整历史
+"""
+import os
+import json
+import math
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from config.settings import get_settings
+
+
+# 季节划分方式 -> (时段数, 由时间戳计算时段序号)
+SEASONALITIES: Dict[str, Any] = {
+    "none": (0, None),
+    "hour_of_day": (24, lambda ts: ts.hour),
+    "day_of_week": (7, lambda ts: ts.dayofweek),
+    "hour_of_week": (168, lambda ts: ts.dayofweek * 24 + ts.hour),
+}
+
+# MAD换算为标准差的系数（正态分布下）
+MAD_SCALE = 1.4826
+
+
+@dataclass
+class SeriesState:
+    """单个序列的在线检测状态（大小与历史长度无关）"""
+    key: str
+    count: int = 0
+    mean: float = 0.0
+    var: float = 0.0
+    last_timestamp: Optional[str] = None
+    last_value: Optional[float] = None
+    window: Deque[float] = field(default_factory=deque)
+    season_mean: Dict[int, float] = field(default_factory=dict)
+    season_count: Dict[int, int] = field(default_factory=dict)
+    residual_var: float = 0.0
+    residual_count: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可JSON序列化的字典"""
+        return {
+            "key": self.key,
+            "count": self.count,
+            "mean": self.mean,
+            "var": self.var,
+            "last_timestamp": self.last_timestamp,
+            "last_value": self.last_value,
+            "window": list(self.window),
+            "season_mean": {str(k): v for k, v in self.season_mean.items()},
+            "season_count": {str(k): v for k, v in self.season_count.items()},
+            "residual_var": self.residual_var,
+            "residual_count": self.residual_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], window_size: int) -> "SeriesState":
+        """从字典恢复状态"""
+        return cls(
+            key=data["key"],
+            count=int(data.get("count", 0)),
+            mean=float(data.get("mean", 0.0)),
+            var=float(data.get("var", 0.0)),
+            last_timestamp=data.get("last_timestamp"),
+            last_value=data.get("last_value"),
+            window=deque(data.get("window", []), maxlen=window_size),
+            season_mean={int(k): float(v) for k, v in data.get("season_mean", {}).items()},
+            season_count={int(k): int(v) for k, v in data.get("season_count", {}).items()},
+            residual_var=float(data.get("residual_var", 0.0)),
+            residual_count=int(data.get("residual_count", 0)),
+        )
+
+
+@dataclass
+class OnlinePoint:
+    """单个数据点的在线检测结果"""
+    key: str
+    timestamp: str
+    value: float
+    expected: Optional[float]
+    scores: Dict[str, float]
+    is_anomaly: bool
+    direction: Optional[str] = None
+
+    @property
+    def description(self) -> str:
+        if not self.is_anomaly:
+            return "正常"
+        detail = ", ".join(f"{name}={score:.1f}" for name, score in self.scores.items())
+        direction = "高于" if self.direction == "high" else "低于"
+        expected = f"{self.expected:.2f}" if self.expected is not None else "-"
+        return f"{direction}预期（预期 {expected}，实际 {self.value:.2f}；{detail}）"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "timestamp": self.timestamp,
+            "value": self.value,
+            "expected": self.expected,
+            "scores": self.scores,
+            "is_anomaly": self.is_anomaly,
+            "direction": self.direction,
+            "description": self.description,
+        }
+
+
+class OnlineStateStore:
+    """在线检测状态的JSON文件存储（原子写入）"""
+
+    def __init__(self, path: str):
+        """
+        初始化状态存储
+
+        Args:
+            path: 状态文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """读取全部状态，文件不存在或损坏时返回空字典"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return {}
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"[OnlineStateStore] 状态文件读取失败，将重新初始化: {e}")
+                return {}
+
+    def save(self, states: Dict[str, Dict[str, Any]]):
+        """写入全部状态（先写临时文件再替换，避免中断导致文件损坏）"""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(states, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+
+class OnlineAnomalyDetector:
+    """
+    在线异常检测器
+
+    三个检测器分别打分（|偏离| / 尺度）：
+    - 季节基线可用时以季节分数为准（EWMA和MAD不区分时段，对有日/周周期的指标会误报或漏报）
+    - 否则EWMA和MAD都可用时两者都超过阈值才判定为异常，降低单一基线的误报
+    """
+
+    def __init__(
+        self,
+        state_path: Optional[str] = None,
+        alpha: Optional[float] = None,
+        window_size: Optional[int] = None,
+        seasonality: Optional[str] = None,
+        threshold: Optional[float] = None,
+        warmup: Optional[int] = None
+    ):
+        """
+        初始化在线检测器
+
+        Args:
+            state_path: 状态文件路径（默认读取配置）
+            alpha: EWMA平滑系数（默认读取配置）
+            window_size: 滚动中位数/MAD窗口大小（默认读取配置）
+            seasonality: 季节划分方式 none/hour_of_day/day_of_week/hour_of_week（默认读取配置）
+            threshold: 异常分数阈值（默认按 ANOMALY_SENSITIVITY 取值）
+            warmup: 开始判定异常前所需的最少点数（默认读取配置）
+        """
+        settings = get_settings()
+        self.alpha = alpha or settings.ANOMALY_ONLINE_ALPHA
+        self.window_size = window_size or settings.ANOMALY_ONLINE_WINDOW
+        self.seasonality = seasonality or settings.ANOMALY_ONLINE_SEASONALITY
+        self.threshold = threshold or settings.get_sensitivity_threshold()
+        self.warmup = warmup or settings.ANOMALY_ONLINE_WARMUP
+        # 每个时段的样本远少于整体，季节均值用更大的平滑系数以便尽快收敛
+        self.season_alpha = max(self.alpha, 0.3)
+        self.enabled = settings.ANOMALY_DETECTION_ENABLED
+
+        if self.seasonality not in SEASONALITIES:
+            raise ValueError(f"不支持的季节划分方式: {self.seasonality}")
+
+        self.store = OnlineStateStore(state_path or settings.ANOMALY_STATE_PATH)
+        self._states: Dict[str, SeriesState] = {
+            key: SeriesState.from_dict(data, self.window_size)
+            for key, data in self.store.load().items()
+        }
+        self._lock = threading.Lock()
+
+        logger.info(
+            f"[OnlineAnomalyDetector] 初始化完成，已恢复 {len(self._states)} 个序列状态 "
+            f"(alpha={self.alpha}, window={self.window_size}, seasonality={self.seasonality})"
+        )
+
+    # ========== 状态 ==========
+
+    def state(self, key: str) -> SeriesState:
+        """获取（必要时创建）序列状态"""
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = SeriesState(key=key, window=deque(maxlen=self.window_size))
+                self._states[key] = state
+            return state
+
+    def last_timestamp(self, key: str) -> Optional[pd.Timestamp]:
+        """序列最后处理的时间点（增量查询的起点），没有状态时返回None"""
+        with self._lock:
+            state = self._states.get(key)
+        if state is None or state.last_timestamp is None:
+            return None
+        return pd.Timestamp(state.last_timestamp)
+
+    def reset(self, key: Optional[str] = None):
+        """清除指定序列（或全部序列）的状态"""
+        with self._lock:
+            if key is None:
+                self._states.clear()
+            else:
+                self._states.pop(key, None)
+        self.save()
+
+    def save(self):
+        """持久化全部状态"""
+        with self._lock:
+            snapshot = {key: state.to_dict() for key, state in self._states.items()}
+        self.store.save(snapshot)
+
+    # ========== 打分与更新 ==========
+
+    def _season_slot(self, timestamp: pd.Timestamp) -> Optional[int]:
+        _, slot_of = SEASONALITIES[self.seasonality]
+        return slot_of(timestamp) if slot_of else None
+
+    def _score(self, state: SeriesState, value: float, slot: Optional[int]) -> Dict[str, Any]:
+        """用更新前的状态对新值打分"""
+        scores: Dict[str, float] = {}
+        expected = None
+
+        if state.count >= 2 and state.var > 0:
+            scores["ewma"] = abs(value - state.mean) / math.sqrt(state.var)
+            expected = state.mean
+
+        if len(state.window) >= 3:
+            window = np.asarray(state.window)
+            median = float(np.median(window))
+            mad = float(np.median(np.abs(window - median)))
+            if mad > 0:
+                scores["mad"] = abs(value - median) / (MAD_SCALE * mad)
+            if expected is None:
+                expected = median
+
+        seasonal_ready = (
+            slot is not None
+            and state.season_count.get(slot, 0) >= 2
+            and state.residual_count >= self.warmup
+            and state.residual_var > 0
+        )
+        if seasonal_ready:
+            season_mean = state.season_mean[slot]
+            scores["seasonal"] = abs(value - season_mean) / math.sqrt(state.residual_var)
+            expected = season_mean
+
+        if seasonal_ready:
+            flagged = scores["seasonal"] > self.threshold
+        else:
+            votes = sum(score > self.threshold for score in scores.values())
+            flagged = bool(scores) and votes >= min(2, len(scores))
+        return {"scores": scores, "expected": expected, "is_anomaly": state.count >= self.warmup and flagged}
+
+    def _update_state(self, state: SeriesState, value: float, slot: Optional[int]):
+        """O(1) 更新状态（EWMA/EWMVar、滚动窗口、季节基线）"""
+        if state.count == 0:
+            state.mean, state.var = value, 0.0
+        else:
+            diff = value - state.mean
+            increment = self.alpha * diff
+            state.mean += increment
+            state.var = (1 - self.alpha) * (state.var + diff * increment)
+        state.count += 1
+        state.window.append(value)
+
+        if slot is not None:
+            seen = state.season_count.get(slot, 0)
+            if seen == 0:
+                state.season_mean[slot] = value
+            else:
+                residual = value - state.season_mean[slot]
+                state.season_mean[slot] += self.season_alpha * residual
+                # 季节残差方差（所有时段合并，零均值假设）
+                if state.residual_count == 0:
+                    state.residual_var = residual ** 2
+                else:
+                    state.residual_var = (1 - self.alpha) * state.residual_var + self.alpha * residual ** 2
+                state.residual_count += 1
+            state.season_count[slot] = seen + 1
+
+    def update(self, key: str, timestamp: Any, value: float) -> Optional[OnlinePoint]:
+        """
+        处理一个新数据点
+
+        Args:
+            key: 序列标识
+            timestamp: 时间点
+            value: 数值
+
+        Returns:
+            检测结果；时间点不晚于已处理的最后时间点或数值无效时返回None（重复执行是幂等的）
+        """
+        timestamp = pd.Timestamp(timestamp)
+        if value is None or not np.isfinite(value):
+            return None
+
+        state = self.state(key)
+        with self._lock:
+            if state.last_timestamp is not None and timestamp <= pd.Timestamp(state.last_timestamp):
+                return None
+
+            slot = self._season_slot(timestamp)
+            scored = self._score(state, float(value), slot)
+            self._update_state(state, float(value), slot)
+            state.last_timestamp = timestamp.isoformat()
+            state.last_value = float(value)
+
+        direction = None
+        if scored["is_anomaly"] and scored["expected"] is not None:
+            direction = "high" if value > scored["expected"] else "low"
+
+        return OnlinePoint(
+            key=key,
+            timestamp=timestamp.isoformat(),
+            value=float(value),
+            expected=scored["expected"],
+            scores={name: round(score, 3) for name, score in scored["scores"].items()},
+            is_anomaly=scored["is_anomaly"],
+            direction=direction,
+        )
+
+    def update_frame(
+        self,
+        key: str,
+        df: pd.DataFrame,
+        time_column: str,
+        value_column: str,
+        persist: bool = True
+    ) -> List[OnlinePoint]:
+        """
+        用最新一个周期的查询结果更新序列（按时间排序，已处理过的时间点自动跳过）
+
+        Args:
+            key: 序列标识
+            df: 查询结果
+            time_column: 时间列名
+            value_column: 数值列名
+            persist: 是否在更新后持久化状态
+
+        Returns:
+            新处理的数据点检测结果
+        """
+        if df.empty:
+            return []
+
+        times = pd.to_datetime(df[time_column])
+        values = pd.to_numeric(df[value_column], errors="coerce")
+        order = np.argsort(times.to_numpy(), kind="stable")
+
+        points = []
+        for ts, value in zip(times.to_numpy()[order], values.to_numpy()[order]):
+            point = self.update(key, ts, value)
+            if point is not None:
+                points.append(point)
+
+        if persist:
+            self.save()
+        return points
+
+    def check(
+        self,
+        key: str,
+        fetch: Callable[[Optional[pd.Timestamp]], pd.DataFrame],
+        time_column: str,
+        value_column: str
+    ) -> List[OnlinePoint]:
+        """
+        执行一次增量检查
+
+        Args:
+            key: 序列标识
+            fetch: 查询函数，参数为上次处理的最后时间点（首次为None，此时应返回初始化所需的历史窗口）
+            time_column: 时间列名
+            value_column: 数值列名
+
+        Returns:
+            被判定为异常的数据点
+        """
+        if not self.enabled:
+            logger.info("[OnlineAnomalyDetector] 异常检测未启用，跳过")
+            return []
+
+        since = self.last_timestamp(key)
+        df = fetch(since)
+        points = self.update_frame(key, df, time_column, value_column)
+        anomalies = [p for p in points if p.is_anomaly]
+
+        logger.info(
+            f"[OnlineAnomalyDetector] {key}: 起点 {since.isoformat() if since is not None else '(初始化)'}，"
+            f"新增 {len(points)} 个点，异常 {len(anomalies)} 个"
+        )
+        for anomaly in anomalies:
+            logger.warning(f"[OnlineAnomalyDetector] {key} @ {anomaly.timestamp}: {anomaly.description}")
+        return anomalies
+
+
+_detector: Optional[OnlineAnomalyDetector] = None
+_detector_lock = threading.Lock()
+
+
+def get_online_detector() -> OnlineAnomalyDetector:
+    """获取进程内共享的在线异常检测器"""
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            _detector = OnlineAnomalyDetector()
+        return _detector
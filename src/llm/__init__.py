@@ -0,0 +1,9 @@
+"""
+LLM模块
+包含模型路由（按调用点选择模型、快速模型优先的级联策略）
+和共享的LLM客户端注册表（连接池复用、启动预热）
+"""
+from .client_registry import LLMClientRegistry, get_llm_registry
+from .router import ModelRouter, CascadeResult, get_model_router
+
+__all__ = ['LLMClientRegistry', 'get_llm_registry', 'ModelRouter', 'CascadeResult', 'get_model_router']
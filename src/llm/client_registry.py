@@ -0,0 +1,150 @@
+"""
+LLM客户端注册表
+在进程内共享HTTP连接池和模型实例：
+- 每个 base URL 一个 keep-alive 连接池（httpx.Client），所有模型共用，避免重复TLS握手
+- 每个 (base URL, API密钥, 模型ID) 一个 OpenAIServerModel 实例，跨工具和 reset() 复用
+- 可选的启动预热，提前建立连接，隐藏首次调用的延迟
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from smolagents.models import OpenAIServerModel
+from loguru import logger
+
+from config.settings import get_settings
+
+
+class LLMClientRegistry:
+    """LLM客户端注册表（线程安全）"""
+
+    def __init__(self):
+        """初始化注册表"""
+        self.settings = get_settings()
+        self._http_clients: Dict[str, httpx.Client] = {}
+        self._models: Dict[Tuple[str, str, str], OpenAIServerModel] = {}
+        self._lock = threading.Lock()
+
+    def _pool_key(self, api_base: Optional[str]) -> str:
+        return (api_base or "").rstrip("/")
+
+    def http_client(self, api_base: Optional[str] = None) -> httpx.Client:
+        """
+        获取指定 base URL 的共享HTTP客户端
+
+        Args:
+            api_base: API基础URL（可选，默认LITELLM_BASE_URL）
+
+        Returns:
+            httpx.Client
+        """
+        key = self._pool_key(api_base if api_base is not None else self.settings.LITELLM_BASE_URL)
+        with self._lock:
+            client = self._http_clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=self.settings.LLM_POOL_MAX_CONNECTIONS,
+                        max_keepalive_connections=self.settings.LLM_POOL_MAX_KEEPALIVE,
+                        keepalive_expiry=self.settings.LLM_KEEPALIVE_EXPIRY,
+                    ),
+                    timeout=httpx.Timeout(self.settings.LLM_REQUEST_TIMEOUT, connect=10.0),
+                )
+                self._http_clients[key] = client
+                logger.info(f"[LLMClientRegistry] 创建连接池: {key or '(默认)'}")
+            return client
+
+    def get_model(
+        self,
+        model_id: str,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None
+    ) -> OpenAIServerModel:
+        """
+        获取（复用）模型实例
+
+        Args:
+            model_id: 模型ID
+            api_key: API密钥（可选，默认LITELLM_API_KEY）
+            api_base: API基础URL（可选，默认LITELLM_BASE_URL）
+
+        Returns:
+            OpenAIServerModel
+        """
+        api_key = api_key or self.settings.LITELLM_API_KEY
+        api_base = api_base or self.settings.LITELLM_BASE_URL
+        key = (self._pool_key(api_base), api_key, model_id)
+
+        with self._lock:
+            model = self._models.get(key)
+        if model is not None:
+            return model
+
+        http_client = self.http_client(api_base)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = OpenAIServerModel(
+                    model_id=model_id,
+                    api_key=api_key,
+                    api_base=api_base,
+                    client_kwargs={"http_client": http_client},
+                )
+                self._models[key] = model
+                logger.info(f"[LLMClientRegistry] 创建模型实例: {model_id}")
+            return model
+
+    def warm_up(self, model_ids: Optional[List[str]] = None) -> Dict[str, Optional[float]]:
+        """
+        并行预热连接（请求 /models，不消耗token）
+
+        Args:
+            model_ids: 需要预热的模型ID（默认 LITELLM_MODEL 和 LLM_FAST_MODEL）
+
+        Returns:
+            {模型ID: 耗时（秒），失败为None}
+        """
+        if model_ids is None:
+            model_ids = [self.settings.LITELLM_MODEL, self.settings.LLM_FAST_MODEL]
+        model_ids = list(dict.fromkeys(model_ids))
+
+        def ping(model_id: str) -> Optional[float]:
+            start = time.time()
+            try:
+                self.get_model(model_id).client.with_options(max_retries=0, timeout=10.0).models.list()
+                return time.time() - start
+            except Exception as e:
+                logger.warning(f"[LLMClientRegistry] 预热失败 {model_id}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=len(model_ids) or 1) as executor:
+            latencies = dict(zip(model_ids, executor.map(ping, model_ids)))
+
+        logger.info(
+            "[LLMClientRegistry] 预热完成: "
+            + ", ".join(f"{m}={'失败' if t is None else f'{t:.2f}秒'}" for m, t in latencies.items())
+        )
+        return latencies
+
+    def close(self):
+        """关闭所有连接池"""
+        with self._lock:
+            for client in self._http_clients.values():
+                client.close()
+            self._http_clients.clear()
+            self._models.clear()
+
+
+_registry: Optional[LLMClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_llm_registry() -> LLMClientRegistry:
+    """获取进程内共享的LLM客户端注册表"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = LLMClientRegistry()
+        return _registry
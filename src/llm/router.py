@@ -0,0 +1,269 @@
+"""
+模型路由
+按调用点（call site）选择模型，并支持级联策略：
+先使用轻量快速模型，结果未通过校验或置信度不足时再升级到大模型
+"""
+import time
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from smolagents.models import OpenAIServerModel
+from loguru import logger
+
+from config.settings import get_settings
+from src.llm.client_registry import get_llm_registry
+
+
+# 调用点名称
+CALL_SITE_EVENT_SCHEMA = "event_schema"
+CALL_SITE_SQL_GENERATION = "sql_generation"
+CALL_SITE_ANALYST_PLAN = "analyst_plan"
+CALL_SITE_DRILLDOWN_DECISION = "drilldown_decision"
+CALL_SITE_SYNTHESIS = "synthesis"
+
+# 各调用点的默认模型层级（"fast" = LLM_FAST_MODEL，"main" = LITELLM_MODEL）
+DEFAULT_ROUTES: Dict[str, List[str]] = {
+    CALL_SITE_EVENT_SCHEMA: ["fast"],
+    CALL_SITE_SQL_GENERATION: ["fast", "main"],
+    CALL_SITE_ANALYST_PLAN: ["main"],
+    CALL_SITE_DRILLDOWN_DECISION: ["fast", "main"],
+    CALL_SITE_SYNTHESIS: ["main"],
+}
+
+
+@dataclass
+class TierStats:
+    """单个模型层级的统计"""
+    calls: int = 0
+    accepted: int = 0
+    escalated: int = 0
+    errors: int = 0
+    total_latency: float = 0.0
+
+    @property
+    def avg_latency(self) -> float:
+        return self.total_latency / self.calls if self.calls else 0.0
+
+
+@dataclass
+class CascadeResult:
+    """级联调用结果"""
+    value: Any
+    model_id: str
+    tier: int
+    accepted: bool
+    latency: float
+    attempts: List[Dict[str, Any]] = field(default_factory=list)
+
+
+class ModelRouter:
+    """
+    模型路由器
+
+    - 每个调用点对应一组按顺序排列的模型（层级）
+    - cascade() 逐层调用，accept 判定通过即返回，否则升级到下一层
+    - 记录每层的调用次数、通过率和延迟，估算快速模型带来的延迟节省
+    """
+
+    def __init__(
+        self,
+        routes: Optional[Dict[str, List[str]]] = None,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None
+    ):
+        """
+        初始化模型路由器
+
+        Args:
+            routes: 调用点 -> 模型列表（可选，默认使用配置 LLM_ROUTES 覆盖 DEFAULT_ROUTES）
+            api_key: API密钥（可选）
+            api_base: API基础URL（可选）
+        """
+        self.settings = get_settings()
+        self.api_key = api_key or self.settings.LITELLM_API_KEY
+        self.api_base = api_base or self.settings.LITELLM_BASE_URL
+
+        self.routes = {site: list(tiers) for site, tiers in DEFAULT_ROUTES.items()}
+        self.routes.update(self.settings.LLM_ROUTES)
+        if routes:
+            self.routes.update(routes)
+
+        self._registry = get_llm_registry()
+        self._stats: Dict[str, Dict[str, TierStats]] = {}
+        self._lock = threading.Lock()
+
+    # ========== 模型选择 ==========
+
+    def _resolve_model_id(self, tier_name: str) -> str:
+        """将层级别名解析为模型ID"""
+        if tier_name == "fast":
+            return self.settings.LLM_FAST_MODEL
+        if tier_name == "main":
+            return self.settings.LITELLM_MODEL
+        return tier_name
+
+    def tiers(self, call_site: str) -> List[str]:
+        """
+        获取调用点的模型ID列表（去重，保持顺序）
+
+        路由未启用时只返回最后一层（大模型）
+        """
+        tier_names = self.routes.get(call_site, ["main"])
+        model_ids = list(dict.fromkeys(self._resolve_model_id(name) for name in tier_names))
+        if not self.settings.LLM_ROUTING_ENABLED:
+            return model_ids[-1:]
+        return model_ids
+
+    def get_model(self, model_id: str) -> OpenAIServerModel:
+        """获取（复用）指定模型ID的模型实例（共享连接池）"""
+        return self._registry.get_model(model_id, api_key=self.api_key, api_base=self.api_base)
+
+    def model_for(self, call_site: str, tier: int = 0) -> OpenAIServerModel:
+        """
+        获取调用点指定层级的模型（非级联调用点直接使用）
+
+        Args:
+            call_site: 调用点
+            tier: 层级序号（-1 表示最后一层），超出范围时使用最后一层
+        """
+        model_ids = self.tiers(call_site)
+        return self.get_model(model_ids[min(tier, len(model_ids) - 1)])
+
+    # ========== 级联调用 ==========
+
+    def cascade(
+        self,
+        call_site: str,
+        func: Callable[[OpenAIServerModel], Any],
+        accept: Callable[[Any], bool]
+    ) -> CascadeResult:
+        """
+        按层级级联调用
+
+        Args:
+            call_site: 调用点
+            func: 使用给定模型执行调用，返回结果
+            accept: 判定结果是否可接受（不可接受则升级）
+
+        Returns:
+            CascadeResult（所有层级都不可接受时返回最后一层的结果，accepted=False）
+
+        Raises:
+            最后一层调用抛出的异常
+        """
+        model_ids = self.tiers(call_site)
+        attempts = []
+        cascade_start = time.time()
+        last_value = None
+
+        for tier, model_id in enumerate(model_ids):
+            is_last = tier == len(model_ids) - 1
+            step_start = time.time()
+            try:
+                value = func(self.get_model(model_id))
+            except Exception as e:
+                latency = time.time() - step_start
+                self._record(call_site, model_id, latency, error=True)
+                attempts.append({"model": model_id, "latency": latency, "outcome": "error"})
+                logger.warning(f"[ModelRouter] {call_site} 层级{tier} ({model_id}) 调用失败 ({latency:.2f}秒): {e}")
+                if is_last:
+                    raise
+                continue
+
+            latency = time.time() - step_start
+            ok = bool(accept(value))
+            self._record(call_site, model_id, latency, accepted=ok, escalated=not ok and not is_last)
+            attempts.append({"model": model_id, "latency": latency, "outcome": "accepted" if ok else "rejected"})
+            last_value = value
+
+            if ok:
+                self._log_outcome(call_site, tier, model_id, model_ids, latency)
+                return CascadeResult(
+                    value=value, model_id=model_id, tier=tier, accepted=True,
+                    latency=time.time() - cascade_start, attempts=attempts
+                )
+
+            if not is_last:
+                logger.info(
+                    f"[ModelRouter] {call_site} 层级{tier} ({model_id}) 结果未通过 ({latency:.2f}秒)，"
+                    f"升级到 {model_ids[tier + 1]}"
+                )
+
+        logger.warning(f"[ModelRouter] {call_site} 所有层级结果均未通过，使用最后一层结果")
+        return CascadeResult(
+            value=last_value, model_id=model_ids[-1], tier=len(model_ids) - 1, accepted=False,
+            latency=time.time() - cascade_start, attempts=attempts
+        )
+
+    # ========== 统计 ==========
+
+    def _record(
+        self,
+        call_site: str,
+        model_id: str,
+        latency: float,
+        accepted: bool = False,
+        escalated: bool = False,
+        error: bool = False
+    ):
+        with self._lock:
+            stats = self._stats.setdefault(call_site, {}).setdefault(model_id, TierStats())
+            stats.calls += 1
+            stats.total_latency += latency
+            stats.accepted += int(accepted)
+            stats.escalated += int(escalated)
+            stats.errors += int(error)
+
+    def _log_outcome(self, call_site: str, tier: int, model_id: str, model_ids: List[str], latency: float):
+        """记录路由结果；快速模型通过时估算相对大模型的延迟节省"""
+        if tier == len(model_ids) - 1:
+            logger.info(f"[ModelRouter] {call_site} 由 {model_id} 完成 (层级{tier}, {latency:.2f}秒)")
+            return
+
+        with self._lock:
+            top_stats = self._stats.get(call_site, {}).get(model_ids[-1])
+            reference = top_stats.avg_latency if top_stats and top_stats.calls else None
+
+        if reference:
+            logger.info(
+                f"[ModelRouter] {call_site} 由快速模型 {model_id} 完成 (层级{tier}, {latency:.2f}秒)，"
+                f"相比 {model_ids[-1]} 平均 {reference:.2f}秒 节省约 {reference - latency:.2f}秒"
+            )
+        else:
+            logger.info(f"[ModelRouter] {call_site} 由快速模型 {model_id} 完成 (层级{tier}, {latency:.2f}秒)")
+
+    def get_stats(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        获取路由统计
+
+        Returns:
+            {调用点: {模型ID: {calls, accepted, escalated, errors, avg_latency}}}
+        """
+        with self._lock:
+            return {
+                call_site: {
+                    model_id: {
+                        "calls": s.calls,
+                        "accepted": s.accepted,
+                        "escalated": s.escalated,
+                        "errors": s.errors,
+                        "avg_latency": round(s.avg_latency, 3),
+                    }
+                    for model_id, s in tiers.items()
+                }
+                for call_site, tiers in self._stats.items()
+            }
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    """获取进程内共享的模型路由器"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
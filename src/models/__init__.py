@@ -1,8 +1,8 @@
 """
 Models模块
-包含任务上下文相关的数据模型
+包含任务上下文和分析指令相关的数据模型
 """
 from .task_context import TaskContext, IterationContext, QueryContext
+from .instruction import AnalysisInstruction, AnalysisPlan, EventMetric
 
-__all__ = ['TaskContext', 'IterationContext', 'QueryContext']
-
+__all__ = ['TaskContext', 'IterationContext', 'QueryContext', 'AnalysisInstruction', 'AnalysisPlan', 'EventMetric']
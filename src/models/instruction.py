@@ -0,0 +1,223 @@
+"""
+分析指令数据模型
+
+AnalystAgent 以结构化输出（JSON Schema）返回分析计划，
+这里定义计划和指令的类型，并提供严格解析与低成本修复
+"""
+import re
+import json
+import hashlib
+from typing import List, Optional, Dict, Any
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from loguru import logger
+
+
+class EventMetric(BaseModel):
+    """单个事件的简单指标（次数或去重人数）"""
+
+    name: str = Field(..., min_length=1, description="指标名称（结果列名），如'商品点击次数'")
+    event: str = Field(..., min_length=1, description="事件名，如'ProductClick'")
+    aggregate: str = Field(default="count", pattern="^(count|uv)$", description="count=次数，uv=去重人数")
+
+
+class AnalysisInstruction(BaseModel):
+    """单条查询指令（交给AutoSQLQueryTool执行）"""
+
+    task: str = Field(..., min_length=1, description="自然语言查询任务，例如'查询最近7天每天的GMV总额和订单数'")
+    time_range: str = Field(
+        default="last_7_days",
+        description="时间范围，如'last_7_days'、'yesterday'或'2024-12-01 to 2024-12-07'"
+    )
+    dimensions: List[str] = Field(default_factory=list, description="分组维度，如['date', 'channel']")
+    metrics: List[str] = Field(default_factory=list, description="指标，如['GMV总额', '订单数']")
+    filters: Dict[str, List[str]] = Field(
+        default_factory=dict,
+        description="过滤条件（维度 -> 取值列表），如{'platform': ['iOS']}"
+    )
+    funnel_steps: List[str] = Field(
+        default_factory=list,
+        description="漏斗步骤事件名（按顺序），填写时由本地漏斗引擎计算，如['ProductClick', 'AddToCartClick', 'PurchaseSuccess']"
+    )
+    funnel_window_days: Optional[int] = Field(default=None, ge=1, description="漏斗转化窗口期（天，可选）")
+    retention_events: List[str] = Field(
+        default_factory=list,
+        description="留存的[起始事件, 回访事件]，填写时由本地留存引擎计算，如['AppLaunch', 'PurchaseSuccess']"
+    )
+    retention_type: Optional[str] = Field(
+        default=None,
+        pattern="^(daily|weekly|monthly)$",
+        description="留存类型 daily/weekly/monthly（可选，默认daily）"
+    )
+    event_metrics: List[EventMetric] = Field(
+        default_factory=list,
+        description="指标都是单个事件的次数/人数时填写（与metrics一一对应），可由本地预聚合表直接回答"
+    )
+    description: Optional[str] = Field(default=None, description="该指令的目的说明（可选）")
+
+    @field_validator("task", "time_range")
+    @classmethod
+    def _strip(cls, value: str) -> str:
+        return value.strip()
+
+    @field_validator("dimensions", "metrics")
+    @classmethod
+    def _normalize_list(cls, values: List[str]) -> List[str]:
+        # 去除空值和重复项，保留顺序
+        return list(dict.fromkeys(v.strip() for v in values if v and v.strip()))
+
+    def cache_key(self) -> str:
+        """
+        指令的规范化标识，用于去重和缓存
+
+        维度和指标与顺序无关，文本大小写和空白不敏感
+        """
+        canonical = {
+            "task": re.sub(r"\s+", " ", self.task).lower(),
+            "time_range": self.time_range.lower(),
+            "dimensions": sorted(d.lower() for d in self.dimensions),
+            "metrics": sorted(m.lower() for m in self.metrics),
+        }
+        if self.filters:
+            canonical["filters"] = {
+                k.lower(): sorted(v.lower() for v in values) for k, values in sorted(self.filters.items())
+            }
+        if self.funnel_steps:
+            # 步骤顺序有意义，不排序
+            canonical["funnel_steps"] = self.funnel_steps
+            canonical["funnel_window_days"] = self.funnel_window_days
+        if self.retention_events:
+            canonical["retention_events"] = self.retention_events
+            canonical["retention_type"] = self.retention_type
+        if self.event_metrics:
+            canonical["event_metrics"] = sorted(
+                (m.name.lower(), m.event, m.aggregate) for m in self.event_metrics
+            )
+        payload = json.dumps(canonical, ensure_ascii=False, sort_keys=True)
+        return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（兼容原有的指令字典格式）"""
+        data = self.model_dump(exclude_none=True)
+        if not data.get("filters"):
+            data.pop("filters", None)
+        if not data.get("funnel_steps"):
+            data.pop("funnel_steps", None)
+        if not data.get("retention_events"):
+            data.pop("retention_events", None)
+        if not data.get("event_metrics"):
+            data.pop("event_metrics", None)
+        return data
+
+
+class AnalysisPlan(BaseModel):
+    """分析计划：自然语言计划 + 指令列表"""
+
+    plan: str = Field(default="", description="用自然语言描述的分析思路")
+    instructions: List[AnalysisInstruction] = Field(default_factory=list, description="本阶段需要执行的查询指令")
+
+    def deduplicated(self) -> "AnalysisPlan":
+        """移除规范化后重复的指令"""
+        seen = set()
+        unique = []
+        for instruction in self.instructions:
+            key = instruction.cache_key()
+            if key in seen:
+                logger.info(f"[AnalysisPlan] 移除重复指令: {instruction.task}")
+                continue
+            seen.add(key)
+            unique.append(instruction)
+        return AnalysisPlan(plan=self.plan, instructions=unique)
+
+
+def analysis_plan_response_format() -> Dict[str, Any]:
+    """
+    构建OpenAI兼容的 response_format（JSON Schema 结构化输出）
+
+    Returns:
+        response_format 参数
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "analysis_plan",
+            "schema": AnalysisPlan.model_json_schema(),
+        },
+    }
+
+
+def parse_analysis_plan(text: str) -> AnalysisPlan:
+    """
+    严格解析分析计划JSON
+
+    Args:
+        text: LLM返回的JSON文本
+
+    Returns:
+        AnalysisPlan
+
+    Raises:
+        ValueError: JSON格式错误或不符合Schema
+    """
+    try:
+        data = json.loads(text)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"分析计划不是合法的JSON: {e}")
+
+    # 兼容直接返回指令数组的情况
+    if isinstance(data, list):
+        data = {"plan": "", "instructions": data}
+
+    try:
+        return AnalysisPlan.model_validate(data)
+    except ValidationError as e:
+        raise ValueError(f"分析计划不符合Schema: {e}")
+
+
+def repair_json_text(text: str) -> str:
+    """
+    低成本修复常见的JSON格式问题（不调用LLM）
+
+    处理: Markdown代码块包裹、前后多余文字、Python变量赋值、
+    尾随逗号、Python字面量（True/False/None）、单引号字符串
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        修复后的文本（不保证一定合法）
+    """
+    if not text:
+        return text
+
+    repaired = text.strip()
+
+    # 去除Markdown代码块
+    fence_match = re.search(r"```(?:json|python)?\s*(.*?)\s*```", repaired, re.DOTALL)
+    if fence_match:
+        repaired = fence_match.group(1).strip()
+
+    # 去除Python变量赋值（如 plan = {...}）
+    repaired = re.sub(r"^\s*\w+\s*=\s*", "", repaired)
+
+    # 截取最外层的JSON对象/数组
+    starts = [i for i in (repaired.find("{"), repaired.find("[")) if i >= 0]
+    if starts:
+        start = min(starts)
+        end = max(repaired.rfind("}"), repaired.rfind("]"))
+        if end > start:
+            repaired = repaired[start:end + 1]
+
+    # Python字面量
+    repaired = re.sub(r"\bTrue\b", "true", repaired)
+    repaired = re.sub(r"\bFalse\b", "false", repaired)
+    repaired = re.sub(r"\bNone\b", "null", repaired)
+
+    # 单引号字符串 -> 双引号（仅在没有双引号时处理，避免破坏正常内容）
+    if '"' not in repaired and "'" in repaired:
+        repaired = repaired.replace("'", '"')
+
+    # 尾随逗号
+    repaired = re.sub(r",\s*([}\]])", r"\1", repaired)
+
+    return repaired
@@ -491,6 +491,7 @@ class QueryContext:
         self.data_result_column_count: Optional[int] = None
         self.data_result_columns: Optional[List[Dict[str, Any]]] = None
         self.data_preview: List[Dict[str, Any]] = []
+        self.events_analyzed: List[str] = []
 
         # 分析相关
         self.insights: List[Dict[str, Any]] = []
@@ -516,9 +517,10 @@ class QueryContext:
         column_count: Optional[int] = None,
         columns: Optional[List[Dict[str, Any]]] = None,
         data_preview: Optional[List[Dict[str, Any]]] = None,
-        download_url: Optional[str] = None
+        download_url: Optional[str] = None,
+        events_analyzed: Optional[List[str]] = None
     ):
-        """设置CSV数据信息"""
+        """设置CSV数据信息（events_analyzed 为结果涉及的事件，供结果改写区分同名指标）"""
         self.csv_path = csv_path
         self.data_result_row_count = row_count
         self.data_result_column_count = column_count
@@ -527,6 +529,8 @@ class QueryContext:
             self.data_preview = data_preview
         if download_url:
             self.download_url = download_url
+        if events_analyzed:
+            self.events_analyzed = list(events_analyzed)
 
     def complete(self, status: str = "success", error: Optional[str] = None):
         """完成查询"""
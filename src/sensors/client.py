@@ -4,7 +4,7 @@
 """
 import time
 import json
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterable, Iterator, Tuple
 from datetime import datetime, timedelta
 import requests
 from requests.adapters import HTTPAdapter
@@ -560,6 +560,143 @@ class SensorsClient:
         logger.info("=" * 60)
         return result.get("data", result)
 
+    @staticmethod
+    def _align_rows(row_columns: List[str], rows: List[List[Any]], columns: List[str]) -> List[List[Any]]:
+        """
+        按列名将行对齐到标准列（与 _combine_jsonl_response 相同的规则）
+
+        汇总行缺少的分组字段填充 None，标准列中没有的字段丢弃
+        """
+        index = {name: i for i, name in enumerate(row_columns)}
+        positions = [index.get(name) for name in columns]
+        return [
+            [row[p] if p is not None and p < len(row) else None for p in positions]
+            for row in rows
+        ]
+
+    def _stream_batches(
+        self,
+        lines: Iterable[Any],
+        batch_rows: int,
+        with_types: bool = False
+    ) -> Iterator[Tuple]:
+        """
+        将JSONL响应行解析为按列名对齐的批次
+
+        列数较少的行（GROUP BY 的汇总行）按列名对齐到列数最多的列名；
+        第一批产出前出现更完整的列名时，已缓存的行会重新对齐，之后列名固定。
+        结果为空但有列名时产出一个空批次，调用方仍能拿到列信息
+
+        Args:
+            lines: 响应行（bytes/str）
+            batch_rows: 每批行数
+            with_types: 是否同时产出列类型
+
+        Yields:
+            (列名, 行) 或 (列名, 行, 列类型)
+        """
+        columns: List[str] = []
+        types: List[str] = []
+        batch: List[List[Any]] = []
+        yielded = False
+        total_rows = 0
+
+        def emit():
+            return (columns, batch, types) if with_types else (columns, batch)
+
+        for raw_line in lines:
+            if not raw_line:
+                continue
+            try:
+                line = json.loads(raw_line)
+            except json.JSONDecodeError:
+                logger.warning(f"流式响应行解析失败: {raw_line[:200]}")
+                continue
+
+            if "error" in line or "error_code" in line or line.get("code") not in (None, "SUCCESS", 0):
+                raise SensorsAPIError(line.get("error") or line.get("message") or "API请求失败")
+
+            data_obj = line.get("data", line)
+            if not isinstance(data_obj, dict):
+                continue
+            if data_obj.get("types") and len(data_obj["types"]) > len(types):
+                types = data_obj["types"]
+
+            line_columns = data_obj.get("columns") or columns
+            if len(line_columns) > len(columns):
+                if not yielded:
+                    if batch and columns:
+                        batch = self._align_rows(columns, batch, line_columns)
+                    columns = line_columns
+                else:
+                    logger.warning(f"流式结果在首批之后出现更完整的列名，按已产出的列名对齐: {line_columns}")
+
+            rows = data_obj.get("data", data_obj.get("rows")) or []
+            if rows and not isinstance(rows[0], list):
+                rows = [rows]
+            if rows and line_columns is not columns and list(line_columns) != list(columns):
+                rows = self._align_rows(line_columns, rows, columns)
+            batch.extend(rows)
+
+            if len(batch) >= batch_rows:
+                total_rows += len(batch)
+                yield emit()
+                yielded = True
+                batch = []
+
+        if batch or (columns and not yielded):
+            total_rows += len(batch)
+            yield emit()
+
+        logger.debug(f"[SensorsClient] 流式解析完成，共 {total_rows} 行")
+
+    def stream_sql(
+        self,
+        sql: str,
+        batch_rows: int = 100000,
+        limit: int = 1000000000,
+        with_types: bool = False
+    ) -> Iterator[Tuple]:
+        """
+        流式执行SQL查询
+
+        逐行解析JSONL响应，每累积 batch_rows 行产出一批，
+        不在内存中保留完整的响应文本和全部行（适合明细级的大结果）；
+        汇总行按列名对齐，空结果产出一个只有列名的空批次
+
+        Args:
+            sql: SQL查询语句
+            batch_rows: 每批行数
+            limit: 返回结果限制
+            with_types: 是否同时产出神策返回的列类型
+
+        Yields:
+            (列名列表, 行列表)，with_types 时为 (列名列表, 行列表, 列类型列表)
+
+        Raises:
+            SensorsAPIError: 请求失败或响应中包含错误
+        """
+        url = f"{self.api_url}/api/v3/analytics/v1/model/sql/query"
+        headers = {"sensorsdata-project": self.project, "api-key": self.api_key}
+        data = {"sql": sql, "limit": str(limit)}
+
+        logger.info(f"[SensorsClient] 流式执行SQL查询\n{sql}")
+        start_time = time.time()
+
+        try:
+            with self.session.post(url, json=data, headers=headers, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                yield from self._stream_batches(response.iter_lines(), batch_rows, with_types=with_types)
+
+        except requests.exceptions.Timeout:
+            logger.error(f"API请求超时: {url}")
+            raise SensorsAPIError(f"请求超时: {url}")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"API请求异常: {str(e)}")
+            raise SensorsAPIError(f"请求失败: {str(e)}")
+
+        logger.info(f"[SensorsClient] 流式查询完成，耗时 {time.time() - start_time:.2f}秒")
+
     def get_event_list(self) -> List[str]:
         """
         获取项目中所有事件列表
@@ -0,0 +1,9 @@
+"""
+SQL模块
+包含本地SQL校验相关的组件：Schema目录、Impala SQL静态检查、字面量转义
+"""
+from .schema_catalog import SchemaCatalog, get_schema_catalog
+from .linter import SQLLinter
+from .literals import sql_literal, sql_column
+
+__all__ = ['SchemaCatalog', 'get_schema_catalog', 'SQLLinter', 'sql_literal', 'sql_column']
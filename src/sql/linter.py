@@ -0,0 +1,314 @@
+"""
+本地SQL静态检查
+在SQL提交到神策（Impala）之前完成语法解析、字段解析和事件名检查，
+校验失败的SQL直接返回错误信息用于重新生成，不会发送到神策
+"""
+import re
+from typing import Any, Dict, List, Optional, Set
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, TokenError
+from loguru import logger
+
+from src.sql.schema_catalog import SchemaCatalog, get_schema_catalog
+
+
+# sqlglot没有Impala方言，Hive方言的语法（反引号标识符、函数、LIMIT/OFFSET）与Impala最接近
+IMPALA_DIALECT = "hive"
+
+ALLOWED_TABLES = {"events", "users", "items"}
+
+# 会修改数据的语句类型
+_FORBIDDEN_NODES = (
+    exp.Insert, exp.Delete, exp.Update, exp.Drop, exp.Create, exp.Alter,
+    exp.Command, exp.Merge, exp.TruncateTable,
+)
+
+# 神策属性名以 $ 开头（如 $country），Hive方言会把 $xxx 当作变量，解析前先转为反引号标识符
+_DOLLAR_IDENTIFIER_RE = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)|(?<![\w$])\$([A-Za-z_]\w*)")
+
+
+def _quote_dollar_identifiers(sql: str) -> str:
+    """将未加引号的 $xxx 标识符转换为 `$xxx`，字符串字面量保持不变"""
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        return f"`${match.group(2)}`"
+    return _DOLLAR_IDENTIFIER_RE.sub(replace, sql)
+
+
+class SQLLinter:
+    """
+    Impala SQL静态检查器
+
+    检查内容:
+    1. 语法解析（失败时给出行列位置）
+    2. 只允许单条SELECT查询，禁止写操作
+    3. 表名白名单（events/users/items）
+    4. 事件名必须存在于埋点文档中，且在期望事件列表内
+    5. 必需条件：WHERE子句、日期过滤、事件筛选
+    6. 字段名必须能在Schema目录或查询内别名中解析
+    """
+
+    def __init__(self, catalog: Optional[SchemaCatalog] = None, strict_columns: bool = True):
+        """
+        初始化SQL检查器
+
+        Args:
+            catalog: Schema目录（可选，默认使用共享实例）
+            strict_columns: 未知字段是否作为错误（False时仅作为警告）
+        """
+        self.catalog = catalog or get_schema_catalog()
+        self.strict_columns = strict_columns
+
+    def parse(self, sql: str) -> exp.Expression:
+        """
+        解析SQL为语法树
+
+        Args:
+            sql: SQL语句
+
+        Returns:
+            sqlglot语法树
+
+        Raises:
+            ValueError: 语法错误或包含多条语句
+        """
+        prepared = _quote_dollar_identifiers(sql.strip().rstrip(';').strip())
+        try:
+            statements = [s for s in sqlglot.parse(prepared, read=IMPALA_DIALECT) if s is not None]
+        except ParseError as e:
+            details = []
+            for err in e.errors[:3]:
+                details.append(
+                    f"第{err.get('line')}行第{err.get('col')}列: {err.get('description')}"
+                    f"（附近: {str(err.get('start_context', ''))[-40:]}{err.get('highlight', '')}）"
+                )
+            raise ValueError("SQL语法错误: " + "; ".join(details or [str(e)]))
+        except TokenError as e:
+            raise ValueError(f"SQL语法错误: {e}")
+
+        if not statements:
+            raise ValueError("SQL语法错误: 未解析到任何语句")
+        if len(statements) > 1:
+            raise ValueError(f"SQL语法错误: 只允许单条语句，实际包含{len(statements)}条")
+
+        return statements[0]
+
+    def lint(self, sql: str, expected_events: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        检查SQL语句
+
+        Args:
+            sql: SQL语句
+            expected_events: 期望使用的事件列表（可选）
+
+        Returns:
+            检查结果 {"valid": bool, "errors": List[str], "warnings": List[str],
+                     "events": List[str], "tables": List[str]}
+        """
+        result = {
+            "valid": True,
+            "errors": [],
+            "warnings": [],
+            "events": [],
+            "tables": []
+        }
+
+        if not sql or not sql.strip():
+            result["errors"].append("❌ SQL为空")
+            result["valid"] = False
+            return result
+
+        try:
+            tree = self.parse(sql)
+        except ValueError as e:
+            result["errors"].append(f"❌ {e}")
+            result["valid"] = False
+            return result
+
+        self._check_statement(tree, result)
+        table_aliases, derived_aliases = self._check_tables(tree, result)
+        events = self._check_events(tree, expected_events, result)
+        self._check_required_conditions(tree, result)
+        self._check_columns(tree, events, table_aliases, derived_aliases, result)
+
+        result["valid"] = not result["errors"]
+        if not result["valid"]:
+            logger.debug(f"[SQLLinter] 检查未通过: {result['errors']}")
+        return result
+
+    # ========== 检查项 ==========
+
+    def _check_statement(self, tree: exp.Expression, result: Dict[str, Any]):
+        """只允许SELECT查询"""
+        if not isinstance(tree, exp.Query):
+            result["errors"].append("❌ SQL必须是SELECT查询")
+
+        for node_type in _FORBIDDEN_NODES:
+            node = tree.find(node_type)
+            if node is not None:
+                result["errors"].append(f"❌ 不允许的操作: {node.key.upper()}")
+
+    def _check_tables(self, tree: exp.Expression, result: Dict[str, Any]) -> tuple:
+        """
+        检查表名白名单
+
+        Returns:
+            (基础表别名映射 {小写别名: 表名}, 派生表/CTE别名集合)
+        """
+        cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        derived_aliases = set(cte_names)
+        for subquery in tree.find_all(exp.Subquery):
+            if subquery.alias:
+                derived_aliases.add(subquery.alias.lower())
+
+        table_aliases = {}
+        tables = set()
+        for table in tree.find_all(exp.Table):
+            name = table.name.lower()
+            if name in cte_names:
+                if table.alias:
+                    derived_aliases.add(table.alias.lower())
+                continue
+            tables.add(name)
+            if name not in ALLOWED_TABLES:
+                result["errors"].append(
+                    f"❌ 未知的表: {table.name}（只允许: {', '.join(sorted(ALLOWED_TABLES))}）"
+                )
+                continue
+            table_aliases[name] = name
+            if table.alias:
+                table_aliases[table.alias.lower()] = name
+
+        result["tables"] = sorted(tables)
+        return table_aliases, derived_aliases
+
+    def _check_events(
+        self,
+        tree: exp.Expression,
+        expected_events: Optional[List[str]],
+        result: Dict[str, Any]
+    ) -> List[str]:
+        """检查 event = 'X' / event IN (...) 中的事件名"""
+        sql_events = []
+        for node in tree.find_all(exp.EQ, exp.NEQ, exp.In):
+            if isinstance(node, exp.In):
+                target = node.this
+                values = node.expressions
+            else:
+                target, value = node.left, node.right
+                if not self._is_event_column(target):
+                    target, value = value, target
+                values = [value]
+
+            if not self._is_event_column(target):
+                continue
+
+            for value in values:
+                if isinstance(value, exp.Literal) and value.is_string:
+                    sql_events.append(value.this)
+
+        sql_events = list(dict.fromkeys(sql_events))
+        result["events"] = sql_events
+
+        unknown = [e for e in sql_events if not self.catalog.has_event(e)]
+        if unknown:
+            result["errors"].append(f"❌ 事件不存在于埋点文档中: {', '.join(unknown)}")
+
+        if expected_events:
+            expected_lower = {e.lower() for e in expected_events}
+            unexpected = [e for e in sql_events if e.lower() not in expected_lower]
+            if unexpected:
+                result["errors"].append(
+                    f"❌ SQL使用了未预期的事件: {', '.join(unexpected)}。"
+                    f"应该只使用: {', '.join(expected_events)}"
+                )
+
+        return sql_events
+
+    def _check_required_conditions(self, tree: exp.Expression, result: Dict[str, Any]):
+        """检查WHERE子句、日期过滤和事件筛选"""
+        wheres = list(tree.find_all(exp.Where))
+        if not wheres:
+            result["errors"].append("❌ 缺少WHERE子句")
+            return
+
+        where_columns = {
+            column.name.lower()
+            for where in wheres
+            for column in where.find_all(exp.Column)
+        }
+        if "date" not in where_columns:
+            result["errors"].append("❌ 缺少日期范围过滤（WHERE date BETWEEN ... AND ...）")
+        if "event" not in where_columns:
+            result["errors"].append("❌ 缺少事件名筛选（WHERE event = '...' 或 event IN (...)）")
+        if "is_spider_user" not in where_columns:
+            result["warnings"].append("⚠️ 建议添加爬虫过滤（is_spider_user = '正常用户'）以确保数据准确性")
+
+    def _check_columns(
+        self,
+        tree: exp.Expression,
+        events: List[str],
+        table_aliases: Dict[str, str],
+        derived_aliases: Set[str],
+        result: Dict[str, Any]
+    ):
+        """检查字段名能否在Schema目录或查询内别名中解析"""
+        known_events = [e for e in events if self.catalog.has_event(e)]
+        event_columns = self.catalog.event_columns(known_events or None)
+        table_columns = {
+            "events": event_columns,
+            "users": self.catalog.user_columns(),
+            "items": self.catalog.item_columns(),
+        }
+
+        # 查询内定义的别名（SELECT别名、派生表列名）
+        local_names = set(derived_aliases)
+        for alias in tree.find_all(exp.Alias):
+            if alias.alias:
+                local_names.add(alias.alias.lower())
+        for table_alias in tree.find_all(exp.TableAlias):
+            for column in table_alias.columns:
+                local_names.add(column.name.lower())
+
+        unqualified_scope = set(local_names)
+        for table_name in set(table_aliases.values()):
+            unqualified_scope |= table_columns[table_name]
+
+        unknown = []
+        for column in tree.find_all(exp.Column):
+            name = column.name
+            if not name or name == "*" or isinstance(column.this, exp.Star):
+                continue
+            key = name.lower()
+            qualifier = column.table.lower() if column.table else ""
+
+            if qualifier:
+                if qualifier in derived_aliases:
+                    continue
+                table_name = table_aliases.get(qualifier)
+                if table_name is None:
+                    result["errors"].append(f"❌ 未知的表别名: {column.table}.{name}")
+                    continue
+                if key not in table_columns[table_name]:
+                    unknown.append(f"{column.table}.{name}")
+            elif key not in unqualified_scope:
+                unknown.append(name)
+
+        unknown = list(dict.fromkeys(unknown))
+        if unknown:
+            message = (
+                f"未知字段: {', '.join(unknown)}"
+                f"（不在事件属性/公共属性/预置属性/虚拟属性中）"
+            )
+            if self.strict_columns:
+                result["errors"].append(f"❌ {message}")
+            else:
+                result["warnings"].append(f"⚠️ {message}")
+
+    @staticmethod
+    def _is_event_column(node: exp.Expression) -> bool:
+        """是否为 event 字段引用"""
+        return isinstance(node, exp.Column) and node.name.lower() == "event"
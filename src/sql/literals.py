@@ -0,0 +1,40 @@
+"""
+SQL字面量与字段名
+本地拼接神策SQL（漏斗、留存、预聚合表、异常监控）时共用的转义和字段名校验
+"""
+import re
+from typing import Any
+
+# 允许直接拼入SQL的属性名（事件表字段，如 $os、platform）
+_IDENTIFIER = re.compile(r"^\$?[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def sql_literal(value: Any) -> str:
+    """
+    SQL字符串字面量
+
+    Args:
+        value: 任意值（按字符串转义反斜杠和单引号）
+
+    Returns:
+        带单引号的字面量，如 'iOS'
+    """
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def sql_column(name: str) -> str:
+    """
+    校验并返回属性字段名（不合法的名称直接拒绝，避免拼接注入）
+
+    Args:
+        name: 字段名，如 '$os'、'platform'
+
+    Returns:
+        原字段名
+
+    Raises:
+        ValueError: 字段名不合法
+    """
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"不支持的属性名: {name}")
+    return name
@@ -0,0 +1,257 @@
+"""
+Schema目录
+从埋点文档（docs/Bloomchic埋点）中加载事件名、事件属性、公共属性、预置属性、
+虚拟属性和用户表属性，供本地SQL校验使用
+"""
+import os
+import re
+import json
+import threading
+from typing import Dict, List, Optional, Set
+
+from loguru import logger
+
+
+# 事件表的内置字段（不在埋点文档中，但Impala events表始终存在）
+EVENTS_BUILTIN_COLUMNS = {
+    "event", "date", "time", "distinct_id", "user_id", "_offset",
+    "day", "week_id", "month_id", "is_spider_user", "product_id",
+}
+
+# 用户表的内置字段
+USERS_BUILTIN_COLUMNS = {"id", "first_id", "second_id"}
+
+# 商品表字段（通过 events.product_id 关联）
+ITEMS_COLUMNS = {
+    "product_id", "item_id", "item_type", "tags", "category", "handle",
+    "current_price", "origin_price", "comment_count", "comment_rating", "discount",
+}
+
+# 神策SDK预置事件（不在 events/ 目录中）
+PRESET_EVENTS = {
+    "$AppStart", "$AppEnd", "$AppViewScreen", "$AppClick", "$AppStartPassively",
+    "$AppInstall", "$AppCrashed", "$pageview", "$WebClick", "$WebStay",
+    "$WebPageLeave", "$SignUp", "$MPLaunch", "$MPShow", "$MPHide", "$MPViewScreen",
+}
+
+_IDENTIFIER_RE = re.compile(r'^\$?[A-Za-z_][\w$]*$')
+
+
+class SchemaCatalog:
+    """
+    埋点Schema目录
+
+    所有名称查找均大小写不敏感（与Impala标识符规则一致）
+    """
+
+    def __init__(self, doc_root: str = "docs/Bloomchic埋点"):
+        """
+        初始化Schema目录
+
+        Args:
+            doc_root: 埋点文档根目录
+        """
+        self.doc_root = doc_root
+
+        # 事件名（保留原始大小写） 及 小写 -> 原始名 的映射
+        self.events: Dict[str, str] = {}
+        # 事件名小写 -> 事件属性 {小写属性名: 数据类型}
+        self.event_properties: Dict[str, Dict[str, str]] = {}
+        # 所有事件共享的属性（公共/预置/虚拟） {小写属性名: 数据类型}
+        self.shared_properties: Dict[str, str] = {}
+        # 用户表属性
+        self.user_properties: Dict[str, str] = {}
+
+        self._load()
+
+    # ========== 加载 ==========
+
+    def _load(self):
+        """加载所有文档"""
+        for name in EVENTS_BUILTIN_COLUMNS:
+            self.shared_properties[name] = "BUILTIN"
+
+        for filename in ("公共属性.md", "预置属性.md", "虚拟属性.md"):
+            self.shared_properties.update(self._parse_markdown_properties(filename))
+
+        self.shared_properties.update(self._load_virtual_fields())
+
+        self.user_properties = {name: "BUILTIN" for name in USERS_BUILTIN_COLUMNS}
+        self.user_properties.update(self._parse_markdown_properties("用户表.md"))
+
+        events_dir = os.path.join(self.doc_root, "events")
+        if os.path.isdir(events_dir):
+            for filename in sorted(os.listdir(events_dir)):
+                if not filename.endswith(".md"):
+                    continue
+                event_name = filename[:-3]
+                self.events[event_name.lower()] = event_name
+                self.event_properties[event_name.lower()] = self._parse_markdown_properties(
+                    os.path.join("events", filename)
+                )
+        else:
+            logger.warning(f"[SchemaCatalog] 事件目录不存在: {events_dir}")
+
+        for event_name in PRESET_EVENTS:
+            self.events.setdefault(event_name.lower(), event_name)
+
+        logger.info(
+            f"[SchemaCatalog] 加载完成: {len(self.events)} 个事件, "
+            f"{len(self.shared_properties)} 个公共字段, {len(self.user_properties)} 个用户字段"
+        )
+
+    def _parse_markdown_properties(self, relative_path: str) -> Dict[str, str]:
+        """
+        解析Markdown表格中的属性定义
+
+        以表头中包含"英文"的列作为属性名列，包含"类型"的列作为数据类型列
+
+        Args:
+            relative_path: 相对doc_root的文件路径
+
+        Returns:
+            {小写属性名: 数据类型}
+        """
+        path = os.path.join(self.doc_root, relative_path)
+        if not os.path.exists(path):
+            logger.debug(f"[SchemaCatalog] 文档不存在: {path}")
+            return {}
+
+        properties = {}
+        name_idx = None
+        type_idx = None
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line.startswith('|'):
+                        name_idx = type_idx = None
+                        continue
+
+                    cells = [cell.strip() for cell in line.strip('|').split('|')]
+
+                    # 表头行
+                    if name_idx is None:
+                        for i, cell in enumerate(cells):
+                            if name_idx is None and "英文" in cell:
+                                name_idx = i
+                            elif type_idx is None and "类型" in cell:
+                                type_idx = i
+                        continue
+
+                    # 分隔行
+                    if set(''.join(cells)) <= {'-', ':', ' '}:
+                        continue
+
+                    if name_idx >= len(cells):
+                        continue
+
+                    name = cells[name_idx].replace('`', '').strip()
+                    if not _IDENTIFIER_RE.match(name):
+                        continue
+
+                    data_type = ""
+                    if type_idx is not None and type_idx < len(cells):
+                        data_type = re.split(r'<br\s*/?>', cells[type_idx])[0].strip().upper()
+                    properties[name.lower()] = data_type
+        except Exception as e:
+            logger.warning(f"[SchemaCatalog] 解析文档失败: {path}, 错误: {e}")
+
+        return properties
+
+    def _load_virtual_fields(self) -> Dict[str, str]:
+        """加载虚拟字段定义（虚拟字段.json）"""
+        path = os.path.join(self.doc_root, "虚拟字段.json")
+        if not os.path.exists(path):
+            return {}
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                fields = json.load(f)
+            return {
+                field["name"].lower(): str(field.get("data_type", "")).upper()
+                for field in fields
+                if isinstance(field, dict) and field.get("name")
+            }
+        except Exception as e:
+            logger.warning(f"[SchemaCatalog] 解析虚拟字段失败: {e}")
+            return {}
+
+    # ========== 查询 ==========
+
+    def has_event(self, event_name: str) -> bool:
+        """事件是否存在"""
+        return event_name.lower() in self.events
+
+    def canonical_event(self, event_name: str) -> Optional[str]:
+        """返回事件的标准名称（文档中的大小写）"""
+        return self.events.get(event_name.lower())
+
+    def event_columns(self, events: Optional[List[str]] = None) -> Set[str]:
+        """
+        获取events表上可用的字段（小写）
+
+        Args:
+            events: 限定的事件列表；为None时返回所有事件的属性并集
+
+        Returns:
+            字段名集合
+        """
+        columns = set(self.shared_properties)
+        if events is None:
+            for props in self.event_properties.values():
+                columns.update(props)
+        else:
+            for event_name in events:
+                columns.update(self.event_properties.get(event_name.lower(), {}))
+        return columns
+
+    def column_type(self, column: str, events: Optional[List[str]] = None) -> Optional[str]:
+        """
+        查找字段的数据类型
+
+        Args:
+            column: 字段名
+            events: 限定的事件列表（可选）
+
+        Returns:
+            数据类型（大写），未找到返回None
+        """
+        key = column.lower()
+        if key in self.shared_properties:
+            return self.shared_properties[key]
+        candidates = events if events is not None else list(self.event_properties)
+        for event_name in candidates:
+            props = self.event_properties.get(event_name.lower(), {})
+            if key in props:
+                return props[key]
+        return self.user_properties.get(key)
+
+    def user_columns(self) -> Set[str]:
+        """用户表字段（小写）"""
+        return set(self.user_properties)
+
+    def item_columns(self) -> Set[str]:
+        """商品表字段（小写）"""
+        return set(ITEMS_COLUMNS)
+
+
+_catalog_cache: Dict[str, SchemaCatalog] = {}
+_catalog_lock = threading.Lock()
+
+
+def get_schema_catalog(doc_root: str = "docs/Bloomchic埋点") -> SchemaCatalog:
+    """
+    获取（进程内共享的）Schema目录实例
+
+    Args:
+        doc_root: 埋点文档根目录
+
+    Returns:
+        SchemaCatalog实例
+    """
+    with _catalog_lock:
+        if doc_root not in _catalog_cache:
+            _catalog_cache[doc_root] = SchemaCatalog(doc_root)
+        return _catalog_cache[doc_root]
@@ -14,6 +14,7 @@ from src.sensors.client import SensorsClient, SensorsAPIError
 from src.tools.event_schema_tool import EventSchemaTool
 from src.tools.sql_expert_tool import SQLExpertTool
 from src.tools.sql_execution_tool import SQLExecutionTool
+from src.llm.router import ModelRouter, get_model_router, CALL_SITE_EVENT_SCHEMA, CALL_SITE_SQL_GENERATION
 
 
 class AutoSQLQueryTool(Tool):
@@ -24,7 +25,8 @@ class AutoSQLQueryTool(Tool):
     1. 调用EventSchemaTool检索事件Schema
     2. 调用SQLExpertTool生成SQL
     3. 调用SQLExecutionTool执行SQL并生成CSV
-    4. 如果执行失败且是语法错误，自动重试SQL生成（最多重试2次）
+    4. 生成的SQL先在本地完成语法/字段/事件名校验，校验失败直接重新生成，不发送到神策
+    5. 如果执行失败且是语法错误，自动重试SQL生成（本地校验与执行共用重试次数，默认2次）
     """
 
     name = "auto_sql_query"
@@ -35,7 +37,8 @@ class AutoSQLQueryTool(Tool):
 1. 根据查询需求检索相关事件的Schema定义
 2. 基于Schema和查询需求生成优化的SQL语句
 3. 执行SQL查询并将结果保存为CSV文件
-4. 如果SQL执行失败且是语法错误，会自动重新生成SQL并重试（最多重试2次）
+4. SQL在发送到神策之前会先在本地校验（语法、字段名、事件名），校验失败会带着错误信息重新生成
+5. 如果SQL执行失败且是语法错误，会自动重新生成SQL并重试（最多重试2次）
 
 参数说明：
 - user_query: 用户的查询需求描述，例如"查询最近7天每天的商品点击次数"
@@ -94,7 +97,8 @@ result = auto_sql_query(
         sensors_client: Optional[SensorsClient] = None,
         event_schema_model: Optional[OpenAIServerModel] = None,
         sql_expert_model: Optional[OpenAIServerModel] = None,
-        base_url: Optional[str] = None
+        base_url: Optional[str] = None,
+        router: Optional[ModelRouter] = None
     ):
         """
         初始化自动SQL查询工具
@@ -102,8 +106,9 @@ result = auto_sql_query(
         Args:
             sensors_client: 神策客户端（可选）
             event_schema_model: 事件Schema检索使用的LLM模型（可选，默认使用轻量模型）
-            sql_expert_model: SQL生成使用的LLM模型（可选）
+            sql_expert_model: SQL生成使用的LLM模型（可选，不提供时按路由先用快速模型、校验失败再升级）
             base_url: API服务器基础URL，用于生成CSV下载链接（可选）
+            router: 模型路由器（可选，默认使用共享实例）
         """
         super().__init__()
         self.settings = get_settings()
@@ -114,23 +119,21 @@ result = auto_sql_query(
             sensors_client = self._create_sensors_client()
         self.sensors_client = sensors_client
 
+        self.router = router or get_model_router()
+
         # 初始化事件Schema检索工具（使用轻量模型）
         if event_schema_model is None:
-            event_schema_model = OpenAIServerModel(
-                model_id="gemini-2.5-flash-lite",
-                api_key=self.settings.LITELLM_API_KEY,
-                api_base=self.settings.LITELLM_BASE_URL,
-            )
+            event_schema_model = self.router.model_for(CALL_SITE_EVENT_SCHEMA)
         self.event_schema_tool = EventSchemaTool(event_schema_model)
 
-        # 初始化SQL生成工具
+        # 初始化SQL生成工具（显式指定模型时不做级联）
         if sql_expert_model is None:
-            sql_expert_model = OpenAIServerModel(
-                model_id=self.settings.LITELLM_MODEL,
-                api_key=self.settings.LITELLM_API_KEY,
-                api_base=self.settings.LITELLM_BASE_URL,
+            self.sql_expert_tool = SQLExpertTool(
+                self.router.model_for(CALL_SITE_SQL_GENERATION, tier=-1),
+                router=self.router
             )
-        self.sql_expert_tool = SQLExpertTool(sql_expert_model)
+        else:
+            self.sql_expert_tool = SQLExpertTool(sql_expert_model)
 
         # 初始化SQL执行工具
         self.sql_execution_tool = SQLExecutionTool(
@@ -361,27 +364,52 @@ result = auto_sql_query(
             step_elapsed = time.time() - step_start
             logger.info(f"[步骤 1/3] ✓ Schema检索完成 (耗时: {step_elapsed:.2f}秒)")
 
-            # 步骤2: 调用SQLExpertTool生成SQL
-            step_start = time.time()
-            logger.info("[步骤 2/3] 生成SQL语句...")
-            sql_result = self.sql_expert_tool.forward(
-                event_schemas=event_schemas,
-                user_query=user_query,
-                date_range=date_range or "last_7_days"
-            )
-            sql = self._extract_sql_from_result(sql_result)
-            step_elapsed = time.time() - step_start
-            logger.info(f"[步骤 2/3] ✓ SQL生成完成 (耗时: {step_elapsed:.2f}秒)")
-            logger.debug(f"[生成的SQL]\n{sql}")
-
-            # 步骤3: 执行SQL（带重试机制）
+            # 步骤2/3: 生成SQL → 本地校验 → 执行
+            # 本地校验失败的SQL不会发送到神策，直接带着错误信息重新生成；
+            # 执行阶段的语法错误同样触发重新生成，两者共用重试次数
             retry_count = 0
-            last_error = None
+            feedback = None
+
+            while True:
+                step_start = time.time()
+                attempt_label = f"尝试 {retry_count + 1}/{max_retries + 1}"
+                logger.info(f"[步骤 2/3] 生成SQL语句并本地校验 ({attempt_label})...")
+
+                # 构建包含之前错误信息的查询
+                query = f"{user_query}\n\n[{feedback}]" if feedback else user_query
+                generation = self.sql_expert_tool.generate_sql(
+                    event_schemas=event_schemas,
+                    user_query=query,
+                    date_range=date_range or "last_7_days"
+                )
+                sql = generation["sql"]
+                validation = generation["validation"]
+                step_elapsed = time.time() - step_start
+                logger.debug(f"[生成的SQL]\n{sql}")
+
+                if not validation["valid"]:
+                    error_list = "; ".join(validation["errors"])
+                    if retry_count >= max_retries:
+                        logger.error(f"[步骤 2/3] ✗ SQL本地校验失败，已达到最大重试次数 ({max_retries})")
+                        raise ValueError(f"SQL生成失败（本地校验未通过）: {error_list}")
+
+                    retry_count += 1
+                    logger.warning(
+                        f"[步骤 2/3] ✗ SQL本地校验失败 (耗时: {step_elapsed:.2f}秒)，"
+                        f"不发送到神策，重新生成 ({retry_count}/{max_retries})"
+                    )
+                    logger.warning(f"[校验错误] {error_list[:500]}")
+                    feedback = (
+                        f"之前生成的SQL未通过本地校验，错误信息: {error_list[:500]}\n"
+                        f"之前的SQL:\n{sql}"
+                    )
+                    continue
+
+                logger.info(f"[步骤 2/3] ✓ SQL生成并校验通过 (耗时: {step_elapsed:.2f}秒)")
 
-            while retry_count <= max_retries:
                 try:
                     step_start = time.time()
-                    logger.info(f"[步骤 3/3] 执行SQL查询 (尝试 {retry_count + 1}/{max_retries + 1})...")
+                    logger.info(f"[步骤 3/3] 执行SQL查询 ({attempt_label})...")
                     result = self.sql_execution_tool.forward(sql=sql, filename=filename)
                     step_elapsed = time.time() - step_start
                     logger.info(f"[步骤 3/3] ✓ SQL执行成功 (耗时: {step_elapsed:.2f}秒)")
@@ -393,7 +421,6 @@ result = auto_sql_query(
                     return result
 
                 except Exception as e:
-                    last_error = e
                     error_msg = str(e)
 
                     # 判断是否是语法错误
@@ -401,37 +428,16 @@ result = auto_sql_query(
                         retry_count += 1
                         logger.warning(f"[步骤 3/3] ✗ SQL执行失败（语法错误），准备重试 ({retry_count}/{max_retries})")
                         logger.warning(f"[错误信息] {error_msg[:500]}")
+                        feedback = f"之前的SQL执行失败，错误信息: {error_msg[:300]}"
+                        continue
 
-                        # 重新生成SQL（将错误信息传递给SQLExpertTool以帮助改进）
-                        step_start = time.time()
-                        logger.info(f"[重试 {retry_count}] 重新生成SQL（考虑之前的错误）...")
-                        
-                        # 构建包含错误信息的查询
-                        enhanced_query = f"{user_query}\n\n[之前的SQL执行失败，错误信息: {error_msg[:300]}]"
-                        
-                        sql_result = self.sql_expert_tool.forward(
-                            event_schemas=event_schemas,
-                            user_query=enhanced_query,
-                            date_range=date_range or "last_7_days"
-                        )
-                        sql = self._extract_sql_from_result(sql_result)
-                        step_elapsed = time.time() - step_start
-                        logger.info(f"[重试 {retry_count}] ✓ 新SQL已生成 (耗时: {step_elapsed:.2f}秒)")
-                        logger.debug(f"[新生成的SQL]\n{sql}")
+                    # 非语法错误或达到最大重试次数
+                    if retry_count >= max_retries:
+                        logger.error(f"[步骤 3/3] ✗ SQL执行失败，已达到最大重试次数 ({max_retries})")
                     else:
-                        # 非语法错误或达到最大重试次数
-                        if retry_count >= max_retries:
-                            logger.error(f"[步骤 3/3] ✗ SQL执行失败，已达到最大重试次数 ({max_retries})")
-                        else:
-                            logger.error(f"[步骤 3/3] ✗ SQL执行失败（非语法错误），不重试")
-                        logger.error(f"[错误信息] {error_msg}")
-                        raise
-
-            # 如果循环结束仍未成功，抛出最后的错误
-            if last_error:
-                raise last_error
-            else:
-                raise RuntimeError("SQL执行失败，未知错误")
+                        logger.error(f"[步骤 3/3] ✗ SQL执行失败（非语法错误），不重试")
+                    logger.error(f"[错误信息] {error_msg}")
+                    raise
 
         except Exception as e:
             error_msg = f"自动SQL查询失败: {str(e)}"
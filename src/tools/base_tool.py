@@ -148,6 +148,7 @@ class BaseSensorsTool(Tool):
         - "today" -> 今天
         - "yesterday" -> 昨天
         - "2024-01-01,2024-01-31" -> 指定日期范围
+        - "2024-01-01 to 2024-01-31" -> 指定日期范围（分析指令的写法）
 
         Args:
             date_range: 日期范围字符串
@@ -161,6 +162,7 @@ class BaseSensorsTool(Tool):
         from datetime import datetime, timedelta
 
         today = datetime.now().date()
+        date_range = date_range.strip().replace(" to ", ",")
 
         if date_range == "today":
             date_str = today.strftime("%Y-%m-%d")
@@ -4,20 +4,33 @@
 对查询结果进行深度数据分析，生成趋势、异常和统计洞察
 """
 
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from smolagents import Tool
 from loguru import logger
+import pandas as pd
 import json
 
-from src.analysis import TrendAnalyzer, StatisticsAnalyzer, AnomalyDetector, InsightGenerator
+from config.settings import get_settings
+from src.analysis import (
+    TrendAnalyzer,
+    StatisticsAnalyzer,
+    AnomalyDetector,
+    InsightGenerator,
+    BatchAnalyzer,
+    ParallelAnalyzer,
+    CorrelationAnalyzer,
+    DataSampler
+)
+from src.analysis.memo import get_analysis_cache, content_digest
 from src.analysis.utils import (
     parse_data_to_dataframe,
+    infer_time_column,
     extract_structured_data,
+    infer_numeric_columns,
     prepare_timeseries_data,
     validate_analysis_params,
     detect_data_quality_issues,
-    calculate_confidence_level,
-    sample_large_dataset
+    calculate_confidence_level
 )
 
 
@@ -36,6 +49,7 @@ class DataAnalysisTool(Tool):
     - 用户询问"趋势"、"变化"、"增长"、"下降" → 使用trend分析
     - 用户询问"异常"、"突然"、"波动"、"峰值" → 使用anomaly检测
     - 用户询问"统计"、"平均"、"分布" → 使用statistics分析
+    - 用户询问"哪些指标相关"、"领先/滞后"、"跟着变化" → 使用correlation分析
     - 用户询问"对比"、"差异" → 使用comparison分析
 
     【输入格式】
@@ -45,13 +59,17 @@ class DataAnalysisTool(Tool):
     也可以直接从SQLQueryTool的返回结果中提取<structured_data>标签内的JSON数据。
 
     analysis_types: 分析类型列表，可选值：
-    - "trend": 趋势分析（增长率、移动平均、拐点）
-    - "anomaly": 异常检测（突变点、异常值）
+    - "trend": 趋势分析（增长率、移动平均、拐点、季节分解）
+    - "anomaly": 异常检测（突变点、异常值、季节残差异常）
     - "statistics": 统计分析（均值、分位数、分布）
+    - "correlation": 相关性分析（所有指标两两的同期/滞后相关，多重检验校正后取最显著的指标对；
+      只给一个指标列时，计算它与数据中其他所有数值列的相关性）
 
     metric_columns: 要分析的指标列名列表（必填）
     time_column: 时间列名（可选，用于时间序列分析）
     context: 业务上下文描述（可选，帮助生成更准确的洞察）
+    group_column: 分组维度列名（可选，如country、channel），按 时间 × 分组 展开后
+        对每个分组序列分别做趋势/异常/统计分析，报告中展示合计最大的分组
 
     【输出】
     结构化的分析报告，包含：
@@ -77,7 +95,7 @@ class DataAnalysisTool(Tool):
         },
         "analysis_types": {
             "type": "array",
-            "description": "分析类型列表，可选: trend, anomaly, statistics"
+            "description": "分析类型列表，可选: trend, anomaly, statistics, correlation"
         },
         "metric_columns": {
             "type": "array",
@@ -92,11 +110,22 @@ class DataAnalysisTool(Tool):
             "type": "string",
             "description": "业务上下文描述（可选）",
             "nullable": True
+        },
+        "group_column": {
+            "type": "string",
+            "description": "分组维度列名（可选），每个分组值作为一条独立序列分析",
+            "nullable": True
         }
     }
 
     output_type = "string"
 
+    # 异常检测方法（季节残差检测在无规则时间索引时自动跳过）
+    anomaly_methods = ["zscore", "iqr", "sudden_change", "seasonal"]
+
+    # 分析类型 -> 结果字段
+    result_keys = {"trend": "trend_analysis", "anomaly": "anomaly_detection", "statistics": "statistics"}
+
     def __init__(self):
         """初始化数据分析工具"""
         super().__init__()
@@ -106,6 +135,12 @@ class DataAnalysisTool(Tool):
         self.statistics_analyzer = StatisticsAnalyzer()
         self.anomaly_detector = AnomalyDetector()
         self.insight_generator = InsightGenerator()
+        self.batch_analyzer = BatchAnalyzer()
+        self.parallel_analyzer = ParallelAnalyzer()
+        self.correlation_analyzer = CorrelationAnalyzer()
+        self.sampler = DataSampler()
+        self.settings = get_settings()
+        self.cache = get_analysis_cache()
 
         logger.info("DataAnalysisTool 初始化完成")
 
@@ -115,7 +150,8 @@ class DataAnalysisTool(Tool):
         analysis_types: List[str],
         metric_columns: List[str],
         time_column: Optional[str] = None,
-        context: Optional[str] = None
+        context: Optional[str] = None,
+        group_column: Optional[str] = None
     ) -> str:
         """
         执行数据分析
@@ -126,6 +162,7 @@ class DataAnalysisTool(Tool):
             metric_columns: 要分析的指标列名列表
             time_column: 时间列名
             context: 业务上下文
+            group_column: 分组维度列名（按 时间 × 分组 展开为多条序列）
 
         Returns:
             分析报告（格式化的字符串）
@@ -134,11 +171,21 @@ class DataAnalysisTool(Tool):
             logger.info(f"开始数据分析，分析类型: {analysis_types}, 指标列: {metric_columns}")
 
             # 1. 参数验证
-            valid_types = ["trend", "anomaly", "statistics"]
+            valid_types = ["trend", "anomaly", "statistics", "correlation"]
             is_valid, error_msg = validate_analysis_params(data, analysis_types, valid_types)
             if not is_valid:
                 return f"❌ 参数验证失败: {error_msg}"
 
+            # 完全相同的调用直接返回上次的报告
+            report_key = (
+                "report", content_digest(data), tuple(analysis_types), tuple(metric_columns),
+                time_column, context, group_column
+            )
+            cached_report = self.cache.get(report_key)
+            if cached_report is not None:
+                logger.info("命中分析结果缓存，直接返回报告")
+                return cached_report
+
             # 2. 解析数据
             # 首先尝试提取<structured_data>标签
             structured_data = extract_structured_data(data)
@@ -157,78 +204,56 @@ class DataAnalysisTool(Tool):
             if quality_report['has_issues']:
                 logger.warning(f"数据质量问题: {quality_report['issues']}")
 
-            # 4. 采样大数据集
-            if len(df) > 1000:
-                logger.info(f"数据量较大({len(df)}行)，进行采样分析")
-                original_size = len(df)
-                df = sample_large_dataset(df, max_rows=1000)
-                logger.info(f"采样后数据量: {len(df)}行")
-
-            # 5. 准备数据
+            # 4. 采样大数据集（分组分析先按 时间 × 分组 汇总，不对原始行采样；
+            #    没有时间列时按第一个类别列分层采样）
+            if len(df) > self.sampler.max_rows and not group_column:
+                sample_metrics = [c for c in metric_columns if c in df.columns]
+                sample_time = time_column if time_column in df.columns else infer_time_column(df)
+                categorical = [
+                    c for c in df.columns
+                    if c not in sample_metrics and c != sample_time and not pd.api.types.is_numeric_dtype(df[c])
+                ]
+                sample = self.sampler.sample(
+                    df,
+                    metric_columns=sample_metrics,
+                    time_column=sample_time,
+                    group_column=categorical[0] if categorical else None,
+                    analysis_types=analysis_types
+                )
+                df = sample.frame
+                quality_report.setdefault('warnings', []).append(sample.description)
+
+            # 5. 准备数据（所有指标共用一次时间索引解析）
+            missing_columns = [c for c in metric_columns if c not in df.columns]
+            if missing_columns:
+                logger.warning(f"指标列不存在: {missing_columns}")
+            metric_columns = [c for c in metric_columns if c in df.columns]
+            if not metric_columns:
+                return "❌ 指标列均不存在，无法进行分析"
+
+            try:
+                if group_column:
+                    series_frame, time_series = self._pivot_by_group(df, metric_columns, time_column, group_column)
+                else:
+                    _, time_series = prepare_timeseries_data(df, time_column, metric_columns[0])
+                    series_frame = df[metric_columns]
+            except Exception as e:
+                logger.error(f"数据准备失败: {str(e)}")
+                return f"❌ 数据准备失败: {str(e)}"
+
+            # 6. 执行各类分析（数值且无缺失的序列批量计算，其余逐序列分析）
             all_results = {}
+            if any(t in analysis_types for t in ("trend", "anomaly", "statistics")):
+                logger.info(f"执行分析: {len(series_frame.columns)} 个序列")
+                all_results = self._analyze_series(series_frame, analysis_types, time_series)
 
-            # 对每个指标列进行分析
-            for metric_column in metric_columns:
-                if metric_column not in df.columns:
-                    logger.warning(f"指标列不存在: {metric_column}")
-                    continue
-
-                logger.info(f"分析指标: {metric_column}")
-
-                # 准备时间序列数据
-                try:
-                    value_series, time_series = prepare_timeseries_data(
-                        df, time_column, metric_column
-                    )
-                except Exception as e:
-                    logger.error(f"数据准备失败: {str(e)}")
-                    return f"❌ 数据准备失败: {str(e)}"
-
-                # 6. 执行各类分析
-                metric_results = {}
-
-                # 趋势分析
-                if "trend" in analysis_types:
-                    logger.info("执行趋势分析...")
-                    try:
-                        trend_result = self.trend_analyzer.comprehensive_analysis(
-                            value_series,
-                            time_index=time_series,
-                            metric_name=metric_column
-                        )
-                        metric_results["trend_analysis"] = trend_result
-                    except Exception as e:
-                        logger.error(f"趋势分析失败: {str(e)}")
-                        metric_results["trend_analysis"] = {"error": str(e)}
-
-                # 异常检测
-                if "anomaly" in analysis_types:
-                    logger.info("执行异常检测...")
-                    try:
-                        anomaly_result = self.anomaly_detector.comprehensive_detection(
-                            value_series,
-                            methods=["zscore", "iqr", "sudden_change"],
-                            time_index=time_series
-                        )
-                        metric_results["anomaly_detection"] = anomaly_result
-                    except Exception as e:
-                        logger.error(f"异常检测失败: {str(e)}")
-                        metric_results["anomaly_detection"] = {"error": str(e)}
-
-                # 统计分析
-                if "statistics" in analysis_types:
-                    logger.info("执行统计分析...")
-                    try:
-                        stats_result = self.statistics_analyzer.comprehensive_analysis(
-                            value_series,
-                            metric_name=metric_column
-                        )
-                        metric_results["statistics"] = stats_result
-                    except Exception as e:
-                        logger.error(f"统计分析失败: {str(e)}")
-                        metric_results["statistics"] = {"error": str(e)}
-
-                all_results[metric_column] = metric_results
+                if group_column:
+                    all_results = self._limit_group_results(all_results, series_frame, quality_report)
+
+            # 跨指标相关性分析
+            correlation = None
+            if "correlation" in analysis_types:
+                correlation = self._analyze_correlation(df, series_frame, time_series, metric_columns, time_column)
 
             # 7. 生成洞察
             logger.info("生成分析洞察...")
@@ -239,9 +264,11 @@ class DataAnalysisTool(Tool):
                 analysis_types,
                 context,
                 quality_report,
-                len(df)
+                len(df),
+                correlation
             )
 
+            self.cache.put(report_key, output)
             logger.info("数据分析完成")
             return output
 
@@ -250,13 +277,242 @@ class DataAnalysisTool(Tool):
             logger.error(error_msg, exc_info=True)
             return f"❌ {error_msg}"
 
+    def _pivot_by_group(
+        self,
+        df: pd.DataFrame,
+        metric_columns: List[str],
+        time_column: Optional[str],
+        group_column: str
+    ) -> Tuple[pd.DataFrame, Optional[pd.Series]]:
+        """
+        按 时间 × 分组 展开为多条序列（缺失的组合补0）
+
+        Returns:
+            (序列矩阵，列名为"指标[分组值]", 时间索引)
+        """
+        if group_column not in df.columns:
+            raise ValueError(f"分组列不存在: {group_column}")
+        if time_column is None:
+            time_column = infer_time_column(df)
+        if time_column is None or time_column not in df.columns:
+            raise ValueError("按分组分析需要时间列")
+
+        times = pd.to_datetime(df[time_column])
+        values = df[metric_columns].apply(pd.to_numeric, errors="coerce")
+        pivot = values.pivot_table(
+            index=times.rename(time_column),
+            columns=df[group_column].astype(str),
+            values=metric_columns,
+            aggfunc="sum",
+            fill_value=0
+        ).sort_index()
+        pivot.columns = [f"{metric}[{group}]" for metric, group in pivot.columns]
+
+        time_series = pd.Series(pivot.index)
+        series_frame = pivot.reset_index(drop=True)
+        logger.info(f"按 {group_column} 分组展开: {len(series_frame.columns)} 个序列 × {len(series_frame)} 个时间点")
+        return series_frame, time_series
+
+    def _analyze_series(
+        self,
+        series_frame: pd.DataFrame,
+        analysis_types: List[str],
+        time_series: Optional[pd.Series]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        分析所有序列
+
+        每条序列的每类分析结果按 (序列内容, 列名, 时间索引, 分析类型) 缓存，只计算缓存中缺少的部分；
+        同一类分析缺少的序列一起计算
+        """
+        time_digest = content_digest(time_series)
+        digests = {column: content_digest(series_frame[column]) for column in series_frame.columns}
+
+        def cache_key(column: str, analysis_type: str) -> tuple:
+            methods = tuple(self.anomaly_methods) if analysis_type == "anomaly" else ()
+            return ("series", digests[column], time_digest, analysis_type, methods)
+
+        all_results: Dict[str, Dict[str, Any]] = {column: {} for column in series_frame.columns}
+        for analysis_type, result_key in self.result_keys.items():
+            if analysis_type not in analysis_types:
+                continue
+            missing = []
+            for column in series_frame.columns:
+                cached = self.cache.get(cache_key(column, analysis_type))
+                if cached is None:
+                    missing.append(column)
+                else:
+                    all_results[column][result_key] = cached
+            if not missing:
+                continue
+            if len(missing) < len(series_frame.columns):
+                logger.info(f"{analysis_type} 分析命中缓存 {len(series_frame.columns) - len(missing)} 个序列")
+
+            computed = self._compute_series(series_frame[missing], [analysis_type], time_series)
+            for column in missing:
+                result = computed[column].get(result_key)
+                all_results[column][result_key] = result
+                if isinstance(result, dict) and "error" not in result:
+                    self.cache.put(cache_key(column, analysis_type), result)
+        return all_results
+
+    def _compute_series(
+        self,
+        series_frame: pd.DataFrame,
+        analysis_types: List[str],
+        time_series: Optional[pd.Series]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        计算序列的分析结果（不经过缓存）
+
+        数值型且无缺失的序列走批量引擎（BatchAnalyzer），序列很多时按列分块交给进程池（ParallelAnalyzer），
+        其余序列或批量计算失败时逐序列调用原有分析器，结果结构相同
+        """
+        batch_columns = [
+            c for c in series_frame.columns
+            if pd.api.types.is_numeric_dtype(series_frame[c]) and not series_frame[c].isna().any()
+        ]
+        batch_results: Dict[str, Dict[str, Any]] = {}
+        if batch_columns and self.parallel_analyzer.should_parallelize(series_frame[batch_columns]):
+            try:
+                batch_results = self.parallel_analyzer.analyze(
+                    series_frame[batch_columns], analysis_types,
+                    time_index=time_series, anomaly_methods=self.anomaly_methods
+                )
+            except Exception as e:
+                logger.warning(f"多进程分析失败，回退到单进程批量分析: {str(e)}")
+        if batch_columns and not batch_results:
+            try:
+                batch_results = self.batch_analyzer.analyze(
+                    series_frame[batch_columns], analysis_types,
+                    time_index=time_series, anomaly_methods=self.anomaly_methods
+                )
+            except Exception as e:
+                logger.warning(f"批量分析失败，回退到逐序列分析: {str(e)}")
+
+        all_results = {}
+        for column in series_frame.columns:
+            if column in batch_results:
+                all_results[column] = batch_results[column]
+            else:
+                all_results[column] = self._analyze_single(series_frame[column], analysis_types, time_series, column)
+        return all_results
+
+    def _analyze_single(
+        self,
+        value_series: pd.Series,
+        analysis_types: List[str],
+        time_series: Optional[pd.Series],
+        metric_column: str
+    ) -> Dict[str, Any]:
+        """逐序列分析（原有分析器）"""
+        metric_results = {}
+
+        # 趋势分析
+        if "trend" in analysis_types:
+            try:
+                metric_results["trend_analysis"] = self.trend_analyzer.comprehensive_analysis(
+                    value_series,
+                    time_index=time_series,
+                    metric_name=metric_column
+                )
+            except Exception as e:
+                logger.error(f"趋势分析失败: {str(e)}")
+                metric_results["trend_analysis"] = {"error": str(e)}
+
+        # 异常检测
+        if "anomaly" in analysis_types:
+            try:
+                metric_results["anomaly_detection"] = self.anomaly_detector.comprehensive_detection(
+                    value_series,
+                    methods=self.anomaly_methods,
+                    time_index=time_series
+                )
+            except Exception as e:
+                logger.error(f"异常检测失败: {str(e)}")
+                metric_results["anomaly_detection"] = {"error": str(e)}
+
+        # 统计分析
+        if "statistics" in analysis_types:
+            try:
+                metric_results["statistics"] = self.statistics_analyzer.comprehensive_analysis(
+                    value_series,
+                    metric_name=metric_column
+                )
+            except Exception as e:
+                logger.error(f"统计分析失败: {str(e)}")
+                metric_results["statistics"] = {"error": str(e)}
+
+        return metric_results
+
+    def _analyze_correlation(
+        self,
+        df: pd.DataFrame,
+        series_frame: pd.DataFrame,
+        time_series: Optional[pd.Series],
+        metric_columns: List[str],
+        time_column: Optional[str]
+    ) -> Dict[str, Any]:
+        """
+        跨指标相关性分析
+
+        序列不足2条时改用数据中的所有数值列，并只检验与指定指标相关的列对；
+        时间点不唯一（未按时间汇总的明细行）时只计算同期相关
+        """
+        frame = series_frame
+        anchors = None
+        if len(frame.columns) < 2:
+            exclude = {time_column} if time_column else set()
+            numeric = [c for c in infer_numeric_columns(df) if c not in exclude]
+            frame = df[numeric].reset_index(drop=True)
+            anchors = metric_columns
+
+        max_lag = None
+        if time_series is not None and len(time_series) == len(frame):
+            times = pd.Series(time_series).reset_index(drop=True)
+            if times.is_unique:
+                frame = frame.reset_index(drop=True).loc[times.sort_values(kind="stable").index]
+            else:
+                max_lag = 0
+        else:
+            max_lag = 0
+
+        try:
+            key = ("correlation", content_digest(frame), max_lag, tuple(anchors or ()))
+            return self.cache.get_or_compute(
+                key, lambda: self.correlation_analyzer.analyze(frame, max_lag=max_lag, anchor_columns=anchors)
+            )
+        except Exception as e:
+            logger.error(f"相关性分析失败: {str(e)}")
+            return {"error": str(e)}
+
+    def _limit_group_results(
+        self,
+        results: Dict[str, Dict[str, Any]],
+        series_frame: pd.DataFrame,
+        quality_report: Dict[str, Any]
+    ) -> Dict[str, Dict[str, Any]]:
+        """报告只保留合计值最大的分组序列（全部序列均已分析）"""
+        limit = self.settings.ANALYSIS_GROUP_REPORT_LIMIT
+        if len(results) <= limit:
+            return results
+
+        top_columns = series_frame.sum().sort_values(ascending=False).index[:limit]
+        omitted = len(results) - limit
+        logger.info(f"分组序列共 {len(results)} 个，报告展示合计最大的 {limit} 个，省略 {omitted} 个")
+        quality_report.setdefault('warnings', []).append(
+            f"分组序列共{len(results)}个，仅展示合计最大的{limit}个"
+        )
+        return {column: results[column] for column in top_columns}
+
     def _format_analysis_report(
         self,
         results: Dict[str, Any],
         analysis_types: List[str],
         context: Optional[str],
         quality_report: Dict[str, Any],
-        data_size: int
+        data_size: int,
+        correlation: Optional[Dict[str, Any]] = None
     ) -> str:
         """
         格式化分析报告
@@ -267,6 +523,7 @@ class DataAnalysisTool(Tool):
             context: 业务上下文
             quality_report: 数据质量报告
             data_size: 数据量
+            correlation: 相关性分析结果（可选）
 
         Returns:
             格式化的报告字符串
@@ -284,7 +541,7 @@ class DataAnalysisTool(Tool):
         # 数据概览
         lines.append("【数据概览】")
         lines.append(f"  数据量: {data_size} 行")
-        lines.append(f"  分析指标: {', '.join(results.keys())}")
+        lines.append(f"  分析指标: {', '.join(results.keys() or (correlation or {}).get('columns', []))}")
         lines.append(f"  分析类型: {', '.join(analysis_types)}")
 
         # 置信度
@@ -342,6 +599,13 @@ class DataAnalysisTool(Tool):
                         if periodicity.get("has_periodicity"):
                             lines.append(f"  🔄 周期性: {periodicity.get('description', '')}")
 
+                    # 季节分解
+                    seasonality = trend_result.get("seasonality", {})
+                    if seasonality.get("available"):
+                        lines.append(f"  📅 季节分解({seasonality['method']}): {seasonality['description']}")
+                        if trend_result.get("trend", {}).get("basis") == "deseasonalized":
+                            lines.append("     （整体趋势基于去季节化序列）")
+
                     lines.append("")
 
             # 异常检测结果
@@ -369,6 +633,13 @@ class DataAnalysisTool(Tool):
                                     top = anomalies[0]
                                     lines.append(f"  ⚠️  统计异常: 第 {top['index']} 个点偏离 {abs(top['deviation']):.1f}%")
 
+                            # 季节残差异常
+                            if "seasonal" in results_by_method:
+                                seasonal_anomalies = results_by_method["seasonal"].get("anomalies", [])
+                                if len(seasonal_anomalies) > 0:
+                                    top = seasonal_anomalies[0]
+                                    lines.append(f"  ⚠️  季节残差异常: 第 {top['index']} 个点{top['description']}")
+
                             # 突变检测
                             if "sudden_change" in results_by_method:
                                 changes = results_by_method["sudden_change"].get("changes", [])
@@ -400,6 +671,20 @@ class DataAnalysisTool(Tool):
 
                     lines.append("")
 
+        # 相关性分析结果
+        if correlation is not None:
+            lines.append("【相关性分析】")
+            if "error" in correlation:
+                lines.append(f"  ⚠️  {correlation['error']}")
+            else:
+                lines.append(f"  {correlation['description']}")
+                for note in correlation.get("notes", []):
+                    lines.append(f"  ⚠️  {note}")
+                for pair in correlation["pairs"]:
+                    if pair["significant"]:
+                        lines.append(f"  • {pair['description']}")
+            lines.append("")
+
         # 生成综合洞察
         lines.append("【综合洞察】")
 
@@ -414,6 +699,9 @@ class DataAnalysisTool(Tool):
                 anomaly_insights = self.insight_generator.generate_anomaly_insights(metric_results["anomaly_detection"])
                 all_insights.extend(anomaly_insights)
 
+        if correlation is not None:
+            all_insights.extend(self.insight_generator.generate_correlation_insights(correlation))
+
         # 显示高优先级洞察
         high_priority_insights = [i for i in all_insights if i.get('priority') == 'high']
         if high_priority_insights:
@@ -437,10 +725,10 @@ class DataAnalysisTool(Tool):
         # 附加结构化数据供LLM解读
         lines.append("")
         lines.append("<analysis_insights>")
-        insight_json = self.insight_generator.format_for_llm(
-            {metric: results[metric] for metric in results.keys()},
-            context
-        )
+        llm_results = {metric: results[metric] for metric in results.keys()}
+        if correlation is not None:
+            llm_results["correlation"] = correlation
+        insight_json = self.insight_generator.format_for_llm(llm_results, context)
         lines.append(insight_json)
         lines.append("</analysis_insights>")
 
@@ -1,10 +1,14 @@
 """
 漏斗分析工具
 用于分析用户转化漏斗，计算各步骤转化率
+
+一次SQL查询拉取步骤事件明细，由本地漏斗引擎（FunnelEngine）计算有序窗口转化
 """
 from typing import Optional, List, Dict, Any
 from loguru import logger
+import pandas as pd
 from src.tools.base_tool import BaseSensorsTool
+from src.analysis.funnel import FunnelEngine
 
 
 class FunnelTool(BaseSensorsTool):
@@ -29,11 +33,14 @@ class FunnelTool(BaseSensorsTool):
       用户需要在多少天内完成所有步骤才算转化
     - filters: 过滤条件，JSON格式（可选）
       例如: {"platform": "iOS", "country": "CN"}
+    - breakdown: 分组属性（可选），按第1步事件上的属性值拆分漏斗
+      例如: "$os"
 
     返回：
     - 各步骤的用户数
     - 各步骤转化率
     - 总体转化率
+    - 按分组属性拆分的各组转化率（指定breakdown时）
 
     示例查询：
     - "分析从注册到首次购买的转化漏斗"
@@ -59,6 +66,11 @@ class FunnelTool(BaseSensorsTool):
             "type": "string",
             "description": "过滤条件（JSON格式），例如: {\"platform\": \"iOS\"}",
             "nullable": True
+        },
+        "breakdown": {
+            "type": "string",
+            "description": "分组属性（可选），按第1步事件上的属性值拆分，例如: $os",
+            "nullable": True
         }
     }
 
@@ -66,6 +78,7 @@ class FunnelTool(BaseSensorsTool):
 
     def __init__(self, sensors_client):
         super().__init__(sensors_client)
+        self.engine = FunnelEngine()
         logger.info("FunnelTool 初始化完成")
 
     def validate_params(self, **kwargs) -> bool:
@@ -94,7 +107,8 @@ class FunnelTool(BaseSensorsTool):
         steps: str,
         date_range: str,
         window: Optional[int] = None,
-        filters: Optional[str] = None
+        filters: Optional[str] = None,
+        breakdown: Optional[str] = None
     ) -> str:
         """
         执行漏斗分析
@@ -104,6 +118,7 @@ class FunnelTool(BaseSensorsTool):
             date_range: 日期范围
             window: 转化窗口期（天数）
             filters: 过滤条件（JSON字符串）
+            breakdown: 分组属性（可选）
 
         Returns:
             漏斗分析结果
@@ -116,7 +131,7 @@ class FunnelTool(BaseSensorsTool):
             # 解析参数
             steps_list = json.loads(steps)
             start_date, end_date = self.parse_date_range(date_range)
-            window_days = window if window is not None else 7
+            window_days = window if window is not None else self.engine.window_days
 
             # 解析过滤条件
             filters_dict = None
@@ -128,16 +143,15 @@ class FunnelTool(BaseSensorsTool):
 
             logger.debug(f"解析后的参数: steps={steps_list}, dates={start_date}~{end_date}, window={window_days}")
 
-            # 将步骤名称转换为API需要的格式
-            formatted_steps = [{"event_name": step} for step in steps_list]
-
-            # 调用神策API
-            result = self.client.query_funnel(
-                steps=formatted_steps,
-                start_date=start_date,
-                end_date=end_date,
-                window=window_days,
-                filters=filters_dict
+            # 一次明细查询 + 本地计算
+            result = self.engine.run(
+                self.client,
+                steps_list,
+                start_date,
+                end_date,
+                window_days=window_days,
+                filters=filters_dict,
+                breakdown=breakdown
             )
 
             # 格式化结果
@@ -146,12 +160,12 @@ class FunnelTool(BaseSensorsTool):
         except Exception as e:
             return self.handle_error(e)
 
-    def _format_funnel_result(self, data: Dict[str, Any], steps: List[str]) -> str:
+    def _format_funnel_result(self, result: Dict[str, Any], steps: List[str]) -> str:
         """
         格式化漏斗分析结果
 
         Args:
-            data: API返回的原始数据
+            result: FunnelEngine.run 的返回结果
             steps: 步骤列表
 
         Returns:
@@ -162,59 +176,55 @@ class FunnelTool(BaseSensorsTool):
         lines.append("=" * 60)
         lines.append("")
 
-        # 如果API返回了错误
-        if "error" in data:
-            lines.append(f"❌ 查询失败: {data['error']}")
-            return "\n".join(lines)
-
-        # 提取漏斗数据（根据实际API响应结构调整）
-        # 这里使用示例数据结构，实际需要根据神策API文档调整
-        if "data" in data:
-            funnel_data = data["data"]
+        table: pd.DataFrame = result["table"]
+        if "breakdown" in table:
+            total = table[table["breakdown"] == "全部"]
+            groups = table[table["breakdown"] != "全部"]
+        else:
+            total, groups = table, None
 
-            # 显示各步骤数据
-            lines.append("📊 各步骤统计:")
+        # 显示各步骤数据
+        lines.append(f"📊 各步骤统计（{result['window_days']}天窗口）:")
+        lines.append("")
+        for _, row in total.iterrows():
+            lines.append(f"  {row['step']}. {row['step_name']}")
+            lines.append(f"     用户数: {int(row['users']):,}")
+            if row['step'] == 1:
+                lines.append(f"     转化率: 100.00%")
+            else:
+                lines.append(f"     整体转化率: {row['overall_rate'] * 100:.2f}%")
+                lines.append(f"     上一步转化率: {row['step_rate'] * 100:.2f}%")
             lines.append("")
 
-            if isinstance(funnel_data, list):
-                total_users = None
-                for i, step_data in enumerate(funnel_data):
-                    step_name = steps[i] if i < len(steps) else f"步骤{i+1}"
-                    user_count = step_data.get("user_count", 0)
-
-                    if i == 0:
-                        total_users = user_count
-                        lines.append(f"  {i+1}. {step_name}")
-                        lines.append(f"     用户数: {user_count:,}")
-                        lines.append(f"     转化率: 100.00%")
-                    else:
-                        conversion_rate = (user_count / total_users * 100) if total_users > 0 else 0
-                        prev_count = funnel_data[i-1].get("user_count", 0)
-                        step_rate = (user_count / prev_count * 100) if prev_count > 0 else 0
-
-                        lines.append(f"  {i+1}. {step_name}")
-                        lines.append(f"     用户数: {user_count:,}")
-                        lines.append(f"     整体转化率: {conversion_rate:.2f}%")
-                        lines.append(f"     上一步转化率: {step_rate:.2f}%")
-
-                    lines.append("")
-
-                # 计算总体转化率
-                if len(funnel_data) > 1 and total_users:
-                    final_users = funnel_data[-1].get("user_count", 0)
-                    overall_rate = (final_users / total_users * 100) if total_users > 0 else 0
-                    lines.append("-" * 60)
-                    lines.append(f"🎯 总体转化率: {overall_rate:.2f}% ({final_users:,}/{total_users:,})")
-
-                    # 计算流失情况
-                    lost_users = total_users - final_users
-                    if lost_users > 0:
-                        lines.append(f"⚠️  流失用户: {lost_users:,} ({(lost_users/total_users*100):.2f}%)")
-
-        else:
-            # 如果数据结构不符合预期，显示原始数据
-            lines.append("原始数据:")
-            lines.append(self.format_result(data))
+        # 总体转化率和流失情况
+        total_users = int(total["users"].iloc[0])
+        final_users = int(total["users"].iloc[-1])
+        if total_users:
+            lines.append("-" * 60)
+            lines.append(f"🎯 总体转化率: {final_users / total_users * 100:.2f}% ({final_users:,}/{total_users:,})")
+
+            lost_users = total_users - final_users
+            if lost_users > 0:
+                lines.append(f"⚠️  流失用户: {lost_users:,} ({(lost_users / total_users * 100):.2f}%)")
+
+            # 流失最多的一步
+            drops = total["users"].shift(1) - total["users"]
+            worst = drops.iloc[1:].idxmax() if len(total) > 1 else None
+            if worst is not None and drops[worst] > 0:
+                row = total.loc[worst]
+                lines.append(f"📉 流失最多: 第{row['step'] - 1}步 → 第{row['step']}步（上一步转化率 {row['step_rate'] * 100:.2f}%）")
+
+        # 分组对比（按进入人数排序）
+        if groups is not None and len(groups):
+            lines.append("")
+            lines.append("📋 分组对比:")
+            first = groups[groups["step"] == 1].set_index("breakdown")["users"]
+            last = groups[groups["step"] == len(steps)].set_index("breakdown")
+            for name in first.sort_values(ascending=False).index[:20]:
+                lines.append(
+                    f"  {name}: 进入 {int(first[name]):,}，完成 {int(last.loc[name, 'users']):,}，"
+                    f"总体转化率 {last.loc[name, 'overall_rate'] * 100:.2f}%"
+                )
 
         lines.append("")
         lines.append("=" * 60)
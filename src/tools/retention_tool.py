@@ -1,10 +1,14 @@
 """
 留存分析工具
 用于分析用户留存率
+
+按天的用户位图由本地留存引擎（RetentionEngine）查询和缓存，留存矩阵在本地由位图交集计算
 """
 from typing import Optional, Dict, Any
 from loguru import logger
+import pandas as pd
 from src.tools.base_tool import BaseSensorsTool
+from src.analysis.retention import get_retention_engine
 
 
 class RetentionTool(BaseSensorsTool):
@@ -32,11 +36,13 @@ class RetentionTool(BaseSensorsTool):
       默认: "daily"
     - filters: 过滤条件，JSON格式（可选）
       例如: {"platform": "iOS", "country": "CN"}
+    - periods: 计算的后续周期数（可选），默认: 7
 
     返回：
     - 各时间段的留存率（例如：次日留存、3日留存、7日留存等）
     - 留存用户数
     - 起始用户数
+    - 各同期群的留存矩阵
 
     示例查询：
     - "查看最近30天的用户留存情况"
@@ -66,6 +72,11 @@ class RetentionTool(BaseSensorsTool):
             "type": "string",
             "description": "过滤条件（JSON格式），例如: {\"platform\": \"iOS\"}",
             "nullable": True
+        },
+        "periods": {
+            "type": "integer",
+            "description": "计算的后续周期数，默认: 7",
+            "nullable": True
         }
     }
 
@@ -73,6 +84,7 @@ class RetentionTool(BaseSensorsTool):
 
     def __init__(self, sensors_client):
         super().__init__(sensors_client)
+        self.engine = get_retention_engine()
         logger.info("RetentionTool 初始化完成")
 
     def validate_params(self, **kwargs) -> bool:
@@ -99,7 +111,8 @@ class RetentionTool(BaseSensorsTool):
         return_event: str,
         date_range: str,
         retention_type: Optional[str] = None,
-        filters: Optional[str] = None
+        filters: Optional[str] = None,
+        periods: Optional[int] = None
     ) -> str:
         """
         执行留存分析
@@ -110,6 +123,7 @@ class RetentionTool(BaseSensorsTool):
             date_range: 日期范围
             retention_type: 留存类型（daily/weekly/monthly）
             filters: 过滤条件（JSON字符串）
+            periods: 后续周期数
 
         Returns:
             留存分析结果
@@ -139,13 +153,15 @@ class RetentionTool(BaseSensorsTool):
                 f"dates={start_date}~{end_date}, type={ret_type}"
             )
 
-            # 调用神策API
-            result = self.client.query_retention(
-                start_event=start_event,
-                return_event=return_event,
-                start_date=start_date,
-                end_date=end_date,
+            # 按天位图（缺少的天一次查询补齐）+ 本地交集计算
+            result = self.engine.run(
+                self.client,
+                start_event,
+                return_event,
+                start_date,
+                end_date,
                 retention_type=ret_type,
+                periods=periods,
                 filters=filters_dict
             )
 
@@ -157,7 +173,7 @@ class RetentionTool(BaseSensorsTool):
 
     def _format_retention_result(
         self,
-        data: Dict[str, Any],
+        result: Dict[str, Any],
         start_event: str,
         return_event: str,
         retention_type: str
@@ -166,7 +182,7 @@ class RetentionTool(BaseSensorsTool):
         格式化留存分析结果
 
         Args:
-            data: API返回的原始数据
+            result: RetentionEngine.run 的返回结果
             start_event: 起始事件
             return_event: 回访事件
             retention_type: 留存类型
@@ -179,11 +195,6 @@ class RetentionTool(BaseSensorsTool):
         lines.append("=" * 60)
         lines.append("")
 
-        # 如果API返回了错误
-        if "error" in data:
-            lines.append(f"❌ 查询失败: {data['error']}")
-            return "\n".join(lines)
-
         # 显示分析参数
         type_name = {"daily": "日留存", "weekly": "周留存", "monthly": "月留存"}.get(
             retention_type, retention_type
@@ -191,52 +202,43 @@ class RetentionTool(BaseSensorsTool):
         lines.append(f"📊 分析类型: {type_name}")
         lines.append(f"   起始事件: {start_event}")
         lines.append(f"   回访事件: {return_event}")
+        lines.append(f"   同期群数: {len(result['counts'])}")
         lines.append("")
 
-        # 提取留存数据（根据实际API响应结构调整）
-        if "data" in data:
-            retention_data = data["data"]
+        counts: pd.DataFrame = result["counts"]
+        rates: pd.DataFrame = result["rates"]
+        total = rates.iloc[-1]
+        period_columns = [c for c in counts.columns if c not in ("cohort", "users")]
 
-            # 显示起始用户数
-            initial_users = retention_data.get("initial_users", 0)
-            lines.append(f"👥 起始用户数: {initial_users:,}")
+        # 显示起始用户数
+        initial_users = int(total["users"])
+        lines.append(f"👥 起始用户数: {initial_users:,}")
+        lines.append("")
+
+        # 合计留存率（每期只统计已完整观测到该期的同期群）
+        lines.append("📈 留存率:")
+        lines.append("")
+        for period in period_columns:
+            if pd.isna(total[period]):
+                continue
+            retained_users = int(counts[period].dropna().sum())
+            lines.append(f"  {self._format_period_name(period, retention_type)}:")
+            lines.append(f"    留存率: {total[period] * 100:.2f}%")
+            lines.append(f"    留存用户: {retained_users:,}")
             lines.append("")
 
-            # 显示留存率数据
-            if "retention_rates" in retention_data:
-                lines.append("📈 留存率:")
-                lines.append("")
-
-                rates = retention_data["retention_rates"]
-                for period, rate_data in rates.items():
-                    if isinstance(rate_data, dict):
-                        retained_users = rate_data.get("retained_users", 0)
-                        retention_rate = rate_data.get("rate", 0)
-                    else:
-                        # 如果只是一个数字
-                        retention_rate = rate_data
-                        retained_users = int(initial_users * retention_rate / 100)
-
-                    # 格式化周期名称
-                    period_name = self._format_period_name(period, retention_type)
-
-                    lines.append(f"  {period_name}:")
-                    lines.append(f"    留存率: {retention_rate:.2f}%")
-                    lines.append(f"    留存用户: {retained_users:,}")
-                    lines.append("")
-
-            # 显示留存趋势（如果有）
-            if "trend" in retention_data:
-                trend = retention_data["trend"]
-                lines.append("-" * 60)
-                lines.append(f"📉 留存趋势: {trend}")
-
-        else:
-            # 如果数据结构不符合预期，显示原始数据
-            lines.append("原始数据:")
-            lines.append(self.format_result(data))
+        # 同期群矩阵
+        lines.append("-" * 60)
+        lines.append("📋 同期群留存矩阵:")
+        for _, row in rates.iloc[:-1].iterrows():
+            cells = [
+                f"{row[period] * 100:.1f}%" if pd.notna(row[period]) else "-"
+                for period in period_columns
+            ]
+            lines.append(f"  {row['cohort']} ({int(row['users']):,}人): {' | '.join(cells)}")
 
         lines.append("")
+        lines.append(f"ℹ️  本次查询 {result['fetched_days']} 个(事件, 日期)，复用缓存 {result['cached_days']} 个")
         lines.append("=" * 60)
 
         return "\n".join(lines)
@@ -253,6 +255,8 @@ class RetentionTool(BaseSensorsTool):
             格式化后的周期名称
         """
         try:
+            if period.endswith("_0"):
+                return "当期"
             if retention_type == "daily":
                 if period.startswith("day_"):
                     day_num = period.split("_")[1]
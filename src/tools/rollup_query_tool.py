@@ -0,0 +1,178 @@
+"""
+预聚合表查询工具
+用热门事件的按天预聚合表回答简单的次数/人数查询，不经过 Impala
+
+V1 Agent 把它放在 auto_sql_query 之前；V2 编排器在调用 AutoSQLQueryTool 之前用 answer_instruction 路由
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+from loguru import logger
+
+from config.settings import get_settings
+from src.tools.base_tool import BaseSensorsTool
+from src.tools.sql_execution_tool import SQLExecutionTool
+from src.analysis.rollup import get_rollup_store
+
+
+class RollupQueryTool(BaseSensorsTool):
+    """
+    预聚合表查询工具
+
+    只回答 预聚合事件 × 日期/预聚合维度 的次数和人数；无法回答时返回 status=not_available，
+    由调用方改用 auto_sql_query
+    """
+
+    name = "rollup_query"
+    description = """用本地预聚合表快速回答热门事件的简单统计（秒级返回，不查询神策）。
+
+适用于：指定事件按天/按平台/按站点统计次数（count）或人数（uv），可带维度过滤。
+不适用于：其他事件、其他维度或属性、漏斗、留存、复杂计算，这些请直接使用 auto_sql_query。
+
+参数说明：
+- event_metrics: 指标列表（JSON字符串），每项为 {"name": 结果列名, "event": 事件名, "aggregate": "count" 或 "uv"}
+  例如: [{"name": "点击次数", "event": "ProductClick", "aggregate": "count"}]
+- date_range: 日期范围，如 "last_7_days" 或 "2024-12-01 to 2024-12-07"
+- dimensions: 分组维度（JSON数组字符串，可选），如 ["date", "platform"]
+- filters: 过滤条件（JSON字符串，可选），如 {"platform": ["iOS"]}
+- filename: CSV文件名（可选）
+
+返回值：
+- 能回答时返回与 auto_sql_query 相同格式的JSON（含 csv_path / download_url / rows / columns，source 为 local_rollup）
+- 无法回答时返回 {"status": "not_available", ...}，此时必须改用 auto_sql_query
+"""
+
+    inputs = {
+        "event_metrics": {
+            "type": "string",
+            "description": "指标列表（JSON），如 [{\"name\": \"点击次数\", \"event\": \"ProductClick\", \"aggregate\": \"count\"}]"
+        },
+        "date_range": {
+            "type": "string",
+            "description": "日期范围，如'last_7_days'或'2024-12-01 to 2024-12-07'"
+        },
+        "dimensions": {
+            "type": "string",
+            "description": "分组维度（JSON数组），如 [\"date\", \"platform\"]",
+            "nullable": True
+        },
+        "filters": {
+            "type": "string",
+            "description": "过滤条件（JSON），如 {\"platform\": [\"iOS\"]}",
+            "nullable": True
+        },
+        "filename": {
+            "type": "string",
+            "description": "CSV文件名（可选），不提供则自动生成",
+            "nullable": True
+        }
+    }
+
+    output_type = "string"
+
+    def __init__(self, sensors_client, sql_execution_tool: Optional[SQLExecutionTool] = None, base_url: Optional[str] = None):
+        """
+        初始化预聚合表查询工具
+
+        Args:
+            sensors_client: 神策API客户端
+            sql_execution_tool: 用于保存CSV和格式化结果的SQL执行工具（可选，与AutoSQLQueryTool共用时传入）
+            base_url: API服务器基础URL，用于生成CSV下载链接（可选）
+        """
+        super().__init__(sensors_client)
+        self.settings = get_settings()
+        self.store = get_rollup_store()
+        self.sql_execution_tool = sql_execution_tool or SQLExecutionTool(sensors_client, base_url=base_url)
+        self.description = (
+            f"{self.description}\n当前预聚合事件: {', '.join(self.store.events)}；"
+            f"维度: date, {', '.join(self.store.dimensions)}"
+        )
+        logger.info("RollupQueryTool 初始化完成")
+
+    def answer_instruction(self, instruction: Dict[str, Any], filename: Optional[str] = None) -> Optional[str]:
+        """
+        尝试用预聚合表回答结构化指令
+
+        Args:
+            instruction: 结构化指令（需包含 event_metrics，可含 time_range / dimensions / filters / task）
+            filename: CSV文件名（可选）
+
+        Returns:
+            与AutoSQLQueryTool相同格式的JSON字符串；无法回答时返回None
+        """
+        if not self.settings.ROLLUP_ENABLED or not isinstance(instruction, dict):
+            return None
+        event_metrics = instruction.get("event_metrics") or []
+        if not event_metrics:
+            return None
+
+        try:
+            start_date, end_date = self.parse_date_range(instruction.get("time_range", "last_7_days"))
+            filters = {
+                name: [values] if isinstance(values, str) else list(values)
+                for name, values in (instruction.get("filters") or {}).items()
+            }
+            df = self.store.answer(
+                event_metrics,
+                instruction.get("dimensions") or [],
+                filters or None,
+                start_date,
+                end_date
+            )
+            if df is None:
+                return None
+
+            execution_tool = self.sql_execution_tool
+            if not filename:
+                key = json.dumps(instruction, ensure_ascii=False, sort_keys=True, default=str)
+                filename = f"rollup_{hashlib.md5(key.encode()).hexdigest()[:8]}.csv"
+            csv_path = execution_tool._save_csv(df, os.path.join(execution_tool.default_output_dir, filename))
+
+            result_data = json.loads(execution_tool._format_result(csv_path, df, {}))
+            result_data["source"] = "local_rollup"
+            if df.attrs.get("note"):
+                result_data["note"] = df.attrs["note"]
+            return json.dumps(result_data, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning(f"[Rollup] 预聚合表回答失败，改为查询神策: {e}")
+            return None
+
+    def forward(
+        self,
+        event_metrics: str,
+        date_range: str,
+        dimensions: Optional[str] = None,
+        filters: Optional[str] = None,
+        filename: Optional[str] = None
+    ) -> str:
+        """
+        用预聚合表回答查询
+
+        Args:
+            event_metrics: 指标列表（JSON字符串）
+            date_range: 日期范围
+            dimensions: 分组维度（JSON数组字符串）
+            filters: 过滤条件（JSON字符串）
+            filename: CSV文件名（可选）
+
+        Returns:
+            结果JSON字符串；无法回答时 status 为 not_available
+        """
+        try:
+            instruction = {
+                "event_metrics": json.loads(event_metrics),
+                "time_range": date_range,
+                "dimensions": json.loads(dimensions) if dimensions else [],
+                "filters": json.loads(filters) if filters else None,
+            }
+        except (TypeError, json.JSONDecodeError) as e:
+            return json.dumps({"status": "not_available", "message": f"参数不是合法JSON: {e}，请改用 auto_sql_query"}, ensure_ascii=False)
+
+        result = self.answer_instruction(instruction, filename)
+        if result is None:
+            return json.dumps({
+                "status": "not_available",
+                "message": "预聚合表无法回答该查询（事件/维度不在预聚合范围、人数不可跨天相加或分区未就绪），请改用 auto_sql_query"
+            }, ensure_ascii=False)
+        return result
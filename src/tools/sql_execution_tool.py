@@ -6,7 +6,7 @@ import os
 import json
 import hashlib
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from pathlib import Path
 
 import pandas as pd
@@ -14,6 +14,13 @@ from smolagents import Tool
 from loguru import logger
 
 from config.settings import get_settings
+from src.analysis.digest import ResultDigester, StreamingDigest
+from src.analysis.utils import build_typed_dataframe, decode_interned_columns
+from src.utils.artifacts import RESULT_SUFFIXES, compressed_path, open_artifact, pandas_compression, split_compression
+
+
+# 返回结果中的数据预览行数
+PREVIEW_ROWS = 30
 
 
 class SQLExecutionTool(Tool):
@@ -56,6 +63,7 @@ result = sql_execution(
 注意：
 - 自动创建输出目录
 - 自动清理超过24小时的旧CSV文件
+- CSV文件可能按配置压缩保存（.csv.gz / .csv.zst），pd.read_csv 可直接读取
 - 返回的是字符串，不是元组！不要尝试解包！
 - 如需提取CSV路径，请从返回字符串的 <structured_data> 部分解析JSON
 """
@@ -135,12 +143,14 @@ result = sql_execution(
 
         return filename
 
-    def _result_to_dataframe(self, result: Dict[str, Any]) -> pd.DataFrame:
+    def _result_to_dataframe(self, result: Dict[str, Any], intern_user_ids: bool = False) -> pd.DataFrame:
         """
         将神策API返回的结果转换为pandas DataFrame
 
         Args:
             result: API返回的结果字典
+            intern_user_ids: 是否将用户ID列（USER_ID_COLUMNS）编码为整数序号，
+                供本地用户级计算使用；保存CSV时会自动还原
 
         Returns:
             pandas DataFrame
@@ -205,9 +215,10 @@ result = sql_execution(
             else:
                 raise ValueError("无法创建DataFrame: 缺少列信息且数据为空")
 
-        # 创建DataFrame
+        # 创建DataFrame（有列类型时按类型逐列构造）
         try:
-            df = pd.DataFrame(rows, columns=columns)
+            intern_columns = self.settings.USER_ID_COLUMNS if intern_user_ids else None
+            df = build_typed_dataframe(columns, rows or [], result.get('types'), intern_columns=intern_columns)
             logger.info(f"成功创建DataFrame: {len(df)} 行 x {len(df.columns)} 列")
             return df
         except Exception as e:
@@ -215,6 +226,25 @@ result = sql_execution(
             logger.error(f"数据结构: columns={columns}, rows={rows[:5] if rows else []}")
             raise ValueError(f"数据格式错误，无法创建DataFrame: {str(e)}")
 
+    def query_dataframe(self, sql: str, intern_user_ids: bool = True) -> pd.DataFrame:
+        """
+        执行SQL并返回DataFrame（不保存CSV），用于本地的用户级计算
+
+        Args:
+            sql: SQL查询语句
+            intern_user_ids: 是否将用户ID列编码为整数序号（默认是）
+
+        Returns:
+            pandas DataFrame
+
+        Raises:
+            ValueError: SQL执行失败或结果无法转换
+        """
+        result = self.client.execute_sql(sql)
+        if "error" in result:
+            raise ValueError(f"SQL执行失败: {result.get('error', '未知错误')}")
+        return self._result_to_dataframe(result, intern_user_ids=intern_user_ids)
+
     def _safe_int(self, value: Any) -> Optional[int]:
         """
         尝试将值转换为int，无法转换则返回None，避免字符串导致崩溃。
@@ -229,7 +259,7 @@ result = sql_execution(
 
     def _save_csv(self, df: pd.DataFrame, output_path: str) -> str:
         """
-        保存DataFrame为CSV文件
+        保存DataFrame为CSV文件（按 SQL_OUTPUT_COMPRESSION 压缩，路径补上 .gz/.zst 后缀）
 
         Args:
             df: pandas DataFrame
@@ -238,8 +268,10 @@ result = sql_execution(
         Returns:
             保存的文件路径
         """
+        df = decode_interned_columns(df)
+        output_path = compressed_path(output_path)
         try:
-            df.to_csv(output_path, index=False, encoding='utf-8')
+            df.to_csv(output_path, index=False, encoding='utf-8', compression=pandas_compression(output_path))
             file_size = os.path.getsize(output_path)
             logger.info(f"CSV文件已保存: {output_path}, 大小: {file_size} 字节")
             return output_path
@@ -248,13 +280,173 @@ result = sql_execution(
             # 尝试备用位置
             backup_path = f"/tmp/{os.path.basename(output_path)}"
             try:
-                df.to_csv(backup_path, index=False, encoding='utf-8')
+                df.to_csv(backup_path, index=False, encoding='utf-8', compression=pandas_compression(backup_path))
                 logger.warning(f"已保存到备用位置: {backup_path}")
                 return backup_path
             except Exception as e2:
                 logger.error(f"备用位置也保存失败: {e2}")
                 raise ValueError(f"无法保存CSV文件: {str(e)}")
 
+    @staticmethod
+    def _normalize_batch(rows: List[Any], width: int) -> Tuple[int, int]:
+        """
+        原地修正一批行的列数：短行用None补齐，长行截断；列数一致时不做复制
+
+        Args:
+            rows: 一批行数据
+            width: 目标列数
+
+        Returns:
+            (补齐的行数, 截断的行数)
+        """
+        try:
+            if set(map(len, rows)) == {width}:
+                return 0, 0
+        except TypeError:
+            pass
+
+        padded = truncated = 0
+        for i, row in enumerate(rows):
+            row = list(row) if isinstance(row, (list, tuple)) else [row]
+            if len(row) < width:
+                row += [None] * (width - len(row))
+                padded += 1
+            elif len(row) > width:
+                row = row[:width]
+                truncated += 1
+            rows[i] = row
+        return padded, truncated
+
+    def _stream_result(self, sql: str, csv_path: str) -> Tuple[str, pd.DataFrame, Optional[Dict[str, Any]]]:
+        """
+        流式执行SQL并写出CSV
+
+        结果不超过 SQL_STREAM_BUFFER_ROWS 行时整体构建DataFrame（与非流式路径一致）；
+        超过后转为边接收边写出，只保留运行计数、增量摘要和固定大小的预览
+
+        Args:
+            sql: SQL查询语句
+            csv_path: 输出文件路径
+
+        Returns:
+            (实际保存的路径, 完整DataFrame或预览行, 流式汇总；整体构建时为None)
+        """
+        batches = iter(self.client.stream_sql(sql, batch_rows=self.settings.SQL_STREAM_BATCH_ROWS, with_types=True))
+        columns: List[str] = []
+        types: List[str] = []
+        buffered: List[Any] = []
+        for columns, rows, types in batches:
+            buffered.extend(rows)
+            if len(buffered) > self.settings.SQL_STREAM_BUFFER_ROWS:
+                return self._write_stream(csv_path, columns, types, buffered, batches)
+
+        # 空结果时流式响应产出只有列名的空批次，得到带列名的空表
+        df = self._result_to_dataframe({"columns": columns, "rows": buffered, "types": types})
+        return self._save_csv(df, csv_path), df, None
+
+    def _write_stream(
+        self,
+        csv_path: str,
+        columns: List[str],
+        types: List[str],
+        buffered: List[Any],
+        batches
+    ) -> Tuple[str, pd.DataFrame, Dict[str, Any]]:
+        """
+        将已缓冲的行和剩余批次逐批写入CSV
+
+        列数以第一批为准（列名缺失或与不齐的数据列数不符时按数据推断为 col_i），
+        之后的行按该列数补齐或截断
+
+        Args:
+            csv_path: 输出文件路径
+            columns: 列名
+            types: 神策返回的列类型（每批按类型构造，与非流式路径一致）
+            buffered: 已缓冲的行（写出后清空）
+            batches: 剩余的 (列名, 行, 列类型) 批次
+
+        Returns:
+            (实际保存的路径, 预览行, 流式汇总)
+        """
+        widths = {len(row) if isinstance(row, (list, tuple)) else 1 for row in buffered}
+        if not columns or (len(widths) > 1 and len(columns) != max(widths)):
+            logger.warning(f"列名数量({len(columns)})与实际数据列数({max(widths)})不匹配，重新推断列名")
+            columns = [f"col_{i}" for i in range(max(widths))]
+        width = len(columns)
+        csv_path = compressed_path(csv_path)
+        compression = split_compression(csv_path)[1]
+        logger.info(f"结果超过 {self.settings.SQL_STREAM_BUFFER_ROWS} 行，转为流式写出: {csv_path}")
+
+        try:
+            handle = open_artifact(csv_path + ".part", "wt", compression=compression)
+        except OSError as e:
+            logger.error(f"创建CSV文件失败: {csv_path}, 错误: {e}")
+            csv_path = f"/tmp/{os.path.basename(csv_path)}"
+            logger.warning(f"改为写入备用位置: {csv_path}")
+            handle = open_artifact(csv_path + ".part", "wt", compression=compression)
+
+        digest = StreamingDigest()
+        counters = {"rows": 0, "padded": 0, "truncated": 0}
+        preview = None
+        date_range = None
+
+        def write(rows: List[Any]):
+            nonlocal preview, date_range, digest
+            padded, truncated = self._normalize_batch(rows, width)
+            counters["padded"] += padded
+            counters["truncated"] += truncated
+            chunk = build_typed_dataframe(columns, rows, types)
+            chunk.to_csv(handle, header=counters["rows"] == 0, index=False)
+            counters["rows"] += len(chunk)
+            if digest is not None:
+                try:
+                    digest.update(chunk)
+                except Exception as e:
+                    logger.warning(f"增量摘要失败，不再生成摘要: {e}")
+                    digest = None
+            if preview is None:
+                preview = chunk.head(PREVIEW_ROWS).copy()
+            if "date" in chunk.columns:
+                try:
+                    dates = chunk["date"].dropna()
+                    if len(dates):
+                        low, high = dates.min(), dates.max()
+                        date_range = (low, high) if date_range is None else (min(date_range[0], low), max(date_range[1], high))
+                except Exception:
+                    pass
+
+        try:
+            with handle:
+                write(buffered)
+                buffered.clear()
+                for _, rows, _ in batches:
+                    write(rows)
+            os.replace(csv_path + ".part", csv_path)
+        except BaseException:
+            try:
+                os.remove(csv_path + ".part")
+            except OSError:
+                pass
+            raise
+
+        if counters["padded"] or counters["truncated"]:
+            logger.warning(f"流式写出时修正了列数不一致的行: 补齐 {counters['padded']} 行, 截断 {counters['truncated']} 行")
+        file_size = os.path.getsize(csv_path)
+        logger.info(f"CSV文件已流式保存: {csv_path}, {counters['rows']} 行, 大小: {file_size} 字节")
+
+        summary = {
+            "rows": counters["rows"],
+            "date_range": f"{date_range[0]} 到 {date_range[1]}" if date_range else None,
+            "padded_rows": counters["padded"],
+            "truncated_rows": counters["truncated"],
+        }
+        if digest is not None:
+            try:
+                summary["digest"] = digest.result()
+            except Exception as e:
+                logger.warning(f"生成结果摘要失败: {e}")
+        return csv_path, preview, summary
+
     def _cleanup_old_files(self, directory: str, hours: int = 24):
         """
         清理旧的CSV文件
@@ -268,7 +460,7 @@ result = sql_execution(
             removed_count = 0
 
             for filename in os.listdir(directory):
-                if not filename.endswith('.csv'):
+                if not filename.endswith(RESULT_SUFFIXES + tuple(suffix + '.part' for suffix in RESULT_SUFFIXES)):
                     continue
 
                 filepath = os.path.join(directory, filename)
@@ -289,24 +481,32 @@ result = sql_execution(
         except Exception as e:
             logger.warning(f"清理旧文件时出错: {e}")
 
-    def _format_result(self, csv_path: str, df: pd.DataFrame, raw_result: Dict[str, Any], sql: str = "") -> str:
+    def _format_result(
+        self,
+        csv_path: str,
+        df: pd.DataFrame,
+        raw_result: Dict[str, Any],
+        sql: str = "",
+        summary: Optional[Dict[str, Any]] = None
+    ) -> str:
         """
         格式化输出结果，返回JSON格式的字符串
 
         Args:
             csv_path: CSV文件路径
-            df: DataFrame
+            df: DataFrame（流式写出时只是预览行）
             raw_result: 原始API结果
             sql: 执行的SQL语句
+            summary: 流式写出的汇总（行数、日期范围、摘要），提供时不再从df计算
 
         Returns:
             JSON格式的结果字符串
         """
         csv_filename = os.path.basename(csv_path)
 
-        # 如果配置了base_url，生成HTTP下载链接
+        # 如果配置了base_url，生成HTTP下载链接（压缩文件按CSV名下载，由服务端协商编码）
         if self.base_url:
-            download_url = f"{self.base_url.rstrip('/')}/files/{csv_filename}"
+            download_url = f"{self.base_url.rstrip('/')}/files/{split_compression(csv_filename)[0]}"
         else:
             download_url = f"file://{csv_path}"
 
@@ -316,17 +516,28 @@ result = sql_execution(
             "task_id": self._extract_task_id_from_filename(csv_filename),
             "csv_path": csv_path,
             "download_url": download_url,
-            "rows": len(df),
+            "rows": summary["rows"] if summary else len(df),
             "columns": list(df.columns),
         }
+        if summary:
+            result_data["streamed"] = True
+            if summary.get("padded_rows") or summary.get("truncated_rows"):
+                result_data["ragged_rows"] = {"padded": summary["padded_rows"], "truncated": summary["truncated_rows"]}
 
         # 提取查询信息
         query_info = {}
 
         # 尝试提取日期范围
-        if 'date' in df.columns and len(df) > 0:
+        if summary:
+            if summary.get("date_range"):
+                query_info["date_range"] = summary["date_range"]
+        elif 'date' in df.columns and len(df) > 0:
             try:
-                dates = df['date'].dropna().tolist()
+                dates = df['date'].dropna()
+                if pd.api.types.is_datetime64_any_dtype(dates) and (dates == dates.dt.normalize()).all():
+                    # 按类型构造的日期列只保留日期部分
+                    dates = dates.dt.date
+                dates = dates.tolist()
                 if dates:
                     min_date = min(dates)
                     max_date = max(dates)
@@ -337,14 +548,16 @@ result = sql_execution(
         # 尝试从SQL提取事件信息
         if sql:
             import re
-            # 提取事件名称
-            event_match = re.findall(r"event\s*(?:=|IN)\s*\(?'([^']+)'", sql, re.IGNORECASE)
+            # 提取事件名称（IN 列表中的每个事件都要记录，结果立方体按事件集合区分）
+            event_match = []
+            for single, listed in re.findall(r"\bevent\s*(?:=\s*'([^']+)'|IN\s*\(([^)]*)\))", sql, re.IGNORECASE):
+                event_match.extend([single] if single else re.findall(r"'([^']+)'", listed))
             if event_match:
-                query_info["events_analyzed"] = event_match
+                query_info["events_analyzed"] = list(dict.fromkeys(event_match))
 
         # 统计总记录数
-        if len(df) > 0:
-            query_info["total_records"] = len(df)
+        if result_data["rows"] > 0:
+            query_info["total_records"] = result_data["rows"]
 
         if query_info:
             result_data["query_info"] = query_info
@@ -356,16 +569,27 @@ result = sql_execution(
 
         # === 新增：前30行数据预览（表格形式） ===
         if len(df) > 0:
-            preview_count = min(30, len(df))
+            preview_count = min(PREVIEW_ROWS, len(df))
             # 获取预览数据
             preview_df = df.head(preview_count)
-            # 将NaN值替换为空字符串，以便在表格中显示
-            preview_df = preview_df.fillna('')
+            # 将NaN值替换为空字符串，以便在表格中显示（分类列需先转为object才能填充新值）
+            category_cols = preview_df.select_dtypes(include="category").columns
+            preview_df = preview_df.astype({c: object for c in category_cols}).fillna('')
             # 转换为简单表格字符串格式
             table_str = preview_df.to_string(index=False)
             result_data["head_preview"] = table_str
             logger.info(f"已添加前 {preview_count} 行数据预览（表格形式）到返回结果")
 
+        # 紧凑数值摘要（供综合分析使用，大小与行数无关）
+        if summary:
+            if summary.get("digest"):
+                result_data["digest"] = summary["digest"]
+        else:
+            try:
+                result_data["digest"] = ResultDigester().digest(df)
+            except Exception as e:
+                logger.warning(f"生成结果摘要失败: {e}")
+
         # 返回JSON字符串
         return json.dumps(result_data, ensure_ascii=False, indent=2)
 
@@ -407,29 +631,9 @@ result = sql_execution(
         logger.info("-" * 60)
 
         try:
-            # 1. 执行SQL查询
-            step_start = time.time()
-            logger.info("[步骤 1/5] 执行SQL查询...")
-            result = self.client.execute_sql(sql)
-            step_elapsed = time.time() - step_start
-            logger.info(f"[步骤 1/5] ✓ SQL查询执行成功 (API耗时: {step_elapsed:.2f}秒)")
-
-            # 检查是否有错误
-            if "error" in result:
-                error_msg = result.get("error", "未知错误")
-                logger.error(f"SQL执行失败: {error_msg}")
-                raise ValueError(f"SQL执行失败: {error_msg}")
-
-            # 2. 转换为DataFrame
+            # 1. 确定输出路径
             step_start = time.time()
-            logger.info("[步骤 2/5] 转换数据为DataFrame...")
-            df = self._result_to_dataframe(result)
-            step_elapsed = time.time() - step_start
-            logger.info(f"[步骤 2/5] ✓ DataFrame创建成功: {len(df)} 行 x {len(df.columns)} 列 (耗时: {step_elapsed:.2f}秒)")
-
-            # 3. 确定输出路径
-            step_start = time.time()
-            logger.info("[步骤 3/5] 确定输出路径...")
+            logger.info("[步骤 1/5] 确定输出路径...")
             output_directory = output_dir if output_dir else self.default_output_dir
             self._ensure_output_dir(output_directory)
 
@@ -441,14 +645,45 @@ result = sql_execution(
 
             csv_path = os.path.join(output_directory, filename)
             step_elapsed = time.time() - step_start
-            logger.info(f"[步骤 3/5] ✓ 输出路径: {csv_path} (耗时: {step_elapsed:.2f}秒)")
-
-            # 4. 保存CSV
-            step_start = time.time()
-            logger.info("[步骤 4/5] 保存CSV文件...")
-            csv_path = self._save_csv(df, csv_path)
-            step_elapsed = time.time() - step_start
-            logger.info(f"[步骤 4/5] ✓ CSV文件已保存 (耗时: {step_elapsed:.2f}秒)")
+            logger.info(f"[步骤 1/5] ✓ 输出路径: {csv_path} (耗时: {step_elapsed:.2f}秒)")
+
+            result: Dict[str, Any] = {}
+            summary = None
+            if self.settings.SQL_STREAM_ENABLED and hasattr(self.client, "stream_sql"):
+                # 2-4. 流式执行SQL并写出CSV（大结果不构建完整DataFrame）
+                step_start = time.time()
+                logger.info("[步骤 2-4/5] 流式执行SQL并写出CSV...")
+                csv_path, df, summary = self._stream_result(sql, csv_path)
+                step_elapsed = time.time() - step_start
+                rows = summary["rows"] if summary else len(df)
+                logger.info(f"[步骤 2-4/5] ✓ CSV文件已保存: {rows} 行 x {len(df.columns)} 列 (耗时: {step_elapsed:.2f}秒)")
+            else:
+                # 2. 执行SQL查询
+                step_start = time.time()
+                logger.info("[步骤 2/5] 执行SQL查询...")
+                result = self.client.execute_sql(sql)
+                step_elapsed = time.time() - step_start
+                logger.info(f"[步骤 2/5] ✓ SQL查询执行成功 (API耗时: {step_elapsed:.2f}秒)")
+
+                # 检查是否有错误
+                if "error" in result:
+                    error_msg = result.get("error", "未知错误")
+                    logger.error(f"SQL执行失败: {error_msg}")
+                    raise ValueError(f"SQL执行失败: {error_msg}")
+
+                # 3. 转换为DataFrame
+                step_start = time.time()
+                logger.info("[步骤 3/5] 转换数据为DataFrame...")
+                df = self._result_to_dataframe(result)
+                step_elapsed = time.time() - step_start
+                logger.info(f"[步骤 3/5] ✓ DataFrame创建成功: {len(df)} 行 x {len(df.columns)} 列 (耗时: {step_elapsed:.2f}秒)")
+
+                # 4. 保存CSV
+                step_start = time.time()
+                logger.info("[步骤 4/5] 保存CSV文件...")
+                csv_path = self._save_csv(df, csv_path)
+                step_elapsed = time.time() - step_start
+                logger.info(f"[步骤 4/5] ✓ CSV文件已保存 (耗时: {step_elapsed:.2f}秒)")
 
             # 5. 清理旧文件
             step_start = time.time()
@@ -459,7 +694,7 @@ result = sql_execution(
             logger.info(f"[步骤 5/5] ✓ 清理完成 (耗时: {step_elapsed:.2f}秒)")
 
             # 6. 格式化返回结果
-            output = self._format_result(csv_path, df, result, sql=sql)
+            output = self._format_result(csv_path, df, result, sql=sql, summary=summary)
 
             tool_elapsed = time.time() - tool_start_time
             logger.info("=" * 60)
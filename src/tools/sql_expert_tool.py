@@ -10,6 +10,11 @@ from datetime import datetime, timedelta
 from smolagents import Tool
 from loguru import logger
 
+from config.settings import get_settings
+from src.sql.linter import SQLLinter
+from src.sql.schema_catalog import get_schema_catalog
+from src.llm.router import ModelRouter, CALL_SITE_SQL_GENERATION
+
 
 class SQLExpertTool(Tool):
     """
@@ -68,20 +73,28 @@ sql_expert(
 
     output_type = "string"
 
-    def __init__(self, model):
+    def __init__(self, model, router: Optional[ModelRouter] = None):
         """
         初始化SQL专家工具
 
         Args:
             model: LLM模型实例
+            router: 模型路由器（可选）；提供时先用快速模型生成，本地校验失败再升级到大模型
         """
         super().__init__()
         self.model = model
+        self.router = router
         self.doc_root = "docs/Bloomchic埋点"
 
         # 加载上下文文档
         self.context_docs = self._load_context_docs()
 
+        # 本地SQL检查器（语法解析 + Schema字段/事件名校验）
+        self.linter = SQLLinter(
+            catalog=get_schema_catalog(self.doc_root),
+            strict_columns=get_settings().SQL_LINT_STRICT_COLUMNS
+        )
+
         logger.info("SQLExpertTool 初始化完成")
 
     def _load_context_docs(self) -> Dict[str, str]:
@@ -317,21 +330,23 @@ SQL最佳实践:
 
         return prompt
 
-    def _generate_sql_with_llm(self, prompt: str) -> str:
+    def _generate_sql_with_llm(self, prompt: str, model=None) -> str:
         """
         使用LLM生成SQL
 
         Args:
             prompt: LLM提示词
+            model: 使用的模型（可选，默认self.model）
 
         Returns:
             生成的SQL语句
         """
+        model = model or self.model
         try:
             logger.info("正在调用LLM生成SQL...")
 
             # 调用LLM
-            response = self.model([{"role": "user", "content": prompt}])
+            response = model([{"role": "user", "content": prompt}])
 
             # 检查response是否为None
             if response is None:
@@ -358,6 +373,9 @@ SQL最佳实践:
         """
         验证SQL语句
 
+        使用本地SQL检查器完成语法解析、表名/事件名/字段名校验，
+        不需要请求神策即可发现错误
+
         Args:
             sql: SQL语句
             expected_events: 期望使用的事件列表（用于验证）
@@ -365,70 +383,16 @@ SQL最佳实践:
         Returns:
             验证结果字典 {"valid": bool, "warnings": List[str], "errors": List[str]}
         """
+        lint_result = self.linter.lint(sql, expected_events=expected_events)
+
         validation = {
-            "valid": True,
-            "warnings": [],
-            "errors": []
+            "valid": lint_result["valid"],
+            "warnings": lint_result["warnings"],
+            "errors": lint_result["errors"]
         }
 
-        sql_upper = sql.upper()
-
-        # 检查必需条件
-        if "WHERE" not in sql_upper:
-            validation["errors"].append("❌ 缺少WHERE子句")
-            validation["valid"] = False
-
-        if "DATE BETWEEN" not in sql_upper and "DATE =" not in sql_upper and "`DATE`" not in sql_upper:
-            validation["errors"].append("❌ 缺少日期范围过滤（WHERE date BETWEEN ... AND ...）")
-            validation["valid"] = False
-
-        if "EVENT" not in sql_upper and "`EVENT`" not in sql_upper:
-            validation["errors"].append("❌ 缺少事件名筛选（WHERE event = '...' 或 event IN (...)）")
-            validation["valid"] = False
-
-        # 验证SQL中使用的事件是否与预期一致
-        if expected_events:
-            # 提取SQL中使用的事件名（从 event = 'XXX' 或 event IN ('XXX', 'YYY') 中提取）
-            event_pattern = r"event\s*=\s*'([^']+)'|event\s+IN\s*\(([^)]+)\)"
-            matches = re.finditer(event_pattern, sql, re.IGNORECASE)
-
-            sql_events = set()
-            for match in matches:
-                if match.group(1):  # event = 'XXX'
-                    sql_events.add(match.group(1))
-                elif match.group(2):  # event IN ('XXX', 'YYY')
-                    events_str = match.group(2)
-                    # 提取所有引号中的事件名
-                    event_names = re.findall(r"'([^']+)'", events_str)
-                    sql_events.update(event_names)
-
-            expected_events_set = set(expected_events)
-
-            # 检查SQL中的事件是否都在预期事件列表中
-            unexpected_events = sql_events - expected_events_set
-            if unexpected_events:
-                validation["errors"].append(
-                    f"❌ SQL使用了未预期的事件: {', '.join(unexpected_events)}。"
-                    f"应该只使用: {', '.join(expected_events)}"
-                )
-                validation["valid"] = False
-                logger.error(f"SQL验证失败: 使用了错误的事件名 {unexpected_events}，期望的事件: {expected_events}")
-
-        # 检查建议条件
-        if "IS_SPIDER_USER" not in sql_upper and "`IS_SPIDER_USER`" not in sql_upper:
-            validation["warnings"].append("⚠️ 建议添加爬虫过滤（is_spider_user = '正常用户'）以确保数据准确性")
-
-        # 检查危险操作
-        dangerous_keywords = ["DROP", "DELETE", "TRUNCATE", "ALTER", "INSERT", "UPDATE"]
-        for keyword in dangerous_keywords:
-            if keyword in sql_upper:
-                validation["errors"].append(f"❌ 不允许的操作: {keyword}")
-                validation["valid"] = False
-
-        # 检查是否是SELECT查询
-        if not sql_upper.strip().startswith("SELECT"):
-            validation["errors"].append("❌ SQL必须是SELECT查询")
-            validation["valid"] = False
+        if not validation["valid"]:
+            logger.error(f"SQL验证失败: {validation['errors']}")
 
         return validation
 
@@ -484,6 +448,102 @@ SQL最佳实践:
 
         return "\n".join(lines)
 
+    def generate_sql(self, event_schemas: str, user_query: str, date_range: str = "last_7_days") -> Dict[str, Any]:
+        """
+        生成SQL并完成本地校验（校验失败不抛出异常，由调用方决定是否重新生成）
+
+        Args:
+            event_schemas: 事件Schema文档
+            user_query: 用户查询问题
+            date_range: 日期范围
+
+        Returns:
+            {"sql": str, "events": List[str], "start_date": str, "end_date": str, "validation": Dict}
+        """
+        import time
+
+        # 1. 解析事件列表
+        step_start = time.time()
+        logger.info("[步骤 1/5] 解析事件列表...")
+        events = self._parse_event_list(event_schemas)
+        step_elapsed = time.time() - step_start
+        if not events:
+            logger.warning(f"[步骤 1/5] ⚠ 未能从event_schemas提取事件列表 (耗时: {step_elapsed:.2f}秒)")
+        else:
+            logger.info(f"[步骤 1/5] ✓ 提取到 {len(events)} 个事件: {', '.join(events)} (耗时: {step_elapsed:.2f}秒)")
+
+        # 2. 解析日期范围
+        step_start = time.time()
+        logger.info("[步骤 2/5] 解析日期范围...")
+        start_date, end_date = self._parse_date_range(date_range)
+        step_elapsed = time.time() - step_start
+        logger.info(f"[步骤 2/5] ✓ 日期范围: {start_date} 到 {end_date} (耗时: {step_elapsed:.2f}秒)")
+
+        # 3. 构建LLM提示词
+        step_start = time.time()
+        logger.info("[步骤 3/5] 构建LLM提示词...")
+        prompt = self._build_sql_generation_prompt(
+            event_schemas, user_query, start_date, end_date, events
+        )
+        step_elapsed = time.time() - step_start
+        logger.info(f"[步骤 3/5] ✓ 提示词已构建 (长度: {len(prompt)} 字符, 耗时: {step_elapsed:.2f}秒)")
+
+        # 4-5. 使用LLM生成SQL并本地校验
+        if self.router is not None:
+            outcome = self.router.cascade(
+                CALL_SITE_SQL_GENERATION,
+                lambda model: self._generate_and_validate(prompt, events, model),
+                accept=lambda generated: generated[1]["valid"]
+            )
+            sql, validation = outcome.value
+        else:
+            sql, validation = self._generate_and_validate(prompt, events)
+
+        return {
+            "sql": sql,
+            "events": events,
+            "start_date": start_date,
+            "end_date": end_date,
+            "validation": validation
+        }
+
+    def _generate_and_validate(self, prompt: str, events: List[str], model=None) -> tuple:
+        """
+        调用LLM生成SQL并本地校验
+
+        Args:
+            prompt: LLM提示词
+            events: 期望使用的事件列表
+            model: 使用的模型（可选，默认self.model）
+
+        Returns:
+            (sql, validation)
+        """
+        import time
+
+        # 4. 使用LLM生成SQL
+        step_start = time.time()
+        model_id = getattr(model or self.model, "model_id", "")
+        logger.info(f"[步骤 4/5] 调用LLM生成SQL... {model_id}")
+        sql = self._generate_sql_with_llm(prompt, model)
+        step_elapsed = time.time() - step_start
+        logger.info(f"[步骤 4/5] ✓ SQL已生成 (长度: {len(sql)} 字符, LLM耗时: {step_elapsed:.2f}秒)")
+
+        # 5. 本地校验SQL
+        step_start = time.time()
+        logger.info("[步骤 5/5] 本地校验SQL语句...")
+        validation = self._validate_sql(sql, expected_events=events)
+        step_elapsed = time.time() - step_start
+
+        if validation["valid"]:
+            logger.info(f"[步骤 5/5] ✓ SQL验证通过 (耗时: {step_elapsed:.2f}秒)")
+            for warning in validation["warnings"]:
+                logger.warning(f"[验证警告] {warning}")
+        else:
+            logger.error(f"[步骤 5/5] ✗ SQL验证失败 (耗时: {step_elapsed:.2f}秒): {validation['errors']}")
+
+        return sql, validation
+
     def forward(self, event_schemas: str, user_query: str, date_range: str = "last_7_days") -> str:
         """
         生成SQL查询
@@ -516,58 +576,22 @@ SQL最佳实践:
             logger.warning("[event_schemas] 参数为空或None")
 
         try:
-            # 1. 解析事件列表
-            step_start = time.time()
-            logger.info("[步骤 1/5] 解析事件列表...")
-            events = self._parse_event_list(event_schemas)
-            step_elapsed = time.time() - step_start
-            if not events:
-                logger.warning(f"[步骤 1/5] ⚠ 未能从event_schemas提取事件列表 (耗时: {step_elapsed:.2f}秒)")
-            else:
-                logger.info(f"[步骤 1/5] ✓ 提取到 {len(events)} 个事件: {', '.join(events)} (耗时: {step_elapsed:.2f}秒)")
-
-            # 2. 解析日期范围
-            step_start = time.time()
-            logger.info("[步骤 2/5] 解析日期范围...")
-            start_date, end_date = self._parse_date_range(date_range)
-            step_elapsed = time.time() - step_start
-            logger.info(f"[步骤 2/5] ✓ 日期范围: {start_date} 到 {end_date} (耗时: {step_elapsed:.2f}秒)")
-
-            # 3. 构建LLM提示词
-            step_start = time.time()
-            logger.info("[步骤 3/5] 构建LLM提示词...")
-            prompt = self._build_sql_generation_prompt(
-                event_schemas, user_query, start_date, end_date, events
-            )
-            step_elapsed = time.time() - step_start
-            logger.info(f"[步骤 3/5] ✓ 提示词已构建 (长度: {len(prompt)} 字符, 耗时: {step_elapsed:.2f}秒)")
-
-            # 4. 使用LLM生成SQL
-            step_start = time.time()
-            logger.info("[步骤 4/5] 调用LLM生成SQL...")
-            sql = self._generate_sql_with_llm(prompt)
-            step_elapsed = time.time() - step_start
-            logger.info(f"[步骤 4/5] ✓ SQL已生成 (长度: {len(sql)} 字符, LLM耗时: {step_elapsed:.2f}秒)")
-
-            # 5. 验证SQL
-            step_start = time.time()
-            logger.info("[步骤 5/5] 验证SQL语句...")
-            validation = self._validate_sql(sql, expected_events=events)
-            step_elapsed = time.time() - step_start
+            generation = self.generate_sql(event_schemas, user_query, date_range)
+            validation = generation["validation"]
 
             if not validation["valid"]:
-                logger.error(f"[步骤 5/5] ✗ SQL验证失败 (耗时: {step_elapsed:.2f}秒): {validation['errors']}")
                 error_list = "\n".join(validation["errors"])
                 # 直接抛出异常，中断执行流程
                 raise ValueError(f"SQL生成失败（验证未通过）:\n{error_list}")
 
-            logger.info(f"[步骤 5/5] ✓ SQL验证通过 (耗时: {step_elapsed:.2f}秒)")
-            if validation["warnings"]:
-                for warning in validation["warnings"]:
-                    logger.warning(f"[验证警告] {warning}")
-
             # 6. 格式化返回结果
-            result = self._format_sql_result(sql, events, start_date, end_date, validation)
+            result = self._format_sql_result(
+                generation["sql"],
+                generation["events"],
+                generation["start_date"],
+                generation["end_date"],
+                validation
+            )
 
             tool_elapsed = time.time() - tool_start_time
             logger.info("=" * 60)
@@ -0,0 +1,177 @@
+"""
+结果文件压缩模块
+
+SQL_OUTPUT_DIR 下的结果文件按 SQL_OUTPUT_COMPRESSION 压缩保存（gzip 或 zstd），
+文件名为 xxx.csv.gz / xxx.csv.zst；pandas.read_csv 可按后缀直接读取。
+这里提供写入、解压读取和原始大小查询，供结果写出和 /files 下载使用
+"""
+import gzip
+import os
+import struct
+import threading
+from typing import IO, Any, Dict, Optional, Tuple
+
+from config.settings import get_settings
+
+try:
+    import zstandard
+except ImportError:  # zstd为可选依赖，未安装时退回gzip
+    zstandard = None
+
+
+# 压缩方式 -> 文件后缀（压缩方式名同时作为HTTP Content-Encoding）
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# 压缩级别（兼顾大结果的写出速度）
+COMPRESSION_LEVELS = {"gzip": 6, "zstd": 3}
+
+# 结果文件后缀（清理旧文件和文件列表使用）
+RESULT_SUFFIXES = (".csv",) + tuple(f".csv{suffix}" for suffix in COMPRESSION_SUFFIXES.values())
+
+# gzip 尾部的 ISIZE 只记录原始长度模 2^32；deflate 的压缩比不超过约 1032:1，
+# 压缩后大小乘以该比值仍小于 2^32 时 ISIZE 才一定是真实长度
+GZIP_ISIZE_MODULUS = 1 << 32
+GZIP_MAX_RATIO = 1032
+
+_size_cache: Dict[str, Tuple[int, int]] = {}
+_size_lock = threading.Lock()
+
+
+def get_compression() -> Optional[str]:
+    """
+    当前配置的压缩方式
+
+    Returns:
+        'gzip' / 'zstd'，不压缩时返回None（配置为zstd但未安装zstandard时返回'gzip'）
+    """
+    compression = get_settings().SQL_OUTPUT_COMPRESSION
+    if compression == "zstd" and zstandard is None:
+        return "gzip"
+    return compression if compression in COMPRESSION_SUFFIXES else None
+
+
+def split_compression(filename: str) -> Tuple[str, Optional[str]]:
+    """
+    拆分压缩后缀
+
+    Args:
+        filename: 文件名或路径，如 'query.csv.gz'
+
+    Returns:
+        (去掉压缩后缀的名称, 压缩方式)，未压缩时压缩方式为None
+    """
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if filename.lower().endswith(suffix):
+            return filename[:-len(suffix)], compression
+    return filename, None
+
+
+def compressed_path(path: str, compression: Optional[str] = None) -> str:
+    """
+    按压缩方式补全文件后缀
+
+    Args:
+        path: 未压缩的文件路径（已带压缩后缀时原样返回）
+        compression: 压缩方式（默认读取配置）
+
+    Returns:
+        实际写入的文件路径
+    """
+    if split_compression(path)[1]:
+        return path
+    compression = compression or get_compression()
+    return path + COMPRESSION_SUFFIXES[compression] if compression else path
+
+
+def pandas_compression(path: str) -> Optional[Dict[str, Any]]:
+    """DataFrame.to_csv 的 compression 参数（按文件后缀）"""
+    compression = split_compression(path)[1]
+    if compression is None:
+        return None
+    return {"method": compression, "level" if compression == "zstd" else "compresslevel": COMPRESSION_LEVELS[compression]}
+
+
+def open_artifact(path: str, mode: str = "rt", compression: Optional[str] = None) -> IO:
+    """
+    按文件后缀打开结果文件（文本模式使用utf-8，换行符原样保留）
+
+    Args:
+        path: 文件路径
+        mode: 打开模式，'rt' / 'wt' / 'rb' / 'wb'
+        compression: 压缩方式（默认按文件后缀判断，写入 .part 临时文件时需显式指定）
+
+    Returns:
+        文件对象（读取时得到解压后的内容）
+    """
+    if compression is None:
+        compression = split_compression(path)[1]
+    text = {} if "b" in mode else {"encoding": "utf-8", "newline": ""}
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=COMPRESSION_LEVELS["gzip"], **text)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("读取或写入zstd文件需要安装 zstandard")
+        if "w" in mode:
+            return zstandard.open(path, mode, cctx=zstandard.ZstdCompressor(level=COMPRESSION_LEVELS["zstd"]), **text)
+        return zstandard.open(path, mode, **text)
+    return open(path, mode, **text)
+
+
+def uncompressed_size(path: str) -> Optional[int]:
+    """
+    结果文件的原始（解压后）大小
+
+    gzip 在原始长度不可能超过 4GiB 时读取尾部记录的长度（ISIZE 模 4GiB），否则解压计数；
+    zstd 优先读取帧头中的内容长度，流式写出的文件没有记录长度时解压计数。结果按文件修改时间缓存
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        字节数，文件不存在或无法读取时返回None
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    compression = split_compression(path)[1]
+    if compression is None:
+        return stat.st_size
+
+    with _size_lock:
+        cached = _size_cache.get(path)
+    if cached and cached[0] == stat.st_mtime_ns:
+        return cached[1]
+
+    try:
+        if compression == "gzip":
+            if stat.st_size < 18:
+                return None
+            if stat.st_size * GZIP_MAX_RATIO < GZIP_ISIZE_MODULUS:
+                with open(path, "rb") as f:
+                    f.seek(-4, os.SEEK_END)
+                    size = struct.unpack("<I", f.read(4))[0]
+            else:
+                size = _count_decoded(path)
+        else:
+            if zstandard is None:
+                return None
+            with open(path, "rb") as f:
+                size = zstandard.frame_content_size(f.read(18))
+            if size < 0:
+                size = _count_decoded(path)
+    except Exception:
+        return None
+
+    with _size_lock:
+        _size_cache[path] = (stat.st_mtime_ns, size)
+    return size
+
+
+def _count_decoded(path: str) -> int:
+    """解压计数原始字节数"""
+    size = 0
+    with open_artifact(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            size += len(chunk)
+    return size
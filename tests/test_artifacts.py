@@ -0,0 +1,24 @@
+"""
+结果文件压缩测试
+"""
+import gzip
+
+from src.utils import artifacts
+
+
+def test_gzip_size_counts_when_isize_may_wrap(tmp_path, monkeypatch):
+    payload = b"date,value\n" + b"".join(f"2024-01-{i % 28 + 1:02d},{i}\n".encode() for i in range(5000))
+    path = tmp_path / "result.csv.gz"
+    with gzip.open(path, "wb") as f:
+        f.write(payload)
+
+    assert artifacts.uncompressed_size(str(path)) == len(payload)
+
+    # 压缩后大小乘以最大压缩比超过 2^32 时不能信任 ISIZE，必须解压计数
+    counted = []
+    count_decoded = artifacts._count_decoded
+    monkeypatch.setattr(artifacts, "GZIP_ISIZE_MODULUS", 1)
+    monkeypatch.setattr(artifacts, "_count_decoded", lambda p: counted.append(p) or count_decoded(p))
+    artifacts._size_cache.clear()
+    assert artifacts.uncompressed_size(str(path)) == len(payload)
+    assert counted == [str(path)]
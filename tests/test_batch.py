@@ -0,0 +1,44 @@
+"""
+批量趋势分析测试
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from src.analysis.batch import BatchAnalyzer
+from src.analysis.trends import TrendAnalyzer
+
+
+def _assert_same(batch, single, path="result"):
+    if isinstance(single, dict):
+        assert set(batch) == set(single), path
+        for key in single:
+            _assert_same(batch[key], single[key], f"{path}.{key}")
+    elif isinstance(single, list):
+        assert len(batch) == len(single), path
+        for i, (b, s) in enumerate(zip(batch, single)):
+            _assert_same(b, s, f"{path}[{i}]")
+    elif isinstance(single, float) and not isinstance(batch, str):
+        assert math.isclose(batch, single, rel_tol=1e-9, abs_tol=1e-9) or (math.isnan(batch) and math.isnan(single)), path
+    else:
+        assert batch == single, path
+
+
+def test_trend_batch_matches_per_series_analysis():
+    n, k = 60, 12
+    rng = np.random.default_rng(0)
+    weekly = np.tile(np.array([1, 1, 1, 1, 1, -2, -3]) * 10, n // 7 + 1)[:n, None]
+    values = 100 + weekly + np.linspace(0, 20, n)[:, None] * rng.uniform(-1, 1, k) + rng.normal(0, 5, (n, k))
+    values[:, 3] = 50.0
+    values[20, 5] = 0.0
+    frame = pd.DataFrame(values, columns=[f"g{j}" for j in range(k)])
+    time_index = pd.Series(pd.date_range("2024-01-01", periods=n, freq="D"))
+
+    batch = BatchAnalyzer().analyze(frame, ["trend"], time_index=time_index)
+    analyzer = TrendAnalyzer()
+    for name in frame.columns:
+        single = analyzer.comprehensive_analysis(frame[name], time_index, metric_name=name)
+        _assert_same(batch[name]["trend_analysis"], single, name)
+    assert batch["g0"]["trend_analysis"]["seasonality"]["available"]
+    assert not batch["g3"]["trend_analysis"]["seasonality"]["available"]
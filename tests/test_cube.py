@@ -0,0 +1,53 @@
+"""
+本地结果立方体测试
+"""
+import pandas as pd
+
+from src.analysis.cube import CubeStore
+
+
+def _click_frame():
+    return pd.DataFrame({
+        "date": ["2024-12-01", "2024-12-01", "2024-12-02", "2024-12-02"],
+        "platform": ["iOS", "Android", "iOS", "Android"],
+        "次数": [10, 20, 30, 40],
+    })
+
+
+def _instruction(event, dimensions, task=None):
+    return {
+        "task": task or f"{event} 每天次数",
+        "time_range": "last_7_days",
+        "dimensions": dimensions,
+        "metrics": ["次数"],
+        "event_metrics": [{"name": "次数", "event": event, "aggregate": "count"}],
+    }
+
+
+def test_cube_answers_same_event_set():
+    store = CubeStore(max_entries=4, ttl_seconds=600)
+    assert store.add(_instruction("ProductClick", ["date", "platform"]), _click_frame()) is not None
+
+    result = store.answer(_instruction("ProductClick", ["date"]))
+    assert result["次数"].tolist() == [30, 70]
+
+
+def test_cube_does_not_answer_other_event():
+    store = CubeStore(max_entries=4, ttl_seconds=600)
+    store.add(_instruction("ProductClick", ["date", "platform"]), _click_frame())
+
+    assert store.answer(_instruction("AddToCartClick", ["date"])) is None
+
+
+def test_cube_requires_known_events():
+    store = CubeStore(max_entries=4, ttl_seconds=600)
+    source = {"task": "ProductClick 每天各平台次数", "time_range": "last_7_days", "dimensions": ["date", "platform"], "metrics": ["次数"]}
+
+    # 结果记录的事件可以代替 event_metrics
+    assert store.add(source, _click_frame(), events=["ProductClick"]) is not None
+    assert store.answer(_instruction("ProductClick", ["date"])) is not None
+
+    # 指令无法确定事件时不回答
+    unknown = {"task": "AddToCartClick 每天次数", "time_range": "last_7_days", "dimensions": ["date"], "metrics": ["次数"]}
+    assert store.answer(unknown) is None
+    assert store.add(source, _click_frame()) is None
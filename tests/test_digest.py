@@ -0,0 +1,53 @@
+"""
+查询结果摘要测试
+"""
+import pandas as pd
+import pytest
+
+from src.analysis.digest import ResultDigester, StreamingDigest
+
+
+def _rate_frame():
+    rows = []
+    for day in pd.date_range("2024-01-01", periods=7):
+        for platform, rate, clicks in (("iOS", 0.04, 100), ("Android", 0.03, 200), ("Web", 0.02, 300)):
+            rows.append({"date": str(day.date()), "platform": platform, "conversion_rate": rate, "次数": clicks})
+    return pd.DataFrame(rows)
+
+
+def test_rate_is_not_summed_across_dimension_rows():
+    digester = ResultDigester()
+    digest = digester.digest(_rate_frame())
+
+    assert digest["non_additive"] == ["conversion_rate"]
+    assert digest["totals"]["conversion_rate"]["sum"] is None
+    assert digest["totals"]["次数"]["sum"] == 4200
+    assert digest["day_over_day"]["metrics"]["conversion_rate"]["last"] == 0.03
+    assert digest["day_over_day"]["metrics"]["次数"]["last"] == 600
+    assert [item["value"] for item in digest["top"]["items"]] == [0.04, 0.03, 0.02]
+    assert all(item["share_pct"] is None for item in digest["top"]["items"])
+
+    text = digester.render(digest, max_chars=400)
+    assert "conversion_rate: 合计" not in text
+    assert "0.09" not in text and "0.63" not in text
+
+
+def test_raw_rows_rendered_when_they_fit():
+    digester = ResultDigester()
+    digest = digester.digest(_rate_frame())
+
+    assert "2024-01-07,Web,0.02,300" in digester.render(digest, max_chars=1200)
+    assert "原始数据" not in digester.render(digest, max_chars=400)
+
+
+def test_streaming_digest_matches():
+    df = _rate_frame()
+    streaming = StreamingDigest()
+    for start in range(0, len(df), 5):
+        streaming.update(df.iloc[start:start + 5])
+    result = streaming.result()
+
+    assert result["totals"]["conversion_rate"]["sum"] is None
+    assert result["records"] == ResultDigester().digest(df)["records"]
+    assert result["day_over_day"]["metrics"]["conversion_rate"]["last"] == pytest.approx(0.03)
+    assert [item["key"] for item in result["top"]["items"]] == ["iOS", "Android", "Web"]
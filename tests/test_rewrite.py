@@ -0,0 +1,59 @@
+"""
+基于已有结果的指令改写测试
+"""
+import pandas as pd
+import pytest
+
+from src.analysis.rewrite import ResultRewriter
+
+
+def _parse_range(time_range):
+    return "2024-12-01", "2024-12-07"
+
+
+@pytest.fixture
+def source_csv(tmp_path):
+    path = tmp_path / "source.csv"
+    pd.DataFrame({
+        "date": ["2024-12-01", "2024-12-01", "2024-12-02", "2024-12-02"],
+        "platform": ["iOS", "Android", "iOS", "Android"],
+        "次数": [10, 20, 30, 40],
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+SOURCE = {"task": "ProductClick 每天各平台次数", "time_range": "last_7_days", "dimensions": ["date", "platform"], "metrics": ["次数"]}
+
+
+def _instruction(event):
+    return {
+        "task": f"{event} 每天次数",
+        "time_range": "last_7_days",
+        "dimensions": ["date"],
+        "metrics": ["次数"],
+        "event_metrics": [{"name": "次数", "event": event, "aggregate": "count"}],
+    }
+
+
+def test_derives_from_source_with_same_events(source_csv):
+    rewriter = ResultRewriter(_parse_range)
+    answered = rewriter.answer(_instruction("ProductClick"), [(SOURCE, source_csv, ["ProductClick"])])
+
+    assert answered is not None
+    df, source, events = answered
+    assert df["次数"].tolist() == [30, 70]
+    assert events == frozenset({"ProductClick"})
+
+
+def test_does_not_derive_from_other_event(source_csv):
+    rewriter = ResultRewriter(_parse_range)
+
+    assert rewriter.answer(_instruction("AddToCartClick"), [(SOURCE, source_csv, ["ProductClick"])]) is None
+
+
+def test_unknown_events_are_not_derived(source_csv):
+    rewriter = ResultRewriter(_parse_range)
+    unknown = {"task": "AddToCartClick 每天次数", "time_range": "last_7_days", "dimensions": ["date"], "metrics": ["次数"]}
+
+    assert rewriter.answer(unknown, [(SOURCE, source_csv, ["ProductClick"])]) is None
+    assert rewriter.answer(_instruction("ProductClick"), [(SOURCE, source_csv, None)]) is None
@@ -0,0 +1,82 @@
+"""
+热门事件预聚合表测试
+"""
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from src.analysis.rollup import RollupStore
+
+
+NOW = datetime(2024, 12, 8, 12, 0)
+TODAY = NOW.date()
+CLICKS = [{"name": "次数", "event": "ProductClick", "aggregate": "count"}]
+USERS = [{"name": "人数", "event": "ProductClick", "aggregate": "uv"}]
+
+
+def _partition(events, users):
+    # grain 0 为不分维度的汇总行，grain 1 按平台
+    return pd.DataFrame({
+        "grain": [0, 1, 1],
+        "event": ["ProductClick"] * 3,
+        "d0": ["", "iOS", "Android"],
+        "event_count": [events, events // 2, events - events // 2],
+        "user_count": [users, users // 2, users - users // 2],
+    })
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RollupStore(
+        directory=str(tmp_path), events=["ProductClick"], dimensions={"web_platform_type": ["platform"]}, days=30
+    )
+    store.enabled = True
+    for offset in range(1, 4):
+        store._write(TODAY - timedelta(days=offset), _partition(100 * offset, 10 * offset), True, NOW.timestamp())
+    return store
+
+
+def _range(days):
+    return (TODAY - timedelta(days=days)).isoformat(), (TODAY - timedelta(days=1)).isoformat()
+
+
+def test_counts_are_summed_across_days(store):
+    result = store.answer(CLICKS, [], None, *_range(3), now=NOW)
+    assert result["次数"].tolist() == [600]
+
+    by_platform = store.answer(CLICKS, ["platform"], None, *_range(3), now=NOW)
+    assert dict(zip(by_platform["platform"], by_platform["次数"])) == {"iOS": 300, "Android": 300}
+
+
+def test_users_are_not_summed_across_days(store):
+    assert store.answer(USERS, [], None, *_range(3), now=NOW) is None
+
+    daily = store.answer(USERS, ["date"], None, *_range(3), now=NOW)
+    assert daily["人数"].tolist() == [30, 20, 10]
+    assert store.answer(USERS, [], None, *_range(1), now=NOW)["人数"].tolist() == [10]
+
+
+def test_today_partition_freshness(store):
+    start = (TODAY - timedelta(days=3)).isoformat()
+
+    # 没有当天分区：去掉今天回答并说明，只查今天时不回答
+    clipped = store.answer(CLICKS, ["date"], None, start, TODAY.isoformat(), now=NOW)
+    assert clipped["date"].tolist()[-1] == (TODAY - timedelta(days=1)).isoformat()
+    assert "不含今天" in clipped.attrs["note"]
+    assert store.answer(CLICKS, [], None, TODAY.isoformat(), TODAY.isoformat(), now=NOW) is None
+
+    # 刷新及时的当天分区参与回答
+    store._write(TODAY, _partition(40, 4), False, NOW.timestamp() - store.today_interval)
+    fresh = store.answer(CLICKS, ["date"], None, start, TODAY.isoformat(), now=NOW)
+    assert fresh["次数"].tolist() == [300, 200, 100, 40]
+    assert "note" not in fresh.attrs
+
+    # 超过两个刷新间隔的当天分区不使用
+    stale = NOW + timedelta(seconds=2 * store.today_interval)
+    assert store.answer(CLICKS, ["date"], None, start, TODAY.isoformat(), now=stale)["date"].tolist()[-1] != TODAY.isoformat()
+
+
+def test_missing_past_partition_falls_through(store):
+    start = (TODAY - timedelta(days=5)).isoformat()
+    assert store.answer(CLICKS, [], None, start, (TODAY - timedelta(days=1)).isoformat(), now=NOW) is None
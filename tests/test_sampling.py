@@ -0,0 +1,44 @@
+"""
+大数据集采样测试
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from src.analysis.sampling import DataSampler
+from src.tools.data_analysis_tool import DataAnalysisTool
+
+
+def _site_frame():
+    rng = np.random.default_rng(0)
+    rows = [
+        (day, f"site{site}", rng.normal(0.03, 0.005), int(rng.integers(100, 200)))
+        for day in pd.date_range("2024-01-01", periods=30)
+        for site in range(50)
+    ]
+    return pd.DataFrame(rows, columns=["date", "site", "conversion_rate", "次数"])
+
+
+def test_time_bucket_averages_non_additive_metrics():
+    df = _site_frame()
+    result = DataSampler(max_rows=1000).sample(df)
+
+    assert result.strategy == "time_bucket"
+    assert len(result.frame) == 30
+    assert result.frame["conversion_rate"].between(0.02, 0.04).all()
+    assert result.frame["次数"].sum() == df["次数"].sum()
+    assert result.details["aggregation"] == {"conversion_rate": "mean", "次数": "sum"}
+    assert "total_error_pct" not in result.error_bounds["conversion_rate"]
+    assert result.error_bounds["conversion_rate"]["point_error_pct"] > 0
+
+
+def test_tool_samples_by_first_categorical_column():
+    rng = np.random.default_rng(1)
+    tool = DataAnalysisTool()
+    rows = tool.sampler.max_rows + 500
+    data = json.dumps([{"site": f"s{i % 20}", "次数": int(rng.integers(1, 100))} for i in range(rows)])
+
+    report = tool.forward(data, ["statistics"], ["次数"])
+
+    assert "分层采样" in report
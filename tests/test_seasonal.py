@@ -0,0 +1,76 @@
+"""
+季节残差异常检测测试
+"""
+import numpy as np
+import pandas as pd
+
+from src.analysis.anomaly import AnomalyDetector
+from src.analysis.seasonal import SeasonalDecomposer
+
+
+WEEKLY = np.array([1, 1, 1, 1, 1, -2, -3]) * 20
+
+
+def _detector():
+    detector = AnomalyDetector()
+    detector.seasonal_decomposer = SeasonalDecomposer(cache_size=4)
+    return detector
+
+
+def _days(n):
+    return pd.Series(pd.date_range("2024-01-01", periods=n, freq="D"))
+
+
+def test_noise_is_not_over_flagged():
+    detector = _detector()
+    rng = np.random.default_rng(0)
+    flagged = total = 0
+    for n in (56, 84, 365):
+        for _ in range(10):
+            result = detector.detect_seasonal_anomalies(pd.Series(100 + rng.normal(0, 5, n)), _days(n))
+            flagged += result["anomaly_count"]
+            total += n
+    assert flagged / total < 0.01
+
+
+def test_weekly_spike_is_the_only_anomaly():
+    n = 84
+    rng = np.random.default_rng(1)
+    values = 100 + np.tile(WEEKLY, n // 7) + np.linspace(0, 15, n) + rng.normal(0, 5, n)
+    values[40] += 30
+
+    result = _detector().detect_seasonal_anomalies(pd.Series(values), _days(n))
+
+    assert [item["index"] for item in result["anomalies"]] == [40]
+    assert result["anomalies"][0]["type"] == "high"
+
+
+def test_large_spike_does_not_leak_into_neighbours():
+    n = 84
+    values = 100 + np.tile(WEEKLY, n // 7) + np.random.default_rng(3).normal(0, 5, n)
+    values[40] += 200
+
+    result = _detector().detect_seasonal_anomalies(pd.Series(values), _days(n))
+
+    assert [item["index"] for item in result["anomalies"]] == [40]
+
+
+def test_random_walk_spike_is_the_only_anomaly():
+    n = 84
+    values = 100 + np.cumsum(np.random.default_rng(4).normal(0, 1, n))
+    values[40] *= 3
+
+    result = _detector().detect_seasonal_anomalies(pd.Series(values), _days(n))
+
+    assert [item["index"] for item in result["anomalies"]] == [40]
+
+
+def test_short_series_falls_back_to_timeseries():
+    n = 28
+    detector = _detector()
+    data = pd.Series(100 + np.tile(WEEKLY, n // 7) + np.random.default_rng(2).normal(0, 5, n))
+
+    assert detector.detect_seasonal_anomalies(data, _days(n))["anomaly_count"] == 0
+    result = detector.comprehensive_detection(data, time_index=_days(n))
+    assert "timeseries" in result["results_by_method"]
+    assert "seasonal" not in result["results_by_method"]
@@ -0,0 +1,115 @@
+"""
+SQL结果流式写出测试
+
+用JSONL响应行模拟神策SQL接口，验证流式路径与非流式路径（_combine_jsonl_response）结果一致
+"""
+import json
+
+import pandas as pd
+import pytest
+
+from src.sensors.client import SensorsClient
+from src.tools.sql_execution_tool import SQLExecutionTool
+
+
+COLUMNS = ["date", "$os", "cnt"]
+TYPES = ["DATE", "STRING", "BIGINT"]
+
+
+def _line(columns, rows, types=None):
+    data = {"columns": columns, "data": rows}
+    if types:
+        data["types"] = types
+    return json.dumps({"code": "SUCCESS", "data": data}).encode()
+
+
+class FakeClient(SensorsClient):
+    """用固定的响应行代替HTTP请求"""
+
+    def __init__(self, lines):
+        super().__init__(api_url="http://sensors.test", project="test", api_key="")
+        self.lines = lines
+        self.executed = 0
+
+    def stream_sql(self, sql, batch_rows=100000, limit=1000000000, with_types=False):
+        yield from self._stream_batches(self.lines, batch_rows, with_types=with_types)
+
+    def execute_sql(self, sql, limit=1000000000):
+        self.executed += 1
+        return self._combine_jsonl_response([json.loads(line) for line in self.lines])
+
+
+def _detail_rows(n):
+    return [[f"2024-12-{1 + i % 7:02d}", "iOS" if i % 2 else "Android", i] for i in range(n)]
+
+
+def _run(client, tmp_path, **overrides):
+    tool = SQLExecutionTool(client)
+    for name, value in overrides.items():
+        setattr(tool.settings, name, value)
+    output = json.loads(tool.forward("SELECT date, $os, COUNT(*) AS cnt FROM events GROUP BY ROLLUP(date, $os)", output_dir=str(tmp_path), filename="result"))
+    return output, pd.read_csv(output["csv_path"])
+
+
+@pytest.fixture(autouse=True)
+def _restore_settings():
+    tool_settings = SQLExecutionTool(None).settings
+    saved = {name: getattr(tool_settings, name) for name in ("SQL_STREAM_BATCH_ROWS", "SQL_STREAM_BUFFER_ROWS")}
+    yield
+    for name, value in saved.items():
+        setattr(tool_settings, name, value)
+
+
+@pytest.mark.parametrize("summary_first", [False, True])
+def test_summary_row_aligned_by_name(summary_first):
+    detail = [_line(COLUMNS, _detail_rows(4), TYPES)]
+    summary = [_line(["date", "cnt"], [["2024-12-01", 99]])]
+    client = FakeClient(summary + detail if summary_first else detail + summary)
+
+    batches = list(client.stream_sql("", batch_rows=100, with_types=True))
+    streamed = [row for _, rows, _ in batches for row in rows]
+
+    assert batches[0][0] == COLUMNS
+    assert batches[0][2] == TYPES
+    assert ["2024-12-01", None, 99] in streamed
+    assert sorted(streamed, key=str) == sorted(client.execute_sql("")["rows"], key=str)
+
+
+def test_small_result_keeps_types_and_summary_row(tmp_path):
+    client = FakeClient([_line(COLUMNS, _detail_rows(4), TYPES), _line(["date", "cnt"], [["2024-12-01", 99]])])
+    tool = SQLExecutionTool(client)
+    _, df, summary = tool._stream_result("", str(tmp_path / "result.csv"))
+
+    assert summary is None
+    assert pd.api.types.is_datetime64_any_dtype(df["date"])
+    assert isinstance(df["$os"].dtype, pd.CategoricalDtype)
+    total = df[df["$os"].isna()]
+    assert total["cnt"].tolist() == [99]
+    assert client.executed == 0
+
+
+def test_streamed_export_with_summary_row(tmp_path):
+    lines = [_line(COLUMNS, _detail_rows(50), TYPES), _line(["date", "cnt"], [["2024-12-01", 99]])]
+    lines += [_line(COLUMNS, _detail_rows(50)[i:i + 10]) for i in range(0, 50, 10)]
+    client = FakeClient(lines)
+
+    output, csv = _run(client, tmp_path, SQL_STREAM_BATCH_ROWS=10, SQL_STREAM_BUFFER_ROWS=20)
+
+    assert output["streamed"] is True
+    assert output["rows"] == len(csv) == 101
+    assert "ragged_rows" not in output
+    assert list(csv.columns) == COLUMNS
+    assert csv["cnt"].notna().all()
+    assert csv.loc[csv["$os"].isna(), "cnt"].tolist() == [99]
+    assert output["digest"]["totals"]["cnt"]["sum"] == 2 * sum(range(50)) + 99
+
+
+def test_empty_result_has_columns_without_second_query(tmp_path):
+    client = FakeClient([_line(COLUMNS, [], TYPES)])
+
+    output, csv = _run(client, tmp_path)
+
+    assert output["rows"] == 0
+    assert output["columns"] == COLUMNS
+    assert list(csv.columns) == COLUMNS
+    assert client.executed == 0